@@ -0,0 +1,28 @@
+"""create sequence_counters table for invoice / credit note numbering
+
+Revision ID: 20260301_sequence_counters
+Revises: merge_all_heads_20260131
+Create Date: 2026-03-01 00:00:00.000000
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '20260301_sequence_counters'
+down_revision = 'merge_all_heads_20260131'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'sequence_counters',
+        sa.Column('scope', sa.String(100), primary_key=True),
+        sa.Column('year', sa.Integer, primary_key=True),
+        sa.Column('prefix', sa.String(20), primary_key=True),
+        sa.Column('last_value', sa.Integer, nullable=False, server_default='0'),
+    )
+
+
+def downgrade():
+    op.drop_table('sequence_counters')
@@ -0,0 +1,25 @@
+"""indexes for paginated invoice listing
+
+Revision ID: 20260302_invoice_list_indexes
+Revises: 20260301_sequence_counters
+Create Date: 2026-03-02 00:00:00.000000
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '20260302_invoice_list_indexes'
+down_revision = '20260301_sequence_counters'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('idx_invoice_org_created', 'invoices', ['org_id', 'created_at', 'id'])
+    op.create_index('idx_invoice_org_status_created', 'invoices', ['org_id', 'status', 'created_at'])
+    op.create_index('idx_invoice_org_country', 'invoices', ['org_id', 'customer_country'])
+
+
+def downgrade():
+    op.drop_index('idx_invoice_org_country', table_name='invoices')
+    op.drop_index('idx_invoice_org_status_created', table_name='invoices')
+    op.drop_index('idx_invoice_org_created', table_name='invoices')
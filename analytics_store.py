@@ -0,0 +1,394 @@
+"""
+Columnar revenue store behind /merchant/analytics.
+
+Answering "revenue per week by provider since January" from the invoice
+records means scanning and parsing every invoice. `AnalyticsStore` keeps one
+row per invoice in flat typed arrays instead:
+
+- `ts` (UTC epoch seconds) and its hour/day/week/month period numbers,
+- `cents` (invoice total in integer cents),
+- dictionary-encoded dimensions: currency, provider, buyer_country,
+  vat_rate and status, plus merchant_id / created_by for scoping.
+
+It is an `InvoiceStore` listener like `UsageRollup`: edits overwrite their
+row in place, deletes leave a tombstone that is compacted away once
+tombstones outnumber live rows.
+
+`query()` filters with boolean masks and groups with a single `bincount`
+over a mixed-radix key of (period, dimension codes...), so a query costs a
+few passes over contiguous arrays. NumPy is optional: without it the same
+query runs as a plain Python loop over the rows.
+"""
+
+from array import array
+from datetime import datetime, timezone
+import threading
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+except Exception:
+    # Optional: query() falls back to a row-by-row loop without it
+    np = None
+
+GRANULARITIES = ("hour", "day", "week", "month")
+DIMENSIONS = ("currency", "provider", "buyer_country", "vat_rate", "status")
+
+_EMPTY = ([], [], [], [])
+
+# Above this many distinct (period, dims...) keys, group via np.unique instead of a dense bincount
+_DENSE_KEY_LIMIT = 1 << 22
+
+
+def parse_time(value: str, end: bool = False) -> int:
+    """`YYYY-MM-DD` or ISO datetime -> UTC epoch seconds; raises ValueError.
+
+    A bare date used as the `end` of a range covers that whole day.
+    """
+    value = (value or "").strip()
+    if not value:
+        raise ValueError("Empty timestamp")
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        raise ValueError(f"Invalid timestamp: {value}")
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    seconds = int(parsed.timestamp())
+    if end and len(value) == 10:
+        seconds += 86400 - 1
+    return seconds
+
+
+def _created_ts(inv: dict) -> Optional[datetime]:
+    created_at = inv.get("created_at")
+    if not created_at or not isinstance(created_at, str):
+        return None
+    try:
+        parsed = datetime.fromisoformat(created_at.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        return parsed.replace(tzinfo=timezone.utc)  # created_at is written with utcnow()
+    return parsed.astimezone(timezone.utc)
+
+
+def _cents(inv: dict) -> int:
+    val = inv.get("total")
+    if val is None:
+        val = inv.get("amount", 0)
+    try:
+        return int(round(float(str(val).strip() or 0) * 100))
+    except (ValueError, TypeError):
+        return 0
+
+
+def _vat_rate(inv: dict) -> Optional[float]:
+    try:
+        return round(float(inv.get("vat_rate")), 4)
+    except (TypeError, ValueError):
+        return None
+
+
+def _dimension_values(inv: dict) -> Tuple:
+    """Values for DIMENSIONS, in order."""
+    country = inv.get("buyer_country")
+    return (
+        str(inv.get("currency") or "EUR").upper(),
+        inv.get("payment_provider") or inv.get("payment_system") or "web2",
+        str(country).upper() if country else None,
+        _vat_rate(inv),
+        inv.get("status") or "issued",
+    )
+
+
+def _periods(ts: int) -> Tuple[int, int, int, int]:
+    """Period numbers of a timestamp, in GRANULARITIES order.
+
+    hour/day count from the epoch, week counts Mondays from 1969-12-29 (the
+    epoch was a Thursday), month is year * 12 + month - 1.
+    """
+    day = ts // 86400
+    created = datetime.fromtimestamp(ts, timezone.utc)
+    return ts // 3600, day, (day + 3) // 7, created.year * 12 + created.month - 1
+
+
+def _period_label(granularity: str, value: int) -> str:
+    if granularity == "month":
+        return f"{value // 12:04d}-{value % 12 + 1:02d}"
+    if granularity == "hour":
+        return datetime.fromtimestamp(value * 3600, timezone.utc).strftime("%Y-%m-%dT%H:00Z")
+    if granularity == "week":
+        value = value * 7 - 3  # day number of its Monday
+    return datetime.fromtimestamp(value * 86400, timezone.utc).strftime("%Y-%m-%d")
+
+
+def period_count(granularity: str, start: int, end: int) -> int:
+    """Number of periods a [start, end] range spans."""
+    i = GRANULARITIES.index(granularity)
+    return _periods(end)[i] - _periods(start)[i] + 1
+
+
+class _Dictionary:
+    """Value <-> small int code for one dimension column."""
+
+    def __init__(self):
+        self.values: List = []
+        self.codes: Dict = {}
+
+    def encode(self, value) -> int:
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def code(self, value) -> int:
+        return self.codes.get(value, -1)
+
+
+class AnalyticsStore:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clear()
+
+    def _clear(self) -> None:
+        self._ts = array("q")
+        self._periods = {g: array("i") for g in GRANULARITIES}
+        self._cents = array("q")
+        self._live = array("b")
+        self._dims = {name: array("i") for name in DIMENSIONS}
+        self._merchant = array("i")
+        self._user = array("i")
+        self._dicts = {name: _Dictionary() for name in DIMENSIONS + ("merchant_id", "created_by")}
+        self._rows: Dict[object, int] = {}
+        self._dead = 0
+
+    @staticmethod
+    def _key(inv: dict):
+        inv_id = inv.get("id")
+        return str(inv_id) if inv_id is not None else ("anon", id(inv))
+
+    def _encode(self, inv: dict):
+        created = _created_ts(inv)
+        if created is None:
+            return None  # no position on the time axis
+        ts = int(created.timestamp())
+        codes = [self._dicts[name].encode(v) for name, v in zip(DIMENSIONS, _dimension_values(inv))]
+        return (
+            ts,
+            _periods(ts),
+            _cents(inv),
+            codes,
+            self._dicts["merchant_id"].encode(inv.get("merchant_id")),
+            self._dicts["created_by"].encode(inv.get("created_by")),
+        )
+
+    def _write(self, row: Optional[int], encoded) -> int:
+        ts, periods, cents, codes, merchant, user = encoded
+        if row is None:
+            row = len(self._ts)
+            self._ts.append(ts)
+            for g, period in zip(GRANULARITIES, periods):
+                self._periods[g].append(period)
+            self._cents.append(cents)
+            self._live.append(1)
+            for name, code in zip(DIMENSIONS, codes):
+                self._dims[name].append(code)
+            self._merchant.append(merchant)
+            self._user.append(user)
+            return row
+        self._ts[row] = ts
+        for g, period in zip(GRANULARITIES, periods):
+            self._periods[g][row] = period
+        self._cents[row] = cents
+        for name, code in zip(DIMENSIONS, codes):
+            self._dims[name][row] = code
+        self._merchant[row] = merchant
+        self._user[row] = user
+        return row
+
+    def _remove(self, key) -> None:
+        row = self._rows.pop(key, None)
+        if row is not None:
+            self._live[row] = 0
+            self._dead += 1
+
+    def _compact(self) -> None:
+        keep = [(key, row) for key, row in self._rows.items()]
+        keep.sort(key=lambda kr: kr[1])
+        ts, cents = array("q"), array("q")
+        periods = {g: array("i") for g in GRANULARITIES}
+        dims = {name: array("i") for name in DIMENSIONS}
+        merchant, user = array("i"), array("i")
+        rows = {}
+        for new_row, (key, row) in enumerate(keep):
+            ts.append(self._ts[row])
+            for g in GRANULARITIES:
+                periods[g].append(self._periods[g][row])
+            cents.append(self._cents[row])
+            for name in DIMENSIONS:
+                dims[name].append(self._dims[name][row])
+            merchant.append(self._merchant[row])
+            user.append(self._user[row])
+            rows[key] = new_row
+        self._ts, self._periods, self._cents, self._dims = ts, periods, cents, dims
+        self._merchant, self._user, self._rows = merchant, user, rows
+        self._live = array("b", b"\x01" * len(rows))
+        self._dead = 0
+
+    # ----- InvoiceStore listener -----
+
+    def reset(self) -> None:
+        with self._lock:
+            self._clear()
+
+    def apply(self, old: Optional[dict], new: Optional[dict]) -> None:
+        with self._lock:
+            new_key = self._key(new) if new is not None else None
+            if old is not None and self._key(old) != new_key:
+                self._remove(self._key(old))
+            if new is None:
+                if self._dead > 1024 and self._dead > len(self._rows):
+                    self._compact()
+                return
+            encoded = self._encode(new)
+            if encoded is None:
+                self._remove(new_key)
+                return
+            self._rows[new_key] = self._write(self._rows.get(new_key), encoded)
+
+    def rebuild(self, invoices: Iterable[dict]) -> int:
+        """Recompute from scratch; returns the number of rows."""
+        with self._lock:
+            self._clear()
+            for inv in invoices:
+                encoded = self._encode(inv)
+                if encoded is not None:
+                    self._rows[self._key(inv)] = self._write(None, encoded)
+            return len(self._rows)
+
+    # ----- reads -----
+
+    def query(self, start: int, end: int, granularity: str = "day", group_by: Sequence[str] = ("currency",),
+              merchant_id=None, created_by: Optional[str] = None, scoped: bool = True,
+              where: Optional[Dict[str, object]] = None) -> List[dict]:
+        """Count and revenue of invoices created in [start, end], per period and `group_by` values.
+
+        With `scoped`, only invoices whose merchant_id or created_by match are
+        counted (same matching as /merchant/usage). `where` filters on
+        DIMENSIONS by value. Rows are ordered by period, then dimension codes.
+        """
+        if granularity not in GRANULARITIES:
+            raise ValueError(f"Unknown granularity: {granularity}")
+        unknown = [d for d in list(group_by) + list(where or {}) if d not in DIMENSIONS]
+        if unknown:
+            raise ValueError(f"Unknown dimensions: {', '.join(unknown)}")
+
+        with self._lock:
+            filters = []
+            for name, value in (where or {}).items():
+                code = self._dicts[name].code(value)
+                if code < 0:
+                    return []  # value never seen: nothing can match
+                filters.append((name, code))
+            owners = []
+            if scoped:
+                if merchant_id is not None and self._dicts["merchant_id"].code(merchant_id) >= 0:
+                    owners.append((self._merchant, self._dicts["merchant_id"].code(merchant_id)))
+                if created_by is not None and self._dicts["created_by"].code(created_by) >= 0:
+                    owners.append((self._user, self._dicts["created_by"].code(created_by)))
+                if not owners:
+                    return []
+            cards = [len(self._dicts[name].values) for name in group_by]
+            if np is not None:
+                groups = self._group_numpy(start, end, granularity, group_by, cards, filters, owners)
+            else:
+                groups = self._group_python(start, end, granularity, group_by, filters, owners)
+            values = [self._dicts[name].values for name in group_by]
+
+        periods, codes, counts, sums = groups
+        labels = {p: _period_label(granularity, p) for p in set(periods)}
+        columns = [[vals[c] for c in col] for vals, col in zip(values, codes)]
+        out = []
+        for i, period in enumerate(periods):
+            row = {"period": labels[period]}
+            for name, col in zip(group_by, columns):
+                row[name] = col[i]
+            row["count"] = counts[i]
+            row["amount_cents"] = sums[i]
+            out.append(row)
+        return out
+
+    def _group_numpy(self, start, end, granularity, group_by, cards, filters, owners):
+        n = len(self._ts)
+        if n == 0:
+            return _EMPTY
+        ts = np.frombuffer(self._ts, dtype=np.int64, count=n)
+        mask = np.frombuffer(self._live, dtype=np.int8, count=n).astype(bool)
+        mask &= ts >= start
+        mask &= ts <= end
+        for name, code in filters:
+            mask &= np.frombuffer(self._dims[name], dtype=np.int32, count=n) == code
+        if owners:
+            owned = np.zeros(n, dtype=bool)
+            for column, code in owners:
+                owned |= np.frombuffer(column, dtype=np.int32, count=n) == code
+            mask &= owned
+        idx = np.flatnonzero(mask)
+        if idx.size == 0:
+            return _EMPTY
+
+        period = np.frombuffer(self._periods[granularity], dtype=np.int32, count=n)[idx]
+        base = int(period.min())
+        key = period.astype(np.int64) - base
+        span = int(key.max()) + 1
+        for name, card in zip(group_by, cards):
+            key = key * card + np.frombuffer(self._dims[name], dtype=np.int32, count=n)[idx]
+            span *= card
+        cents = np.frombuffer(self._cents, dtype=np.int64, count=n)[idx]
+
+        if span <= _DENSE_KEY_LIMIT:
+            counts = np.bincount(key, minlength=span)
+            keys = np.flatnonzero(counts)
+            # float64 sums are exact up to 2**53 cents per group
+            sums = np.bincount(key, weights=cents, minlength=span)[keys]
+            counts = counts[keys]
+        else:
+            keys, inverse = np.unique(key, return_inverse=True)
+            counts = np.bincount(inverse)
+            sums = np.bincount(inverse, weights=cents)
+
+        codes = []
+        for card in reversed(cards):
+            codes.append((keys % card).tolist())
+            keys = keys // card
+        return ((keys + base).tolist(), codes[::-1], counts.tolist(), np.rint(sums).astype(np.int64).tolist())
+
+    def _group_python(self, start, end, granularity, group_by, filters, owners):
+        acc: Dict[Tuple, List[int]] = {}
+        dims = [self._dims[name] for name in group_by]
+        periods = self._periods[granularity]
+        for row in range(len(self._ts)):
+            ts = self._ts[row]
+            if not self._live[row] or ts < start or ts > end:
+                continue
+            if any(self._dims[name][row] != code for name, code in filters):
+                continue
+            if owners and not any(column[row] == code for column, code in owners):
+                continue
+            key = (periods[row],) + tuple(col[row] for col in dims)
+            entry = acc.setdefault(key, [0, 0])
+            entry[0] += 1
+            entry[1] += self._cents[row]
+        ordered = sorted(acc.items())
+        return (
+            [key[0] for key, _ in ordered],
+            [[key[i + 1] for key, _ in ordered] for i in range(len(dims))],
+            [count for _, (count, _) in ordered],
+            [cents for _, (_, cents) in ordered],
+        )
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"rows": len(self._rows), "tombstones": self._dead}
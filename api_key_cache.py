@@ -0,0 +1,85 @@
+"""
+In-process cache for API-key authentication.
+
+Maps sha256(api_key) -> resolved principal so repeated requests with the same
+key skip reading api_keys.json, scanning it and querying the users table.
+Entries expire after `ttl_seconds`; unknown keys are cached as misses for the
+shorter `negative_ttl_seconds` so a burst of bad keys doesn't hit disk either.
+The least recently used entry is evicted once `max_entries` is reached.
+
+Writes to the key store in this process invalidate the cache immediately.
+Given the key store's `source` file, every lookup also compares the file's
+stat signature with the one the cache was filled under and drops all entries
+when it changed. A revocation by another worker therefore applies on its
+next request, at the cost of one `stat` per request.
+"""
+
+from collections import OrderedDict
+import copy
+import os
+from pathlib import Path
+import threading
+from time import monotonic
+from typing import Any, Optional, Tuple
+
+
+class APIKeyCache:
+    def __init__(self, ttl_seconds: float = 60, negative_ttl_seconds: float = 10, max_entries: int = 10000,
+                 source: Optional[Path] = None):
+        self.source = source
+        self._source_sig: Optional[Tuple[int, int, int]] = None
+        self.ttl_seconds = ttl_seconds
+        self.negative_ttl_seconds = negative_ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key_hash: str) -> Tuple[bool, Optional[dict]]:
+        """Return (found, principal). `principal` is None for a cached miss."""
+        now = monotonic()
+        sig = self._stat_source() if self.source is not None else None
+        with self._lock:
+            if sig != self._source_sig:
+                # The key store was written (possibly by another worker)
+                self._entries.clear()
+                self._source_sig = sig
+            entry = self._entries.get(key_hash)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self._entries[key_hash]
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(key_hash)
+            self.hits += 1
+            return True, copy.deepcopy(entry[1])
+
+    def set(self, key_hash: str, principal: Optional[dict]) -> None:
+        ttl = self.ttl_seconds if principal is not None else self.negative_ttl_seconds
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key_hash] = (monotonic() + ttl, copy.deepcopy(principal))
+            self._entries.move_to_end(key_hash)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key_hash: Optional[str] = None) -> None:
+        """Drop one entry, or everything when `key_hash` is None."""
+        with self._lock:
+            if key_hash is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key_hash, None)
+
+    def _stat_source(self) -> Optional[Tuple[int, int, int]]:
+        try:
+            st = os.stat(self.source)
+        except OSError:
+            return None
+        return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
@@ -1,5 +1,6 @@
 from fastapi import APIRouter, Depends, HTTPException
 from fastapi.responses import FileResponse
+from sqlalchemy import func
 from sqlalchemy.orm import Session
 from decimal import Decimal
 from app.schemas.invoice import InvoiceCreate, InvoiceOut, CustomerType, PaymentSystem
@@ -9,14 +10,21 @@ from app.utils.pdf import generate_invoice_pdf
 from app.api.deps import get_merchant_by_api_key
 from zeep import Client
 from zeep.exceptions import Fault
+from sequences import next_sql
 
 router = APIRouter(prefix="/invoice", tags=["Invoice"])
 
+
+def _next_invoice_number(db: Session) -> int:
+    # invoice_number is globally unique here, so a single never-resetting counter
+    return next_sql(db, "app", 0, "invoice",
+                    seed=lambda: db.query(func.max(Invoice.invoice_number)).scalar() or 0)
+
+
 @router.post("/create", response_model=InvoiceOut)
 def create_invoice(invoice_in: InvoiceCreate, db: Session = Depends(get_db), merchant_id: int | None = Depends(get_merchant_by_api_key)):
-    # Auto-incrementing invoice number
-    last_invoice = db.query(Invoice).order_by(Invoice.invoice_number.desc()).first()
-    invoice_number = 1 if not last_invoice else (last_invoice.invoice_number or 0) + 1
+    # Sequential invoice number from the counter table
+    invoice_number = _next_invoice_number(db)
 
     # Enforce B2B VAT number presence
     if invoice_in.customer_type == CustomerType.business and not invoice_in.customer_vat_number:
@@ -96,8 +104,7 @@ def create_invoice_pdf(invoice_in: InvoiceCreate, db: Session = Depends(get_db),
         raise HTTPException(status_code=400, detail="Blockchain TX ID vereist voor Web3 betalingen")
 
     # create invoice record
-    last_invoice = db.query(Invoice).order_by(Invoice.invoice_number.desc()).first()
-    invoice_number = 1 if not last_invoice else (last_invoice.invoice_number or 0) + 1
+    invoice_number = _next_invoice_number(db)
 
     vat_total = (invoice_in.subtotal * invoice_in.vat_rate) / Decimal("100")
     total = invoice_in.subtotal + vat_total
@@ -0,0 +1,274 @@
+"""
+Shared SQLAlchemy engine and session factory.
+
+`app/db/session.py` (the JSON API's user/API-key/session tables) and the
+top-level `db.py` (phase-1 models) used to build their own engines. One used
+`echo=True`, neither configured its pool, and `db.py` hardcoded its URL. Both
+now call `get_engine()`, which returns one engine per URL, configured from
+the environment:
+
+- DB_POOL_SIZE (5), DB_MAX_OVERFLOW (10), DB_POOL_TIMEOUT seconds (30),
+  DB_POOL_RECYCLE seconds (1800), DB_POOL_PRE_PING (1)
+- DB_ECHO (0): SQL logging; always off when RAILWAY_ENVIRONMENT=production
+
+Each engine's pool records checkouts, connection churn, timeouts and the
+time spent waiting for a free connection (`pool_metrics()`). Size
+DB_POOL_SIZE + DB_MAX_OVERFLOW per gunicorn worker from the wait times and
+`checked_out` peaks, so that workers x (size + overflow) stays under the
+Postgres `max_connections`.
+
+`get_async_engine()` is the asyncio counterpart used by the phase-1 API when
+ASYNC_DB=1. It maps the same DATABASE_URL onto an async driver (asyncpg for
+Postgres, aiosqlite for SQLite) with the same pool settings and metrics. The
+drivers are optional; they are only imported when an async engine is built.
+"""
+
+from collections import deque
+from contextlib import contextmanager
+import math
+import os
+import threading
+from time import perf_counter
+from typing import Dict, Iterator, Optional, Tuple
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeout
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool, StaticPool
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+def _percentile(samples, pct: float) -> Optional[float]:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    idx = min(len(ordered) - 1, max(0, math.ceil(pct / 100 * len(ordered)) - 1))
+    return round(ordered[idx] * 1000, 2)
+
+
+class PoolStats:
+    def __init__(self, sample_size: int = 1000):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.connects = 0
+        self.invalidated = 0
+        self.timeouts = 0
+        self.peak_checked_out = 0
+        self._checked_out = 0
+        self._waits = deque(maxlen=sample_size)
+
+    def record_wait(self, seconds: float, timed_out: bool = False) -> None:
+        with self._lock:
+            self._waits.append(seconds)
+            if timed_out:
+                self.timeouts += 1
+
+    def on_checkout(self) -> None:
+        with self._lock:
+            self.checkouts += 1
+            self._checked_out += 1
+            self.peak_checked_out = max(self.peak_checked_out, self._checked_out)
+
+    def on_checkin(self) -> None:
+        with self._lock:
+            self._checked_out = max(0, self._checked_out - 1)
+
+    def on_connect(self) -> None:
+        with self._lock:
+            self.connects += 1
+
+    def on_invalidate(self) -> None:
+        with self._lock:
+            self.invalidated += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "connects": self.connects,
+                "invalidated": self.invalidated,
+                "timeouts": self.timeouts,
+                "peak_checked_out": self.peak_checked_out,
+                "wait_ms": {"p50": _percentile(self._waits, 50), "p95": _percentile(self._waits, 95),
+                            "max": _percentile(self._waits, 100)},
+            }
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that measures how long checkouts wait for a free connection."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    def _do_get(self):
+        started = perf_counter()
+        try:
+            conn = super()._do_get()
+        except PoolTimeout:
+            self.stats.record_wait(perf_counter() - started, timed_out=True)
+            raise
+        self.stats.record_wait(perf_counter() - started)
+        return conn
+
+    def recreate(self):
+        # Keep the counters when the engine recreates its pool (e.g. after dispose())
+        new = super().recreate()
+        new.stats = self.stats
+        return new
+
+
+class TimedAsyncQueuePool(TimedQueuePool, AsyncAdaptedQueuePool):
+    """TimedQueuePool for asyncio engines."""
+
+
+ASYNC_DRIVERS = {"sqlite": "aiosqlite", "postgresql": "asyncpg"}
+
+
+def async_url(url: str) -> str:
+    """sqlite:///x.db -> sqlite+aiosqlite:///x.db, postgresql://... -> postgresql+asyncpg://..."""
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    if backend == "postgres":  # Heroku/Railway style URLs
+        backend = "postgresql"
+    driver = ASYNC_DRIVERS.get(backend)
+    if driver is None:
+        raise ValueError(f"No async driver configured for {backend!r}")
+    return parsed.set(drivername=f"{backend}+{driver}").render_as_string(hide_password=False)
+
+
+def sync_url(url) -> str:
+    """Inverse of `async_url()`: the backend's default (blocking) driver."""
+    parsed = make_url(url)
+    return parsed.set(drivername=parsed.get_backend_name()).render_as_string(hide_password=False)
+
+
+def _echo() -> bool:
+    if os.getenv("RAILWAY_ENVIRONMENT") == "production":
+        return False
+    return os.getenv("DB_ECHO", "0").lower() in ("1", "true", "yes")
+
+
+def _engine_kwargs(url: str, poolclass) -> dict:
+    kwargs = {"echo": _echo()}
+    if url.startswith("sqlite"):
+        kwargs["connect_args"] = {"check_same_thread": False}
+    if url.startswith("sqlite") and (":memory:" in url or url.split("?")[0].rstrip("/").endswith(":")):
+        # One shared connection so every session sees the same in-memory DB
+        kwargs["poolclass"] = StaticPool
+    else:
+        kwargs.update(
+            poolclass=poolclass,
+            pool_size=_env_int("DB_POOL_SIZE", 5),
+            max_overflow=_env_int("DB_MAX_OVERFLOW", 10),
+            pool_timeout=_env_int("DB_POOL_TIMEOUT", 30),
+            pool_recycle=_env_int("DB_POOL_RECYCLE", 1800),
+            pool_pre_ping=os.getenv("DB_POOL_PRE_PING", "1").lower() in ("1", "true", "yes"),
+        )
+    return kwargs
+
+
+def _track_pool(engine: Engine) -> None:
+    stats = getattr(engine.pool, "stats", None)
+    if stats is not None:
+        event.listen(engine, "checkout", lambda *args: stats.on_checkout())
+        event.listen(engine, "checkin", lambda *args: stats.on_checkin())
+        event.listen(engine, "connect", lambda *args: stats.on_connect())
+        event.listen(engine, "invalidate", lambda *args: stats.on_invalidate())
+
+
+def create_pooled_engine(url: str) -> Engine:
+    engine = create_engine(url, future=True, **_engine_kwargs(url, TimedQueuePool))
+    _track_pool(engine)
+    return engine
+
+
+def create_async_pooled_engine(url: str):
+    """Async engine for `url`; the driver is swapped with `async_url()`."""
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    url = async_url(url)
+    engine = create_async_engine(url, **_engine_kwargs(url, TimedAsyncQueuePool))
+    _track_pool(engine.sync_engine)
+    return engine
+
+
+_engines: Dict[str, Engine] = {}
+_factories: Dict[str, sessionmaker] = {}
+_async_engines: Dict[str, Tuple[object, object]] = {}
+_engines_lock = threading.Lock()
+
+
+def get_engine(url: str) -> Engine:
+    """The process-wide engine for `url` (created on first use)."""
+    with _engines_lock:
+        engine = _engines.get(url)
+        if engine is None:
+            engine = _engines[url] = create_pooled_engine(url)
+            _factories[url] = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+        return engine
+
+
+def get_sessionmaker(url: str) -> sessionmaker:
+    get_engine(url)
+    return _factories[url]
+
+
+def get_async_engine(url: str):
+    """The process-wide async engine for `url` (created on first use)."""
+    return _async_entry(url)[0]
+
+
+def get_async_sessionmaker(url: str):
+    """async_sessionmaker for `url`; objects stay usable after commit (no implicit lazy loads)."""
+    return _async_entry(url)[1]
+
+
+def _async_entry(url: str):
+    from sqlalchemy.ext.asyncio import async_sessionmaker
+
+    with _engines_lock:
+        entry = _async_engines.get(url)
+        if entry is None:
+            engine = create_async_pooled_engine(url)
+            entry = _async_engines[url] = (
+                engine, async_sessionmaker(engine, autoflush=False, expire_on_commit=False))
+        return entry
+
+
+@contextmanager
+def session_scope(factory: sessionmaker) -> Iterator[Session]:
+    """A session that is always closed (connection back to the pool), rolled back on errors."""
+    db = factory()
+    try:
+        yield db
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def pool_metrics() -> dict:
+    """Pool state and counters for every engine, keyed by URL (password masked)."""
+    out = {}
+    with _engines_lock:
+        engines = list(_engines.values()) + [async_engine.sync_engine for async_engine, _ in _async_engines.values()]
+    for engine in engines:
+        pool = engine.pool
+        entry = {"pool": type(pool).__name__}
+        if isinstance(pool, QueuePool):
+            entry.update(size=pool.size(), checked_out=pool.checkedout(), overflow=pool.overflow(),
+                         max_overflow=pool._max_overflow, timeout=pool.timeout())
+        stats = getattr(pool, "stats", None)
+        if stats is not None:
+            entry.update(stats.snapshot())
+        out[engine.url.render_as_string(hide_password=True)] = entry
+    return out
@@ -1,25 +1,16 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, declarative_base
-from sqlalchemy.pool import StaticPool
+from sqlalchemy.orm import declarative_base
 import os
 
+from app.db.engine import get_engine, get_sessionmaker, session_scope
+
 DATABASE_URL = os.environ.get("DATABASE_URL", "sqlite:///./test.db")  # fallback lokaal
 
-# Use a shared in-memory SQLite DB for tests when the URL is sqlite:///:memory:
-# This ensures that multiple connections (created by SessionLocal and TestClient)
-# see the same in-memory database.
-if DATABASE_URL.startswith("sqlite") and ":memory:" in DATABASE_URL:
-    engine = create_engine(
-        DATABASE_URL,
-        connect_args={"check_same_thread": False},
-        poolclass=StaticPool,
-        echo=True,
-        future=True,
-    )
-else:
-    engine = create_engine(DATABASE_URL, echo=True, future=True)
-
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Pool size/overflow/recycle/pre-ping and SQL echo come from the environment;
+# see app/db/engine.py. sqlite:///:memory: gets one shared connection so
+# SessionLocal and the TestClient see the same in-memory database.
+engine = get_engine(DATABASE_URL)
+
+SessionLocal = get_sessionmaker(DATABASE_URL)
 
 Base = declarative_base()
 
@@ -29,3 +20,8 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+def db_session():
+    """Context manager for code outside a request: `with db_session() as db: ...`."""
+    return session_scope(SessionLocal)
@@ -1,19 +1,23 @@
+from datetime import datetime, timezone
 from typing import Optional, Dict
-from contextlib import contextmanager
-from app.db.session import SessionLocal
+from sqlalchemy import DateTime
+from app.db.session import db_session as _db
 from app.models.hosted_session import HostedSession
 
+# Columns update_session may write; other keys (metadata, payment_status, ...) have no column
+_UPDATABLE = {c.name: c for c in HostedSession.__table__.columns if c.name not in ("id", "created_at")}
 
-@contextmanager
-def _db():
-    try:
-        db = SessionLocal()
-        yield db
-    finally:
-        try:
-            db.close()
-        except Exception:
-            pass
+
+def _column_value(column, value):
+    """Coerce a session-dict value to what `column` stores (ISO strings -> datetime)."""
+    if value is None:
+        return None
+    if isinstance(column.type, DateTime) and isinstance(value, str):
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)  # written with utcnow()
+    if column.name == "merchant_id":
+        return str(value)
+    return value
 
 
 def create_session(session_dict: Dict) -> Dict:
@@ -66,14 +70,29 @@ def get_session(session_id: str) -> Optional[Dict]:
 
 
 def update_session(session_id: str, updates: Dict) -> Optional[Dict]:
+    """Write the column-backed keys of `updates`; the id and created_at are never changed."""
     with _db() as db:
         s = db.query(HostedSession).filter(HostedSession.id == session_id).first()
         if not s:
             return None
         for k, v in updates.items():
-            if hasattr(s, k):
-                setattr(s, k, v)
+            column = _UPDATABLE.get(k)
+            if column is not None:
+                setattr(s, k, _column_value(column, v))
         db.add(s)
         db.commit()
         db.refresh(s)
         return get_session(session_id)
+
+
+class DBSessionStore:
+    """The functions above as a `session_store.SessionBackend`."""
+
+    def create_session(self, session_dict: Dict) -> Dict:
+        return create_session(session_dict)
+
+    def get_session(self, session_id: str) -> Optional[Dict]:
+        return get_session(session_id)
+
+    def update_session(self, session_id: str, updates: Dict) -> Optional[Dict]:
+        return update_session(session_id, updates)
@@ -1,9 +1,11 @@
 from fastapi import FastAPI
 from app.api.routes import invoice
 from app.db.session import Base, engine
+import sequences
 
 # create tables
 Base.metadata.create_all(bind=engine)
+sequences.metadata.create_all(bind=engine)
 
 app = FastAPI(title="Invoice API")
 
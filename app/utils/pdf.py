@@ -64,13 +64,9 @@ def generate_invoice_pdf(invoice) -> str:
     else:
         if seller_vat:
             try:
-                from zeep import Client
-                wsdl = "https://ec.europa.eu/taxation_customs/vies/checkVatService.wsdl"
-                client = Client(wsdl=wsdl)
-                country = seller_vat[:2]
-                number = seller_vat[2:]
-                res = client.service.checkVat(countryCode=country, vatNumber=number)
-                sv_status = "validated" if getattr(res, "valid", False) else "unvalidated"
+                from vies_client import get_vies_client
+                res = get_vies_client().check(seller_vat[:2], seller_vat[2:])
+                sv_status = "validated" if res.get("valid") else "unvalidated"
             except Exception:
                 sv_status = None
 
@@ -99,13 +95,9 @@ def generate_invoice_pdf(invoice) -> str:
             bv_status = "validated" if invoice.buyer_vat_validated else "unvalidated"
         else:
             try:
-                from zeep import Client
-                wsdl = "https://ec.europa.eu/taxation_customs/vies/checkVatService.wsdl"
-                client = Client(wsdl=wsdl)
-                country = buyer_vat[:2]
-                number = buyer_vat[2:]
-                res = client.service.checkVat(countryCode=country, vatNumber=number)
-                bv_status = "validated" if getattr(res, "valid", False) else "unvalidated"
+                from vies_client import get_vies_client
+                res = get_vies_client().check(buyer_vat[:2], buyer_vat[2:])
+                bv_status = "validated" if res.get("valid") else "unvalidated"
             except Exception:
                 bv_status = None
 
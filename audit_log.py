@@ -0,0 +1,302 @@
+"""
+Segmented audit.log with a timestamp index, read from the tail.
+
+`GET /admin/logs` used to read the whole of audit.log on every page view to
+return its last 100 lines, and the file never stopped growing.
+`AuditLogFile` keeps the same `ts | ip | username | event` lines but:
+
+- Rotates by size. `append` (the `AuditWriter` sink) renames `audit.log` to
+  `audit.log.<n>` once it reaches `max_segment_bytes`, and the next write
+  starts a fresh file. Segment numbers only go up, so higher means newer.
+  Rotation holds the cross-process `file_lock`, and a failed rotation is
+  logged and retried on a later write; the lines are already written.
+- Indexes each segment: line count, first/last timestamp, and a mark
+  (timestamp, byte offset) every `index_every` lines. Sealed segments keep
+  their index in `audit.log.<n>.idx`. The active file's index lives in
+  memory and is extended from the last indexed offset, so a reader only
+  scans bytes appended since its previous call.
+- Reads backwards. `query` walks segments newest first and reads each one
+  from the end in blocks. The filters (event type, username, ip, since /
+  until) are checked line by line until `limit` matches are found. A time
+  range skips whole segments via first/last timestamps and seeks within a
+  segment via the marks. Nothing is loaded whole.
+
+Lines come from batching writers in several workers, so timestamps are only
+roughly ordered. Seeks allow `skew_seconds` of slack, and the per-line check
+is exact.
+"""
+
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from pathlib import Path
+import bisect
+import json
+import os
+import threading
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from file_store import file_lock
+
+
+def line_time(line: str) -> Optional[float]:
+    """Epoch seconds of a `ts | ...` audit line, None if it has no parseable timestamp."""
+    stamp = line.split(" | ", 1)[0].strip()
+    try:
+        parsed = datetime.fromisoformat(stamp.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def parse_line(line: str) -> Tuple[str, str, str, str]:
+    """`ts | ip | username | event` -> its four fields (missing ones are "")."""
+    parts = line.split(" | ", 3)
+    parts += [""] * (4 - len(parts))
+    return parts[0], parts[1], parts[2], parts[3]
+
+
+@dataclass
+class SegmentIndex:
+    inode: int
+    size: int = 0                # bytes indexed so far (always ends on a line boundary)
+    lines: int = 0
+    first: Optional[float] = None
+    last: Optional[float] = None
+    marks: List[Tuple[float, int]] = field(default_factory=list)  # (timestamp, offset) every index_every lines
+
+    def to_json(self) -> dict:
+        return {"size": self.size, "lines": self.lines, "first": self.first, "last": self.last, "marks": self.marks}
+
+    @classmethod
+    def from_json(cls, inode: int, data: dict) -> "SegmentIndex":
+        return cls(inode, data["size"], data["lines"], data["first"], data["last"],
+                   [tuple(m) for m in data["marks"]])
+
+
+def _reverse_lines(fh, start: int, end: int, block_size: int = 64 * 1024) -> Iterator[bytes]:
+    """Lines of fh[start:end] from last to first, reading `block_size` bytes at a time."""
+    pos = end
+    rest = b""
+    while pos > start:
+        step = min(block_size, pos - start)
+        pos -= step
+        fh.seek(pos)
+        chunk = fh.read(step) + rest
+        lines = chunk.split(b"\n")
+        rest = lines[0]
+        for line in reversed(lines[1:]):
+            if line:
+                yield line
+    if rest:
+        yield rest
+
+
+class AuditLogFile:
+    def __init__(self, path: Path, max_segment_bytes: int = 16 * 1024 * 1024, index_every: int = 1000,
+                 max_segments: int = 0, skew_seconds: float = 60, fsync: bool = True):
+        self.path = Path(path)
+        self.max_segment_bytes = max_segment_bytes
+        self.index_every = index_every
+        self.max_segments = max_segments  # 0 keeps every sealed segment
+        self.skew_seconds = skew_seconds
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self._indexes: Dict[int, SegmentIndex] = {}  # by inode, so an index survives its segment's rename
+
+    # ----- writing -----
+
+    def append(self, lines: List[str]) -> None:
+        """AuditWriter sink: append pre-formatted lines with one write (and fsync), rotating by size."""
+        data = "".join(lines).encode("utf-8")
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, data)
+            if self.fsync:
+                os.fsync(fd)
+            st = os.fstat(fd)
+        finally:
+            os.close(fd)
+        if self.max_segment_bytes and st.st_size >= self.max_segment_bytes:
+            try:
+                self._rotate(st.st_ino)
+            except OSError as e:
+                # The batch is written; failing the sink now would write it again
+                print(f"[WARN] {self.path.name} rotation failed, retrying on the next write: {e}")
+
+    def _segment_numbers(self) -> List[int]:
+        prefix = self.path.name + "."
+        numbers = []
+        try:
+            names = os.listdir(self.path.parent)
+        except FileNotFoundError:
+            return []
+        for name in names:
+            if name.startswith(prefix) and name[len(prefix):].isdigit():
+                numbers.append(int(name[len(prefix):]))
+        return sorted(numbers)
+
+    def _segment_path(self, number: int) -> Path:
+        return self.path.with_name(f"{self.path.name}.{number}")
+
+    def _rotate(self, inode: int) -> None:
+        # Serializes rotation across workers; FileNotFoundError below means another one already rotated
+        with file_lock(self.path):
+            try:
+                if os.stat(self.path).st_ino != inode:
+                    return  # another worker already rotated this file
+            except FileNotFoundError:
+                return
+            numbers = self._segment_numbers()
+            number = (numbers[-1] if numbers else 0) + 1
+            while True:
+                # link() refuses to overwrite, unlike rename(), so a stray
+                # segment left by an older writer is never clobbered
+                try:
+                    os.link(self.path, self._segment_path(number))
+                    break
+                except FileExistsError:
+                    number += 1
+                except FileNotFoundError:
+                    return
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+            numbers.append(number)
+            if self.max_segments and len(numbers) > self.max_segments:
+                for old in numbers[:-self.max_segments]:
+                    for p in (self._segment_path(old), Path(f"{self._segment_path(old)}.idx")):
+                        try:
+                            p.unlink()
+                        except FileNotFoundError:
+                            pass
+
+    # ----- indexing -----
+
+    def segments(self) -> List[Path]:
+        """Sealed segments oldest first, then the active file (if it exists)."""
+        paths = [self._segment_path(n) for n in self._segment_numbers()]
+        if self.path.exists():
+            paths.append(self.path)
+        return paths
+
+    def _extend(self, path: Path, idx: SegmentIndex) -> None:
+        with open(path, "rb") as fh:
+            fh.seek(idx.size)
+            offset = idx.size
+            last_line = None
+            for raw in fh:
+                if not raw.endswith(b"\n"):
+                    break  # a batch still being written; picked up next time
+                if idx.lines % self.index_every == 0 or idx.first is None:
+                    ts = line_time(raw.decode("utf-8", "replace"))
+                    if ts is not None:
+                        if idx.first is None:
+                            idx.first = ts
+                        if idx.lines % self.index_every == 0:
+                            idx.marks.append((ts, offset))
+                idx.lines += 1
+                offset += len(raw)
+                last_line = raw
+            idx.size = offset
+        if last_line is not None:
+            ts = line_time(last_line.decode("utf-8", "replace"))
+            if ts is not None:
+                idx.last = ts if idx.last is None else max(idx.last, ts)
+
+    def _index(self, path: Path) -> Optional[SegmentIndex]:
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        sealed = path != self.path
+        with self._lock:
+            idx = self._indexes.get(st.st_ino)
+            if idx is None and sealed:
+                try:
+                    idx = SegmentIndex.from_json(st.st_ino, json.loads(Path(f"{path}.idx").read_text(encoding="utf-8")))
+                except (OSError, ValueError, KeyError):
+                    idx = None
+            if idx is None or st.st_size < idx.size:
+                idx = SegmentIndex(st.st_ino)
+            grew = st.st_size > idx.size
+            if grew:
+                self._extend(path, idx)
+            self._indexes[st.st_ino] = idx
+        if sealed and (grew or not Path(f"{path}.idx").exists()):
+            try:
+                Path(f"{path}.idx").write_text(json.dumps(idx.to_json()), encoding="utf-8")
+            except OSError:
+                pass  # read-only deployments rebuild it in memory
+        return idx
+
+    # ----- reading -----
+
+    def count(self) -> int:
+        """Total number of lines across all segments."""
+        total = 0
+        for path in self.segments():
+            idx = self._index(path)
+            total += idx.lines if idx else 0
+        return total
+
+    def tail(self, n: int = 100) -> List[str]:
+        return self.query(limit=n)
+
+    def query(self, limit: int = 100, event: Optional[str] = None, username: Optional[str] = None,
+              ip: Optional[str] = None, since: Optional[float] = None, until: Optional[float] = None) -> List[str]:
+        """The newest `limit` lines matching every given filter, oldest first.
+
+        `event` matches the event type (the first word of the event field);
+        `since`/`until` are inclusive epoch seconds.
+        """
+        matches: List[str] = []
+        if limit <= 0:
+            return matches
+        lo = since - self.skew_seconds if since is not None else None
+        hi = until + self.skew_seconds if until is not None else None
+        for path in reversed(self.segments()):
+            idx = self._index(path)
+            if idx is None or idx.lines == 0:
+                continue
+            if lo is not None and idx.last is not None and idx.last < lo:
+                break  # this segment and every older one end before the range
+            if hi is not None and idx.first is not None and idx.first > hi:
+                continue
+            stamps = [m[0] for m in idx.marks]
+            start, end = 0, idx.size
+            if hi is not None:
+                # marks aren't strictly sorted (see skew), bisect only needs them roughly so
+                pos = bisect.bisect_right(stamps, hi)
+                if pos < len(idx.marks):
+                    end = idx.marks[pos][1]
+            if lo is not None:
+                pos = bisect.bisect_left(stamps, lo)
+                if pos > 0:
+                    start = idx.marks[pos - 1][1]
+            try:
+                fh = open(path, "rb")
+            except FileNotFoundError:
+                continue  # removed by retention since we listed it
+            with fh:
+                for raw in _reverse_lines(fh, start, end):
+                    line = raw.decode("utf-8", "replace")
+                    ts_field, line_ip, line_user, line_event = parse_line(line)
+                    if event is not None and line_event.split(" ", 1)[0] != event:
+                        continue
+                    if username is not None and line_user != username:
+                        continue
+                    if ip is not None and line_ip != ip:
+                        continue
+                    if since is not None or until is not None:
+                        ts = line_time(ts_field)
+                        if ts is None or (since is not None and ts < since) or (until is not None and ts > until):
+                            continue
+                    matches.append(line)
+                    if len(matches) >= limit:
+                        matches.reverse()
+                        return matches
+        matches.reverse()
+        return matches
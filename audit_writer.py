@@ -0,0 +1,192 @@
+"""
+Batched, asynchronous audit-log writes.
+
+Both audit trails used to write synchronously on every event: phase-1's
+`auth.log_audit_event` committed one row per event, and main.py's `log_event`
+opened, appended to and closed `audit.log` under the global lock. An
+`AuditWriter` instead queues events in memory. A background thread hands
+them to a sink in batches, when `max_batch` events are waiting or
+`flush_interval` seconds have passed, whichever comes first. The sink is a
+multi-row INSERT or a single buffered file write.
+
+- `submit(item, sync=True)` is for compliance-critical events. It writes
+  everything queued so far plus `item` before returning, and raises if the
+  sink fails.
+- `flush()` writes what is queued, for readers that need read-your-writes.
+- `close()` runs at interpreter exit (atexit). It stops the thread and
+  writes the rest, so a graceful shutdown loses nothing.
+- Events are never dropped silently. When the queue reaches `max_queue`
+  (e.g. the database is down), the submitting request flushes inline. If the
+  sink fails, the part of the batch it had not written goes back to the front
+  of the queue and is retried; a sink that commits in pieces raises
+  `PartialWrite` so committed events are not written twice.
+- After `max_attempts` failures in a row the head of the queue is retried one
+  event at a time, and an event that still fails on its own `max_attempts`
+  times is handed to `dead_letter` instead of blocking everything behind it.
+"""
+
+from collections import deque
+import atexit
+import os
+import sys
+import threading
+from typing import Any, Callable, List, Optional
+
+Sink = Callable[[List[Any]], None]
+DeadLetter = Callable[[Any, Exception], None]
+
+
+class PartialWrite(Exception):
+    """Raised by a sink that committed the first `written` events of its batch before `error`."""
+
+    def __init__(self, written: int, error: Exception):
+        super().__init__(str(error))
+        self.written = written
+        self.error = error
+
+
+def log_dead_letter(item: Any, error: Exception) -> None:
+    """Default dead-letter path: the event goes to stderr (and so the process log)."""
+    print(f"[ERROR] audit event dropped after repeated failures ({error}): {item!r}", file=sys.stderr)
+
+
+class AuditWriter:
+    def __init__(self, sink: Sink, max_batch: int = 500, flush_interval: float = 1.0,
+                 max_queue: int = 100_000, name: str = "audit", max_attempts: int = 5,
+                 dead_letter: DeadLetter = log_dead_letter):
+        self.sink = sink
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.name = name
+        self.max_attempts = max_attempts
+        self.dead_letter = dead_letter
+        self._queue: deque = deque()
+        self._cond = threading.Condition()
+        self._write_lock = threading.Lock()  # one sink call at a time keeps batches in order
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self._closed = False
+        self._attempts = 0   # failed sink calls in a row
+        self._isolate = 0    # head events to retry one at a time
+        self.written = 0
+        self.batches = 0
+        self.failures = 0
+        self.dead = 0
+        atexit.register(self.close)
+
+    def _ensure_thread(self) -> None:
+        # Started lazily and per process: threads don't survive a gunicorn fork.
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, name=f"{self.name}-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, item: Any, sync: bool = False) -> None:
+        if sync or self._closed:
+            with self._cond:
+                self._queue.append(item)
+            self.flush(raise_errors=True)
+            return
+        with self._cond:
+            self._queue.append(item)
+            size = len(self._queue)
+            if size >= self.max_batch:
+                self._cond.notify()
+            self._ensure_thread()
+        if size >= self.max_queue:
+            self.flush()  # backpressure: the writer is not keeping up
+
+    def flush(self, raise_errors: bool = False) -> int:
+        """Write everything queued so far; returns how many events were written."""
+        written = 0
+        with self._write_lock:
+            while True:
+                with self._cond:
+                    if not self._queue:
+                        return written
+                    size = 1 if self._isolate else self.max_batch
+                    batch = [self._queue.popleft() for _ in range(min(size, len(self._queue)))]
+                try:
+                    self.sink(batch)
+                except Exception as e:
+                    done = e.written if isinstance(e, PartialWrite) else 0
+                    error = e.error if isinstance(e, PartialWrite) else e
+                    written += done
+                    if self._failed(batch, done, error):
+                        continue  # the failing event was dead-lettered; carry on behind it
+                    if raise_errors:
+                        raise error
+                    print(f"[WARN] {self.name} writer: batch of {len(batch) - done} failed, will retry: {error}")
+                    return written
+                written += len(batch)
+                self.written += len(batch)
+                self.batches += 1
+                self._attempts = 0
+                self._isolate = max(0, self._isolate - len(batch))
+
+    def _failed(self, batch: List[Any], done: int, error: Exception) -> bool:
+        """Requeue the unwritten rest of `batch`; True if its head was dead-lettered instead."""
+        rest = batch[done:]
+        with self._cond:
+            self.written += done
+            self.failures += 1
+            self._attempts = 1 if done else self._attempts + 1
+            dead = None
+            if self._attempts >= self.max_attempts:
+                self._attempts = 0
+                if len(rest) == 1:
+                    dead = rest.pop()
+                    self._isolate = max(0, self._isolate - 1)
+                    self.dead += 1
+                else:
+                    self._isolate = len(rest)  # find the event that keeps failing
+            self._queue.extendleft(reversed(rest))
+        if dead is None:
+            return False
+        try:
+            self.dead_letter(dead, error)
+        except Exception as e:
+            print(f"[ERROR] {self.name} writer: dead-letter failed ({e}): {dead!r}", file=sys.stderr)
+        return True
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                if not self._closed and len(self._queue) < self.max_batch:
+                    self._cond.wait(self.flush_interval)
+                closed = self._closed
+            self.flush()
+            if closed:
+                return
+
+    def close(self) -> None:
+        """Stop the background thread and write whatever is still queued."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        thread = self._thread
+        if thread is not None and thread.is_alive() and thread is not threading.current_thread():
+            thread.join(timeout=10)
+        self.flush()
+
+    def stats(self) -> dict:
+        with self._cond:
+            queued = len(self._queue)
+        return {"queued": queued, "written": self.written, "batches": self.batches, "failures": self.failures,
+                "dead": self.dead}
+
+
+def file_sink(path, fsync: bool = True) -> Sink:
+    """Sink appending pre-formatted lines to `path` with one write (and fsync) per batch."""
+    def write(lines: List[str]) -> None:
+        data = "".join(lines).encode("utf-8")
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, data)
+            if fsync:
+                os.fsync(fd)
+        finally:
+            os.close(fd)
+    return write
@@ -3,6 +3,8 @@ Authentication and security utilities for PHASE 1
 Handles JWT tokens, password hashing, email verification, password reset
 """
 
+import asyncio
+import json
 import os
 import secrets
 import hashlib
@@ -11,8 +13,13 @@ from typing import Tuple, Optional
 from jose import jwt, JWTError
 from passlib.context import CryptContext
 from fastapi import HTTPException, status, Request
+from sqlalchemy.ext.asyncio import AsyncEngine
 from sqlalchemy.orm import Session
+from sqlalchemy.pool import StaticPool
 
+from app.db.engine import get_engine, sync_url
+from audit_writer import AuditWriter, PartialWrite
+from login_attempts import tracker_from_env
 from models_phase1 import User, Organization, TokenVersion, AuditLog
 from schemas import TokenResponse
 
@@ -225,6 +232,97 @@ def require_admin(user: User) -> User:
 
 # ===== AUDIT LOGGING =====
 
+# Audit rows are queued and inserted in batches by a background writer (see
+# audit_writer.py) unless AUDIT_ASYNC=0. Events in SYNC_AUDIT_EVENTS are
+# always committed before the call returns: invoices becoming legal
+# documents, and payments.
+AUDIT_ASYNC = os.getenv("AUDIT_ASYNC", "1").lower() in ("1", "true", "yes")
+SYNC_AUDIT_EVENTS = frozenset(
+    e.strip() for e in os.getenv(
+        "AUDIT_SYNC_EVENTS",
+        "INVOICE_FINALIZED,INVOICE_PAID,CREDIT_NOTE_CREATED,"
+        "PAYMENT_COMPLETED_STRIPE,PAYMENT_COMPLETED_ONECOM,PAYMENT_COMPLETED_WEB3"
+    ).split(",") if e.strip()
+)
+# Rows that still fail after AUDIT_MAX_ATTEMPTS tries on their own are appended here as JSON lines
+AUDIT_DEAD_LETTER_FILE = os.getenv("AUDIT_DEAD_LETTER_FILE", "audit_dead_letter.jsonl")
+
+
+def _insert_audit_rows(batch) -> None:
+    """Writer sink: one multi-row INSERT per run of rows for the same engine, in order.
+
+    Raises PartialWrite with the number of rows already committed when a
+    later run fails, so the writer doesn't insert those again.
+    """
+    done = 0
+    while done < len(batch):
+        bind = batch[done][0]
+        end = done
+        while end < len(batch) and batch[end][0] is bind:
+            end += 1
+        try:
+            with bind.begin() as conn:
+                conn.execute(AuditLog.__table__.insert(), [row for _, row in batch[done:end]])
+        except Exception as e:
+            if not done:
+                raise
+            raise PartialWrite(done, e)
+        done = end
+
+
+def _dead_letter_audit_row(item, error: Exception) -> None:
+    bind, row = item
+    record = {"db": bind.url.render_as_string(hide_password=True), "error": str(error)[:500], "row": row}
+    with open(AUDIT_DEAD_LETTER_FILE, "a", encoding="utf-8") as fh:
+        fh.write(json.dumps(record, default=str) + "\n")
+    print(f"[ERROR] audit row {row.get('event_type')} moved to {AUDIT_DEAD_LETTER_FILE}: {error}")
+
+
+audit_writer = AuditWriter(
+    _insert_audit_rows,
+    max_batch=int(os.getenv("AUDIT_BATCH_SIZE", "500")),
+    flush_interval=float(os.getenv("AUDIT_FLUSH_SECONDS", "1.0")),
+    name="audit-db",
+    max_attempts=int(os.getenv("AUDIT_MAX_ATTEMPTS", "5")),
+    dead_letter=_dead_letter_audit_row,
+)
+
+
+def _writer_bind(bind):
+    """Blocking engine the writer thread can use for `bind`, or None to write inline."""
+    if isinstance(bind, AsyncEngine):
+        bind = get_engine(sync_url(bind.url))
+    if isinstance(bind.pool, StaticPool):
+        return None  # in-memory SQLite: one connection shared with the request
+    return bind
+
+
+def _audit_row(org_id, event_type, entity_type, entity_id=None, user_id=None, details=None,
+               ip_address=None, user_agent=None) -> dict:
+    return {
+        "org_id": org_id,
+        "user_id": user_id,
+        "event_type": event_type,
+        "entity_type": entity_type,
+        "entity_id": entity_id,
+        "details": details or {},
+        "ip_address": ip_address,
+        "user_agent": user_agent,
+        "created_at": datetime.now(timezone.utc),
+    }
+
+
+def _queue_audit_row(bind, row: dict, sync: bool) -> bool:
+    """Hand `row` to the batched writer; False if it has to be written in the caller's session."""
+    if sync or not AUDIT_ASYNC or row["event_type"] in SYNC_AUDIT_EVENTS:
+        return False
+    writer_bind = _writer_bind(bind)
+    if writer_bind is None:
+        return False
+    audit_writer.submit((writer_bind, row))
+    return True
+
+
 def log_audit_event(
     db: Session,
     org_id: int,
@@ -234,24 +332,31 @@ def log_audit_event(
     user_id: Optional[int] = None,
     details: Optional[dict] = None,
     ip_address: Optional[str] = None,
-    user_agent: Optional[str] = None
+    user_agent: Optional[str] = None,
+    sync: bool = False
 ) -> AuditLog:
-    """Log event to audit trail."""
-    log_entry = AuditLog(
-        org_id=org_id,
-        user_id=user_id,
-        event_type=event_type,
-        entity_type=entity_type,
-        entity_id=entity_id,
-        details=details or {},
-        ip_address=ip_address,
-        user_agent=user_agent
-    )
+    """Log event to audit trail (queued unless `sync` or listed in SYNC_AUDIT_EVENTS)."""
+    row = _audit_row(org_id, event_type, entity_type, entity_id, user_id, details, ip_address, user_agent)
+    log_entry = AuditLog(**row)
+    if _queue_audit_row(db.get_bind(), row, sync):
+        return log_entry
     db.add(log_entry)
     db.commit()
     return log_entry
 
 
+async def log_audit_event_async(db, org_id: int, event_type: str, entity_type: str,
+                                sync: bool = False, **kwargs) -> AuditLog:
+    """log_audit_event for an AsyncSession."""
+    row = _audit_row(org_id, event_type, entity_type, **kwargs)
+    log_entry = AuditLog(**row)
+    if _queue_audit_row(db.bind, row, sync):
+        return log_entry
+    db.add(log_entry)
+    await db.commit()
+    return log_entry
+
+
 def get_client_ip(request: Request) -> str:
     """Extract client IP from request."""
     # Check X-Forwarded-For (important for reverse proxies)
@@ -265,20 +370,19 @@ def get_client_ip(request: Request) -> str:
 MAX_LOGIN_ATTEMPTS = 5
 LOCKOUT_DURATION_MINUTES = 15
 
+# Sliding-window counters per user and IP (login_attempts.py), shared across
+# workers; replaces counting LOGIN_FAILED rows in audit_logs on every login.
+login_tracker = tracker_from_env(MAX_LOGIN_ATTEMPTS, LOCKOUT_DURATION_MINUTES * 60, namespace="org:")
 
-def check_account_lockout(db: Session, user: User) -> bool:
-    """Check if user account is locked from failed logins."""
-    # Simple version: track in audit logs
-    # For production, consider a dedicated table
-    recent_failures = db.query(AuditLog).filter(
-        AuditLog.user_id == user.id,
-        AuditLog.event_type == "LOGIN_FAILED",
-        AuditLog.created_at > datetime.now(timezone.utc) - timedelta(minutes=LOCKOUT_DURATION_MINUTES)
-    ).count()
-    
-    if recent_failures >= MAX_LOGIN_ATTEMPTS:
-        return True  # locked
-    return False  # not locked
+
+def check_account_lockout(db: Session, user: User, ip_address: Optional[str] = None) -> bool:
+    """Check if user account (or the client IP) is locked from failed logins."""
+    return login_tracker.is_locked(user.id, ip_address)
+
+
+async def check_account_lockout_async(db, user: User, ip_address: Optional[str] = None) -> bool:
+    """check_account_lockout without blocking the event loop."""
+    return await asyncio.to_thread(login_tracker.is_locked, user.id, ip_address)
 
 
 def record_failed_login(
@@ -288,6 +392,7 @@ def record_failed_login(
     ip_address: str
 ):
     """Record failed login attempt."""
+    login_tracker.record_failure(user_id, ip_address)
     log_audit_event(
         db=db,
         org_id=org_id,
@@ -307,6 +412,8 @@ def record_successful_login(
     ip_address: str
 ):
     """Record successful login and clear failures."""
+    login_tracker.record_success(user_id)
+    
     # Log success
     log_audit_event(
         db=db,
@@ -323,3 +430,24 @@ def record_successful_login(
     if user:
         user.last_login = datetime.now(timezone.utc)
         db.commit()
+
+
+async def record_failed_login_async(db, org_id: int, user_id: int, ip_address: str):
+    await asyncio.to_thread(login_tracker.record_failure, user_id, ip_address)
+    await log_audit_event_async(
+        db, org_id, "LOGIN_FAILED", "user",
+        entity_id=user_id, user_id=user_id, ip_address=ip_address,
+        details={"reason": "invalid_password"}
+    )
+
+
+async def record_successful_login_async(db, org_id: int, user_id: int, ip_address: str):
+    await asyncio.to_thread(login_tracker.record_success, user_id)
+    await log_audit_event_async(
+        db, org_id, "LOGIN_SUCCESS", "user",
+        entity_id=user_id, user_id=user_id, ip_address=ip_address
+    )
+    user = await db.get(User, user_id)
+    if user:
+        user.last_login = datetime.now(timezone.utc)
+        await db.commit()
@@ -0,0 +1,258 @@
+"""
+Hosted checkout page (`GET /checkout`), rendered from a precompiled template.
+
+The page used to be assembled by string concatenation on every request,
+with its CSS and script inline, and it scanned all of users.json for the
+merchant's name. It is our highest-traffic public URL, so the work is split:
+
+- The stylesheet and script are static assets served from
+  `/checkout/assets/<name>.<hash>.<ext>`. The content hash is in the name, so
+  they are sent with `Cache-Control: immutable` for a year, and browsers
+  fetch them once. Their gzip and brotli encodings are built once at import.
+- `PAGE` is compiled at import into static byte chunks and the few fields
+  that vary. The asset URLs are bound in at compile time. Rendering a
+  session is a join of the chunks with the escaped per-session values.
+  The session's data travels in `data-*` attributes that the script reads.
+- `MerchantNames` maps merchant id -> display name. It rebuilds the map only
+  when users.json changes, which costs one `stat` per request.
+- Responses are gzip- or brotli-encoded when the client accepts it. brotli is
+  optional: without the package, only gzip is offered.
+"""
+
+from dataclasses import dataclass
+import gzip
+import hashlib
+import html
+import os
+import re
+import threading
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ASSET_PREFIX = "/checkout/assets/"
+ASSET_CACHE_CONTROL = "public, max-age=31536000, immutable"
+PAGE_CACHE_CONTROL = "no-store"  # carries live session state
+
+CSS = """\
+:root{--primary:#0b63ff;--bg:#f6f8fb;--text:#071226}
+body{font-family:Arial,Helvetica,sans-serif;background:var(--bg);color:var(--text);padding:20px;margin:0;}
+.box{max-width:520px;margin:32px auto;background:#fff;padding:20px;border-radius:10px;box-shadow:0 8px 24px rgba(7,18,38,0.06);}
+.logo{display:block;margin:0 auto 12px;max-width:160px;}
+h2{color:var(--primary);text-align:center;margin:6px 0 12px;}
+.amount{font-size:1.25rem;margin:8px 0;}
+.actions{margin-top:14px;text-align:center;}
+button{background:var(--primary);color:#fff;border:none;border-radius:8px;padding:10px 16px;margin:6px;cursor:pointer;font-weight:600;}
+button.secondary{background:#fff;color:var(--primary);border:1px solid #e6e9ef;}
+#status{margin-top:12px;text-align:center;color:#093;}
+footer{margin-top:18px;font-size:12px;color:#7b8390;text-align:center;}
+"""
+
+JS = """\
+(function(){
+const box = document.getElementById('checkout');
+const sessionId = box.dataset.sessionId;
+const successUrl = box.dataset.successUrl;
+const cancelUrl = box.dataset.cancelUrl;
+const status = document.getElementById('status');
+let done = false;
+function paid(){
+  if(done) return;
+  done = true;
+  status.innerText = 'Payment successful';
+  try{ window.opener && window.opener.postMessage({ type: 'apiblockchain.checkout_complete', sessionId: sessionId }, '*'); }catch(e){}
+  setTimeout(()=>{ if(successUrl) window.location.href = successUrl; else status.innerText += ' — You may close this window.'; }, 800);
+}
+async function complete(payment_system){
+  status.innerText = 'Processing...';
+  try{
+    const res = await fetch('/session/' + sessionId + '/complete', { method: 'POST', headers: { 'Content-Type': 'application/json' }, body: JSON.stringify({ payment_system }) });
+    const data = await res.json();
+    if(!res.ok){ status.innerText = 'Error: ' + (data.error || res.statusText); return; }
+    paid();
+  }catch(e){ status.innerText = 'Network error'; }
+}
+// Payments settled by a provider webhook (crypto, PayPal, ...) arrive as status events
+if(window.EventSource){
+  const events = new EventSource('/session/' + encodeURIComponent(sessionId) + '/events');
+  events.addEventListener('status', (e)=>{
+    const s = JSON.parse(e.data);
+    if(s.status === 'paid'){ events.close(); paid(); }
+    else if(s.status === 'failed'){ events.close(); status.innerText = 'Payment failed'; }
+  });
+}
+document.getElementById('pay-web2').addEventListener('click', ()=> complete('web2'));
+document.getElementById('pay-web3').addEventListener('click', ()=> complete('web3'));
+})();
+"""
+
+PAGE = """\
+<!doctype html>
+<html>
+<head>
+<meta charset="utf-8"/>
+<title>APIBlockchain Checkout</title>
+<meta name="viewport" content="width=device-width, initial-scale=1"/>
+<link rel="stylesheet" href="{{css_url}}"/>
+<script src="{{js_url}}" defer></script>
+</head>
+<body>
+<div class="box" id="checkout" data-session-id="{{session_id}}" data-success-url="{{success_url}}" data-cancel-url="{{cancel_url}}">
+<img class="logo" src="https://apiblockchain.io/logo.svg" alt="APIBlockchain"/>
+<h2>Checkout</h2>
+<p><strong>Merchant:</strong> {{merchant}}</p>
+<p class="amount"><strong>Amount:</strong> ${{amount}}</p>
+<div class="actions">
+<button id="pay-web2">Pay with Card</button>
+<button id="pay-web3" class="secondary">Pay with Crypto</button>
+</div>
+<div id="status"></div>
+<footer><a href="https://apiblockchain.io" target="_blank">Powered by APIBlockchain</a></footer>
+</div>
+</body>
+</html>
+"""
+
+
+# ----- compression -----
+
+def accepted_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """Best encoding we can produce for an Accept-Encoding header: "br", "gzip" or None."""
+    accepted = set()
+    for part in (accept_encoding or "").lower().split(","):
+        name, _, params = part.strip().partition(";")
+        if params.replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.add(name.strip())
+    if brotli is not None and ("br" in accepted or "*" in accepted):
+        return "br"
+    if "gzip" in accepted or "*" in accepted:
+        return "gzip"
+    return None
+
+
+def compress(body: bytes, encoding: Optional[str], static: bool = False) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=11 if static else 5)
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=9 if static else 6, mtime=0)
+    return body
+
+
+# ----- static assets -----
+
+@dataclass
+class Asset:
+    name: str
+    media_type: str
+    etag: str
+    encoded: Dict[Optional[str], bytes]  # encoding (None = identity) -> body
+
+    def body(self, encoding: Optional[str]) -> bytes:
+        return self.encoded.get(encoding, self.encoded[None])
+
+
+def _asset(stem: str, ext: str, media_type: str, text: str) -> Asset:
+    raw = text.encode("utf-8")
+    digest = hashlib.sha256(raw).hexdigest()[:12]
+    encoded = {None: raw, "gzip": compress(raw, "gzip", static=True)}
+    if brotli is not None:
+        encoded["br"] = compress(raw, "br", static=True)
+    return Asset(f"{stem}.{digest}.{ext}", media_type, f'"{digest}"', encoded)
+
+
+ASSETS: Dict[str, Asset] = {
+    a.name: a for a in (
+        _asset("checkout", "css", "text/css; charset=utf-8", CSS),
+        _asset("checkout", "js", "application/javascript; charset=utf-8", JS),
+    )
+}
+
+
+def asset_url(ext: str) -> str:
+    return ASSET_PREFIX + next(name for name in ASSETS if name.endswith("." + ext))
+
+
+# ----- page template -----
+
+class CompiledTemplate:
+    """`{{name}}` template split once into static chunks and field names.
+
+    Fields given to the constructor are bound at compile time. The rest are
+    filled, HTML-escaped, by `render`.
+    """
+
+    _FIELD = re.compile(r"\{\{(\w+)\}\}")
+
+    def __init__(self, source: str, **bound: str):
+        self.chunks: List[str] = []   # len(fields) + 1 static pieces
+        self.fields: List[str] = []
+        pending = ""
+        pos = 0
+        for m in self._FIELD.finditer(source):
+            pending += source[pos:m.start()]
+            pos = m.end()
+            name = m.group(1)
+            if name in bound:
+                pending += html.escape(bound[name])
+            else:
+                self.chunks.append(pending)
+                self.fields.append(name)
+                pending = ""
+        self.chunks.append(pending + source[pos:])
+
+    def render(self, **values) -> str:
+        out = [self.chunks[0]]
+        for name, chunk in zip(self.fields, self.chunks[1:]):
+            out.append(html.escape(str(values[name])))
+            out.append(chunk)
+        return "".join(out)
+
+
+CHECKOUT_TEMPLATE = CompiledTemplate(PAGE, css_url=asset_url("css"), js_url=asset_url("js"))
+
+
+def render_checkout(session: dict, merchant_name: str) -> str:
+    return CHECKOUT_TEMPLATE.render(
+        session_id=session.get("id") or "",
+        success_url=session.get("success_url") or "",
+        cancel_url=session.get("cancel_url") or "",
+        merchant=merchant_name or "",
+        amount=f"{float(session.get('amount') or 0):.2f}",
+    )
+
+
+# ----- merchant names -----
+
+class MerchantNames:
+    """Merchant id -> display name from a users `JsonFile`, rebuilt when the file changes."""
+
+    def __init__(self, users_file):
+        self.users_file = users_file
+        self._names: Dict[object, str] = {}
+        self._sig: Optional[Tuple[int, int, int]] = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def _stat_sig(self) -> Optional[Tuple[int, int, int]]:
+        try:
+            st = os.stat(self.users_file.path)
+        except OSError:
+            return None
+        return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def get(self, merchant_id) -> Optional[str]:
+        sig = self._stat_sig()
+        if not self._loaded or sig != self._sig:
+            with self._lock:
+                if not self._loaded or sig != self._sig:
+                    # Stat before reading: a write in between only causes one more rebuild
+                    users = self.users_file.read()
+                    self._names = {u.get("id"): u.get("name") for u in users
+                                   if isinstance(u, dict) and u.get("name")}
+                    self._sig = sig
+                    self._loaded = True
+        return self._names.get(merchant_id)
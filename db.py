@@ -1,19 +1,22 @@
 """
-Database configuration for SQLite (testing & development)
+Database configuration for the phase-1 API (SQLite in development,
+PostgreSQL in production via DATABASE_URL).
 """
 
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+import logging
+import os
 
-# Use SQLite for immediate testing - swap to PostgreSQL in production
-DATABASE_URL = "sqlite:///./mijn_api_dev.db"
+from app.db.engine import get_async_sessionmaker, get_engine, get_sessionmaker
 
-engine = create_engine(
-    DATABASE_URL,
-    connect_args={"check_same_thread": False}
-)
+logger = logging.getLogger(__name__)
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./mijn_api_dev.db")
+
+# Shared with app/db/session.py when both point at the same DATABASE_URL;
+# pool settings come from DB_POOL_* (see app/db/engine.py).
+engine = get_engine(DATABASE_URL)
+
+SessionLocal = get_sessionmaker(DATABASE_URL)
 
 
 def get_db():
@@ -23,9 +26,19 @@ def get_db():
     finally:
         db.close()
 
+
+async def get_async_db():
+    """AsyncSession on the same DATABASE_URL (asyncpg/aiosqlite), built on first use."""
+    async with get_async_sessionmaker(DATABASE_URL)() as db:
+        yield db
+
+
+def init_db():
     """Create all tables (development only; use Alembic for production)."""
     from models_phase1 import Base
+    import sequences
     Base.metadata.create_all(bind=engine)
+    sequences.metadata.create_all(bind=engine)
     logger.info("Database tables initialized")
 
 
@@ -0,0 +1,170 @@
+"""
+Cross-process safe JSON files.
+
+main.py's JSON stores (users.json, api_keys.json, contacts.json) used to be
+rewritten in place with `write_text` under a `threading.Lock`. That lock only
+covers one process. With GUNICORN_WORKERS > 1, two workers doing
+load -> modify -> save at the same time lost one of the updates, and a crash
+mid-write left truncated JSON. This module provides:
+
+- `file_lock(path)`: an exclusive `fcntl.flock` on a sidecar `<name>.lock`
+  file, so all workers on the host take turns. It is re-entrant within a
+  thread, and threads in one process queue on an RLock first. On platforms
+  without fcntl (Windows dev machines) only the thread lock applies, as in
+  sequences.py.
+- `atomic_write_text(path, text)`: writes to a temp file in the same
+  directory, fsyncs it, then `os.replace`s it over the target. Readers see
+  the old file or the new one, never a partial one. That is why reads need
+  no lock.
+- `JsonFile`: `read()`, `write(data)`, and `transaction()`, a
+  read-modify-write block that holds the lock from the read until the write
+  and writes nothing if the block raises or changes nothing.
+"""
+
+from contextlib import contextmanager
+from pathlib import Path
+import json
+import os
+import tempfile
+import threading
+from typing import Any, Callable, Dict, Iterator
+
+try:
+    import fcntl
+except ImportError:  # Windows dev machines
+    fcntl = None
+
+
+class _PathLock:
+    def __init__(self, lock_path: Path):
+        self.lock_path = lock_path
+        self._rlock = threading.RLock()
+        self._depth = 0
+        self._fd = None
+
+    def __enter__(self) -> "_PathLock":
+        self._rlock.acquire()
+        if self._depth == 0:
+            try:
+                fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+            except BaseException:
+                self._rlock.release()
+                raise
+            if fcntl:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+                except BaseException:
+                    os.close(fd)
+                    self._rlock.release()
+                    raise
+            self._fd = fd
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._depth -= 1
+        if self._depth == 0:
+            fd, self._fd = self._fd, None
+            if fcntl:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+        self._rlock.release()
+
+
+_locks: Dict[str, _PathLock] = {}
+_locks_guard = threading.Lock()
+
+
+def file_lock(path: Path) -> _PathLock:
+    """Exclusive cross-process lock guarding `path` (held on `path.with_suffix('.lock')`)."""
+    lock_path = Path(path).with_suffix(".lock")
+    key = os.path.abspath(lock_path)
+    with _locks_guard:
+        lock = _locks.get(key)
+        if lock is None:
+            lock = _locks[key] = _PathLock(lock_path)
+        return lock
+
+
+def atomic_write_text(path: Path, text: str, fsync: bool = True) -> None:
+    """Replace `path` with `text` via temp file + fsync + rename."""
+    path = Path(path)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as fh:
+            fh.write(text)
+            fh.flush()
+            if fsync:
+                os.fsync(fh.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except FileNotFoundError:
+            pass
+        raise
+    if fsync and hasattr(os, "O_DIRECTORY"):
+        # Make the rename itself durable
+        try:
+            dir_fd = os.open(path.parent, os.O_RDONLY | os.O_DIRECTORY)
+        except OSError:
+            return
+        try:
+            os.fsync(dir_fd)
+        except OSError:
+            pass
+        finally:
+            os.close(dir_fd)
+
+
+def create_if_missing(path: Path, text: str) -> bool:
+    """Create `path` holding `text` unless it exists; never clobbers another worker's file."""
+    path = Path(path)
+    if path.exists():
+        return False
+    with file_lock(path):
+        if path.exists():
+            return False
+        atomic_write_text(path, text)
+        return True
+
+
+class JsonFile:
+    def __init__(self, path: Path, default: Callable[[], Any] = list, read_only: bool = False, indent: int = 4):
+        self.path = Path(path)
+        self.default = default
+        self.read_only = read_only
+        self.indent = indent
+
+    def ensure(self) -> None:
+        if not self.read_only:
+            create_if_missing(self.path, json.dumps(self.default()))
+
+    def read(self) -> Any:
+        """Current contents; `default()` if the file is missing or unparseable."""
+        try:
+            return json.loads(self.path.read_text(encoding="utf-8"))
+        except (FileNotFoundError, ValueError):
+            return self.default()
+
+    def write(self, data: Any) -> None:
+        if self.read_only:
+            raise RuntimeError(f"Filesystem is read-only; cannot persist {self.path.name}")
+        with file_lock(self.path):
+            atomic_write_text(self.path, json.dumps(data, indent=self.indent))
+
+    @contextmanager
+    def transaction(self) -> Iterator[Any]:
+        """Read, let the caller modify in place, write back; all under the file lock.
+
+        Nothing is written if the block raises or leaves the data unchanged.
+        """
+        if self.read_only:
+            raise RuntimeError(f"Filesystem is read-only; cannot persist {self.path.name}")
+        with file_lock(self.path):
+            data = self.read()
+            before = json.dumps(data, indent=self.indent)
+            yield data
+            after = json.dumps(data, indent=self.indent)
+            if after != before:
+                atomic_write_text(self.path, after)
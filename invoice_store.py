@@ -0,0 +1,467 @@
+"""Indexed, append-only storage for invoices.json.
+
+Every write used to parse and re-serialize the whole invoices.json file, so
+the cost of a single insert grew with the invoice history. This store keeps
+the snapshot file (`invoices.json`, same format as before) plus an
+append-only JSON-lines log next to it. Records are held in memory with a
+primary index by `id`, secondary indexes on `INDEXED_FIELDS`, and an index
+ordered by (`created_at`, `id`) for newest-first keyset pagination.
+
+- `put()` appends one line to the log and updates the indexes: O(1).
+- `all()` / `get()` / `for_merchant()` / `for_session()` / `page()` serve
+  reads from memory.
+- Once the log grows past `compact_threshold` entries, a background thread
+  folds it back into the snapshot file.
+- Listeners (`add_listener`) see every record change as `apply(old, new)`,
+  which lets derived aggregates stay in sync incrementally.
+
+Other processes writing to the same files are picked up on the next read:
+the log is tailed from the last known offset, and a replaced snapshot forces
+a full reload. Writes and the compaction swap hold the snapshot's
+`file_lock` (file_store.py), so a worker can't append to a log that another
+worker is replacing.
+"""
+from bisect import bisect_left, bisect_right, insort
+from contextlib import nullcontext
+from pathlib import Path
+import copy
+import json
+import os
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from file_store import file_lock
+
+DEFAULT_COMPACT_THRESHOLD = 1000
+
+# Fields with an equality index (value -> ordered set of ids)
+INDEXED_FIELDS = ("merchant_id", "created_by", "session_id", "status", "payment_system", "buyer_country")
+
+SortKey = Tuple[str, str]
+
+
+class InvoiceStore:
+    # Subclasses reuse the same snapshot + log layout for other record types
+    kind = "invoice"
+    indexed_fields: Tuple[str, ...] = INDEXED_FIELDS
+
+    def __init__(self, snapshot_path: Path, log_path: Optional[Path] = None,
+                 read_only: bool = False, compact_threshold: int = DEFAULT_COMPACT_THRESHOLD):
+        self.snapshot_path = Path(snapshot_path)
+        self.log_path = Path(log_path) if log_path else self.snapshot_path.with_suffix(".jsonl")
+        self.read_only = read_only
+        self.compact_threshold = compact_threshold
+
+        self._lock = threading.RLock()
+        self._records: Dict[str, dict] = {}
+        self._indexes: Dict[str, Dict[object, Dict[str, None]]] = {f: {} for f in self.indexed_fields}
+        self._order: List[SortKey] = []
+        self._order_key: Dict[str, SortKey] = {}
+        self._anon_seq = 0
+        self._log_offset = 0
+        self._log_entries = 0
+        self._snapshot_sig = None
+        self._compacting = False
+        self._loaded = False
+        self._listeners = []
+
+    # ----- loading -----
+
+    def _stat_sig(self, path: Path):
+        try:
+            st = path.stat()
+            return (st.st_ino, st.st_mtime_ns, st.st_size)
+        except FileNotFoundError:
+            return None
+
+    def _reset_indexes(self) -> None:
+        self._records = {}
+        self._indexes = {f: {} for f in self.indexed_fields}
+        self._order = []
+        self._order_key = {}
+        self._anon_seq = 0
+        for listener in self._listeners:
+            listener.reset()
+
+    def _load_all(self) -> None:
+        self._reset_indexes()
+        self._snapshot_sig = self._stat_sig(self.snapshot_path)
+        try:
+            data = json.loads(self.snapshot_path.read_text(encoding="utf-8") or "[]")
+        except Exception:
+            data = []
+        for rec in data if isinstance(data, list) else []:
+            if isinstance(rec, dict):
+                self._index(self._key_for(rec), rec)
+        self._log_offset = 0
+        self._log_entries = 0
+        self._replay_log()
+        self._loaded = True
+
+    def _replay_log(self) -> None:
+        """Apply log entries written after `_log_offset` (by us or another process)."""
+        try:
+            with open(self.log_path, "rb") as fh:
+                fh.seek(self._log_offset)
+                chunk = fh.read()
+        except FileNotFoundError:
+            return
+        # Only consume complete lines; a concurrent writer may be mid-append.
+        end = chunk.rfind(b"\n") + 1
+        for raw in chunk[:end].splitlines():
+            if not raw.strip():
+                continue
+            try:
+                entry = json.loads(raw)
+            except ValueError:
+                continue
+            self._apply(entry)
+            self._log_entries += 1
+        self._log_offset += end
+
+    def _refresh(self) -> None:
+        if not self._loaded or self._stat_sig(self.snapshot_path) != self._snapshot_sig:
+            self._load_all()
+            return
+        try:
+            size = self.log_path.stat().st_size
+        except FileNotFoundError:
+            size = 0
+        if size < self._log_offset:
+            # Log was truncated by a compaction in another process.
+            self._load_all()
+        elif size > self._log_offset:
+            self._replay_log()
+
+    # ----- indexes -----
+
+    def _key_for(self, rec: dict) -> str:
+        rec_id = rec.get("id")
+        if rec_id is not None:
+            return str(rec_id)
+        # Legacy rows without an id keep their position but can't be addressed.
+        self._anon_seq += 1
+        return f"__anon-{self._anon_seq}"
+
+    @staticmethod
+    def _add(index: dict, value, key: str) -> None:
+        if value is None:
+            return
+        index.setdefault(value, {})[key] = None
+
+    @staticmethod
+    def _discard(index: dict, value, key: str) -> None:
+        bucket = index.get(value)
+        if bucket is not None:
+            bucket.pop(key, None)
+            if not bucket:
+                index.pop(value, None)
+
+    @staticmethod
+    def sort_key(key: str, rec: dict) -> SortKey:
+        created = rec.get("created_at")
+        return (created if isinstance(created, str) else str(created or "")), key
+
+    def _drop_from_indexes(self, key: str, old: dict) -> None:
+        for field in self.indexed_fields:
+            self._discard(self._indexes[field], old.get(field), key)
+        pos = self._order_key.pop(key, None)
+        if pos is not None:
+            i = bisect_left(self._order, pos)
+            if i < len(self._order) and self._order[i] == pos:
+                del self._order[i]
+
+    def _notify(self, old: Optional[dict], new: Optional[dict]) -> None:
+        for listener in self._listeners:
+            try:
+                listener.apply(old, new)
+            except Exception as e:
+                print(f"[WARN] {self.kind.capitalize()} store listener failed: {e}")
+
+    def _unindex(self, key: str) -> None:
+        old = self._records.pop(key, None)
+        if old is None:
+            return
+        self._drop_from_indexes(key, old)
+        self._notify(old, None)
+
+    def _index(self, key: str, rec: dict) -> None:
+        old = self._records.get(key)
+        if old is not None:
+            self._drop_from_indexes(key, old)
+        self._records[key] = rec
+        for field in self.indexed_fields:
+            self._add(self._indexes[field], rec.get(field), key)
+        pos = self.sort_key(key, rec)
+        self._order_key[key] = pos
+        if not self._order or self._order[-1] <= pos:
+            self._order.append(pos)  # the usual case: newest invoice last
+        else:
+            insort(self._order, pos)
+        self._notify(old, rec)
+
+    def _apply(self, entry: dict) -> None:
+        op = entry.get("op")
+        if op == "put" and isinstance(entry.get("record"), dict):
+            rec = entry["record"]
+            self._index(self._key_for(rec), rec)
+        elif op == "delete":
+            self._unindex(str(entry.get("id")))
+
+    # ----- writes -----
+
+    def _write_lock(self):
+        """Cross-process lock held around read-modify-append and the compaction swap."""
+        return nullcontext() if self.read_only else file_lock(self.snapshot_path)
+
+    def _append(self, entries: Iterable[dict]) -> None:
+        if self.read_only:
+            raise RuntimeError(f"Filesystem is read-only; cannot persist {self.kind}s")
+        payload = "".join(json.dumps(e, default=str) + "\n" for e in entries)
+        if not payload:
+            return
+        data = payload.encode("utf-8")
+        # One write() on an O_APPEND descriptor keeps lines from different
+        # processes from interleaving.
+        fd = os.open(self.log_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, data)
+        finally:
+            os.close(fd)
+
+    def put(self, record: dict) -> dict:
+        """Insert or replace a single invoice record by its `id`."""
+        if record.get("id") is None:
+            raise ValueError(f"{self.kind} record requires an 'id'")
+        # Round-trip through JSON so later mutations by the caller can't leak
+        # into the index without another put().
+        line_rec = json.loads(json.dumps(record, default=str))
+        with self._lock, self._write_lock():
+            self._refresh()
+            self._append([{"op": "put", "record": line_rec}])
+            self._replay_log()
+        self._maybe_compact()
+        return copy.deepcopy(line_rec)
+
+    def delete(self, invoice_id) -> bool:
+        key = str(invoice_id)
+        with self._lock, self._write_lock():
+            self._refresh()
+            if key not in self._records:
+                return False
+            self._append([{"op": "delete", "id": key}])
+            self._replay_log()
+        self._maybe_compact()
+        return True
+
+    def replace_all(self, invoices: List[dict]) -> None:
+        """Persist a full invoice list, writing only the records that changed.
+
+        Keeps `save_invoices()` callers working; new code should use `put()`.
+        """
+        with self._lock, self._write_lock():
+            self._refresh()
+            entries = []
+            seen = set()
+            for rec in invoices:
+                if not isinstance(rec, dict) or rec.get("id") is None:
+                    continue
+                key = str(rec["id"])
+                seen.add(key)
+                normalized = json.loads(json.dumps(rec, default=str))
+                if self._records.get(key) != normalized:
+                    entries.append({"op": "put", "record": normalized})
+            for key in list(self._records):
+                if key not in seen and not key.startswith("__anon-"):
+                    entries.append({"op": "delete", "id": key})
+            if not entries:
+                return
+            self._append(entries)
+            self._replay_log()
+        self._maybe_compact()
+
+    # ----- listeners -----
+
+    def add_listener(self, listener) -> None:
+        """Register an object with `reset()` and `apply(old, new)`; it is fed the current records.
+
+        Registering the same listener again is a no-op.
+        """
+        with self._lock:
+            if any(existing is listener for existing in self._listeners):
+                return
+            self._listeners.append(listener)
+            if self._loaded:
+                listener.rebuild(self._records.values())
+
+    def rebuild_listener(self, listener):
+        """Recompute a listener from the current records (e.g. after a backfill)."""
+        with self._lock:
+            self._refresh()
+            return listener.rebuild(self._records.values())
+
+    def sync(self) -> None:
+        """Pick up writes from other processes without reading any records."""
+        with self._lock:
+            self._refresh()
+
+    # ----- reads -----
+
+    def all(self) -> List[dict]:
+        with self._lock:
+            self._refresh()
+            return copy.deepcopy(list(self._records.values()))
+
+    def get(self, invoice_id) -> Optional[dict]:
+        with self._lock:
+            self._refresh()
+            rec = self._records.get(str(invoice_id))
+            return copy.deepcopy(rec) if rec is not None else None
+
+    def for_merchant(self, merchant_id=None, created_by: Optional[str] = None) -> List[dict]:
+        """Invoices matching `merchant_id` or `created_by` (legacy rows), in insertion order."""
+        with self._lock:
+            self._refresh()
+            keys = {}
+            if merchant_id is not None:
+                keys.update(self._indexes["merchant_id"].get(merchant_id, {}))
+            if created_by is not None:
+                keys.update(self._indexes["created_by"].get(created_by, {}))
+            ordered = [k for k in self._records if k in keys] if len(keys) > 1 else list(keys)
+            return copy.deepcopy([self._records[k] for k in ordered])
+
+    def for_session(self, session_id: str) -> List[dict]:
+        with self._lock:
+            self._refresh()
+            keys = self._indexes["session_id"].get(session_id, {})
+            return copy.deepcopy([self._records[k] for k in keys])
+
+    def page(self, limit: int, after: Optional[SortKey] = None, merchant_id=None,
+             created_by: Optional[str] = None, where: Optional[dict] = None,
+             created_from: Optional[str] = None, created_to: Optional[str] = None,
+             predicate: Optional[Callable[[dict], bool]] = None) -> Tuple[List[dict], Optional[SortKey]]:
+        """Newest-first page of invoices, keyset-paginated on (created_at, id).
+
+        `merchant_id` / `created_by` scope the result like `for_merchant()`;
+        `where` holds equality filters on INDEXED_FIELDS; `created_from` /
+        `created_to` are inclusive ISO date(-time) prefixes. Returns the page
+        and the sort key to pass as `after` for the next one (None at the end).
+        """
+        with self._lock:
+            self._refresh()
+            candidates = None
+            if merchant_id is not None or created_by is not None:
+                candidates = {}
+                if merchant_id is not None:
+                    candidates.update(self._indexes["merchant_id"].get(merchant_id, {}))
+                if created_by is not None:
+                    candidates.update(self._indexes["created_by"].get(created_by, {}))
+            for field, value in (where or {}).items():
+                bucket = self._indexes[field].get(value, {})
+                if candidates is None:
+                    candidates = bucket
+                else:
+                    small, big = (candidates, bucket) if len(candidates) <= len(bucket) else (bucket, candidates)
+                    candidates = {k: None for k in small if k in big}
+
+            lo = bisect_left(self._order, (created_from, "")) if created_from else 0
+            hi = len(self._order)
+            if created_to:
+                hi = bisect_right(self._order, (created_to + "\uffff", ""))
+            if after is not None:
+                hi = min(hi, bisect_left(self._order, tuple(after)))
+
+            if candidates is not None and len(candidates) * 8 < hi - lo:
+                # Few matches: sort just those instead of walking the range
+                lo_key = self._order[lo] if lo < len(self._order) else None
+                hi_key = self._order[hi] if hi < len(self._order) else None
+                ordered = sorted(
+                    (self._order_key[k] for k in candidates
+                     if (lo_key is None or self._order_key[k] >= lo_key) and (hi_key is None or self._order_key[k] < hi_key)),
+                    reverse=True,
+                )
+            else:
+                ordered = (self._order[i] for i in range(hi - 1, lo - 1, -1))
+
+            keys: List[str] = []
+            has_more = False
+            for pos in ordered:
+                key = pos[1]
+                if candidates is not None and key not in candidates:
+                    continue
+                if predicate is not None and not predicate(self._records[key]):
+                    continue
+                if len(keys) == limit:
+                    has_more = True
+                    break
+                keys.append(key)
+            next_after = self._order_key[keys[-1]] if has_more and keys else None
+            return copy.deepcopy([self._records[k] for k in keys]), next_after
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._refresh()
+            return len(self._records)
+
+    # ----- compaction -----
+
+    def _should_compact(self) -> bool:
+        return self._log_entries >= self.compact_threshold
+
+    def _maybe_compact(self) -> None:
+        if self.read_only or self._compacting or not self._should_compact():
+            return
+        self._compacting = True
+        threading.Thread(target=self._compact_safely, name=f"{self.kind}-store-compact", daemon=True).start()
+
+    def _compact_safely(self) -> None:
+        try:
+            self.compact()
+        except Exception as e:
+            print(f"[WARN] {self.kind.capitalize()} store compaction failed: {e}")
+        finally:
+            self._compacting = False
+
+    def compact(self) -> None:
+        """Fold the log into the snapshot file.
+
+        The snapshot is serialized outside the lock; records are never mutated
+        in place, so the captured list stays consistent while writers continue
+        appending to the log. Entries appended meanwhile are carried over.
+        """
+        if self.read_only:
+            return
+        with self._lock:
+            self._refresh()
+            records = list(self._records.values())
+            offset = self._log_offset
+            snapshot_sig = self._snapshot_sig
+
+        tmp = self.snapshot_path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.compact.tmp")
+        with open(tmp, "w", encoding="utf-8") as fh:
+            fh.write(json.dumps(records, indent=4))
+            fh.flush()
+            os.fsync(fh.fileno())
+
+        with self._lock, self._write_lock():
+            if self._stat_sig(self.snapshot_path) != snapshot_sig:
+                # Another worker compacted first; our offsets refer to its old log
+                os.unlink(tmp)
+                self._refresh()
+                return
+            # Bring memory fully up to date; the tail past `offset` is already
+            # applied and only needs to survive in the new log file.
+            self._replay_log()
+            try:
+                with open(self.log_path, "rb") as fh:
+                    fh.seek(offset)
+                    tail = fh.read(self._log_offset - offset)
+            except FileNotFoundError:
+                tail = b""
+            os.replace(tmp, self.snapshot_path)
+            log_tmp = self.log_path.with_suffix(".jsonl.tmp")
+            log_tmp.write_bytes(tail)
+            os.replace(log_tmp, self.log_path)
+            self._snapshot_sig = self._stat_sig(self.snapshot_path)
+            self._log_offset = len(tail)
+            self._log_entries = tail.count(b"\n")
@@ -6,36 +6,42 @@ Handles sequential numbering, immutability, tax calculations, credit notes
 import json
 from datetime import datetime, timezone
 from typing import List, Optional, Dict, Any
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy import func, select
 
 from models_phase1 import Invoice, InvoiceLineItem, Organization, User
 from schemas import (
     InvoiceLineItemCreate, InvoiceCreate, InvoiceUpdate,
     InvoiceFinalizeRequest, InvoiceMarkPaidRequest
 )
-from auth import log_audit_event
+from auth import log_audit_event, log_audit_event_async
+from sequences import format_block, max_sequence, reserve_sql
+from tax_engine import decide
 
 # ===== INVOICE NUMBERING =====
 
+def _invoice_number_seed(db: Session, org: Organization, year: int):
+    """Highest existing INV-YEAR-NNNN for org; only used the first time the counter is created."""
+    def _seed() -> int:
+        rows = db.query(Invoice.number).filter(
+            Invoice.org_id == org.id,
+            Invoice.number.like(f"INV-{year}-%")
+        ).all()
+        return max_sequence((r[0] for r in rows), "INV", year)
+    return _seed
+
+
+def reserve_invoice_numbers(db: Session, org: Organization, count: int) -> List[str]:
+    """Reserve `count` consecutive invoice numbers for org (bulk imports)."""
+    year = datetime.now(timezone.utc).year
+    block = reserve_sql(db, f"org:{org.id}", year, "INV", count, seed=_invoice_number_seed(db, org, year))
+    return format_block("INV", year, block)
+
+
 def generate_invoice_number(db: Session, org: Organization) -> str:
     """Generate next sequential invoice number for org: INV-2026-0001"""
-    year = datetime.now(timezone.utc).year
-    
-    # Get highest number for this year
-    last_invoice = db.query(Invoice).filter(
-        Invoice.org_id == org.id,
-        Invoice.number.like(f"INV-{year}-%")
-    ).order_by(Invoice.number.desc()).first()
-    
-    if last_invoice:
-        # Extract sequence number from "INV-2026-0042" -> 42
-        seq_str = last_invoice.number.split("-")[-1]
-        next_seq = int(seq_str) + 1
-    else:
-        next_seq = 1
-    
-    return f"INV-{year}-{next_seq:04d}"
+    return reserve_invoice_numbers(db, org, 1)[0]
 
 
 # ===== TAX CALCULATION =====
@@ -54,77 +60,12 @@ def determine_tax_jurisdiction(
         "explanation": "Domestic (EU) - NL VAT 21%"
     }
     """
-    # Import from main.py eventually, for now simplified version
-    EU_VAT_RATES = {
-        'AT': 20.0, 'BE': 21.0, 'BG': 20.0, 'HR': 25.0, 'CY': 19.0,
-        'CZ': 21.0, 'DK': 25.0, 'EE': 22.0, 'FI': 25.5, 'FR': 20.0,
-        'DE': 19.0, 'GR': 24.0, 'HU': 27.0, 'IE': 23.0, 'IT': 22.0,
-        'LV': 21.0, 'LT': 21.0, 'LU': 17.0, 'MT': 18.0, 'NL': 21.0,
-        'PL': 23.0, 'PT': 23.0, 'RO': 19.0, 'SK': 20.0, 'SI': 22.0,
-        'ES': 21.0, 'SE': 25.0,
-    }
-    
-    seller = (seller_country or 'NL').upper()
-    buyer = (buyer_country or seller).upper()
-    
-    seller_in_eu = seller in EU_VAT_RATES
-    buyer_in_eu = buyer in EU_VAT_RATES
-    
-    # === EU → EU (same country) ===
-    if seller == buyer and seller_in_eu:
-        rate = EU_VAT_RATES.get(seller, 21.0)
-        return {
-            "tax_rate": f"{rate}",
-            "is_reverse_charge": False,
-            "jurisdiction": seller,
-            "explanation": f"Domestic (EU) - {seller} VAT {rate}%"
-        }
-    
-    # === EU → EU (different countries) ===
-    if seller_in_eu and buyer_in_eu and seller != buyer:
-        if buyer_vat_id:
-            # B2B with VAT ID → reverse charge
-            return {
-                "tax_rate": "0.0",
-                "is_reverse_charge": True,
-                "jurisdiction": buyer,
-                "explanation": f"EU B2B Reverse Charge - {seller} to {buyer}"
-            }
-        else:
-            # B2C → charge seller's VAT
-            rate = EU_VAT_RATES.get(seller, 21.0)
-            return {
-                "tax_rate": f"{rate}",
-                "is_reverse_charge": False,
-                "jurisdiction": seller,
-                "explanation": f"EU B2C - {seller} VAT {rate}%"
-            }
-    
-    # === EU → Outside EU ===
-    if seller_in_eu and not buyer_in_eu:
-        return {
-            "tax_rate": "0.0",
-            "is_reverse_charge": False,
-            "jurisdiction": seller,
-            "explanation": f"Export from {seller} - 0% VAT"
-        }
-    
-    # === Outside EU → EU ===
-    if not seller_in_eu and buyer_in_eu:
-        rate = EU_VAT_RATES.get(buyer, 21.0)
-        return {
-            "tax_rate": f"{rate}",
-            "is_reverse_charge": False,
-            "jurisdiction": buyer,
-            "explanation": f"Import to {buyer} - {buyer} VAT {rate}%"
-        }
-    
-    # === Default (outside EU) ===
+    decision = decide(seller_country, buyer_country, bool(buyer_vat_id))
     return {
-        "tax_rate": "0.0",
-        "is_reverse_charge": False,
-        "jurisdiction": seller,
-        "explanation": f"International - {seller}"
+        "tax_rate": f"{decision.rate}",
+        "is_reverse_charge": decision.reverse_charge,
+        "jurisdiction": decision.jurisdiction,
+        "explanation": decision.explanation
     }
 
 
@@ -173,22 +114,12 @@ def calculate_invoice_amounts(
 
 # ===== INVOICE OPERATIONS =====
 
-def create_draft_invoice(
-    db: Session,
-    org_id: int,
+def _build_draft_invoice(
+    org: Organization,
     created_by: User,
-    invoice_data: InvoiceCreate
+    invoice_data: InvoiceCreate,
+    invoice_number: str
 ) -> Invoice:
-    """Create new draft invoice."""
-    
-    # Get organization
-    org = db.query(Organization).get(org_id)
-    if not org:
-        raise ValueError("Organization not found")
-    
-    # Generate number
-    invoice_number = generate_invoice_number(db, org)
-    
     # Calculate amounts
     amounts = calculate_invoice_amounts(
         line_items=invoice_data.line_items,
@@ -210,9 +141,8 @@ def create_draft_invoice(
         for item in invoice_data.line_items
     ]
     
-    # Create invoice
-    invoice = Invoice(
-        org_id=org_id,
+    return Invoice(
+        org_id=org.id,
         number=invoice_number,
         status="draft",
         created_by_id=created_by.id,
@@ -231,6 +161,26 @@ def create_draft_invoice(
         notes=invoice_data.notes,
         due_at=invoice_data.due_at
     )
+
+
+def create_draft_invoice(
+    db: Session,
+    org_id: int,
+    created_by: User,
+    invoice_data: InvoiceCreate
+) -> Invoice:
+    """Create new draft invoice."""
+    
+    # Get organization
+    org = db.query(Organization).get(org_id)
+    if not org:
+        raise ValueError("Organization not found")
+    
+    # Generate number
+    invoice_number = generate_invoice_number(db, org)
+    
+    # Create invoice
+    invoice = _build_draft_invoice(org, created_by, invoice_data, invoice_number)
     
     db.add(invoice)
     db.commit()
@@ -247,13 +197,21 @@ def create_draft_invoice(
         details={
             "number": invoice_number,
             "customer": invoice_data.customer_email,
-            "amount": amounts["total"]
+            "amount": invoice.amount_total
         }
     )
     
     return invoice
 
 
+def _apply_finalize(invoice: Invoice) -> None:
+    if invoice.status != "draft":
+        raise ValueError(f"Cannot finalize invoice in {invoice.status} status")
+    
+    invoice.status = "finalized"
+    invoice.finalized_at = datetime.now(timezone.utc)
+
+
 def finalize_invoice(
     db: Session,
     invoice: Invoice,
@@ -264,11 +222,7 @@ def finalize_invoice(
     This is when the invoice becomes a legal document.
     """
     
-    if invoice.status != "draft":
-        raise ValueError(f"Cannot finalize invoice in {invoice.status} status")
-    
-    invoice.status = "finalized"
-    invoice.finalized_at = datetime.now(timezone.utc)
+    _apply_finalize(invoice)
     db.commit()
     
     # Audit log
@@ -288,14 +242,7 @@ def finalize_invoice(
     return invoice
 
 
-def mark_invoice_paid(
-    db: Session,
-    invoice: Invoice,
-    user: User,
-    payment_date: Optional[datetime] = None
-) -> Invoice:
-    """Mark finalized invoice as paid."""
-    
+def _apply_paid(invoice: Invoice, payment_date: Optional[datetime]) -> None:
     if invoice.status == "draft":
         raise ValueError("Cannot mark draft invoice as paid; finalize first")
     
@@ -304,6 +251,17 @@ def mark_invoice_paid(
     
     invoice.status = "paid"
     invoice.paid_at = payment_date or datetime.now(timezone.utc)
+
+
+def mark_invoice_paid(
+    db: Session,
+    invoice: Invoice,
+    user: User,
+    payment_date: Optional[datetime] = None
+) -> Invoice:
+    """Mark finalized invoice as paid."""
+    
+    _apply_paid(invoice, payment_date)
     db.commit()
     
     # Audit log
@@ -324,30 +282,18 @@ def mark_invoice_paid(
     return invoice
 
 
-def create_credit_note(
-    db: Session,
+def _build_credit_note(
     original_invoice: Invoice,
+    credit_number: str,
     percentage: int,
     user: User,
     reason: str
 ) -> Invoice:
-    """
-    Create credit note (reduce customer's balance by returning credit).
-    percentage: 0-100, how much to credit back
-    """
-    
-    if original_invoice.status == "draft":
-        raise ValueError("Cannot create credit note for draft invoice")
-    
     # Calculate credit amounts
     credit_subtotal = int(original_invoice.amount_subtotal * (percentage / 100))
     credit_tax = int(original_invoice.amount_tax * (percentage / 100))
     credit_total = credit_subtotal + credit_tax
     
-    # Create credit note as new invoice
-    org = original_invoice.organization
-    credit_number = generate_invoice_number(db, org)
-    
     # Negative line items
     credit_line_items = []
     if isinstance(original_invoice.line_items, str):
@@ -366,7 +312,7 @@ def create_credit_note(
             "subtotal": -int(item.get("subtotal", 0) * (percentage / 100))
         })
     
-    credit_note = Invoice(
+    return Invoice(
         org_id=original_invoice.org_id,
         number=credit_number,
         status="finalized",
@@ -387,6 +333,37 @@ def create_credit_note(
         finalized_at=datetime.now(timezone.utc),
         created_from_invoice_id=original_invoice.id
     )
+
+
+def _credit_note_details(original_invoice: Invoice, credit_note: Invoice, percentage: int, reason: str) -> dict:
+    return {
+        "original_number": original_invoice.number,
+        "credit_number": credit_note.number,
+        "percentage": percentage,
+        "reason": reason,
+        "credit_amount": -credit_note.amount_total
+    }
+
+
+def create_credit_note(
+    db: Session,
+    original_invoice: Invoice,
+    percentage: int,
+    user: User,
+    reason: str
+) -> Invoice:
+    """
+    Create credit note (reduce customer's balance by returning credit).
+    percentage: 0-100, how much to credit back
+    """
+    
+    if original_invoice.status == "draft":
+        raise ValueError("Cannot create credit note for draft invoice")
+    
+    # Create credit note as new invoice
+    org = original_invoice.organization
+    credit_number = generate_invoice_number(db, org)
+    credit_note = _build_credit_note(original_invoice, credit_number, percentage, user, reason)
     
     db.add(credit_note)
     db.commit()
@@ -400,13 +377,7 @@ def create_credit_note(
         entity_type="invoice",
         entity_id=credit_note.id,
         user_id=user.id,
-        details={
-            "original_number": original_invoice.number,
-            "credit_number": credit_number,
-            "percentage": percentage,
-            "reason": reason,
-            "credit_amount": credit_total
-        }
+        details=_credit_note_details(original_invoice, credit_note, percentage, reason)
     )
     
     return credit_note
@@ -478,3 +449,112 @@ def update_draft_invoice(
     )
     
     return invoice
+
+
+# ===== ASYNC (AsyncSession, used by main_phase1 when ASYNC_DB=1) =====
+#
+# Same rules as the functions above. Nothing here may touch a lazy-loaded
+# relationship (that would block on I/O outside the event loop); related rows
+# are fetched explicitly. Number reservation reuses the sync `reserve_sql`
+# through `run_sync`, which keeps it in the same transaction as the insert.
+
+async def get_org_invoice_async(db: AsyncSession, invoice_id: int, org_id: int) -> Optional[Invoice]:
+    return await db.scalar(select(Invoice).where(Invoice.id == invoice_id, Invoice.org_id == org_id))
+
+
+async def _generate_invoice_number_async(db: AsyncSession, org: Organization) -> str:
+    return await db.run_sync(lambda sync_db: generate_invoice_number(sync_db, org))
+
+
+async def create_draft_invoice_async(
+    db: AsyncSession,
+    org_id: int,
+    created_by: User,
+    invoice_data: InvoiceCreate
+) -> Invoice:
+    org = await db.get(Organization, org_id)
+    if not org:
+        raise ValueError("Organization not found")
+    
+    invoice_number = await _generate_invoice_number_async(db, org)
+    invoice = _build_draft_invoice(org, created_by, invoice_data, invoice_number)
+    
+    db.add(invoice)
+    await db.commit()
+    await db.refresh(invoice)
+    
+    await log_audit_event_async(
+        db, org_id, "INVOICE_CREATED", "invoice",
+        entity_id=invoice.id,
+        user_id=created_by.id,
+        details={
+            "number": invoice_number,
+            "customer": invoice_data.customer_email,
+            "amount": invoice.amount_total
+        }
+    )
+    return invoice
+
+
+async def finalize_invoice_async(db: AsyncSession, invoice: Invoice, user: User) -> Invoice:
+    _apply_finalize(invoice)
+    await db.commit()
+    await db.refresh(invoice)  # updated_at is set by the database
+    
+    await log_audit_event_async(
+        db, invoice.org_id, "INVOICE_FINALIZED", "invoice",
+        entity_id=invoice.id,
+        user_id=user.id,
+        details={"number": invoice.number, "amount": invoice.amount_total}
+    )
+    return invoice
+
+
+async def mark_invoice_paid_async(
+    db: AsyncSession,
+    invoice: Invoice,
+    user: User,
+    payment_date: Optional[datetime] = None
+) -> Invoice:
+    _apply_paid(invoice, payment_date)
+    await db.commit()
+    await db.refresh(invoice)
+    
+    await log_audit_event_async(
+        db, invoice.org_id, "INVOICE_PAID", "invoice",
+        entity_id=invoice.id,
+        user_id=user.id,
+        details={
+            "number": invoice.number,
+            "amount": invoice.amount_total,
+            "payment_date": invoice.paid_at.isoformat()
+        }
+    )
+    return invoice
+
+
+async def create_credit_note_async(
+    db: AsyncSession,
+    original_invoice: Invoice,
+    percentage: int,
+    user: User,
+    reason: str
+) -> Invoice:
+    if original_invoice.status == "draft":
+        raise ValueError("Cannot create credit note for draft invoice")
+    
+    org = await db.get(Organization, original_invoice.org_id)
+    credit_number = await _generate_invoice_number_async(db, org)
+    credit_note = _build_credit_note(original_invoice, credit_number, percentage, user, reason)
+    
+    db.add(credit_note)
+    await db.commit()
+    await db.refresh(credit_note)
+    
+    await log_audit_event_async(
+        db, original_invoice.org_id, "CREDIT_NOTE_CREATED", "invoice",
+        entity_id=credit_note.id,
+        user_id=user.id,
+        details=_credit_note_details(original_invoice, credit_note, percentage, reason)
+    )
+    return credit_note
@@ -0,0 +1,276 @@
+"""
+Failed-login tracking and account lockout.
+
+The phase-1 API used to count LOGIN_FAILED rows in `audit_logs` on every
+login. That COUNT(*) gets slower as the audit table grows. main.py kept
+its own per-process `failed_logins` dict, which each gunicorn worker saw
+differently. `LoginAttemptTracker` replaces both.
+
+- Failures are counted per user and per client IP with a sliding-window
+  counter: the current fixed window's count, plus the previous window's
+  count weighted by how much of it still overlaps. That is two integers per
+  key and O(1) work per login.
+- Reaching `max_attempts` for a user (or `max_ip_attempts` for an IP) sets a
+  lock that expires after `lockout_seconds`. A successful login clears the
+  user's counter but not the IP's.
+
+Backends, chosen with LOGIN_ATTEMPTS_BACKEND (see `tracker_from_env`):
+
+- `memory`: per process and bounded (counters LRU, locks by earliest
+  expiry). Only for a single worker and tests: used with
+  LOGIN_ATTEMPTS_BACKEND=memory or when there is no database URL at all.
+- `sql`: two small tables in the database at LOGIN_ATTEMPTS_URL (default
+  DATABASE_URL, then the caller's `default_url`, e.g. a SQLite file in
+  main.py's DATA_DIR) using upserts. Shared by every worker. This is the
+  default whenever one of those URLs is set.
+- `redis`: any Redis-compatible server at REDIS_URL (Redis, Valkey,
+  KeyDB, ...) through the optional `redis` package. Counters expire on
+  their own.
+"""
+
+from collections import OrderedDict
+import os
+import threading
+from time import time
+from typing import Callable, Optional, Protocol, Sequence, Tuple
+
+from sqlalchemy import Column, Float, Integer, MetaData, String, Table, and_, delete, insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+
+class AttemptBackend(Protocol):
+    def hit(self, key: str, bucket: int, ttl: float) -> Tuple[int, int]:
+        """Count one attempt for `key` in window `bucket`; returns (previous window, this window) counts."""
+        ...
+
+    def lock(self, key: str, until: float) -> None: ...
+
+    def locked_until(self, keys: Sequence[str]) -> float:
+        """Latest lock expiry (epoch seconds) among `keys`, 0 if none."""
+        ...
+
+    def clear(self, key: str, bucket: int) -> None:
+        """Forget `key`'s lock and its counters (at least windows `bucket` and `bucket - 1`)."""
+        ...
+
+
+class MemoryAttemptBackend:
+    def __init__(self, max_entries: int = 100_000):
+        self.max_entries = max_entries
+        self._counts: "OrderedDict[str, Tuple[int, int, int]]" = OrderedDict()  # key -> (bucket, prev, curr)
+        self._locks: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def hit(self, key: str, bucket: int, ttl: float) -> Tuple[int, int]:
+        with self._lock:
+            last, prev, curr = self._counts.get(key, (bucket, 0, 0))
+            if bucket != last:
+                prev, curr = (curr if bucket == last + 1 else 0), 0
+            curr += 1
+            self._counts[key] = (bucket, prev, curr)
+            self._counts.move_to_end(key)
+            while len(self._counts) > self.max_entries:
+                self._counts.popitem(last=False)
+            return prev, curr
+
+    def lock(self, key: str, until: float) -> None:
+        with self._lock:
+            self._locks[key] = until
+            self._locks.move_to_end(key)
+            while len(self._locks) > self.max_entries:
+                # Drop the lock that expires first (expired ones before any live one)
+                del self._locks[min(self._locks, key=self._locks.get)]
+
+    def locked_until(self, keys: Sequence[str]) -> float:
+        with self._lock:
+            return max((self._locks.get(k, 0.0) for k in keys), default=0.0)
+
+    def clear(self, key: str, bucket: int) -> None:
+        with self._lock:
+            self._counts.pop(key, None)
+            self._locks.pop(key, None)
+
+
+metadata = MetaData()
+
+login_attempts = Table(
+    "login_attempts",
+    metadata,
+    Column("key", String(200), primary_key=True),   # "user:42", "ip:203.0.113.7"
+    Column("bucket", Integer, primary_key=True),    # epoch seconds // window
+    Column("count", Integer, nullable=False, default=0),
+)
+
+login_locks = Table(
+    "login_locks",
+    metadata,
+    Column("key", String(200), primary_key=True),
+    Column("locked_until", Float, nullable=False),
+)
+
+
+class SQLAttemptBackend:
+    """Counters in the `login_attempts` / `login_locks` tables (SQLite or Postgres)."""
+
+    def __init__(self, engine, cleanup_every: int = 1000):
+        self.engine = engine
+        self.cleanup_every = cleanup_every
+        self._hits = 0
+        metadata.create_all(bind=engine, checkfirst=True)
+        self._dialect = engine.dialect.name
+
+    def _upsert(self, conn, table, values: dict, on_conflict: dict, conflict_cols) -> None:
+        if self._dialect in ("sqlite", "postgresql"):
+            if self._dialect == "sqlite":
+                from sqlalchemy.dialects.sqlite import insert as dialect_insert
+            else:
+                from sqlalchemy.dialects.postgresql import insert as dialect_insert
+            stmt = dialect_insert(table).values(**values)
+            conn.execute(stmt.on_conflict_do_update(index_elements=conflict_cols, set_=on_conflict))
+            return
+        match = and_(*(table.c[c] == values[c] for c in conflict_cols))
+        if conn.execute(update(table).where(match).values(**on_conflict)).rowcount == 0:
+            try:
+                with conn.begin_nested():
+                    conn.execute(insert(table).values(**values))
+            except IntegrityError:
+                conn.execute(update(table).where(match).values(**on_conflict))
+
+    def hit(self, key: str, bucket: int, ttl: float) -> Tuple[int, int]:
+        t = login_attempts
+        with self.engine.begin() as conn:
+            self._upsert(conn, t, {"key": key, "bucket": bucket, "count": 1},
+                         {"count": t.c.count + 1}, ["key", "bucket"])
+            counts = dict(conn.execute(
+                select(t.c.bucket, t.c.count).where(t.c.key == key, t.c.bucket.in_((bucket - 1, bucket)))
+            ).all())
+            self._hits += 1
+            if self._hits % self.cleanup_every == 0:
+                conn.execute(delete(t).where(t.c.bucket < bucket - 1))
+                conn.execute(delete(login_locks).where(login_locks.c.locked_until < time()))
+        return counts.get(bucket - 1, 0), counts.get(bucket, 0)
+
+    def lock(self, key: str, until: float) -> None:
+        with self.engine.begin() as conn:
+            self._upsert(conn, login_locks, {"key": key, "locked_until": until}, {"locked_until": until}, ["key"])
+
+    def locked_until(self, keys: Sequence[str]) -> float:
+        with self.engine.connect() as conn:
+            value = conn.execute(
+                select(login_locks.c.locked_until).where(login_locks.c.key.in_(list(keys)))
+                .order_by(login_locks.c.locked_until.desc()).limit(1)
+            ).scalar()
+        return value or 0.0
+
+    def clear(self, key: str, bucket: int) -> None:
+        with self.engine.begin() as conn:
+            conn.execute(delete(login_attempts).where(login_attempts.c.key == key))
+            conn.execute(delete(login_locks).where(login_locks.c.key == key))
+
+
+class RedisAttemptBackend:
+    """Counters in a Redis-compatible server; `client` is a redis.Redis (or compatible) instance."""
+
+    def __init__(self, client, prefix: str = "login"):
+        self.client = client
+        self.prefix = prefix
+
+    def _count_key(self, key: str, bucket: int) -> str:
+        return f"{self.prefix}:{key}:{bucket}"
+
+    def _lock_key(self, key: str) -> str:
+        return f"{self.prefix}:lock:{key}"
+
+    def hit(self, key: str, bucket: int, ttl: float) -> Tuple[int, int]:
+        pipe = self.client.pipeline()
+        pipe.incr(self._count_key(key, bucket))
+        pipe.expire(self._count_key(key, bucket), int(ttl) + 1)
+        pipe.get(self._count_key(key, bucket - 1))
+        curr, _, prev = pipe.execute()
+        return int(prev or 0), int(curr)
+
+    def lock(self, key: str, until: float) -> None:
+        self.client.set(self._lock_key(key), until, ex=max(1, int(until - time()) + 1))
+
+    def locked_until(self, keys: Sequence[str]) -> float:
+        values = self.client.mget([self._lock_key(k) for k in keys])
+        return max((float(v) for v in values if v is not None), default=0.0)
+
+    def clear(self, key: str, bucket: int) -> None:
+        # Older windows no longer count and expire on their own
+        self.client.delete(self._count_key(key, bucket), self._count_key(key, bucket - 1), self._lock_key(key))
+
+
+class LoginAttemptTracker:
+    def __init__(self, backend: AttemptBackend, max_attempts: int = 5, window_seconds: float = 900,
+                 lockout_seconds: float = 900, max_ip_attempts: int = 50, namespace: str = "",
+                 clock: Callable[[], float] = time):
+        self.backend = backend
+        self.namespace = namespace  # keeps two apps sharing one backend apart
+        self.max_attempts = max_attempts
+        self.window_seconds = window_seconds
+        self.lockout_seconds = lockout_seconds
+        self.max_ip_attempts = max_ip_attempts
+        self.clock = clock
+
+    def _keys(self, user, ip: Optional[str]):
+        keys = [f"{self.namespace}user:{user}"]
+        if ip and ip not in ("-", "unknown"):
+            keys.append(f"{self.namespace}ip:{ip}")
+        return keys
+
+    def is_locked(self, user, ip: Optional[str] = None) -> bool:
+        return self.backend.locked_until(self._keys(user, ip)) > self.clock()
+
+    def record_failure(self, user, ip: Optional[str] = None) -> bool:
+        """Count a failed login; True if it locked the user or the IP."""
+        now = self.clock()
+        bucket = int(now // self.window_seconds)
+        overlap = 1 - (now % self.window_seconds) / self.window_seconds
+        locked = False
+        for n, key in enumerate(self._keys(user, ip)):
+            limit = self.max_attempts if n == 0 else self.max_ip_attempts
+            prev, curr = self.backend.hit(key, bucket, ttl=2 * self.window_seconds)
+            if prev * overlap + curr >= limit:
+                self.backend.lock(key, now + self.lockout_seconds)
+                locked = True
+        return locked
+
+    def record_success(self, user) -> None:
+        self.backend.clear(self._keys(user, None)[0], int(self.clock() // self.window_seconds))
+
+
+def backend_from_env(default_url: Optional[str] = None) -> AttemptBackend:
+    kind = os.getenv("LOGIN_ATTEMPTS_BACKEND", "").lower()
+    url = os.getenv("LOGIN_ATTEMPTS_URL") or os.getenv("DATABASE_URL") or default_url
+    if not kind:
+        kind = "sql" if url and ":memory:" not in url else "memory"
+    if kind == "redis":
+        if redis is None:
+            print("[WARN] LOGIN_ATTEMPTS_BACKEND=redis but the redis package is not installed; using memory")
+            return MemoryAttemptBackend()
+        return RedisAttemptBackend(redis.Redis.from_url(os.getenv("REDIS_URL", "redis://localhost:6379/0")))
+    if kind == "sql" and url:
+        from app.db.engine import get_engine
+        try:
+            return SQLAttemptBackend(get_engine(url))
+        except Exception as e:
+            print(f"[WARN] login attempt table unavailable ({e}); using memory")
+    return MemoryAttemptBackend()
+
+
+def tracker_from_env(max_attempts: int = 5, lockout_seconds: float = 900, namespace: str = "",
+                     default_url: Optional[str] = None) -> LoginAttemptTracker:
+    return LoginAttemptTracker(
+        backend_from_env(default_url),
+        max_attempts=max_attempts,
+        window_seconds=float(os.getenv("LOGIN_ATTEMPT_WINDOW_SECONDS", "900")),
+        lockout_seconds=lockout_seconds,
+        max_ip_attempts=int(os.getenv("LOGIN_MAX_IP_ATTEMPTS", "50")),
+        namespace=namespace,
+    )
@@ -1,8 +1,8 @@
-from fastapi import FastAPI, HTTPException, Body, Response, Request, UploadFile, File, Header
+from fastapi import FastAPI, HTTPException, Body, Response, Request, UploadFile, File, Header, Query
 from fastapi.middleware.cors import CORSMiddleware
 import hashlib
 from pydantic import BaseModel, Field
-from typing import List
+from typing import List, Optional
 import json
 from pathlib import Path
 import os
@@ -10,198 +10,53 @@ import sys
 from passlib.context import CryptContext
 from datetime import datetime, timedelta, timezone
 import uuid
-from fastapi.responses import JSONResponse, HTMLResponse
+from fastapi.responses import JSONResponse, HTMLResponse, StreamingResponse
 from time import time
 from jose import jwt, JWTError
 from fastapi import Depends
 from fastapi.security import OAuth2PasswordBearer
-import threading
-
-# INTERNATIONAL TAX RATES DATABASE (2026)
-# Format: 'COUNTRY_CODE': tax_rate_percentage
-
-# EU countries - VAT rates
-EU_COUNTRIES = {
-    'AT': 20.0,  'BE': 21.0,  'BG': 20.0,  'HR': 25.0,  'CY': 19.0,
-    'CZ': 21.0,  'DK': 25.0,  'EE': 22.0,  'FI': 25.5,  'FR': 20.0,
-    'DE': 19.0,  'GR': 24.0,  'HU': 27.0,  'IE': 23.0,  'IT': 22.0,
-    'LV': 21.0,  'LT': 21.0,  'LU': 17.0,  'MT': 18.0,  'NL': 21.0,
-    'PL': 23.0,  'PT': 23.0,  'RO': 19.0,  'SK': 20.0,  'SI': 22.0,
-    'ES': 21.0,  'SE': 25.0,
-}
-
-# Non-EU Europe
-NON_EU_EUROPE = {
-    'GB': 20.0,   # United Kingdom (post-Brexit)
-    'CH': 7.7,    # Switzerland
-    'NO': 25.0,   # Norway
-    'IS': 24.0,   # Iceland
-    'UA': 20.0,   # Ukraine
-    'RU': 18.0,   # Russia
-    'TR': 18.0,   # Turkey
-}
-
-# Americas
-AMERICAS = {
-    'US': 0.0,    # No federal sales tax (state-level handling)
-    'CA': 5.0,    # Canada GST (plus PST per province)
-    'MX': 16.0,   # Mexico
-    'BR': 15.0,   # Brazil (ICMS average)
-    'AR': 21.0,   # Argentina
-    'CL': 19.0,   # Chile
-    'CO': 19.0,   # Colombia
-}
-
-# Asia-Pacific
-ASIA_PACIFIC = {
-    'AU': 10.0,   # Australia GST
-    'NZ': 15.0,   # New Zealand GST
-    'JP': 10.0,   # Japan Consumption Tax
-    'KR': 10.0,   # South Korea
-    'CN': 13.0,   # China (VAT average)
-    'IN': 18.0,   # India (CGST average)
-    'SG': 8.0,    # Singapore GST
-    'TH': 7.0,    # Thailand VAT
-    'ID': 11.0,   # Indonesia
-    'MY': 6.0,    # Malaysia SST
-}
-
-# Middle East & Africa
-MIDDLE_EAST_AFRICA = {
-    'AE': 5.0,    # UAE VAT
-    'SA': 15.0,   # Saudi Arabia VAT
-    'EG': 14.0,   # Egypt VAT
-    'ZA': 15.0,   # South Africa VAT
-    'NG': 7.5,    # Nigeria VAT
-}
-
-# Combine all into global tax database
-GLOBAL_TAX_RATES = {
-    **EU_COUNTRIES,
-    **NON_EU_EUROPE,
-    **AMERICAS,
-    **ASIA_PACIFIC,
-    **MIDDLE_EAST_AFRICA,
-}
-
-# Regions for tax rule determination
-TAX_REGIONS = {
-    'EU': set(EU_COUNTRIES.keys()),
-    'ECEA': set(NON_EU_EUROPE.keys()),  # Europe, Caucasus, Central Asia
-    'AMERICAS': set(AMERICAS.keys()),
-    'ASIA_PACIFIC': set(ASIA_PACIFIC.keys()),
-    'MIDDLE_EAST_AFRICA': set(MIDDLE_EAST_AFRICA.keys()),
-}
+import asyncio
+import re
+import weakref
+import zipfile
+from collections import deque
+from contextlib import contextmanager
+from audit_log import AuditLogFile
+import checkout_page
+from audit_writer import AuditWriter
+from file_store import JsonFile, create_if_missing
+from invoice_store import InvoiceStore
+from login_attempts import tracker_from_env
+from session_store import TERMINAL_STATUSES, SessionStore
+from session_events import SessionEventHub, TooManySubscribers, session_status
+from usage_rollup import UsageRollup
+from payment import WEBHOOK_NORMALIZERS, webhook_event_key
+from webhook_queue import QueueFull, WebhookError, WebhookQueue, WebhookWorkerPool
+from analytics_store import GRANULARITIES, AnalyticsStore, parse_time, period_count
+from api_key_cache import APIKeyCache
+from pdf_pool import PDFPoolBusy, pool_from_env
+from pdf_cache import PDFCache, pdf_cache_key
+from vies_client import VIESUnavailable, get_vies_client, normalize_vat_number
+from sequences import FileSequenceAllocator, format_block, max_sequence
+from pagination import MAX_PAGE_SIZE, decode_cursor, encode_cursor, parse_fields, project
+from tax_engine import DEFAULT_COUNTRY, decide, get_country_vat_info, region_for
 
 def get_region_for_country(country_code: str) -> str:
     """Get region for a country code"""
-    country = country_code.upper() if country_code else 'NL'
-    for region, countries in TAX_REGIONS.items():
-        if country in countries:
-            return region
-    return 'OTHER'
-
-def get_tax_rate(country: str) -> float:
-    """Get standard tax rate for a country"""
-    return GLOBAL_TAX_RATES.get(country.upper(), 0.0)
+    return region_for(country_code.upper() if country_code else DEFAULT_COUNTRY)
 
 def determine_tax_rate(seller_country: str, buyer_country: str, buyer_tax_id: str = None) -> tuple:
     """
     Determine tax rate and reason based on seller/buyer countries (INTERNATIONAL).
     
-    Applies correct tax rules for:
-    - EU: VAT rules (same country, intra-EU, export, B2B reverse charge)
-    - Other regions: Tax rules based on seller's country (destination tax, origin tax, etc.)
+    The rules live in tax_engine (EU VAT incl. B2B reverse charge, US/CA,
+    origin rate elsewhere); this is the tuple form used by the invoice routes.
     
     Returns:
         (tax_rate, is_reverse_charge, explanation)
     """
-    seller = seller_country.upper() if seller_country else 'NL'
-    buyer = buyer_country.upper() if buyer_country else seller
-    
-    seller_region = get_region_for_country(seller)
-    buyer_region = get_region_for_country(buyer)
-    
-    # === EU RULES ===
-    if seller_region == 'EU' and buyer_region == 'EU':
-        # Intra-EU transaction
-        if seller == buyer:
-            # Same country - charge local VAT
-            rate = EU_COUNTRIES.get(seller, 21.0)
-            return rate, False, f"Domestic (EU) - {seller} VAT {rate}%"
-        else:
-            # Different EU countries
-            if buyer_tax_id:
-                # B2B with VAT number - reverse charge (0%)
-                return 0.0, True, f"EU B2B Reverse Charge - {seller} to {buyer}"
-            else:
-                # B2C - charge seller's VAT
-                rate = EU_COUNTRIES.get(seller, 21.0)
-                return rate, False, f"EU B2C - {seller} VAT {rate}%"
-    
-    elif seller_region == 'EU':
-        # EU seller selling to non-EU
-        return 0.0, False, f"Export from {seller} - 0% VAT"
-    
-    elif buyer_region == 'EU':
-        # Non-EU seller selling to EU
-        rate = EU_COUNTRIES.get(buyer, 21.0)
-        return rate, False, f"Import to {buyer} - {buyer} VAT {rate}%"
-    
-    # === US RULES (simplified - destination tax per state) ===
-    elif seller == 'US' and buyer == 'US':
-        # Same country - would need state code
-        return 0.0, False, "US - Sales tax applies per state (state code required)"
-    elif seller == 'US':
-        # US seller to non-US
-        return 0.0, False, "US Export - 0% tax"
-    elif buyer == 'US':
-        # Non-US to US
-        return 0.0, False, "Import to US - federal 0% (state tax may apply)"
-    
-    # === CANADA RULES ===
-    elif seller == 'CA' and buyer == 'CA':
-        # Same country - GST + PST (simplified to GST only)
-        return 5.0, False, "Canada Domestic - GST applies"
-    elif seller == 'CA':
-        # Canadian seller to non-Canada
-        return 0.0, False, "Canadian Export - 0% tax"
-    elif buyer == 'CA':
-        # Non-Canada to Canada
-        return 5.0, False, "Import to Canada - GST 5%"
-    
-    # === DEFAULT: Same country or seller's rate ===
-    else:
-        if seller == buyer:
-            rate = get_tax_rate(seller)
-            return rate, False, f"Domestic - {seller} rate {rate}%"
-        else:
-            # Different countries outside EU/CA/US
-            # Apply seller's local rate (origin tax principle)
-            seller_rate = get_tax_rate(seller)
-            return seller_rate, False, f"International - {seller} rate applies {seller_rate}%"
-    
-    # Same country - always charge local VAT
-    if seller == buyer:
-        rate = EU_COUNTRIES.get(seller, 21.0)
-        return rate, False, f"Domestic sale - {seller} VAT"
-    
-    # Check if both in EU
-    seller_in_eu = seller in EU_COUNTRIES
-    buyer_in_eu = buyer in EU_COUNTRIES
-    
-    if seller_in_eu and buyer_in_eu:
-        # EU cross-border
-        if buyer_vat_number:
-            # B2B with valid VAT number - reverse charge
-            return 0.0, True, "EU B2B - Reverse charge (customer pays VAT)"
-        else:
-            # B2C - charge seller's VAT
-            rate = EU_COUNTRIES.get(seller, 21.0)
-            return rate, False, f"EU B2C - {seller} VAT applies"
-    else:
-        # Export outside EU - 0% VAT
-        return 0.0, False, "Export outside EU - 0% VAT"
+    decision = decide(seller_country, buyer_country, bool(buyer_tax_id))
+    return decision.rate, decision.reverse_charge, decision.explanation
 
 app = FastAPI(title="Secure User API")
 
@@ -278,6 +133,7 @@ INVOICE_PDF_DIR = DATA_DIR / "invoice_pdfs"
 API_KEYS_FILE = DATA_DIR / "api_keys.json"
 SESSIONS_FILE = DATA_DIR / "sessions.json"
 CONTACTS_FILE = DATA_DIR / "contacts.json"
+SEQUENCES_FILE = DATA_DIR / "sequences.json"
 
 # Detect read-only filesystem state so writes can be disabled safely.
 READ_ONLY_FS = not os.access(DATA_DIR, os.W_OK)
@@ -354,8 +210,12 @@ if not READ_ONLY_FS and (DATA_DIR / "vat_compliance.json").exists():
     except Exception as e:
         print(f"[WARN] Could not seed vat_compliance.json: {e}")
 
-# Simple in-process lock to avoid concurrent writes from multiple requests (single-process only)
-_lock = threading.Lock()
+# JSON stores shared by every gunicorn worker: writes are atomic (temp file +
+# fsync + rename) and serialized across processes by a file lock; use
+# `.transaction()` for read-modify-write (see file_store.py)
+users_file = JsonFile(USERS_FILE, read_only=READ_ONLY_FS)
+api_keys_file = JsonFile(API_KEYS_FILE, read_only=READ_ONLY_FS)
+contacts_file = JsonFile(CONTACTS_FILE, read_only=READ_ONLY_FS)
 
 # passlib CryptContext configured for bcrypt
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -382,10 +242,28 @@ PAYPAL_MODE = os.getenv("PAYPAL_MODE", "live")  # "sandbox" or "live"
 COINBASE_COMMERCE_API_KEY = os.getenv("COINBASE_COMMERCE_API_KEY", "837cb701-982d-435a-8abd-724b723a3883")
 COINBASE_WEBHOOK_SECRET = os.getenv("COINBASE_WEBHOOK_SECRET", "")
 
-# Brute-force protection
+# Brute-force protection: sliding-window failure counters per user and IP,
+# shared across workers (see login_attempts.py for the backends). Without a
+# DATABASE_URL they live in a SQLite file next to the webhook queue;
+# LOGIN_ATTEMPTS_BACKEND=memory opts into per-process counters.
 MAX_ATTEMPTS = 5
 LOCK_TIME_SECONDS = 15 * 60  # 15 minutes
-failed_logins = {}
+login_tracker = tracker_from_env(
+    max_attempts=MAX_ATTEMPTS, lockout_seconds=LOCK_TIME_SECONDS, namespace="api:",
+    default_url=None if READ_ONLY_FS else f"sqlite:///{DATA_DIR / 'login_attempts.db'}",
+)
+
+# API-key auth cache (sha256 key hash -> resolved principal). Emptied whenever
+# api_keys.json changes, so revocations by other workers apply immediately;
+# the TTL still bounds staleness of user rows and legacy DB-backed keys.
+API_KEY_CACHE_TTL_SECONDS = float(os.getenv("API_KEY_CACHE_TTL_SECONDS", "60"))
+api_key_cache = APIKeyCache(ttl_seconds=API_KEY_CACHE_TTL_SECONDS, source=API_KEYS_FILE)
+
+# Batch VAT validation (/validate-vat/batch)
+VAT_BATCH_MAX_SIZE = int(os.getenv("VAT_BATCH_MAX_SIZE", "500"))
+VIES_PER_COUNTRY_CONCURRENCY = int(os.getenv("VIES_PER_COUNTRY_CONCURRENCY", "4"))
+# event loop -> country code -> Semaphore; shared by every request on that loop
+_vies_country_limits: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
 
 # Cookie settings for refresh token storage. Force secure cookies in production.
 COOKIE_NAME = "refresh_token"
@@ -393,31 +271,14 @@ COOKIE_SECURE = IS_PROD
 COOKIE_SAMESITE = "lax"
 
 
-def is_locked(username: str):
-    entry = failed_logins.get(username)
-    if not entry:
-        return False
-
-    attempts, lock_until = entry
-    if lock_until and time() < lock_until:
-        return True
-
-    # Lock expired → reset
-    if lock_until and time() >= lock_until:
-        failed_logins.pop(username, None)
-    return False
+def is_locked(username: str, ip: str = "-"):
+    return login_tracker.is_locked(username, ip)
 
 
 def register_failed_attempt(username: str, ip: str = "-"):
-    attempts, lock_until = failed_logins.get(username, (0, None))
-    attempts += 1
-
-    if attempts >= MAX_ATTEMPTS:
-        lock_until = time() + LOCK_TIME_SECONDS
+    if login_tracker.record_failure(username, ip):
         # Audit account lock event
-        log_event("ACCOUNT_LOCK", username, ip)
-
-    failed_logins[username] = (attempts, lock_until)
+        log_event("ACCOUNT_LOCK", username, ip, sync=True)
 
 
 # --- PHASE 2: Payment State Machine Helpers ---
@@ -452,35 +313,51 @@ def generate_customer_access_link(session_id: str, merchant_id: int, expires_day
 
 def auto_unlock_api_keys(merchant_id: int, session: dict) -> dict:
     """On payment, create API keys for merchant if they don't exist."""
-    keys = load_api_keys()
-    existing = next((k for k in keys if k.get("merchant_id") == merchant_id), None)
-    if existing:
-        return existing
-    
     import secrets
-    raw_suffix = secrets.token_urlsafe(24)
-    raw_key = f"sk_test_{raw_suffix}"
-    
-    new_key = {
-        "id": max((k.get("id", 0) for k in keys), default=0) + 1,
-        "merchant_id": merchant_id,
-        "key": raw_key,
-        "label": f"Auto-generated from session {session.get('id')[:8]}",
-        "mode": "test",
-        "created_at": datetime.utcnow().isoformat(),
-    }
-    
-    keys.append(new_key)
-    save_api_keys(keys)
-    log_event(f"API_KEY_CREATED merchant_id={merchant_id}", "-", "-")
+    with api_keys_transaction() as keys:
+        existing = next((k for k in keys if k.get("merchant_id") == merchant_id), None)
+        if existing:
+            return existing
+
+        raw_suffix = secrets.token_urlsafe(24)
+        raw_key = f"sk_test_{raw_suffix}"
+
+        new_key = {
+            "id": max((k.get("id", 0) for k in keys), default=0) + 1,
+            "merchant_id": merchant_id,
+            "key": raw_key,
+            "label": f"Auto-generated from session {session.get('id')[:8]}",
+            "mode": "test",
+            "created_at": datetime.utcnow().isoformat(),
+        }
+
+        keys.append(new_key)
+    log_event(f"API_KEY_CREATED merchant_id={merchant_id}", "-", "-", sync=True)
     return new_key
 
 
 def clear_attempts(username: str):
-    failed_logins.pop(username, None)
+    login_tracker.record_success(username)
+
+
+# audit.log lines are buffered and appended in batches (one write + fsync) by
+# a background thread, see audit_writer.py. sync=True writes before returning;
+# used for account, role and payment events. The file rotates into numbered
+# segments with a timestamp index (audit_log.py) so /admin/logs reads the tail.
+audit_log_file = AuditLogFile(
+    AUDIT_LOG_FILE,
+    max_segment_bytes=int(os.getenv("AUDIT_SEGMENT_BYTES", str(16 * 1024 * 1024))),
+    max_segments=int(os.getenv("AUDIT_MAX_SEGMENTS", "0")),
+)
+audit_log_writer = AuditWriter(
+    audit_log_file.append,
+    max_batch=int(os.getenv("AUDIT_BATCH_SIZE", "500")),
+    flush_interval=float(os.getenv("AUDIT_FLUSH_SECONDS", "1.0")),
+    name="audit-log",
+)
 
 
-def log_event(event: str, username: str = "-", ip: str = "-"):
+def log_event(event: str, username: str = "-", ip: str = "-", sync: bool = False):
     timestamp = datetime.now(timezone.utc).isoformat()
     line = f"{timestamp} | {ip} | {username} | {event}\n"
     if READ_ONLY_FS:
@@ -488,9 +365,7 @@ def log_event(event: str, username: str = "-", ip: str = "-"):
         print(line, file=sys.stderr, end="")
         return
 
-    with _lock:
-        with open(AUDIT_LOG_FILE, "a", encoding="utf-8") as f:
-            f.write(line)
+    audit_log_writer.submit(line, sync=sync)
 
 
 def get_client_ip(request: Request):
@@ -557,47 +432,34 @@ class ContactMessage(BaseModel):
 
 
 def _ensure_users_file() -> None:
-    if READ_ONLY_FS:
-        # Running on read-only filesystem — don't attempt to create files.
-        return
-
-    if not USERS_FILE.exists():
-        USERS_FILE.write_text("[]", encoding="utf-8")
+    # No-op on a read-only filesystem
+    users_file.ensure()
 
 
 def _ensure_invoices_file() -> None:
     if READ_ONLY_FS:
         return
-
-    if not INVOICES_FILE.exists():
-        INVOICES_FILE.write_text("[]", encoding="utf-8")
+    create_if_missing(INVOICES_FILE, "[]")
 
 
 def _ensure_api_keys_file() -> None:
-    if READ_ONLY_FS:
-        return
-    if not API_KEYS_FILE.exists():
-        API_KEYS_FILE.write_text("[]", encoding="utf-8")
+    api_keys_file.ensure()
 
 
 def _ensure_sessions_file() -> None:
     if READ_ONLY_FS:
         return
-    if not SESSIONS_FILE.exists():
-        SESSIONS_FILE.write_text("[]", encoding="utf-8")
+    create_if_missing(SESSIONS_FILE, "[]")
 
 
 def _ensure_contacts_file() -> None:
-    if READ_ONLY_FS:
-        return
-    if not CONTACTS_FILE.exists():
-        CONTACTS_FILE.write_text("[]", encoding="utf-8")
+    contacts_file.ensure()
 
 
 def load_contacts() -> List[dict]:
     _ensure_contacts_file()
     try:
-        return json.loads(CONTACTS_FILE.read_text(encoding="utf-8"))
+        return contacts_file.read()
     except Exception:
         return []
 
@@ -608,34 +470,97 @@ def save_contact(contact_data: dict) -> None:
         return
     
     _ensure_contacts_file()
-    with _lock:
-        contacts = load_contacts()
+    with contacts_file.transaction() as contacts:
         contact_data["id"] = str(uuid.uuid4())
         contact_data["created_at"] = datetime.now(timezone.utc).isoformat()
         contacts.append(contact_data)
-        CONTACTS_FILE.write_text(json.dumps(contacts, indent=4), encoding="utf-8")
+
+
+# Invoices live in an indexed append-only store (invoices.json snapshot +
+# invoices.jsonl log) so single-record writes don't rewrite the whole file.
+invoice_store = InvoiceStore(INVOICES_FILE, read_only=READ_ONLY_FS)
+
+# Hosted checkout sessions: same snapshot + log layout, with expired sessions
+# moved to sessions_archive.jsonl (still resolvable by id) and dropped from
+# there after SESSION_ARCHIVE_RETENTION_DAYS.
+session_store = SessionStore(
+    SESSIONS_FILE,
+    read_only=READ_ONLY_FS,
+    archive_after_seconds=float(os.getenv("SESSION_ARCHIVE_AFTER_DAYS", "7")) * 86400,
+    abandon_after_seconds=float(os.getenv("SESSION_ABANDON_AFTER_DAYS", "30")) * 86400,
+    archive_retention_seconds=float(os.getenv("SESSION_ARCHIVE_RETENTION_DAYS", "365")) * 86400,
+)
+
+# Status changes pushed to GET /session/{id}/events subscribers; as a store
+# listener it also sees changes other workers wrote, once the log is replayed
+session_events = SessionEventHub(
+    max_per_session=int(os.getenv("SESSION_EVENTS_MAX_PER_SESSION", "8")),
+    max_total=int(os.getenv("SESSION_EVENTS_MAX_TOTAL", "10000")),
+)
+session_store.add_listener(session_events)
+SESSION_EVENTS_RECHECK_SECONDS = float(os.getenv("SESSION_EVENTS_RECHECK_SECONDS", "5"))
+SESSION_EVENTS_HEARTBEAT_SECONDS = float(os.getenv("SESSION_EVENTS_HEARTBEAT_SECONDS", "15"))
+SESSION_EVENTS_MAX_SECONDS = float(os.getenv("SESSION_EVENTS_MAX_SECONDS", "1800"))
+
+# Per-merchant counts/totals/daily revenue for /merchant/usage, kept in sync by the store
+usage_rollup = UsageRollup()
+invoice_store.add_listener(usage_rollup)
+
+# Columnar per-invoice revenue rows for /merchant/analytics. Attached to the
+# invoice store on first use (_attach_analytics) rather than here: building it
+# scans every invoice, and workers that never serve analytics shouldn't pay that.
+analytics_store = AnalyticsStore()
+ANALYTICS_MAX_PERIODS = int(os.getenv("ANALYTICS_MAX_PERIODS", "10000"))
+
+# Invoice / credit note counters keyed by (merchant, year, prefix)
+sequence_allocator = FileSequenceAllocator(SEQUENCES_FILE, read_only=READ_ONLY_FS)
+
+
+def _attach_analytics() -> None:
+    """Start feeding analytics_store from invoice_store; builds it on the first call per worker."""
+    invoice_store.add_listener(analytics_store)
+
+
+def _sync_analytics() -> None:
+    """Bring analytics_store up to date (blocking: call off the event loop)."""
+    _attach_analytics()  # first call builds the columns
+    invoice_store.sync()  # apply other workers' writes to the columns
 
 
 def load_invoices() -> List[dict]:
     _ensure_invoices_file()
     try:
-        return json.loads(INVOICES_FILE.read_text(encoding="utf-8"))
+        return invoice_store.all()
     except Exception:
         return []
 
 
 def save_invoices(invoices: List[dict]) -> None:
+    """Persist a full invoice list. Only changed records are written; prefer `put_invoice`."""
+    if READ_ONLY_FS:
+        raise RuntimeError("Filesystem is read-only; cannot persist invoices.json")
+
+    invoice_store.replace_all(invoices)
+
+
+def get_invoice_record(invoice_id) -> Optional[dict]:
+    """Return a copy of a single invoice by id (O(1)), or None."""
+    _ensure_invoices_file()
+    return invoice_store.get(invoice_id)
+
+
+def put_invoice(invoice: dict) -> dict:
+    """Insert or update a single invoice record (O(1) append)."""
     if READ_ONLY_FS:
         raise RuntimeError("Filesystem is read-only; cannot persist invoices.json")
 
-    with _lock:
-        INVOICES_FILE.write_text(json.dumps(invoices, indent=4), encoding="utf-8")
+    return invoice_store.put(invoice)
 
 
 def load_api_keys() -> List[dict]:
     _ensure_api_keys_file()
     try:
-        return json.loads(API_KEYS_FILE.read_text(encoding="utf-8"))
+        return api_keys_file.read()
     except Exception:
         return []
 
@@ -643,24 +568,129 @@ def load_api_keys() -> List[dict]:
 def load_sessions() -> List[dict]:
     _ensure_sessions_file()
     try:
-        return json.loads(SESSIONS_FILE.read_text(encoding="utf-8"))
+        return session_store.all()
     except Exception:
         return []
 
 
 def save_api_keys(keys: List[dict]) -> None:
+    """Overwrite api_keys.json; prefer `api_keys_transaction()` for read-modify-write."""
     if READ_ONLY_FS:
         raise RuntimeError("Filesystem is read-only; cannot persist api_keys.json")
-    with _lock:
-        API_KEYS_FILE.write_text(json.dumps(keys, indent=4), encoding="utf-8")
+    api_keys_file.write(keys)
+    # Any key may have been added, revoked or re-assigned
+    api_key_cache.invalidate()
+
+
+@contextmanager
+def api_keys_transaction():
+    """Yield the API key list under the cross-worker lock; saved when the block exits cleanly."""
+    _ensure_api_keys_file()
+    with api_keys_file.transaction() as keys:
+        yield keys
+    api_key_cache.invalidate()
+
+
+def _hash_api_key(api_key: str) -> str:
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+
+
+def _load_api_key_principal(api_key: str, key_hash: str) -> Optional[dict]:
+    """Uncached lookup of an API key and its owner.
+
+    Returns {"key": <key row>, "user": <user dict or None>} or None if the key is unknown.
+    """
+    keys = load_api_keys()
+    # Primary lookup: SHA256 key hash (preferred)
+    row = next((k for k in keys if k.get("key_hash") == key_hash), None)
+    # Backward-compatibility: accept raw `key` field if present in the store
+    if not row:
+        row = next((k for k in keys if k.get("key") == api_key), None)
+
+    with _db_session() as db:
+        if row:
+            uid = row.get("user_id")
+            user = None
+            # Prefer DB-backed user if available
+            try:
+                from app.models.user import User as ORMUser
+                if db:
+                    u = db.query(ORMUser).filter(ORMUser.id == uid).first()
+                    if u:
+                        user = {"id": u.id, "name": u.username, "role": u.role}
+            except Exception:
+                pass
+            # Fallback to file-based users
+            if user is None:
+                user = next((x for x in load_users() if x.get("id") == uid), None)
+            return {"key": row, "user": user}
+
+        # Try DB-backed API keys when available (older deployments)
+        try:
+            from app.models.api_key import APIKey as ORMAPIKey
+            if db:
+                db_row = db.query(ORMAPIKey).filter(ORMAPIKey.key_hash == key_hash).first()
+                if db_row:
+                    user = None
+                    try:
+                        from app.models.user import User as ORMUser
+                        u = db.query(ORMUser).filter(ORMUser.id == db_row.user_id).first()
+                        if u:
+                            user = {"id": u.id, "name": u.username, "role": u.role}
+                    except Exception:
+                        pass
+                    return {"key": {"id": db_row.id, "user_id": db_row.user_id, "key_hash": key_hash}, "user": user}
+        except Exception:
+            pass
+        return None
+
+
+def resolve_api_key(api_key: str) -> Optional[dict]:
+    """Resolve an API key to {"key": row, "user": user}, served from `api_key_cache` when possible."""
+    key_hash = _hash_api_key(api_key)
+    found, principal = api_key_cache.get(key_hash)
+    if found:
+        return principal
+    principal = _load_api_key_principal(api_key, key_hash)
+    api_key_cache.set(key_hash, principal)
+    return principal
 
 
 def save_sessions(sessions: List[dict]) -> None:
     if READ_ONLY_FS:
         raise RuntimeError("Filesystem is read-only; cannot persist sessions.json")
 
-    with _lock:
-        SESSIONS_FILE.write_text(json.dumps(sessions, indent=4), encoding="utf-8")
+    session_store.replace_all(sessions)
+
+
+def _db_session_backend():
+    """DB-backed sessions (app.db.sessions) when that package imports, else None."""
+    try:
+        from app.db.sessions import DBSessionStore
+    except Exception:
+        return None
+    return DBSessionStore()
+
+
+def find_session(session_id: str):
+    """Return (backend, session) for a session id, or (None, None).
+
+    Checks the file store (an in-memory lookup) and then the DB backend. Update
+    the session through the returned backend's `update_session`.
+    """
+    _ensure_sessions_file()
+    s = session_store.get_session(session_id)
+    if s is not None:
+        return session_store, s
+    db_sessions = _db_session_backend()
+    if db_sessions is not None:
+        try:
+            s = db_sessions.get_session(session_id)
+        except Exception:
+            s = None
+        if s:
+            return db_sessions, s
+    return None, None
 
 
 def ensure_invoice_pdf_dir() -> None:
@@ -672,32 +702,36 @@ def ensure_invoice_pdf_dir() -> None:
 
 def load_users() -> List[dict]:
     _ensure_users_file()
-    try:
-        return json.loads(USERS_FILE.read_text(encoding="utf-8"))
-    except json.JSONDecodeError:
-        # If the file is corrupted, return empty list (could also raise)
-        return []
+    # A missing or corrupted file reads as an empty list
+    return users_file.read()
 
 
-def _get_db_session():
+@contextmanager
+def _db_session():
+    """Pooled app.db session that is closed (connection returned) on exit; None without a DB layer."""
     try:
         from app.db.session import SessionLocal
-        return SessionLocal()
+        db = SessionLocal()
     except Exception:
-        return None
+        db = None
+    try:
+        yield db
+    finally:
+        if db is not None:
+            db.close()
 
 
 def db_get_user(username: str):
     """Return a user dict from the database, or None if DB unavailable or user not found."""
     try:
         from app.models.user import User as ORMUser
-        db = _get_db_session()
-        if not db:
-            return None
-        user = db.query(ORMUser).filter(ORMUser.username == username).first()
-        if not user:
-            return None
-        return {"id": user.id, "name": user.username, "password": user.password_hash, "role": user.role}
+        with _db_session() as db:
+            if not db:
+                return None
+            user = db.query(ORMUser).filter(ORMUser.username == username).first()
+            if not user:
+                return None
+            return {"id": user.id, "name": user.username, "password": user.password_hash, "role": user.role}
     except Exception:
         return None
 
@@ -705,11 +739,11 @@ def db_get_user(username: str):
 def db_list_users():
     try:
         from app.models.user import User as ORMUser
-        db = _get_db_session()
-        if not db:
-            return None
-        rows = db.query(ORMUser).all()
-        return [{"id": r.id, "name": r.username, "role": r.role} for r in rows]
+        with _db_session() as db:
+            if not db:
+                return None
+            rows = db.query(ORMUser).all()
+            return [{"id": r.id, "name": r.username, "role": r.role} for r in rows]
     except Exception:
         return None
 
@@ -717,14 +751,14 @@ def db_list_users():
 def db_create_user(user_dict: dict):
     try:
         from app.models.user import User as ORMUser
-        db = _get_db_session()
-        if not db:
-            return None
-        u = ORMUser(username=user_dict["name"], password_hash=user_dict["password"], role=user_dict.get("role", "user"))
-        db.add(u)
-        db.commit()
-        db.refresh(u)
-        return {"id": u.id, "name": u.username, "role": u.role}
+        with _db_session() as db:
+            if not db:
+                return None
+            u = ORMUser(username=user_dict["name"], password_hash=user_dict["password"], role=user_dict.get("role", "user"))
+            db.add(u)
+            db.commit()
+            db.refresh(u)
+            return {"id": u.id, "name": u.username, "role": u.role}
     except Exception:
         return None
 
@@ -732,16 +766,16 @@ def db_create_user(user_dict: dict):
 def db_delete_user_by_id(user_id: int):
     try:
         from app.models.user import User as ORMUser
-        db = _get_db_session()
-        if not db:
-            return None
-        u = db.query(ORMUser).filter(ORMUser.id == user_id).first()
-        if not u:
-            return None
-        out = {"id": u.id, "name": u.username, "role": u.role}
-        db.delete(u)
-        db.commit()
-        return out
+        with _db_session() as db:
+            if not db:
+                return None
+            u = db.query(ORMUser).filter(ORMUser.id == user_id).first()
+            if not u:
+                return None
+            out = {"id": u.id, "name": u.username, "role": u.role}
+            db.delete(u)
+            db.commit()
+            return out
     except Exception:
         return None
 
@@ -749,25 +783,31 @@ def db_delete_user_by_id(user_id: int):
 def db_update_role(user_id: int, role: str):
     try:
         from app.models.user import User as ORMUser
-        db = _get_db_session()
-        if not db:
-            return None
-        u = db.query(ORMUser).filter(ORMUser.id == user_id).first()
-        if not u:
-            return None
-        u.role = role
-        db.commit()
-        return {"id": u.id, "name": u.username, "role": u.role}
+        with _db_session() as db:
+            if not db:
+                return None
+            u = db.query(ORMUser).filter(ORMUser.id == user_id).first()
+            if not u:
+                return None
+            u.role = role
+            db.commit()
+            return {"id": u.id, "name": u.username, "role": u.role}
     except Exception:
         return None
 
 
 def save_users(users: List[dict]) -> None:
+    """Overwrite users.json; prefer `users_transaction()` for read-modify-write."""
     if READ_ONLY_FS:
         raise RuntimeError("Filesystem is read-only; cannot persist users.json")
 
-    with _lock:
-        USERS_FILE.write_text(json.dumps(users, indent=4), encoding="utf-8")
+    users_file.write(users)
+
+
+def users_transaction():
+    """Yield the user list under the cross-worker lock; saved when the block exits cleanly."""
+    _ensure_users_file()
+    return users_file.transaction()
 
 
 def _hash_password(password: str) -> str:
@@ -848,48 +888,9 @@ async def get_current_user(request: Request):
 
     if api_key:
         try:
-            key_hash = hashlib.sha256(api_key.encode("utf-8")).hexdigest()
-            # First check file-based api_keys store
-            keys = load_api_keys()
-            # Primary lookup: SHA256 key hash (preferred)
-            row = next((k for k in keys if k.get("key_hash") == key_hash), None)
-            # Backward-compatibility: accept raw `key` field if present in the store
-            if not row:
-                row = next((k for k in keys if k.get("key") == api_key), None)
-            if row:
-                uid = row.get("user_id")
-                # Prefer DB-backed user if available
-                try:
-                    from app.models.user import User as ORMUser
-                    db = _get_db_session()
-                    if db:
-                        u = db.query(ORMUser).filter(ORMUser.id == uid).first()
-                        if u:
-                            return {"id": u.id, "name": u.username, "role": u.role}
-                except Exception:
-                    pass
-                # Fallback to file-based users
-                users = load_users()
-                u = next((x for x in users if x.get("id") == uid), None)
-                if u:
-                    return u
-
-            # Try DB-backed API keys when available (older deployments)
-            try:
-                from app.models.api_key import APIKey as ORMAPIKey
-                db = _get_db_session()
-                if db:
-                    row = db.query(ORMAPIKey).filter(ORMAPIKey.key_hash == key_hash).first()
-                    if row:
-                        try:
-                            from app.models.user import User as ORMUser
-                            u = db.query(ORMUser).filter(ORMUser.id == row.user_id).first()
-                            if u:
-                                return {"id": u.id, "name": u.username, "role": u.role}
-                        except Exception:
-                            pass
-            except Exception:
-                pass
+            principal = resolve_api_key(api_key)
+            if principal and principal.get("user"):
+                return principal["user"]
         except Exception:
             pass
 
@@ -983,15 +984,14 @@ async def add_user(user: User, admin: dict = Depends(require_admin)):
         return {"id": created["id"], "name": created["name"], "role": created.get("role", "user")}
 
     # Fallback to file-based store
-    users = load_users()
-    if any(u["id"] == user.id for u in users):
-        raise HTTPException(status_code=400, detail="User id already exists")
-    if any(u["name"] == user.name for u in users):
-        raise HTTPException(status_code=400, detail="User name already exists")
-
-    new_user = {"id": user.id, "name": user.name, "password": hashed, "role": user.role}
-    users.append(new_user)
-    save_users(users)
+    with users_transaction() as users:
+        if any(u["id"] == user.id for u in users):
+            raise HTTPException(status_code=400, detail="User id already exists")
+        if any(u["name"] == user.name for u in users):
+            raise HTTPException(status_code=400, detail="User name already exists")
+
+        new_user = {"id": user.id, "name": user.name, "password": hashed, "role": user.role}
+        users.append(new_user)
     return {"id": new_user["id"], "name": new_user["name"], "role": new_user.get("role", "user")}
 
 
@@ -1030,29 +1030,28 @@ async def register_merchant(payload: dict = Body(...)):
     except Exception:
         raise HTTPException(status_code=500, detail="Error processing password")
 
-    # Check for existing user
-    users = load_users()
-    if any(u["name"] == name for u in users):
-        raise HTTPException(status_code=400, detail="Username already exists")
-    if any(u.get("email") == email for u in users):
-        raise HTTPException(status_code=400, detail="Email already registered")
-
-    # Generate new ID
-    new_id = max([u["id"] for u in users], default=0) + 1
-
-    # Create new user with merchant role
-    new_user = {
-        "id": new_id,
-        "name": name,
-        "email": email,
-        "password": hashed,
-        "role": "merchant",
-        "business_name": business_name or name,
-        "country": country,  # For automatic VAT calculation
-    }
+    # Check for existing user and allocate the id under the users.json lock
+    with users_transaction() as users:
+        if any(u["name"] == name for u in users):
+            raise HTTPException(status_code=400, detail="Username already exists")
+        if any(u.get("email") == email for u in users):
+            raise HTTPException(status_code=400, detail="Email already registered")
+
+        # Generate new ID
+        new_id = max([u["id"] for u in users], default=0) + 1
+
+        # Create new user with merchant role
+        new_user = {
+            "id": new_id,
+            "name": name,
+            "email": email,
+            "password": hashed,
+            "role": "merchant",
+            "business_name": business_name or name,
+            "country": country,  # For automatic VAT calculation
+        }
 
-    users.append(new_user)
-    save_users(users)
+        users.append(new_user)
 
     # Auto-login: generate access token
     access_token = create_access_token(
@@ -1081,14 +1080,14 @@ async def login_for_access_token(
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
-    if is_locked(identifier):
+    ip = get_client_ip(request)
+
+    if is_locked(identifier, ip):
         raise HTTPException(
             status_code=403,
             detail="Account temporarily locked due to too many failed login attempts. Try again later."
         )
 
-    ip = get_client_ip(request)
-
     users = load_users()
     # Search by username or email
     user = None
@@ -1113,7 +1112,7 @@ async def login_for_access_token(
 
     if not user or not valid:
         log_event("LOGIN_FAIL", identifier, ip)
-        register_failed_attempt(identifier)
+        register_failed_attempt(identifier, ip)
         raise HTTPException(status_code=401, detail="Invalid username/email or password")
 
     clear_attempts(identifier)
@@ -1167,32 +1166,26 @@ async def forgot_password(request: Request, payload: dict = Body(...)):
     # Optional: allow caller to specify an explicit password to set (dev only)
     set_to = payload.get("set_to")
 
-    users = load_users()
-    user = next((u for u in users if u.get("name") == name), None)
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-
     import hashlib as _hl
+    import secrets
+
+    # Developer explicitly provided a password, or generate a temporary one.
+    # Either is stored as a sha256$ entry (login supports those for dev convenience).
+    new_pw = str(set_to) if set_to else secrets.token_urlsafe(8) + "A1!"
+    with users_transaction() as users:
+        user = next((u for u in users if u.get("name") == name), None)
+        if not user:
+            raise HTTPException(status_code=404, detail="User not found")
+        user["password"] = "sha256$" + _hl.sha256(new_pw.encode("utf-8")).hexdigest()
 
+    ip = get_client_ip(request)
     if set_to:
-        # Developer explicitly provided a password — store as sha256$ for quick dev logins
-        user["password"] = "sha256$" + _hl.sha256(str(set_to).encode("utf-8")).hexdigest()
-        save_users(users)
-        ip = get_client_ip(request)
-        log_event("PASSWORD_SET", name, ip)
+        log_event("PASSWORD_SET", name, ip, sync=True)
         return {"detail": "password set (dev)", "password": "(hidden)"}
 
-    # Generate a temporary password and store it as a sha256$ entry
-    # (login endpoint supports sha256$ entries for dev convenience).
-    import secrets
-    temp_pw = secrets.token_urlsafe(8) + "A1!"
-    user["password"] = "sha256$" + _hl.sha256(temp_pw.encode("utf-8")).hexdigest()
-    save_users(users)
-
-    ip = get_client_ip(request)
-    log_event("PASSWORD_RESET", name, ip)
+    log_event("PASSWORD_RESET", name, ip, sync=True)
 
-    return {"detail": "password reset", "password": temp_pw}
+    return {"detail": "password reset", "password": new_pw}
 
 
 @app.post("/refresh")
@@ -1239,19 +1232,18 @@ async def delete_user(user_id: int, admin: dict = Depends(require_admin)):
     # Try DB delete first
     db_removed = db_delete_user_by_id(user_id)
     if db_removed:
-        log_event(f"DELETE_USER id={user_id}", admin["name"], "-")
+        log_event(f"DELETE_USER id={user_id}", admin["name"], "-", sync=True)
         return db_removed
 
-    users = load_users()
-    idx = next((i for i, u in enumerate(users) if u["id"] == user_id), None)
-    if idx is None:
-        raise HTTPException(status_code=404, detail="User not found")
+    with users_transaction() as users:
+        idx = next((i for i, u in enumerate(users) if u["id"] == user_id), None)
+        if idx is None:
+            raise HTTPException(status_code=404, detail="User not found")
 
-    removed = users.pop(idx)
-    save_users(users)
+        removed = users.pop(idx)
 
     # Audit admin deletion
-    log_event(f"DELETE_USER id={user_id}", admin["name"], "-")
+    log_event(f"DELETE_USER id={user_id}", admin["name"], "-", sync=True)
 
     return {"id": removed["id"], "name": removed["name"], "role": removed.get("role", "user")}
 
@@ -1260,75 +1252,7 @@ async def delete_user(user_id: int, admin: dict = Depends(require_admin)):
 from typing import Optional
 import io
 import logging
-from fpdf import FPDF
-
-
-class InvoicePDFRequest(BaseModel):
-    # ========== HEADER SECTION ==========
-    logo_url: Optional[str] = None
-    invoice_number: Optional[str] = "INV-TEST-001"
-    invoice_date: Optional[str] = None  # e.g., "2026-02-12"
-    supply_date: Optional[str] = None  # If different from invoice date
-    currency: Optional[str] = "EUR"  # ISO code: EUR, USD, GBP, etc.
-    
-    # ========== SELLER INFORMATION (Legal Entity) ==========
-    seller: Optional[str] = "Example Seller"  # Legal business name
-    seller_address: Optional[str] = None  # Full address with country
-    seller_country: Optional[str] = None  # Country code or name
-    seller_registration_number: Optional[str] = None  # Company reg. number
-    seller_vat: Optional[str] = None  # VAT ID / Tax ID
-    seller_eori: Optional[str] = None  # EORI for international export
-    seller_email: Optional[str] = None
-    seller_phone: Optional[str] = None
-    
-    # ========== BUYER INFORMATION ==========
-    buyer: Optional[str] = "Example Buyer"  # Legal name
-    buyer_address: Optional[str] = None  # Full address with country
-    buyer_country: Optional[str] = None  # Country code or name
-    buyer_vat: Optional[str] = None  # VAT ID / Tax ID (for B2B reverse charge)
-    buyer_registration_number: Optional[str] = None  # Company reg. number
-    buyer_email: Optional[str] = None
-    buyer_phone: Optional[str] = None
-    buyer_type: Optional[str] = None  # "B2B" or "B2C" (affects tax treatment)
-    
-    # ========== DESCRIPTION TABLE (Tax-Safe Format) ==========
-    description: Optional[str] = "Service"  # Line item description
-    quantity: Optional[float] = 1.0
-    unit_price: Optional[float] = 100.0
-    net_amount: Optional[float] = None  # Subtotal before tax
-    vat_rate: Optional[float] = 0.0  # Tax rate percentage (e.g., 19.0 for 19%)
-    vat_amount: Optional[float] = None  # Tax amount
-    total_amount: Optional[float] = None  # Total amount gross
-    
-    # Legacy fields (for backward compatibility)
-    subtotal: Optional[float] = None  # Deprecated: use net_amount
-    amount: Optional[float] = None  # Deprecated: use total_amount
-    order_number: Optional[str] = None
-    due_date: Optional[str] = None
-    
-    # ========== TAX INFORMATION SECTION (Flexible) ==========
-    # Choose appropriate tax treatment statement
-    tax_treatment: Optional[str] = None  # E.g. "VAT calculated in accordance with local regulations"
-    is_reverse_charge: Optional[bool] = False  # EU reverse charge
-    is_export: Optional[bool] = False  # Export of services - VAT exempt
-    is_outside_scope: Optional[bool] = False  # Outside scope of VAT
-    tax_exempt_reason: Optional[str] = None  # E.g. "Charity donation", "Government agency"
-    
-    # ========== PAYMENT INFORMATION ==========
-    payment_terms: Optional[str] = None  # E.g. "14 days net", "Net 30"
-    payment_system: Optional[str] = "web2"  # web2 or web3
-    payment_provider: Optional[str] = None  # E.g. Stripe, PayPal
-    blockchain_tx_id: Optional[str] = None  # Blockchain reference
-    bank_name: Optional[str] = None
-    iban: Optional[str] = None
-    swift_bic: Optional[str] = None
-    alternative_payment_methods: Optional[str] = None  # Free text
-    late_payment_clause: Optional[str] = None  # E.g. interest rate info
-    
-    # ========== ADDITIONAL INFO ==========
-    notes: Optional[str] = None  # General notes
-    footer_statement: Optional[str] = None  # Legal footer text
-    registered_office: Optional[str] = None  # For footer
+from pdf_render import InvoicePDFRequest, render_invoice_pdf
 
 
 class InvoiceCreate(BaseModel):
@@ -1418,253 +1342,28 @@ class CreditNoteOut(BaseModel):
     created_at: Optional[str] = None
 
 
-def render_invoice_pdf(data: InvoicePDFRequest) -> bytes:
-    """Render universal international invoice PDF compliant with EU, UK, US, and global tax jurisdictions."""
-    pdf = FPDF()
-    pdf.add_page()
-    pdf.set_auto_page_break(auto=True, margin=10)
-    
-    # Normalize fields for backward compatibility
-    net_amount = data.net_amount or data.subtotal or (data.quantity * data.unit_price if data.quantity and data.unit_price else 0)
-    total_amount = data.total_amount or data.amount or (net_amount + (data.vat_amount or 0))
-    invoice_date = data.invoice_date or datetime.now(timezone.utc).date().isoformat()
-    currency = data.currency or "EUR"
-    
-    # ========== HEADER SECTION WITH TWO COLUMNS ==========
-    # Left side: Invoice title and numbers
-    # Right side: Seller company info
-    pdf.set_font("Arial", "B", size=20)
-    pdf.set_text_color(34, 139, 34)  # Nature green (Forest Green)
-    pdf.cell(100, 12, "INVOICE", ln=False)
-    
-    # Seller info on right
-    pdf.set_font("Arial", "B", size=10)
-    pdf.set_text_color(34, 139, 34)  # Nature green
-    pdf.cell(0, 6, "SELLER", ln=True, align="R")
-    pdf.set_font("Arial", size=9)
-    pdf.set_text_color(0, 0, 0)
-    
-    # Move to next line and create two-column layout
-    pdf.set_x(10)
-    pdf.set_font("Arial", size=9)
-    pdf.cell(95, 4, f"Invoice #: {data.invoice_number or 'N/A'}", ln=False)
-    pdf.set_x(110)
-    pdf.cell(0, 4, data.seller or "Unknown Seller", ln=True)
-    
-    pdf.set_x(10)
-    pdf.cell(95, 4, f"Invoice Date: {invoice_date}", ln=False)
-    pdf.set_x(110)
-    if data.seller_vat:
-        pdf.cell(0, 4, f"VAT: {data.seller_vat}", ln=True)
-    else:
-        pdf.ln(4)
-    
-    pdf.set_x(10)
-    if data.supply_date and data.supply_date != invoice_date:
-        pdf.cell(95, 4, f"Supply Date: {data.supply_date}", ln=False)
-    else:
-        pdf.cell(95, 4, "", ln=False)
-    pdf.set_x(110)
-    if data.seller_registration_number:
-        pdf.cell(0, 4, f"Reg: {data.seller_registration_number}", ln=True)
-    else:
-        pdf.ln(4)
-    
-    # Seller address
-    pdf.set_x(110)
-    if data.seller_address:
-        for line in data.seller_address.split('\n')[:2]:
-            if line.strip():
-                pdf.set_x(110)
-                pdf.cell(0, 4, line.strip(), ln=True)
-    pdf.set_x(110)
-    if data.seller_country:
-        pdf.cell(0, 4, f"Country: {data.seller_country}", ln=True)
-    if data.seller_email:
-        pdf.set_x(110)
-        pdf.cell(0, 4, f"Email: {data.seller_email}", ln=True)
-    
-    pdf.ln(5)
-    
-    # ========== BILLING ADDRESS (LEFT) & ADDITIONAL INFO (RIGHT) ==========
-    pdf.set_font("Arial", "B", size=11)
-    pdf.set_text_color(34, 139, 34)  # Nature green
-    pdf.cell(95, 6, "BILL TO", ln=False)
-    pdf.cell(0, 6, "ORDER INFORMATION", ln=True, align="R")
-    pdf.set_text_color(0, 0, 0)
-    pdf.set_font("Arial", size=9)
-    
-    # Bill to on left
-    pdf.set_x(10)
-    pdf.cell(95, 5, data.buyer or "Unknown Buyer", ln=False)
-    
-    # Order info on right
-    pdf.set_x(110)
-    if data.order_number:
-        pdf.cell(0, 5, f"Order #: {data.order_number}", ln=True)
-    else:
-        pdf.ln(5)
-    
-    # Buyer details
-    if data.buyer_vat:
-        pdf.set_x(10)
-        pdf.cell(95, 4, f"VAT: {data.buyer_vat}", ln=False)
-        pdf.set_x(110)
-        if data.due_date:
-            pdf.cell(0, 4, f"Due Date: {data.due_date}", ln=True)
-        else:
-            pdf.ln(4)
-    
-    if data.buyer_email:
-        pdf.set_x(10)
-        pdf.cell(95, 4, f"Email: {data.buyer_email}", ln=False)
-        pdf.set_x(110)
-        pdf.cell(0, 4, f"Currency: {currency}", ln=True)
-    elif currency:
-        pdf.set_x(110)
-        pdf.cell(0, 4, f"Currency: {currency}", ln=True)
-    
-    if data.buyer_address:
-        for line in data.buyer_address.split('\n')[:2]:
-            if line.strip():
-                pdf.set_x(10)
-                pdf.cell(95, 4, line.strip(), ln=True)
-    
-    pdf.ln(4)
-    
-    # ========== DESCRIPTION TABLE (Tax-Safe Format) ==========
-    pdf.set_font("Arial", "B", size=9)
-    pdf.set_fill_color(34, 139, 34)  # Nature green header
-    pdf.set_text_color(255, 255, 255)  # White text
-    pdf.cell(75, 7, "Description", border=1, fill=True, align="L")
-    pdf.cell(15, 7, "Qty", border=1, fill=True, align="C")
-    pdf.cell(25, 7, "Unit Price", border=1, fill=True, align="R")
-    pdf.cell(25, 7, "Net Amount", border=1, fill=True, align="R", ln=True)
-    
-    pdf.set_text_color(0, 0, 0)
-    pdf.set_font("Arial", size=9)
-    desc = (data.description or "Service")[:75]
-    pdf.cell(75, 6, desc, border=1, align="L")
-    pdf.cell(15, 6, f"{data.quantity:.0f}", border=1, align="C")
-    pdf.cell(25, 6, f"{currency} {data.unit_price:.2f}", border=1, align="R")
-    pdf.cell(25, 6, f"{currency} {net_amount:.2f}", border=1, align="R", ln=True)
-    pdf.ln(4)
-    
-    # ========== TAX CALCULATION SUMMARY ==========
-    x_right = 125
-    pdf.set_font("Arial", size=9)
-    
-    # Subtotal (Net)
-    pdf.set_x(x_right)
-    pdf.cell(35, 5, "Subtotal (Net):", align="L")
-    pdf.cell(0, 5, f"{currency} {net_amount:.2f}", align="R", ln=True)
-    
-    # VAT/Tax line (only if applicable)
-    if data.vat_amount and data.vat_amount > 0:
-        pdf.set_x(x_right)
-        vat_rate = data.vat_rate or 0
-        pdf.cell(35, 5, f"Tax ({vat_rate}%):", align="L")
-        pdf.cell(0, 5, f"{currency} {data.vat_amount:.2f}", align="R", ln=True)
-    elif data.is_reverse_charge or data.is_export or data.is_outside_scope or data.tax_exempt_reason:
-        pdf.set_x(x_right)
-        pdf.set_font("Arial", "I", size=8)
-        pdf.cell(0, 5, "Tax: 0.00 (see tax treatment)", align="R", ln=True)
-        pdf.set_font("Arial", size=9)
-    
-    # Total (Gross)
-    pdf.set_x(x_right)
-    pdf.set_font("Arial", "B", size=11)
-    pdf.set_text_color(34, 139, 34)  # Nature green
-    pdf.cell(35, 7, "TOTAL:", align="L")
-    pdf.cell(0, 7, f"{currency} {total_amount:.2f}", align="R", ln=True)
-    pdf.set_text_color(0, 0, 0)
-    pdf.ln(4)
-    
-    # ========== TAX INFORMATION SECTION (Flexible) ==========
-    if data.is_reverse_charge or data.is_export or data.is_outside_scope or data.tax_exempt_reason or data.tax_treatment:
-        pdf.set_font("Arial", "B", size=10)
-        pdf.set_text_color(34, 139, 34)  # Nature green
-        pdf.cell(0, 6, "TAX TREATMENT", ln=True)
-        pdf.set_text_color(0, 0, 0)
-        pdf.set_font("Arial", size=8)
-        
-        if data.is_reverse_charge and data.buyer_vat:
-            pdf.cell(0, 4, "VAT reverse charged to customer (B2B EU transaction).", ln=True)
-        if data.is_export:
-            pdf.cell(0, 4, "Export of services — VAT exempt per international trade rules.", ln=True)
-        if data.is_outside_scope:
-            pdf.cell(0, 4, "Transaction outside scope of VAT.", ln=True)
-        if data.tax_exempt_reason:
-            pdf.cell(0, 4, f"Tax exempt: {data.tax_exempt_reason}", ln=True)
-        if not (data.is_reverse_charge or data.is_export or data.is_outside_scope or data.tax_exempt_reason) and data.tax_treatment:
-            pdf.multi_cell(0, 4, data.tax_treatment)
-        elif not (data.is_reverse_charge or data.is_export or data.is_outside_scope or data.tax_exempt_reason):
-            pdf.cell(0, 4, "Tax calculated in accordance with local regulations.", ln=True)
-        pdf.ln(2)
-    
-    # ========== PAYMENT INFORMATION ==========
-    pdf.set_font("Arial", "B", size=10)
-    pdf.set_text_color(34, 139, 34)  # Nature green
-    pdf.cell(0, 6, "PAYMENT INFORMATION", ln=True)
-    pdf.set_text_color(0, 0, 0)
-    pdf.set_font("Arial", size=9)
-    
-    if data.payment_terms:
-        pdf.cell(0, 4, f"Terms: {data.payment_terms}", ln=True)
-    if data.due_date:
-        pdf.cell(0, 4, f"Due Date: {data.due_date}", ln=True)
-    
-    pdf.cell(0, 4, f"Method: {data.payment_provider or data.payment_system.upper()}", ln=True)
-    
-    if data.iban:
-        pdf.cell(0, 4, f"IBAN: {data.iban}", ln=True)
-    if data.swift_bic:
-        pdf.cell(0, 4, f"SWIFT/BIC: {data.swift_bic}", ln=True)
-    if data.bank_name:
-        pdf.cell(0, 4, f"Bank: {data.bank_name}", ln=True)
-    
-    if data.blockchain_tx_id:
-        pdf.cell(0, 4, f"Blockchain TX: {data.blockchain_tx_id}", ln=True)
-    
-    if data.alternative_payment_methods:
-        pdf.set_font("Arial", size=8)
-        pdf.multi_cell(0, 3, f"Other methods: {data.alternative_payment_methods}")
-        pdf.set_font("Arial", size=9)
-    
-    if data.late_payment_clause:
-        pdf.set_font("Arial", "I", size=8)
-        pdf.multi_cell(0, 3, f"Late payment: {data.late_payment_clause}")
-        pdf.set_font("Arial", size=9)
-    
-    pdf.ln(2)
-    
-    # ========== NOTES SECTION ==========
-    if data.notes:
-        pdf.set_font("Arial", "B", size=10)
-        pdf.set_text_color(0, 51, 102)
-        pdf.cell(0, 6, "NOTES", ln=True)
-        pdf.set_text_color(0, 0, 0)
-        pdf.set_font("Arial", size=8)
-        pdf.multi_cell(0, 4, data.notes)
-        pdf.ln(2)
-    
-    # ========== 7️⃣ FOOTER (Universal Legal Safety) ==========
-    pdf.set_font("Arial", "I", size=7)
-    pdf.set_text_color(100, 100, 100)
-    
-    footer_text = data.footer_statement or "This invoice is issued in accordance with applicable international tax regulations."
-    if data.registered_office:
-        footer_text += f" | Registered Office: {data.registered_office}"
-    if data.seller_registration_number:
-        footer_text += f" | Company Reg: {data.seller_registration_number}"
-    
-    pdf.multi_cell(0, 3, footer_text)
-    
-    # Generate PDF
-    pdf_str = pdf.output(dest='S')
-    if isinstance(pdf_str, (bytes, bytearray)):
-        return bytes(pdf_str)
-    return pdf_str.encode('latin-1')
+# Rendering runs in a bounded worker pool (PDF_RENDER_WORKERS / PDF_RENDER_QUEUE)
+pdf_render_pool = pool_from_env()
+
+# Rendered PDFs keyed by a hash of their InvoicePDFRequest fields
+pdf_cache = PDFCache(
+    INVOICE_PDF_DIR / "cache",
+    max_bytes=int(os.getenv("PDF_CACHE_MAX_BYTES", str(256 * 1024 * 1024))),
+    read_only=READ_ONLY_FS,
+)
+
+
+async def render_invoice_pdf_async(data: InvoicePDFRequest) -> bytes:
+    """Render off the event loop. Raises PDFPoolBusy when the render queue is full."""
+    return await pdf_render_pool.render(render_invoice_pdf, data)
+
+
+def _pdf_busy_error(exc: PDFPoolBusy) -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail="PDF renderer is busy, please retry",
+        headers={"Retry-After": str(exc.retry_after)},
+    )
 
 
 def _compute_invoice_totals(items: List[dict]) -> tuple:
@@ -1690,8 +1389,10 @@ async def invoice_pdf(req: InvoicePDFRequest):
     For `web3`, include `blockchain_tx_id` to display the on-chain reference.
     """
     try:
-        pdf_bytes = render_invoice_pdf(req)
+        pdf_bytes = await render_invoice_pdf_async(req)
         return Response(content=pdf_bytes, media_type="application/pdf")
+    except PDFPoolBusy as e:
+        raise _pdf_busy_error(e)
     except Exception as e:
         # Log full exception with traceback so it's visible in container logs
         logger = logging.getLogger("uvicorn.error")
@@ -1701,24 +1402,55 @@ async def invoice_pdf(req: InvoicePDFRequest):
 
 
 # ========== INVOICE NUMBERING HELPERS ==========
-def get_next_invoice_number(merchant_id: int = None) -> str:
-    """Get next sequential invoice number (e.g., INV-2026-0001)."""
-    invoices = load_invoices()
+def _sequence_scope(merchant_id) -> str:
+    return f"merchant:{merchant_id}" if merchant_id is not None else "global"
+
+
+def _sequence_seed(merchant_id, created_by, field: str, prefix: str, year: int):
+    """Highest number already used, for the first reservation of a (merchant, year, prefix) key."""
+    def _seed() -> int:
+        if merchant_id is None and created_by is None:
+            invoices = load_invoices()
+        else:
+            invoices = invoice_store.for_merchant(merchant_id=merchant_id, created_by=created_by)
+        return max_sequence((inv.get(field) for inv in invoices), prefix, year)
+    return _seed
+
+
+def reserve_document_numbers(prefix: str, count: int = 1, merchant_id: int = None, created_by: str = None) -> List[str]:
+    """Reserve `count` consecutive document numbers (e.g. for bulk imports)."""
     year = datetime.now(timezone.utc).year
-    
-    # Find max invoice number for this year
-    max_num = 0
-    for inv in invoices:
-        inv_num = inv.get("invoice_number", "")
-        if inv_num.startswith(f"INV-{year}-"):
-            try:
-                num = int(inv_num.split("-")[-1])
-                if num > max_num:
-                    max_num = num
-            except (ValueError, IndexError):
-                pass
-    
-    return f"INV-{year}-{max_num + 1:04d}"
+    field = "credit_note_number" if prefix == "CN" else "invoice_number"
+    block = sequence_allocator.reserve(
+        _sequence_scope(merchant_id), year, prefix, count,
+        seed=_sequence_seed(merchant_id, created_by, field, prefix, year),
+    )
+    return format_block(prefix, year, block)
+
+
+_DOCUMENT_NUMBER = re.compile(r"^([A-Z]+)-(\d{4})-(\d+)$")
+
+
+def note_manual_document_number(number: str, merchant_id: int = None, created_by: str = None) -> None:
+    """Advance the merchant's counter past a caller-supplied PREFIX-YEAR-NNNN number.
+
+    Otherwise a later allocation could hand out the same number again.
+    Numbers in any other shape can't collide with allocated ones.
+    """
+    m = _DOCUMENT_NUMBER.match(str(number).strip())
+    if not m:
+        return
+    prefix, year, value = m.group(1), int(m.group(2)), int(m.group(3))
+    field = "credit_note_number" if prefix == "CN" else "invoice_number"
+    sequence_allocator.observe(
+        _sequence_scope(merchant_id), year, prefix, value,
+        seed=_sequence_seed(merchant_id, created_by, field, prefix, year),
+    )
+
+
+def get_next_invoice_number(merchant_id: int = None, created_by: str = None) -> str:
+    """Get next sequential invoice number (e.g., INV-2026-0001)."""
+    return reserve_document_numbers("INV", 1, merchant_id, created_by)[0]
 
 
 def calculate_vat(subtotal: float, vat_rate: float = 0) -> tuple:
@@ -1739,23 +1471,9 @@ def calculate_vat(subtotal: float, vat_rate: float = 0) -> tuple:
     return vat_amount, total
 
 
-def create_credit_note_number(merchant_id: int = None) -> str:
+def create_credit_note_number(merchant_id: int = None, created_by: str = None) -> str:
     """Generate credit note number (e.g., CN-2026-0001)."""
-    invoices = load_invoices()
-    year = datetime.now(timezone.utc).year
-    
-    max_num = 0
-    for inv in invoices:
-        cn_num = inv.get("credit_note_number", "")
-        if cn_num.startswith(f"CN-{year}-"):
-            try:
-                num = int(cn_num.split("-")[-1])
-                if num > max_num:
-                    max_num = num
-            except (ValueError, IndexError):
-                pass
-    
-    return f"CN-{year}-{max_num + 1:04d}"
+    return reserve_document_numbers("CN", 1, merchant_id, created_by)[0]
 
 
 @app.post("/invoices", response_model=InvoiceOut, status_code=201)
@@ -1763,13 +1481,15 @@ async def create_invoice(payload: InvoiceCreate, current_user: dict = Depends(ge
     """Create and persist an invoice with automatic numbering and VAT calculation."""
     import uuid
     
-    invoices = load_invoices()
-    
     # Generate unique ID
     unique_id = str(uuid.uuid4())
     
     # Auto-generate invoice number if not provided
-    invoice_number = payload.invoice_number or get_next_invoice_number()
+    if payload.invoice_number:
+        invoice_number = payload.invoice_number
+        note_manual_document_number(invoice_number, current_user.get("id"), current_user.get("name"))
+    else:
+        invoice_number = get_next_invoice_number(current_user.get("id"), current_user.get("name"))
     
     def _to_number(value, default=0.0):
         try:
@@ -1851,9 +1571,8 @@ async def create_invoice(payload: InvoiceCreate, current_user: dict = Depends(ge
         "created_at": datetime.now(timezone.utc).isoformat(),
     }
 
-    invoices.append(inv)
     try:
-        save_invoices(invoices)
+        put_invoice(inv)
     except RuntimeError:
         # Filesystem read-only: continue without persistence (in-memory only)
         pass
@@ -1885,7 +1604,9 @@ async def create_invoice(payload: InvoiceCreate, current_user: dict = Depends(ge
             blockchain_tx_id=inv.get("blockchain_tx_id"),
         )
 
-        pdf_bytes = render_invoice_pdf(pdf_req)
+        # If the pool is saturated the invoice is still created; the PDF is
+        # rendered on first download instead.
+        pdf_bytes = await render_invoice_pdf_async(pdf_req)
         ensure_invoice_pdf_dir()
         if not READ_ONLY_FS and INVOICE_PDF_DIR.exists():
             pdf_path = INVOICE_PDF_DIR / f"invoice-{unique_id}.pdf"
@@ -1899,9 +1620,8 @@ async def create_invoice(payload: InvoiceCreate, current_user: dict = Depends(ge
     inv["pdf_url"] = pdf_url
     
     # Update saved invoice with PDF URL
-    invoices[-1] = inv
     try:
-        save_invoices(invoices)
+        put_invoice(inv)
     except RuntimeError:
         pass
 
@@ -1931,18 +1651,18 @@ async def create_invoice(payload: InvoiceCreate, current_user: dict = Depends(ge
     )
 
 
-@app.get("/invoices", response_model=List[InvoiceOut])
-async def list_invoices(current_user: dict = Depends(get_current_user)):
-    invoices = load_invoices()
-    return [InvoiceOut(**{
+def _invoice_out(inv: dict) -> InvoiceOut:
+    return InvoiceOut(**{
         "id": inv.get("id"),
         "invoice_number": inv.get("invoice_number"),
         "order_number": inv.get("order_number"),
         "seller_name": inv.get("seller_name"),
         "seller_address": inv.get("seller_address"),
+        "seller_country": inv.get("seller_country"),
         "seller_vat": inv.get("seller_vat"),
         "buyer_name": inv.get("buyer_name"),
         "buyer_address": inv.get("buyer_address"),
+        "buyer_country": inv.get("buyer_country"),
         "buyer_vat": inv.get("buyer_vat"),
         "buyer_type": inv.get("buyer_type"),
         "subtotal": inv.get("subtotal", 0),
@@ -1957,17 +1677,238 @@ async def list_invoices(current_user: dict = Depends(get_current_user)):
         "due_date": inv.get("due_date"),
         "notes": inv.get("notes"),
         "merchant_logo_url": inv.get("merchant_logo_url"),
-    }) for inv in invoices]
+    })
 
 
-@app.post("/invoices/{invoice_id}/void")
-async def void_invoice(invoice_id: str, current_user: dict = Depends(get_current_user)):
-    """Mark an invoice as VOID without reusing its number. Only works for non-sent invoices."""
-    invoices = load_invoices()
-    inv = next((i for i in invoices if i.get("id") == invoice_id), None)
-    
-    if not inv:
-        raise HTTPException(status_code=404, detail="Invoice not found")
+@app.get("/invoices")
+async def list_invoices(
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+    status: Optional[str] = None,
+    date_from: Optional[str] = Query(None, alias="from"),
+    date_to: Optional[str] = Query(None, alias="to"),
+    buyer_country: Optional[str] = None,
+    payment_system: Optional[str] = None,
+    fields: Optional[str] = None,
+    current_user: dict = Depends(get_current_user),
+):
+    """List the caller's invoices, newest first (admins see every merchant's).
+
+    Filters: `status`, `from`/`to` (created_at, inclusive, YYYY-MM-DD or ISO),
+    `buyer_country`, `payment_system`. `fields=a,b` limits each item to those
+    InvoiceOut fields (plus `id`).
+
+    Without `limit` the whole list is returned as before. With `limit` the
+    response is `{"items": [...], "next_cursor": ...}`; pass `next_cursor` back
+    as `after` for the next page (it is null on the last page).
+    """
+    try:
+        projection = parse_fields(fields, InvoiceOut.model_fields)
+        after_key = decode_cursor(after) if after else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    where = {}
+    if status:
+        where["status"] = status
+    if buyer_country:
+        where["buyer_country"] = buyer_country.upper()
+    if payment_system:
+        where["payment_system"] = payment_system
+    scope = {}
+    if current_user.get("role") != "admin":
+        scope = {"merchant_id": current_user.get("id"), "created_by": current_user.get("name")}
+
+    page, next_after = invoice_store.page(
+        limit=limit or len(invoice_store) or 1,
+        after=after_key,
+        where=where,
+        created_from=date_from,
+        created_to=date_to,
+        **scope,
+    )
+    items = [project(_invoice_out(inv).model_dump(), projection) for inv in page]
+    if limit is None:
+        return items
+    return {"items": items, "next_cursor": encode_cursor(*next_after) if next_after else None}
+
+
+class _ZipStream:
+    """Write-only sink for zipfile: buffers bytes until the generator drains them."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _export_filename(inv: dict, used: set) -> str:
+    base = re.sub(r"[^A-Za-z0-9._-]+", "_", str(inv.get("invoice_number") or inv.get("id")))
+    name = f"{base}.pdf"
+    if name in used:
+        name = f"{base}-{inv.get('id')}.pdf"
+    used.add(name)
+    return name
+
+
+# How long one export waits for a render slot before giving up on that invoice
+EXPORT_RENDER_WAIT_SECONDS = float(os.getenv("EXPORT_RENDER_WAIT_SECONDS", "30"))
+# Invoices read from the store per step of an export
+EXPORT_PAGE_SIZE = int(os.getenv("EXPORT_PAGE_SIZE", "200"))
+
+
+async def _export_pdf_bytes(inv: dict) -> bytes:
+    """Stored PDF, cached PDF, or a fresh render.
+
+    A saturated pool is retried with backoff for up to
+    EXPORT_RENDER_WAIT_SECONDS, then PDFPoolBusy is raised for this invoice.
+    """
+    if inv.get("pdf_url"):
+        try:
+            return Path(inv["pdf_url"]).read_bytes()
+        except OSError:
+            pass
+    pdf_req = invoice_pdf_request(inv)
+    key = pdf_cache_key(pdf_req.model_dump())
+    pdf_bytes = pdf_cache.get(key)
+    if pdf_bytes is not None:
+        return pdf_bytes
+    deadline = time() + EXPORT_RENDER_WAIT_SECONDS
+    delay = 0.1
+    while True:
+        try:
+            pdf_bytes = await render_invoice_pdf_async(pdf_req)
+            break
+        except PDFPoolBusy as e:
+            remaining = deadline - time()
+            if remaining <= 0:
+                raise
+            # Back off towards the pool's own estimate instead of spinning
+            delay = min(delay * 2, float(e.retry_after), remaining)
+            await asyncio.sleep(delay)
+    try:
+        pdf_cache.put(key, pdf_bytes)
+    except OSError:
+        pass
+    return pdf_bytes
+
+
+async def _export_entry(inv: dict):
+    """(pdf bytes, None), or (None, reason) when this invoice can't be rendered."""
+    try:
+        return await _export_pdf_bytes(inv), None
+    except asyncio.CancelledError:
+        raise
+    except PDFPoolBusy:
+        return None, "PDF renderer stayed busy; export this invoice again later."
+    except Exception as e:
+        logging.getLogger("uvicorn.error").exception("Export: rendering invoice %s failed", inv.get("id"))
+        return None, f"Rendering failed: {type(e).__name__}"
+
+
+@app.get("/invoices/export.zip")
+async def export_invoices_zip(
+    date_from: Optional[str] = Query(None, alias="from"),
+    date_to: Optional[str] = Query(None, alias="to"),
+    status: Optional[str] = None,
+    current_user: dict = Depends(get_current_user),
+):
+    """Stream a ZIP of invoice PDFs issued between `from` and `to` (YYYY-MM-DD, inclusive).
+
+    Invoices are read from the store a page at a time and rendered in parallel
+    through the PDF pool with a bounded window, so memory stays flat no matter
+    how many invoices are exported. Admins export
+    every merchant's invoices; everyone else only their own.
+    """
+    _ensure_invoices_file()
+    scope = {}
+    if current_user.get("role") != "admin":
+        scope = {"merchant_id": current_user.get("id"), "created_by": current_user.get("name")}
+
+    def _selected(inv: dict) -> bool:
+        if inv.get("type") == "credit_note":
+            return False
+        issued = str(inv.get("date_issued") or inv.get("created_at") or "")[:10]
+        if date_from and issued < date_from:
+            return False
+        if date_to and issued > date_to:
+            return False
+        return True
+
+    def _next_page(after):
+        # Only one page of matching invoices is copied out of the store at a time
+        return invoice_store.page(EXPORT_PAGE_SIZE, after=after, where={"status": status} if status else None,
+                                  predicate=_selected, **scope)
+
+    window = max(2, pdf_render_pool.workers * 2)
+    exported = 0
+
+    used_names = set()
+    failed = []
+
+    async def _write(zf, inv, task):
+        name = _export_filename(inv, used_names)
+        pdf_bytes, error = await task
+        if error is None:
+            zf.writestr(name, pdf_bytes)
+        else:
+            # The archive stays valid; the failure is listed next to where the PDF would be
+            failed.append(inv.get("id"))
+            zf.writestr(name[:-len(".pdf")] + ".error.txt", f"Invoice {inv.get('id')}: {error}\n")
+
+    async def _generate():
+        nonlocal exported
+        sink = _ZipStream()
+        pending = deque()
+        try:
+            with zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_STORED) as zf:
+                after = None
+                while True:
+                    invoices, after = await asyncio.to_thread(_next_page, after)
+                    for inv in invoices:
+                        exported += 1
+                        pending.append((inv, asyncio.ensure_future(_export_entry(inv))))
+                        if len(pending) < window:
+                            continue
+                        await _write(zf, *pending.popleft())
+                        yield sink.drain()
+                    if after is None:
+                        break
+                while pending:
+                    await _write(zf, *pending.popleft())
+                    yield sink.drain()
+            yield sink.drain()
+        finally:
+            # Client went away mid-stream: don't keep rendering for nobody
+            for _, task in pending:
+                task.cancel()
+        log_event(f"INVOICES_EXPORTED count={exported} failed={len(failed)}", current_user.get("name"), "-")
+
+    filename = re.sub(r"[^A-Za-z0-9._-]+", "_", f"invoices-{date_from or 'all'}-{date_to or 'all'}.zip")
+    return StreamingResponse(
+        _generate(),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+@app.post("/invoices/{invoice_id}/void")
+async def void_invoice(invoice_id: str, current_user: dict = Depends(get_current_user)):
+    """Mark an invoice as VOID without reusing its number. Only works for non-sent invoices."""
+    inv = get_invoice_record(invoice_id)
+    
+    if not inv:
+        raise HTTPException(status_code=404, detail="Invoice not found")
     
     # Only allow voiding drafted/non-sent invoices
     if inv.get("status") in ["paid", "refunded"]:
@@ -1978,7 +1919,7 @@ async def void_invoice(invoice_id: str, current_user: dict = Depends(get_current
     inv["voided_by"] = current_user.get("name")
     
     try:
-        save_invoices(invoices)
+        put_invoice(inv)
     except RuntimeError:
         pass
     
@@ -1988,14 +1929,12 @@ async def void_invoice(invoice_id: str, current_user: dict = Depends(get_current
 @app.post("/credit-notes", response_model=CreditNoteOut, status_code=201)
 async def create_credit_note(payload: CreditNoteCreate, current_user: dict = Depends(get_current_user)):
     """Create a credit note referencing an original invoice. This handles refunds without modifying the original."""
-    invoices = load_invoices()
-    
     # Find original invoice
-    original_inv = next((i for i in invoices if i.get("id") == payload.invoice_id), None)
+    original_inv = get_invoice_record(payload.invoice_id)
     if not original_inv:
         raise HTTPException(status_code=404, detail="Referenced invoice not found")
     
-    credit_note_num = create_credit_note_number()
+    credit_note_num = create_credit_note_number(current_user.get("id"), current_user.get("name"))
     
     credit_note = {
         "id": str(uuid.uuid4()),
@@ -2016,9 +1955,9 @@ async def create_credit_note(payload: CreditNoteCreate, current_user: dict = Dep
         original_inv["credit_notes"] = []
     original_inv["credit_notes"].append(credit_note_num)
     
-    invoices.append(credit_note)
     try:
-        save_invoices(invoices)
+        put_invoice(original_inv)
+        put_invoice(credit_note)
     except RuntimeError:
         pass
     
@@ -2089,83 +2028,72 @@ async def merchant_usage(request: Request):
         current_user = users[0] if users else {"id": 0, "name": "dev", "role": "user"}
     """Return simple usage statistics for the current merchant/user.
 
-    Aggregates invoices created by the current user (or matching `merchant_id` when present).
+    Aggregates invoices created by the current user (or matching `merchant_id` when present),
+    served from the incrementally maintained usage rollup.
     """
-    invoices = load_invoices()
-
-    merchant_name = current_user.get("name")
-    merchant_id = current_user.get("id")
-
-    # Match either by `created_by` (legacy) or explicit `merchant_id` field
-    my_invoices = [
-        inv for inv in invoices
-        if (inv.get("created_by") == merchant_name) or (merchant_id is not None and inv.get("merchant_id") == merchant_id)
-    ]
-
-    total_invoices = len(my_invoices)
-    web2_invoices = [i for i in my_invoices if (i.get("payment_system") or "web2") == "web2"]
-    web3_invoices = [i for i in my_invoices if i.get("payment_system") == "web3"]
-
-    def _sum_total(lst):
-        try:
-            total = 0.0
-            for i in lst:
-                val = i.get("total", 0)
-                if val is None:
-                    val = 0
-                try:
-                    total += float(str(val).strip())
-                except (ValueError, TypeError):
-                    total += 0.0
-            return round(total, 2)
-        except Exception:
-            return 0.0
-
-    web2_total = _sum_total(web2_invoices)
-    web3_total = _sum_total(web3_invoices)
-    total_amount = _sum_total(my_invoices)
+    _ensure_invoices_file()
+    await asyncio.to_thread(invoice_store.sync)  # apply other workers' writes to the rollup
+    return usage_rollup.usage(merchant_id=current_user.get("id"), created_by=current_user.get("name"))
+
+
+@app.get("/merchant/analytics")
+async def merchant_analytics(
+    granularity: str = "day",
+    group_by: Optional[str] = None,
+    date_from: Optional[str] = Query(None, alias="from"),
+    date_to: Optional[str] = Query(None, alias="to"),
+    currency: Optional[str] = None,
+    provider: Optional[str] = None,
+    buyer_country: Optional[str] = None,
+    status: Optional[str] = None,
+    current_user: dict = Depends(get_current_user),
+):
+    """Invoice count and revenue per hour/day/week/month over any range.
 
-    # Generate daily revenue for last 30 days
-    from datetime import datetime, timedelta
-    today = datetime.now().date()
-    daily_revenue = {}
-    
-    for i in range(30):
-        date = today - timedelta(days=i)
-        daily_revenue[date.strftime("%Y-%m-%d")] = 0.0
-    
-    # Aggregate invoices by date
-    for inv in my_invoices:
-        try:
-            created_at = inv.get("created_at", "")
-            if created_at:
-                # Parse date (format: 2026-02-12 or 2026-02-12T...)
-                date_str = created_at.split("T")[0] if "T" in created_at else created_at[:10]
-                if date_str in daily_revenue:
-                    val = inv.get("total", 0)
-                    if val is None:
-                        val = 0
-                    try:
-                        daily_revenue[date_str] += float(str(val).strip())
-                    except (ValueError, TypeError):
-                        daily_revenue[date_str] += 0.0
-        except Exception:
-            pass
-    
-    # Format as array for chart, sorted by date
-    revenue_data = [
-        {"date": date, "amount": round(amount, 2)}
-        for date, amount in sorted(daily_revenue.items())
-    ]
+    `group_by` takes any of currency, provider, buyer_country, vat_rate and
+    status (comma separated); currency is always included so amounts are never
+    summed across currencies. `from`/`to` are YYYY-MM-DD or ISO (UTC, default
+    the last 30 days) and the other parameters filter on a single value.
+    Admins see every merchant's invoices, everyone else only their own.
+    """
+    requested = [d.strip() for d in (group_by or "").split(",") if d.strip()]
+    dims = ["currency"] + [d for d in dict.fromkeys(requested) if d != "currency"]
+    where = {}
+    if currency:
+        where["currency"] = currency.upper()
+    if provider:
+        where["provider"] = provider
+    if buyer_country:
+        where["buyer_country"] = buyer_country.upper()
+    if status:
+        where["status"] = status
+    try:
+        end = parse_time(date_to, end=True) if date_to else int(datetime.now(timezone.utc).timestamp())
+        start = parse_time(date_from) if date_from else end - 30 * 86400 + 1
+        if start > end:
+            raise ValueError("'from' must not be after 'to'")
+        if granularity not in GRANULARITIES:
+            raise ValueError(f"granularity must be one of {', '.join(GRANULARITIES)}")
+        if period_count(granularity, start, end) > ANALYTICS_MAX_PERIODS:
+            raise ValueError(f"Range spans more than {ANALYTICS_MAX_PERIODS} {granularity} periods")
+        _ensure_invoices_file()
+        await asyncio.to_thread(_sync_analytics)
+        rows = analytics_store.query(
+            start, end, granularity=granularity, group_by=dims, where=where,
+            merchant_id=current_user.get("id"), created_by=current_user.get("name"),
+            scoped=current_user.get("role") != "admin",
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
+    for row in rows:
+        row["amount"] = round(row.pop("amount_cents") / 100, 2)
     return {
-        "total_invoices": total_invoices,
-        "web2_count": len(web2_invoices),
-        "web3_count": len(web3_invoices),
-        "web2_total": web2_total,
-        "web3_total": web3_total,
-        "total_amount": total_amount,
-        "revenue": revenue_data,
+        "granularity": granularity,
+        "from": datetime.fromtimestamp(start, timezone.utc).isoformat(),
+        "to": datetime.fromtimestamp(end, timezone.utc).isoformat(),
+        "group_by": dims,
+        "series": rows,
     }
 
 
@@ -2199,43 +2127,42 @@ async def merchant_me(current_user: dict = Depends(get_current_user)):
 @app.put("/merchant/profile")
 async def update_merchant_profile(payload: dict = Body(...), current_user: dict = Depends(get_current_user)):
     """Update merchant profile information."""
-    users = load_users()
-    user = next((u for u in users if u["id"] == current_user.get("id")), None)
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
+    with users_transaction() as users:
+        user = next((u for u in users if u["id"] == current_user.get("id")), None)
+        if not user:
+            raise HTTPException(status_code=404, detail="User not found")
     
-    # Update allowed fields
-    allowed_fields = [
-        "username", "business_name", "email", "phone_number",
-        "address", "city", "postal_code", "country",
-        "vat_number", "business_type", "website", "description"
-    ]
+        # Update allowed fields
+        allowed_fields = [
+            "username", "business_name", "email", "phone_number",
+            "address", "city", "postal_code", "country",
+            "vat_number", "business_type", "website", "description"
+        ]
     
-    for field in allowed_fields:
-        if field in payload:
-            # Map camelCase to snake_case
-            snake_field = field
-            camel_field = field
+        for field in allowed_fields:
+            if field in payload:
+                # Map camelCase to snake_case
+                snake_field = field
+                camel_field = field
             
-            # Convert camelCase keys from frontend
-            field_mapping = {
-                "businessName": "business_name",
-                "contactEmail": "email",
-                "phoneNumber": "phone_number",
-                "postalCode": "postal_code",
-                "vatNumber": "vat_number",
-                "businessType": "business_type",
-            }
+                # Convert camelCase keys from frontend
+                field_mapping = {
+                    "businessName": "business_name",
+                    "contactEmail": "email",
+                    "phoneNumber": "phone_number",
+                    "postalCode": "postal_code",
+                    "vatNumber": "vat_number",
+                    "businessType": "business_type",
+                }
             
-            if camel_field in field_mapping:
-                snake_field = field_mapping[camel_field]
+                if camel_field in field_mapping:
+                    snake_field = field_mapping[camel_field]
             
-            # Check for both camelCase and snake_case
-            value = payload.get(camel_field) or payload.get(snake_field)
-            if value is not None:
-                user[snake_field] = value
+                # Check for both camelCase and snake_case
+                value = payload.get(camel_field) or payload.get(snake_field)
+                if value is not None:
+                    user[snake_field] = value
     
-    save_users(users)
     return {"message": "Profile updated successfully", "user": user}
 
 
@@ -2344,22 +2271,21 @@ async def create_api_key(payload: APIKeyCreate, current_user: dict = Depends(get
     raw_suffix = secrets.token_urlsafe(24)
     raw = f"{prefix}{raw_suffix}"
 
-    keys = load_api_keys()
-    next_id = (max((k.get("id", 0) for k in keys), default=0) + 1)
     now = datetime.now(timezone.utc).isoformat()
-
-    # Persist the raw key and merchant association
-    new = {
-        "id": next_id,
-        "user_id": current_user.get("id"),
-        "merchant_id": current_user.get("id"),
-        "key": raw,
-        "label": payload.label,
-        "mode": mode,
-        "created_at": now,
-    }
-    keys.append(new)
-    save_api_keys(keys)
+    with api_keys_transaction() as keys:
+        next_id = (max((k.get("id", 0) for k in keys), default=0) + 1)
+
+        # Persist the raw key and merchant association
+        new = {
+            "id": next_id,
+            "user_id": current_user.get("id"),
+            "merchant_id": current_user.get("id"),
+            "key": raw,
+            "label": payload.label,
+            "mode": mode,
+            "created_at": now,
+        }
+        keys.append(new)
 
     # Return raw key once to user
     return {"id": next_id, "key": raw, "label": payload.label, "mode": mode, "created_at": now}
@@ -2370,12 +2296,11 @@ async def revoke_api_key(key_id: int, current_user: dict = Depends(get_current_u
     """Revoke (delete) an API key owned by the current user."""
     if READ_ONLY_FS:
         raise HTTPException(status_code=500, detail="Storage is read-only; cannot delete API keys")
-    keys = load_api_keys()
-    idx = next((i for i, k in enumerate(keys) if k.get("id") == key_id and k.get("user_id") == current_user.get("id")), None)
-    if idx is None:
-        raise HTTPException(status_code=404, detail="API key not found")
-    removed = keys.pop(idx)
-    save_api_keys(keys)
+    with api_keys_transaction() as keys:
+        idx = next((i for i, k in enumerate(keys) if k.get("id") == key_id and k.get("user_id") == current_user.get("id")), None)
+        if idx is None:
+            raise HTTPException(status_code=404, detail="API key not found")
+        removed = keys.pop(idx)
     return {"ok": True, "id": removed.get("id")}
 
 
@@ -2450,8 +2375,7 @@ async def debug_add_api_key(payload: dict = Body(...)):
 
 @app.get("/invoices/{invoice_id}", response_model=InvoiceOut)
 async def get_invoice(invoice_id: str, current_user: dict = Depends(get_current_user)):
-    invoices = load_invoices()
-    inv = next((i for i in invoices if str(i.get("id")) == str(invoice_id)), None)
+    inv = get_invoice_record(invoice_id)
     if not inv:
         raise HTTPException(status_code=404, detail="Invoice not found")
     return InvoiceOut(**{
@@ -2472,11 +2396,16 @@ async def get_invoice(invoice_id: str, current_user: dict = Depends(get_current_
 @app.patch("/invoices/{invoice_id}", response_model=InvoiceOut)
 async def update_invoice(invoice_id: str, payload: InvoiceUpdate, current_user: dict = Depends(get_current_user)):
     """Update an invoice. Recalculates VAT if items are modified. Validates state transitions."""
-    invoices = load_invoices()
-    inv = next((i for i in invoices if str(i.get("id")) == str(invoice_id)), None)
+    inv = get_invoice_record(invoice_id)
     if not inv:
         raise HTTPException(status_code=404, detail="Invoice not found")
     
+    # Remember which cached PDF the current version maps to so it can be dropped
+    try:
+        old_pdf_key = pdf_cache_key(invoice_pdf_request(inv).model_dump())
+    except Exception:
+        old_pdf_key = None
+    
     # State transition validation
     current_status = inv.get("status", "draft")
     new_status = payload.status or current_status
@@ -2555,12 +2484,24 @@ async def update_invoice(invoice_id: str, payload: InvoiceUpdate, current_user:
     inv["updated_at"] = datetime.now(timezone.utc).isoformat()
     inv["updated_by"] = current_user.get("name")
     
+    # The PDF rendered at creation time no longer matches; downloads re-render via the cache
+    stale_pdf = inv.get("pdf_url")
+    inv["pdf_url"] = None
+    
     # Persist
     try:
-        save_invoices(invoices)
+        put_invoice(inv)
     except RuntimeError:
         pass
     
+    if old_pdf_key:
+        pdf_cache.invalidate(old_pdf_key)
+    if stale_pdf and not READ_ONLY_FS and Path(stale_pdf).parent == INVOICE_PDF_DIR:
+        try:
+            Path(stale_pdf).unlink()
+        except OSError:
+            pass
+    
     # Log audit event
     log_event(f"INVOICE_UPDATED id={invoice_id} status={new_status}", current_user.get("name"), "-")
     
@@ -2579,209 +2520,6 @@ async def update_invoice(invoice_id: str, payload: InvoiceUpdate, current_user:
     })
 
 
-# --- Country-Specific VAT & Compliance Database ---
-COUNTRY_VAT_RULES = {
-    "NL": {
-        "name": "Netherlands",
-        "standard_rate": 21.0,
-        "reduced_rates": [9.0],  # Food, books, medicines
-        "oss_threshold": 10000,  # EUR
-        "currency": "EUR",
-        "tax_authority": "Belastingdienst",
-        "vat_return_frequency": "Quarterly",
-        "invoice_requirements": [
-            "Sequential invoice number",
-            "VAT identification number",
-            "Date of supply",
-            "Customer VAT number (B2B)",
-            "Reverse charge notation (EU B2B)"
-        ],
-        "reverse_charge_phrase": "Verlegd naar u - BTW-heffing bij afnemer",
-        "digital_reporting": "Yes - SAF-T required",
-        "record_retention_years": 7,
-    },
-    "DE": {
-        "name": "Germany",
-        "standard_rate": 19.0,
-        "reduced_rates": [7.0],
-        "oss_threshold": 10000,
-        "currency": "EUR",
-        "tax_authority": "Bundeszentralamt für Steuern",
-        "vat_return_frequency": "Monthly/Quarterly",
-        "invoice_requirements": [
-            "Rechnungsnummer (invoice number)",
-            "Steuernummer (tax number)",
-            "Reverse charge: 'Steuerschuldnerschaft des Leistungsempfängers'",
-            "GoBD compliant archiving"
-        ],
-        "reverse_charge_phrase": "Steuerschuldnerschaft des Leistungsempfängers gemäß §13b UStG",
-        "digital_reporting": "Yes - GoBD compliance required",
-        "record_retention_years": 10,
-    },
-    "FR": {
-        "name": "France",
-        "standard_rate": 20.0,
-        "reduced_rates": [10.0, 5.5, 2.1],
-        "oss_threshold": 10000,
-        "currency": "EUR",
-        "tax_authority": "Direction Générale des Finances Publiques (DGFiP)",
-        "vat_return_frequency": "Monthly",
-        "invoice_requirements": [
-            "Numéro de TVA intracommunautaire",
-            "Autoliquidation mention (reverse charge)",
-            "Electronic invoicing mandatory from 2026"
-        ],
-        "reverse_charge_phrase": "Autoliquidation - Article 283-2 du CGI",
-        "digital_reporting": "Yes - E-invoicing mandatory 2026",
-        "record_retention_years": 6,
-    },
-    "BE": {
-        "name": "Belgium",
-        "standard_rate": 21.0,
-        "reduced_rates": [12.0, 6.0],
-        "oss_threshold": 10000,
-        "currency": "EUR",
-        "tax_authority": "FOD Financiën / SPF Finances",
-        "vat_return_frequency": "Monthly/Quarterly",
-        "invoice_requirements": [
-            "BTW-nummer / Numéro de TVA",
-            "Sequential numbering per fiscal year",
-            "Reverse charge: 'Autoliquidation / Verlegde BTW'"
-        ],
-        "reverse_charge_phrase": "Autoliquidation / Verlegde BTW - Art. 51 §2 1° WBTW/CTVA",
-        "digital_reporting": "Yes - Mandatory listing required",
-        "record_retention_years": 7,
-    },
-    "GB": {
-        "name": "United Kingdom",
-        "standard_rate": 20.0,
-        "reduced_rates": [5.0, 0.0],
-        "oss_threshold": 0,  # Post-Brexit: no EU OSS
-        "currency": "GBP",
-        "tax_authority": "HM Revenue & Customs (HMRC)",
-        "vat_return_frequency": "Quarterly",
-        "invoice_requirements": [
-            "VAT registration number",
-            "Unique sequential invoice number",
-            "Making Tax Digital (MTD) compliance",
-            "No reverse charge for EU (post-Brexit)"
-        ],
-        "reverse_charge_phrase": "Reverse charge: Customer to account for VAT",
-        "digital_reporting": "Yes - Making Tax Digital mandatory",
-        "record_retention_years": 6,
-        "special_notes": "Post-Brexit: EU B2B treated as exports (0% VAT with proof)"
-    },
-    "US": {
-        "name": "United States",
-        "standard_rate": 0.0,  # No federal VAT
-        "reduced_rates": [],
-        "oss_threshold": 0,
-        "currency": "USD",
-        "tax_authority": "State-specific (no federal VAT)",
-        "vat_return_frequency": "State-dependent",
-        "invoice_requirements": [
-            "Sales tax varies by state",
-            "Economic nexus rules apply",
-            "Marketplace facilitator laws"
-        ],
-        "reverse_charge_phrase": "N/A - Use tax applies",
-        "digital_reporting": "State-dependent",
-        "record_retention_years": 7,
-        "special_notes": "No VAT - Sales tax system. Each state has different rates (0-10%). Economic nexus: $100k+ or 200+ transactions."
-    },
-    "ES": {
-        "name": "Spain",
-        "standard_rate": 21.0,
-        "reduced_rates": [10.0, 4.0],
-        "oss_threshold": 10000,
-        "currency": "EUR",
-        "tax_authority": "Agencia Tributaria",
-        "vat_return_frequency": "Quarterly/Monthly",
-        "invoice_requirements": [
-            "NIF (tax ID) or VAT number",
-            "Reverse charge: 'Inversión del sujeto pasivo'",
-            "SII (Immediate Supply of Information) for large companies"
-        ],
-        "reverse_charge_phrase": "Inversión del sujeto pasivo - Art. 84.Uno.2º LIVA",
-        "digital_reporting": "Yes - SII for turnover >6M EUR",
-        "record_retention_years": 4,
-    },
-    "IT": {
-        "name": "Italy",
-        "standard_rate": 22.0,
-        "reduced_rates": [10.0, 5.0, 4.0],
-        "oss_threshold": 10000,
-        "currency": "EUR",
-        "tax_authority": "Agenzia delle Entrate",
-        "vat_return_frequency": "Monthly/Quarterly",
-        "invoice_requirements": [
-            "Partita IVA (VAT number)",
-            "SDI (electronic invoicing) mandatory",
-            "Reverse charge: 'Inversione contabile - Reverse charge'"
-        ],
-        "reverse_charge_phrase": "Inversione contabile art. 17 c. 6 DPR 633/72",
-        "digital_reporting": "Yes - FatturaPA (SDI) mandatory",
-        "record_retention_years": 10,
-    },
-    "SE": {
-        "name": "Sweden",
-        "standard_rate": 25.0,
-        "reduced_rates": [12.0, 6.0],
-        "oss_threshold": 10000,
-        "currency": "SEK",
-        "tax_authority": "Skatteverket",
-        "vat_return_frequency": "Monthly",
-        "invoice_requirements": [
-            "Organisationsnummer and VAT number",
-            "Reverse charge: 'Omvänd skattskyldighet'",
-            "Electronic invoicing recommended"
-        ],
-        "reverse_charge_phrase": "Omvänd skattskyldighet enligt 1 kap. 2 § ML",
-        "digital_reporting": "Yes - SIE format for accounting",
-        "record_retention_years": 7,
-    },
-    "PL": {
-        "name": "Poland",
-        "standard_rate": 23.0,
-        "reduced_rates": [8.0, 5.0],
-        "oss_threshold": 10000,
-        "currency": "PLN",
-        "tax_authority": "Krajowa Administracja Skarbowa",
-        "vat_return_frequency": "Monthly",
-        "invoice_requirements": [
-            "NIP number (tax ID)",
-            "KSeF (structured electronic invoices) from 2024",
-            "Split payment mechanism for high-risk goods"
-        ],
-        "reverse_charge_phrase": "Odwrotne obciążenie - Art. 17 ust. 1 pkt 4 Ustawy o VAT",
-        "digital_reporting": "Yes - KSeF mandatory from 2024",
-        "record_retention_years": 5,
-    },
-}
-
-def get_country_vat_info(country_code: str) -> dict:
-    """Get VAT rules for a specific country. Returns generic EU rules if country not found."""
-    country = country_code.upper() if country_code else "XX"
-    
-    if country in COUNTRY_VAT_RULES:
-        return COUNTRY_VAT_RULES[country]
-    
-    # Default EU country rules
-    return {
-        "name": country,
-        "standard_rate": 20.0,
-        "reduced_rates": [10.0],
-        "oss_threshold": 10000,
-        "currency": "EUR",
-        "tax_authority": "Local tax authority",
-        "vat_return_frequency": "Quarterly",
-        "invoice_requirements": ["VAT number", "Sequential numbering", "Reverse charge notation for EU B2B"],
-        "reverse_charge_phrase": "Reverse charge applies - VAT payable by customer",
-        "digital_reporting": "Check local requirements",
-        "record_retention_years": 7,
-    }
-
-
 # --- AI Assistant Endpoint ---
 @app.post("/ai/chat")
 async def ai_chat(payload: dict = Body(...), current_user: dict = Depends(get_current_user)):
@@ -2853,15 +2591,14 @@ async def ai_chat(payload: dict = Body(...), current_user: dict = Depends(get_cu
         should_persist = any(t in low for t in persist_triggers)
         if should_persist and isinstance(current_user, dict) and current_user.get('id'):
             try:
-                users = load_users()
                 changed = False
-                for u in users:
-                    if u.get('id') == current_user.get('id') or u.get('name') == current_user.get('name'):
-                        u['country'] = detected_country
-                        changed = True
-                        break
+                with users_transaction() as users:
+                    for u in users:
+                        if u.get('id') == current_user.get('id') or u.get('name') == current_user.get('name'):
+                            u['country'] = detected_country
+                            changed = True
+                            break
                 if changed:
-                    save_users(users)
                     return {"reply": f"Saved your country as {detected_country} for your account."}
             except Exception as e:
                 print(f"[WARN] Could not persist user country: {e}")
@@ -3730,23 +3467,8 @@ Our platform automates correct VAT calculation for all scenarios."""
 What would you like to know?"""
 
 
-@app.get("/invoices/{invoice_id}/pdf")
-async def download_invoice_pdf(invoice_id: str, current_user: dict = Depends(get_current_user)):
-    invoices = load_invoices()
-    inv = next((i for i in invoices if i.get("id") == invoice_id), None)
-    if not inv:
-        raise HTTPException(status_code=404, detail="Invoice not found")
-
-    # If a stored pdf exists, return it
-    if inv.get("pdf_url"):
-        try:
-            path = Path(inv.get("pdf_url"))
-            if path.exists():
-                return Response(content=path.read_bytes(), media_type="application/pdf")
-        except Exception:
-            pass
-
-    # Generate comprehensive international invoice PDF with all details
+def invoice_pdf_request(inv: dict) -> InvoicePDFRequest:
+    """Map a stored invoice record to the comprehensive international PDF layout."""
     items = inv.get("items", [])
     first_item = items[0] if items else {}
     
@@ -3762,10 +3484,10 @@ async def download_invoice_pdf(invoice_id: str, current_user: dict = Depends(get
     if not tax_treatment and not (is_reverse_charge or is_export or is_outside_scope or tax_exempt_reason):
         tax_treatment = "Tax calculated in accordance with local regulations."
     
-    pdf_req = InvoicePDFRequest(
+    return InvoicePDFRequest(
         # Header
         logo_url=inv.get("logo_url"),
-        invoice_number=inv.get("invoice_number", invoice_id),
+        invoice_number=inv.get("invoice_number", inv.get("id")),
         invoice_date=inv.get("created_at", inv.get("date_issued", "")),
         supply_date=inv.get("supply_date"),
         currency=inv.get("currency", "EUR"),
@@ -3824,8 +3546,157 @@ async def download_invoice_pdf(invoice_id: str, current_user: dict = Depends(get
         footer_statement=inv.get("footer_statement"),
         registered_office=inv.get("registered_office"),
     )
-    pdf_bytes = render_invoice_pdf(pdf_req)
-    return Response(content=pdf_bytes, media_type="application/pdf")
+
+
+def _pdf_response(content: bytes, etag: str) -> Response:
+    return Response(content=content, media_type="application/pdf",
+                    headers={"ETag": etag, "Cache-Control": "private, no-cache"})
+
+
+def _weak(tag: str) -> str:
+    tag = tag.strip()
+    return tag[2:] if tag.startswith("W/") else tag
+
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    """If-None-Match check with weak comparison (RFC 9110 13.1.2): proxies may hand back W/ tags."""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    return header.strip() == "*" or _weak(etag) in [_weak(t) for t in header.split(",")]
+
+
+@app.get("/invoices/{invoice_id}/pdf")
+async def download_invoice_pdf(invoice_id: str, request: Request, current_user: dict = Depends(get_current_user)):
+    inv = get_invoice_record(invoice_id)
+    if not inv:
+        raise HTTPException(status_code=404, detail="Invoice not found")
+
+    # If a stored pdf exists, return it
+    if inv.get("pdf_url"):
+        try:
+            path = Path(inv.get("pdf_url"))
+            st = path.stat()
+            etag = f'"{st.st_size:x}-{st.st_mtime_ns:x}"'
+            if _etag_matches(request, etag):
+                return Response(status_code=304, headers={"ETag": etag})
+            return _pdf_response(path.read_bytes(), etag)
+        except Exception:
+            pass
+
+    # Otherwise serve from the content-addressed cache, rendering on a miss
+    pdf_req = invoice_pdf_request(inv)
+    key = pdf_cache_key(pdf_req.model_dump())
+    etag = f'"{key}"'
+    if _etag_matches(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+
+    pdf_bytes = pdf_cache.get(key)
+    if pdf_bytes is None:
+        try:
+            pdf_bytes = await render_invoice_pdf_async(pdf_req)
+        except PDFPoolBusy as e:
+            raise _pdf_busy_error(e)
+        try:
+            pdf_cache.put(key, pdf_bytes)
+        except OSError as e:
+            print(f"[WARN] Could not cache invoice PDF: {e}")
+    return _pdf_response(pdf_bytes, etag)
+
+
+def _vies_response(vat_number: str, country_code: str, result: dict) -> dict:
+    """Shape a VIESClient result like the /validate-vat response."""
+    if result.get("fault"):
+        return {
+            "valid": False,
+            "vat_number": vat_number,
+            "country": country_code,
+            "message": "✗ Invalid VAT number format. The VAT number does not match the expected format for this country."
+        }
+    if result.get("valid"):
+        return {
+            "valid": True,
+            "vat_number": vat_number,
+            "country": country_code,
+            "company_name": result.get("name") or "Name not provided by VIES",
+            "address": result.get("address") or "Address not provided by VIES",
+            "message": "✓ VAT number is valid and registered in the EU VIES system"
+        }
+    return {
+        "valid": False,
+        "vat_number": vat_number,
+        "country": country_code,
+        "message": "✗ VAT number is not registered in the EU VIES system or is invalid"
+    }
+
+
+def _vies_semaphore(country_code: str) -> asyncio.Semaphore:
+    """Cap on concurrent VIES calls for one member state, across all requests of this worker."""
+    loop = asyncio.get_running_loop()
+    limits = _vies_country_limits.get(loop)
+    if limits is None:
+        limits = _vies_country_limits[loop] = {}
+    semaphore = limits.get(country_code)
+    if semaphore is None:
+        semaphore = limits[country_code] = asyncio.Semaphore(VIES_PER_COUNTRY_CONCURRENCY)
+    return semaphore
+
+
+async def check_vat_number(vat_number: str) -> dict:
+    """Validate a VAT number normalized with `normalize_vat_number` (format, EU membership, then VIES).
+
+    At most VIES_PER_COUNTRY_CONCURRENCY VIES calls per member state run at
+    once in this worker; cache hits never wait for a slot.
+    """
+    # Validate format: should be 2-letter country code + at least 5 digits/letters
+    if len(vat_number) < 7 or not vat_number[:2].isalpha():
+        return {
+            "valid": False,
+            "vat_number": vat_number,
+            "country": vat_number[:2] if len(vat_number) >= 2 else "??",
+            "message": "Invalid VAT format. Expected format: CCNNNNNNNNN (e.g., DE123456789, FR12345678901)"
+        }
+    
+    country_code = vat_number[:2]
+    vat_nr = vat_number[2:]
+    
+    # VIES only works for EU countries, so check if it's an EU code
+    eu_countries = {'AT', 'BE', 'BG', 'HR', 'CY', 'CZ', 'DK', 'EE', 'FI', 'FR', 'DE', 
+                   'GR', 'HU', 'IE', 'IT', 'LV', 'LT', 'LU', 'MT', 'NL', 'PL', 'PT', 
+                   'RO', 'SK', 'SI', 'ES', 'SE', 'GB', 'XI', 'EL', 'GE'}
+    
+    if country_code not in eu_countries:
+        return {
+            "valid": False,
+            "vat_number": vat_number,
+            "country": country_code,
+            "message": f"VIES validation is only available for EU countries. Country '{country_code}' is not in the EU VIES system."
+        }
+    
+    # Ask VIES through the shared client (cached, pooled, circuit-broken)
+    client = get_vies_client()
+    try:
+        result = client.cached(vat_number)
+        if result is None:
+            async with _vies_semaphore(country_code):
+                result = await client.check_async(country_code, vat_nr)
+    except VIESUnavailable as e:
+        if e.fault:
+            # VIES service fault (e.g. member state service temporarily down)
+            return {
+                "valid": False,
+                "vat_number": vat_number,
+                "country": country_code,
+                "message": f"VIES service error: {e.fault}"
+            }
+        # Network error, service unavailable, breaker open, etc.
+        return {
+            "valid": None,
+            "vat_number": vat_number,
+            "country": country_code,
+            "message": f"⚠ Could not reach VIES service. Please try again later. Error: {str(e)}"
+        }
+    return _vies_response(vat_number, country_code, result)
 
 
 @app.post("/validate-vat")
@@ -3850,97 +3721,12 @@ async def validate_vat_number(payload: dict = Body(...), current_user: dict = De
     }
     """
     try:
-        vat_number = (payload.get("vat_number") or "").strip().upper().replace(" ", "")
+        vat_number = normalize_vat_number(payload.get("vat_number") or "")
         
         if not vat_number:
             raise HTTPException(status_code=400, detail="vat_number is required")
         
-        # Validate format: should be 2-letter country code + at least 5 digits/letters
-        if len(vat_number) < 7 or not vat_number[:2].isalpha():
-            return {
-                "valid": False,
-                "vat_number": vat_number,
-                "country": vat_number[:2] if len(vat_number) >= 2 else "??",
-                "message": "Invalid VAT format. Expected format: CCNNNNNNNNN (e.g., DE123456789, FR12345678901)"
-            }
-        
-        country_code = vat_number[:2]
-        vat_nr = vat_number[2:]
-        
-        # VIES only works for EU countries, so check if it's an EU code
-        eu_countries = {'AT', 'BE', 'BG', 'HR', 'CY', 'CZ', 'DK', 'EE', 'FI', 'FR', 'DE', 
-                       'GR', 'HU', 'IE', 'IT', 'LV', 'LT', 'LU', 'MT', 'NL', 'PL', 'PT', 
-                       'RO', 'SK', 'SI', 'ES', 'SE', 'GB', 'XI', 'EL', 'GE'}
-        
-        if country_code not in eu_countries:
-            return {
-                "valid": False,
-                "vat_number": vat_number,
-                "country": country_code,
-                "message": f"VIES validation is only available for EU countries. Country '{country_code}' is not in the EU VIES system."
-            }
-        
-        # Try to connect to VIES service
-        try:
-            from zeep import Client
-            from zeep.exceptions import Fault
-            
-            wsdl_url = "https://ec.europa.eu/taxation_customs/vies/checkVatService.wsdl"
-            client = Client(wsdl=wsdl_url)
-            
-            # Call VIES checkVat service
-            response = client.service.checkVat(countryCode=country_code, vatNumber=vat_nr)
-            
-            # Extract response details
-            is_valid = getattr(response, 'valid', False)
-            company_name = getattr(response, 'name', None)
-            company_address = getattr(response, 'address', None)
-            
-            if is_valid:
-                return {
-                    "valid": True,
-                    "vat_number": vat_number,
-                    "country": country_code,
-                    "company_name": company_name or "Name not provided by VIES",
-                    "address": company_address or "Address not provided by VIES",
-                    "message": "✓ VAT number is valid and registered in the EU VIES system"
-                }
-            else:
-                return {
-                    "valid": False,
-                    "vat_number": vat_number,
-                    "country": country_code,
-                    "message": "✗ VAT number is not registered in the EU VIES system or is invalid"
-                }
-        
-        except Fault as e:
-            # VIES service fault (e.g., invalid format, temporary service issue)
-            error_msg = str(e)
-            if "INVALID_INPUT" in error_msg or "invalid" in error_msg.lower():
-                return {
-                    "valid": False,
-                    "vat_number": vat_number,
-                    "country": country_code,
-                    "message": "✗ Invalid VAT number format. The VAT number does not match the expected format for this country."
-                }
-            else:
-                return {
-                    "valid": False,
-                    "vat_number": vat_number,
-                    "country": country_code,
-                    "message": f"VIES service error: {error_msg}"
-                }
-        
-        except Exception as e:
-            # Network error, service unavailable, etc.
-            import traceback
-            traceback.print_exc()
-            return {
-                "valid": None,
-                "vat_number": vat_number,
-                "country": country_code,
-                "message": f"⚠ Could not reach VIES service. Please try again later. Error: {str(e)}"
-            }
+        return await check_vat_number(vat_number)
     
     except HTTPException:
         raise
@@ -3950,6 +3736,50 @@ async def validate_vat_number(payload: dict = Body(...), current_user: dict = De
         raise HTTPException(status_code=500, detail=f"VAT validation error: {str(e)}")
 
 
+@app.post("/validate-vat/batch")
+async def validate_vat_batch(request: Request, payload: dict = Body(...), current_user: dict = Depends(get_current_user)):
+    """
+    Validate many VAT numbers in one call.
+
+    Request:
+    {
+        "vat_numbers": ["DE123456789", "NL123456789B01", ...],  # up to VAT_BATCH_MAX_SIZE
+        "stream": false   # true (or Accept: application/x-ndjson) streams NDJSON as results arrive
+    }
+
+    Numbers are normalized and deduplicated; cached answers are returned
+    without calling VIES and the rest are checked concurrently, at most
+    VIES_PER_COUNTRY_CONCURRENCY at a time per member state. Each result has
+    the same shape as the /validate-vat response.
+    """
+    raw = payload.get("vat_numbers")
+    if not isinstance(raw, list) or not raw:
+        raise HTTPException(status_code=400, detail="vat_numbers must be a non-empty list")
+    if len(raw) > VAT_BATCH_MAX_SIZE:
+        raise HTTPException(status_code=400, detail=f"At most {VAT_BATCH_MAX_SIZE} VAT numbers per batch")
+
+    unique = list(dict.fromkeys(normalize_vat_number(str(v or "")) for v in raw))
+
+    stream = bool(payload.get("stream")) or "application/x-ndjson" in request.headers.get("accept", "")
+    if not stream:
+        results = await asyncio.gather(*(check_vat_number(v) for v in unique))
+        log_event(f"VAT_BATCH_VALIDATED count={len(unique)}", current_user.get("name"), "-")
+        return {"count": len(results), "duplicates": len(raw) - len(unique), "results": list(results)}
+
+    async def _generate():
+        tasks = [asyncio.ensure_future(check_vat_number(v)) for v in unique]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield json.dumps(await task, ensure_ascii=False) + "\n"
+        finally:
+            # Client went away mid-stream: stop asking VIES for nobody
+            for task in tasks:
+                task.cancel()
+        log_event(f"VAT_BATCH_VALIDATED count={len(unique)}", current_user.get("name"), "-")
+
+    return StreamingResponse(_generate(), media_type="application/x-ndjson")
+
+
 @app.post("/calculate-vat")
 async def vat(data: dict = Body(...)):
     """Calculate VAT for a simple invoice-like payload.
@@ -3966,6 +3796,21 @@ async def vat(data: dict = Body(...)):
         raise HTTPException(status_code=400, detail=str(e))
 
 
+@app.post("/calculate-vat/batch")
+async def vat_batch(data: dict = Body(...)):
+    """Calculate VAT for many invoices at once (large carts, marketplace imports).
+
+    Accepts `invoices` as a list of `/calculate-vat` payloads, or `invoices`
+    plus columnar `lines` ({"invoice", "qty", "unit_price", "vat_rate"} arrays).
+    Per-invoice `subtotal`/`vat_total`/`total` match `/calculate-vat` exactly.
+    """
+    try:
+        from vat_engine import calculate_vat_batch
+        return calculate_vat_batch(data)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
 @app.post("/pdf-hash")
 async def pdf_hash(file: UploadFile = File(...)):
     """Accept a PDF upload and return its SHA256 hash."""
@@ -3989,18 +3834,74 @@ async def admin_list_users(admin: dict = Depends(require_admin)):
 
 
 @app.get("/admin/logs")
-async def get_audit_logs(admin: dict = Depends(require_admin)):
-    """Admin-only: return the most recent audit log lines (up to 100)."""
-    if not AUDIT_LOG_FILE.exists():
-        return {"count": 0, "logs": []}
+async def get_audit_logs(
+    limit: int = Query(100, ge=1, le=1000),
+    event: Optional[str] = None,
+    username: Optional[str] = None,
+    ip: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    admin: dict = Depends(require_admin),
+):
+    """Admin-only: return the most recent audit log lines (up to `limit`, oldest first).
 
-    lines = AUDIT_LOG_FILE.read_text(encoding="utf-8").splitlines()
+    Filters: `event` (event type, e.g. LOGIN_FAIL), `username`, `ip`, and
+    `since`/`until` (inclusive, YYYY-MM-DD or ISO). `count` is the total
+    number of lines in the log.
+    """
+    try:
+        start = parse_time(since) if since else None
+        end = parse_time(until, end=True) if until else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    def read():
+        audit_log_writer.flush()  # include lines still queued in this worker
+        logs = audit_log_file.query(limit=limit, event=event, username=username, ip=ip, since=start, until=end)
+        return audit_log_file.count(), logs
+
+    count, logs = await asyncio.to_thread(read)
     return {
-        "count": len(lines),
-        "logs": lines[-100:]
+        "count": count,
+        "logs": logs
     }
 
 
+@app.post("/admin/usage/rebuild")
+async def rebuild_usage_rollups(admin: dict = Depends(require_admin)):
+    """Admin-only: recompute the /merchant/usage and /merchant/analytics aggregates from all invoices (after backfills/imports).
+
+    Rebuilds this worker only; scripts/rebuild_usage_rollups.py makes every worker rebuild.
+    """
+    _ensure_invoices_file()
+
+    def rebuild():
+        merchants = invoice_store.rebuild_listener(usage_rollup)
+        _attach_analytics()
+        return merchants, invoice_store.rebuild_listener(analytics_store)
+
+    merchants, analytics_rows = await asyncio.to_thread(rebuild)
+    log_event(f"USAGE_ROLLUPS_REBUILT merchants={merchants} analytics_rows={analytics_rows}", admin.get("name"), "-")
+    return {"rebuilt": True, "merchants": merchants, "analytics_rows": analytics_rows}
+
+
+@app.get("/admin/metrics/db")
+async def db_pool_metrics(admin: dict = Depends(require_admin)):
+    """Admin-only: DB connection pool usage and checkout wait times, per engine."""
+    try:
+        from app.db import session as _app_db_session  # noqa: F401  (creates the engine on first use)
+        from app.db.engine import pool_metrics
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=f"Database layer unavailable: {e}")
+    return pool_metrics()
+
+
+@app.get("/admin/metrics/pdf")
+async def pdf_render_metrics(admin: dict = Depends(require_admin)):
+    """Admin-only: PDF render pool saturation, queue wait and render time."""
+    return pdf_render_pool.metrics()
+
+
 @app.get("/admin/users/{user_id}", response_model=PublicUser)
 async def admin_get_user(user_id: int, admin: dict = Depends(require_admin)):
     """Admin-only: return a single user by id."""
@@ -4020,13 +3921,12 @@ async def admin_delete_user(user_id: int, admin: dict = Depends(require_admin)):
     if db_removed:
         return db_removed
 
-    users = load_users()
-    idx = next((i for i, u in enumerate(users) if u["id"] == user_id), None)
-    if idx is None:
-        raise HTTPException(status_code=404, detail="User not found")
+    with users_transaction() as users:
+        idx = next((i for i, u in enumerate(users) if u["id"] == user_id), None)
+        if idx is None:
+            raise HTTPException(status_code=404, detail="User not found")
 
-    removed = users.pop(idx)
-    save_users(users)
+        removed = users.pop(idx)
 
     return {"id": removed["id"], "name": removed["name"], "role": removed.get("role", "user")}
 
@@ -4043,21 +3943,19 @@ async def update_user_role(
     # Try DB update first
     updated = db_update_role(user_id, payload.role)
     if updated:
-        log_event(f"ROLE_CHANGE id={user_id} → {payload.role}", current_user["name"], "-")
+        log_event(f"ROLE_CHANGE id={user_id} → {payload.role}", current_user["name"], "-", sync=True)
         return {"message": f"User {updated['name']} role updated to {payload.role}"}
 
-    users = load_users()
-    for u in users:
-        if u["id"] == user_id:
-            u["role"] = payload.role
-            save_users(users)
-
-            # Audit role change
-            log_event(f"ROLE_CHANGE id={user_id} → {payload.role}", current_user["name"], "-")
+    with users_transaction() as users:
+        u = next((u for u in users if u["id"] == user_id), None)
+        if u is None:
+            raise HTTPException(status_code=404, detail="User not found")
+        u["role"] = payload.role
 
-            return {"message": f"User {u['name']} role updated to {payload.role}"}
+    # Audit role change
+    log_event(f"ROLE_CHANGE id={user_id} → {payload.role}", current_user["name"], "-", sync=True)
 
-    raise HTTPException(status_code=404, detail="User not found")
+    return {"message": f"User {u['name']} role updated to {payload.role}"}
 
 
 # AWS Lambda adapter (Mangum). If Mangum isn't installed this will silently
@@ -4085,11 +3983,11 @@ def checkout(
 
     # Find key from persistent storage
     try:
-        api_keys = load_api_keys()
+        principal = resolve_api_key(x_api_key)
     except Exception:
         return JSONResponse(status_code=500, content={"error": "Failed to load API keys"})
 
-    key = next((k for k in api_keys if k.get("key") == x_api_key), None)
+    key = principal["key"] if principal else None
     # Local dev fallback: allow any key in non-production for quick testing
     if not key and not IS_PROD:
         # Create a temporary key object mapping to merchant_id 1
@@ -4098,11 +3996,6 @@ def checkout(
         return JSONResponse(status_code=403, content={"error": "Invalid API key"})
 
     # Build invoice and persist to invoices.json
-    try:
-        invoices = load_invoices()
-    except Exception:
-        return JSONResponse(status_code=500, content={"error": "Failed to load invoices storage"})
-
     try:
         amount = float(payload.get("amount", 0) or 0)
     except Exception:
@@ -4118,10 +4011,8 @@ def checkout(
         "created_at": datetime.utcnow().isoformat(),
     }
 
-    invoices.append(invoice)
-
     try:
-        save_invoices(invoices)
+        put_invoice(invoice)
     except Exception:
         return JSONResponse(status_code=500, content={"error": "Failed to persist invoice"})
 
@@ -4142,23 +4033,18 @@ def create_session(
         return JSONResponse(status_code=503, content={"error": "Persistence disabled on this server"})
 
     try:
-        api_keys = load_api_keys()
+        principal = resolve_api_key(x_api_key)
     except Exception:
         return JSONResponse(status_code=500, content={"error": "Failed to load API keys"})
 
-    key = next((k for k in api_keys if k.get("key") == x_api_key), None)
+    key = principal["key"] if principal else None
     if not key and not IS_PROD:
         key = {"merchant_id": 1, "key": x_api_key, "mode": "test"}
     if not key:
         return JSONResponse(status_code=403, content={"error": "Invalid API key"})
 
     # Prefer DB-backed sessions when available
-    db_sessions_available = False
-    try:
-        from app.db.sessions import create_session as db_create_session
-        db_sessions_available = True
-    except Exception:
-        db_sessions_available = False
+    db_sessions = _db_session_backend()
 
     try:
         amount = float(payload.get("amount", 0) or 0)
@@ -4195,23 +4081,17 @@ def create_session(
         }
     }
 
-    if db_sessions_available:
+    if db_sessions is not None:
         try:
-            created = db_create_session(session)
+            created = db_sessions.create_session(session)
             return {"success": True, "id": created.get("id"), "url": created.get("url"), "session": created}
         except Exception:
             # Fall back to file-based persistence
             pass
 
     try:
-        sessions = load_sessions()
-    except Exception:
-        return JSONResponse(status_code=500, content={"error": "Failed to load sessions storage"})
-
-    sessions.append(session)
-
-    try:
-        save_sessions(sessions)
+        _ensure_sessions_file()
+        session_store.create_session(session)
     except Exception:
         return JSONResponse(status_code=500, content={"error": "Failed to persist session"})
 
@@ -4220,28 +4100,28 @@ def create_session(
 
 @app.get("/session/{session_id}")
 def get_session(session_id: str):
-    # Try DB-backed lookup first
     try:
-        from app.db.sessions import get_session as db_get_session
-        s = db_get_session(session_id)
-        if s:
-            return {"success": True, "session": s}
-    except Exception:
-        pass
-
-    try:
-        sessions = load_sessions()
+        _, s = find_session(session_id)
     except Exception:
         return JSONResponse(status_code=500, content={"error": "Failed to load sessions storage"})
-
-    s = next((x for x in sessions if x.get("id") == session_id), None)
     if not s:
         return JSONResponse(status_code=404, content={"error": "Session not found"})
     return {"success": True, "session": s}
 
 
+# Merchant display names for the checkout page, rebuilt only when users.json changes
+merchant_names = checkout_page.MerchantNames(users_file)
+
+
+def _encoded_response(content: bytes, media_type: str, headers: dict, encoding: Optional[str]) -> Response:
+    headers = {**headers, "Vary": "Accept-Encoding"}
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(content=content, media_type=media_type, headers=headers)
+
+
 @app.get("/checkout")
-def hosted_checkout(session: str = None):
+def hosted_checkout(request: Request, session: str = None):
         """Hosted checkout page. Renders a simple UI to pay a session.
 
         Query param: ?session=<session_id>
@@ -4249,104 +4129,39 @@ def hosted_checkout(session: str = None):
         if not session:
                 return HTMLResponse("<h1>Missing session</h1>", status_code=400)
 
-        # Try DB-backed lookup first
-        s = None
         try:
-            from app.db.sessions import get_session as db_get_session
-            s = db_get_session(session)
+            _, s = find_session(session)
         except Exception:
-            s = None
-
-        if not s:
-            try:
-                sessions = load_sessions()
-            except Exception:
-                return HTMLResponse("<h1>Failed to load sessions</h1>", status_code=500)
-
-            s = next((x for x in sessions if x.get("id") == session), None)
+            return HTMLResponse("<h1>Failed to load sessions</h1>", status_code=500)
         if not s:
                 return HTMLResponse("<h1>Session not found</h1>", status_code=404)
 
-        # Resolve merchant name if available
-        merchant_name = None
         try:
-                users = load_users()
-                u = next((x for x in users if x.get("id") == s.get("merchant_id")), None)
-                if u:
-                        merchant_name = u.get("name")
+                merchant_name = merchant_names.get(s.get("merchant_id"))
         except Exception:
                 merchant_name = None
-
         if not merchant_name:
                 merchant_name = f"Merchant {s.get('merchant_id')}"
 
-        amount = float(s.get("amount") or 0)
-        success_url = s.get("success_url") or ""
-        cancel_url = s.get("cancel_url") or ""
-
-        # Build HTML by concatenation to avoid f-string brace escaping issues
-        sess_id_js = json.dumps(s.get('id'))
-        success_js = json.dumps(success_url)
-        cancel_js = json.dumps(cancel_url)
-        merchant_escaped = (merchant_name or "").replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
-
-        html = (
-            "<!doctype html>"
-            "<html>"
-            "<head>"
-            "<meta charset=\"utf-8\"/>"
-            "<title>APIBlockchain Checkout</title>"
-            "<meta name=\"viewport\" content=\"width=device-width, initial-scale=1\"/>"
-            "<style>"
-            " :root{--primary:#0b63ff;--bg:#f6f8fb;--text:#071226}"
-            " body{font-family:Arial,Helvetica,sans-serif;background:var(--bg);color:var(--text);padding:20px;margin:0;}"
-            " .box{max-width:520px;margin:32px auto;background:#fff;padding:20px;border-radius:10px;box-shadow:0 8px 24px rgba(7,18,38,0.06);}"
-            " .logo{display:block;margin:0 auto 12px;max-width:160px;}"
-            " h2{color:var(--primary);text-align:center;margin:6px 0 12px;}"
-            " .amount{font-size:1.25rem;margin:8px 0;}"
-            " .actions{margin-top:14px;text-align:center;}"
-            " button{background:var(--primary);color:#fff;border:none;border-radius:8px;padding:10px 16px;margin:6px;cursor:pointer;font-weight:600;}"
-            " button.secondary{background:#fff;color:var(--primary);border:1px solid #e6e9ef;}"
-            " #status{margin-top:12px;text-align:center;color:#093;}"
-            " footer{margin-top:18px;font-size:12px;color:#7b8390;text-align:center;}"
-            "</style>"
-            "</head>"
-            "<body>"
-            "<div class=\"box\">"
-            "<img class=\"logo\" src=\"https://apiblockchain.io/logo.svg\" alt=\"APIBlockchain\"/>"
-            "<h2>Checkout</h2>"
-            "<p><strong>Merchant:</strong> " + merchant_escaped + "</p>"
-            "<p class=\"amount\"><strong>Amount:</strong> $" + f"{amount:.2f}" + "</p>"
-            "<div class=\"actions\">"
-            "<button id=\"pay-web2\">Pay with Card</button>"
-            "<button id=\"pay-web3\" class=\"secondary\">Pay with Crypto</button>"
-            "</div>"
-            "<div id=\"status\"></div>"
-            "<footer><a href=\"https://apiblockchain.io\" target=\"_blank\">Powered by APIBlockchain</a></footer>"
-            "<script>"
-            "const sessionId = " + sess_id_js + ";"
-            "const successUrl = " + success_js + ";"
-            "const cancelUrl = " + cancel_js + ";"
-            "async function complete(payment_system){"
-            "document.getElementById('status').innerText = 'Processing...';"
-            "try{"
-            "const res = await fetch('/session/' + sessionId + '/complete', { method: 'POST', headers: { 'Content-Type': 'application/json' }, body: JSON.stringify({ payment_system }) });"
-            "const data = await res.json();"
-            "if(!res.ok){ document.getElementById('status').innerText = 'Error: ' + (data.error || res.statusText); return; }"
-            "document.getElementById('status').innerText = 'Payment successful';"
-            "try{ window.opener && window.opener.postMessage({ type: 'apiblockchain.checkout_complete', sessionId: sessionId }, '*'); }catch(e){}"
-            "setTimeout(()=>{ if(successUrl) window.location.href = successUrl; else document.getElementById('status').innerText += ' — You may close this window.'; }, 800);"
-            "}catch(e){ document.getElementById('status').innerText = 'Network error'; }"
-            "}"
-            "document.getElementById('pay-web2').addEventListener('click', ()=> complete('web2'));"
-            "document.getElementById('pay-web3').addEventListener('click', ()=> complete('web3'));"
-            "</script>"
-            "</div>"
-            "</body>"
-            "</html>"
-        )
+        body = checkout_page.render_checkout(s, merchant_name).encode("utf-8")
+        encoding = checkout_page.accepted_encoding(request.headers.get("accept-encoding"))
+        return _encoded_response(checkout_page.compress(body, encoding), "text/html; charset=utf-8",
+                                 {"Cache-Control": checkout_page.PAGE_CACHE_CONTROL}, encoding)
 
-        return HTMLResponse(html)
+
+@app.get("/checkout/assets/{name}")
+def checkout_asset(name: str, request: Request):
+    """Stylesheet and script of the checkout page; content-hashed names, cached for a year."""
+    asset = checkout_page.ASSETS.get(name)
+    if asset is None:
+        raise HTTPException(status_code=404, detail="Not found")
+    headers = {"ETag": asset.etag, "Cache-Control": checkout_page.ASSET_CACHE_CONTROL}
+    if _etag_matches(request, asset.etag):
+        return Response(status_code=304, headers={**headers, "Vary": "Accept-Encoding"})
+    encoding = checkout_page.accepted_encoding(request.headers.get("accept-encoding"))
+    if encoding not in asset.encoded:
+        encoding = None
+    return _encoded_response(asset.body(encoding), asset.media_type, headers, encoding)
 
 
 @app.post("/session/{session_id}/complete")
@@ -4358,39 +4173,18 @@ def complete_session(session_id: str, payload: dict = Body(...)):
         if READ_ONLY_FS:
                 return JSONResponse(status_code=503, content={"error": "Persistence disabled on this server"})
 
-        # Try DB-backed lookup first
-        s = None
-        db_available = False
         try:
-            from app.db.sessions import get_session as db_get_session, update_session as db_update_session
-            db_available = True
-            s = db_get_session(session_id)
+            backend, s = find_session(session_id)
         except Exception:
-            s = None
-
+            return JSONResponse(status_code=500, content={"error": "Failed to load sessions storage"})
         if not s:
-            try:
-                sessions = load_sessions()
-            except Exception:
-                return JSONResponse(status_code=500, content={"error": "Failed to load sessions storage"})
-
-            s = next((x for x in sessions if x.get('id') == session_id), None)
-            if not s:
-                return JSONResponse(status_code=404, content={"error": "Session not found"})
-        else:
-            # s found in DB
-            pass
+            return JSONResponse(status_code=404, content={"error": "Session not found"})
 
         # ensure we don't double-pay
         if s.get('status') == 'paid':
                 return {"success": True, "message": "Already paid"}
 
         # create invoice
-        try:
-                invoices = load_invoices()
-        except Exception:
-                return JSONResponse(status_code=500, content={"error": "Failed to load invoices storage"})
-
         invoice = {
                 'id': str(uuid.uuid4()),
                 'merchant_id': s.get('merchant_id'),
@@ -4402,12 +4196,10 @@ def complete_session(session_id: str, payload: dict = Body(...)):
                 'created_at': datetime.utcnow().isoformat(),
         }
 
-        invoices.append(invoice)
-
         # update session (DB or file)
-        if db_available and s and isinstance(s, dict) and s.get('id'):
+        if backend is not session_store:
             try:
-                db_update_session(session_id, {
+                backend.update_session(session_id, {
                     'status': 'paid',
                     'paid_at': datetime.utcnow(),
                     'payment_system': payment_system,
@@ -4415,6 +4207,8 @@ def complete_session(session_id: str, payload: dict = Body(...)):
                 })
             except Exception:
                 return JSONResponse(status_code=500, content={"error": "Failed to persist DB session"})
+            # The file store publishes through its listener; DB sessions don't have one
+            session_events.publish(session_id, session_status(session_id, {**s, 'status': 'paid'}))
         else:
             s['status'] = 'paid'
             s['paid_at'] = datetime.utcnow().isoformat()
@@ -4423,201 +4217,271 @@ def complete_session(session_id: str, payload: dict = Body(...)):
                 s['blockchain_tx_id'] = blockchain_tx_id
 
             try:
-                save_invoices(invoices)
-                save_sessions(sessions)
+                put_invoice(invoice)
+                session_store.update_session(session_id, s)
             except Exception:
                 return JSONResponse(status_code=500, content={"error": "Failed to persist invoice/session"})
 
         # simple audit/event
-        log_event('SESSION_COMPLETED id=' + session_id, '-', '-')
+        log_event('SESSION_COMPLETED id=' + session_id, '-', '-', sync=True)
 
         return {"success": True, "invoice": invoice, "session": s}
 
 
-@app.post('/webhooks/stripe')
-def webhook_stripe(payload: dict = Body(...), request: Request = None):
-    """Stripe webhook: payment_intent.succeeded -> mark session PAID."""
-    if READ_ONLY_FS:
-        return JSONResponse(status_code=503, content={"error": "Persistence disabled"})
-    
-    event_type = payload.get('type', '')
-    if event_type not in ['payment_intent.succeeded', 'charge.completed']:
-        log_event(f'WEBHOOK_STRIPE_IGNORED event_type={event_type}', '-', '-')
-        return {"received": True}
-    
-    intent_data = payload.get('data', {}).get('object', {})
-    session_id = intent_data.get('metadata', {}).get('session_id') or intent_data.get('description', '')
-    
-    if not session_id:
-        log_event('WEBHOOK_STRIPE_NO_SESSION_ID', '-', '-')
-        return JSONResponse(status_code=400, content={"error": "No session_id in webhook"})
-    
-    try:
-        sessions = load_sessions()
-    except Exception as e:
-        return JSONResponse(status_code=500, content={"error": str(e)})
-    
-    session = next((s for s in sessions if s.get('id') == session_id), None)
-    if not session:
-        log_event(f'WEBHOOK_STRIPE_SESSION_NOT_FOUND session_id={session_id[:8]}', '-', '-')
-        return JSONResponse(status_code=404, content={"error": "Session not found"})
-    
-    if session.get('status') in ['paid', 'failed']:
-        return {"success": True, "message": f"Session already in terminal state: {session.get('status')}"}
-    
-    if not validate_payment_state_transition(session.get('status', 'created'), 'paid'):
-        return JSONResponse(status_code=409, content={"error": "Invalid state transition"})
-    
-    session['status'] = 'paid'
-    session['payment_status'] = 'completed'
-    session['paid_at'] = datetime.utcnow().isoformat()
-    session['payment_provider'] = 'stripe'
-    session['stripe_intent_id'] = intent_data.get('id')
-    session['metadata']['webhook_sources'].append('stripe')
-    
-    try:
-        invoices = load_invoices()
-    except Exception:
-        invoices = []
-    
+def _webhook_invoice(event: dict, session: dict):
+    """The invoice a settled webhook issues for `session`, and the amount charged."""
+    provider = event["provider"]
+    session_id = event["session_id"]
+    amount_value = event.get('amount')
+    if amount_value is None:
+        amount_value = session.get('amount')
     invoice = {
         'id': str(uuid.uuid4()),
         'session_id': session_id,
         'merchant_id': session.get('merchant_id'),
-        'amount': session.get('amount'),
-        'mode': session.get('mode', 'test'),
+        'amount': amount_value,
+    }
+    if event.get('currency'):
+        invoice['currency'] = event['currency']
+
+    if event.get('apply_vat'):
+        amount_value = float(amount_value or 0)
+        # Get merchant and buyer countries for VAT calculation
+        merchant_id = session.get('merchant_id')
+        merchant = next((u for u in load_users() if u.get('id') == merchant_id), None)
+        seller_country = merchant.get('country', 'NL') if merchant else 'NL'
+
+        buyer_country = session.get('metadata', {}).get('buyer_country') or session.get('metadata', {}).get('country') or 'NL'
+        buyer_vat = session.get('metadata', {}).get('buyer_vat_number') or session.get('metadata', {}).get('vat_number')
+
+        # Calculate tax (international)
+        vat_rate, is_reverse_charge, vat_explanation = determine_tax_rate(seller_country, buyer_country, buyer_vat)
+        subtotal = amount_value / (1 + vat_rate / 100) if vat_rate > 0 else amount_value
+        invoice.update({
+            'subtotal': round(subtotal, 2),
+            'vat_rate': vat_rate,
+            'vat_amount': round(amount_value - subtotal, 2),
+            'total': amount_value,
+            'amount': amount_value,
+            'seller_country': seller_country,
+            'buyer_country': buyer_country,
+            'buyer_vat': buyer_vat,
+            'is_reverse_charge': is_reverse_charge,
+            'notes': vat_explanation,
+        })
+
+    invoice.update({
+        'mode': session.get('mode', event.get('default_mode', 'test')),
         'status': 'paid',
-        'payment_provider': 'stripe',
-        'stripe_intent_id': intent_data.get('id'),
+        'payment_provider': provider,
         'created_at': datetime.utcnow().isoformat(),
-    }
-    invoices.append(invoice)
-    
+    })
+    invoice.update(event.get('invoice_fields') or {})
+    return invoice, amount_value
+
+
+def settle_webhook_payment(event: dict) -> dict:
+    """Mark a session paid and issue its invoice, for any provider's normalized event.
+
+    `event` comes from one of payment.WEBHOOK_NORMALIZERS. Raises WebhookError
+    with the HTTP status the inline path answers with; `retry=False` for
+    failures a redelivery can't fix.
+
+    Runs under the session store's cross-process lock, so two events for one
+    session (different ids, or different providers) settle it once. The
+    invoice is written before the session is marked paid, and a session that
+    already has one reuses it, so a failed session write is safe to retry.
+    """
+    provider = event["provider"]
+    tag = provider.upper()
+    session_id = event["session_id"]
+
+    with session_store.locked():
+        backend, session = find_session(session_id)
+        if not session:
+            log_event(f'WEBHOOK_{tag}_SESSION_NOT_FOUND session_id={session_id[:8]}', '-', '-')
+            # Retried: the webhook can beat the session write on another worker
+            raise WebhookError(404, "Session not found")
+
+        if session.get('status') in ['paid', 'failed']:
+            return {"success": True, "message": f"Session already in terminal state: {session.get('status')}"}
+
+        if not validate_payment_state_transition(session.get('status', 'created'), 'paid'):
+            raise WebhookError(409, "Invalid state transition", retry=False)
+
+        metadata = dict(session.get('metadata') or {})
+        metadata['webhook_sources'] = list(metadata.get('webhook_sources') or []) + [provider]
+        # Only the changed fields go to update_session; the DB backend can't take the whole dict back
+        changes = {
+            'status': 'paid',
+            'payment_status': 'completed',
+            'paid_at': datetime.utcnow().isoformat(),
+            'payment_provider': provider,
+            **(event.get('session_fields') or {}),
+            'metadata': metadata,
+        }
+        session.update(changes)
+
+        try:
+            # Left by an earlier attempt whose session write failed
+            invoice = next(iter(invoice_store.for_session(session_id)), None)
+            if invoice is None:
+                invoice, amount_value = _webhook_invoice(event, session)
+                put_invoice(invoice)
+            else:
+                amount_value = invoice.get('amount')
+            backend.update_session(session_id, changes)
+        except Exception as e:
+            log_event(f'WEBHOOK_{tag}_PERSIST_FAILED {str(e)[:50]}', '-', '-')
+            raise WebhookError(500, "Failed to persist")
+    if backend is not session_store:
+        session_events.publish(session_id, session_status(session_id, session))
+
     api_key = auto_unlock_api_keys(session.get('merchant_id'), session)
     access_link = generate_customer_access_link(session_id, session.get('merchant_id'))
-    
-    try:
-        save_sessions(sessions)
-        save_invoices(invoices)
-    except Exception as e:
-        log_event(f'WEBHOOK_STRIPE_PERSIST_FAILED {str(e)[:50]}', '-', '-')
-        return JSONResponse(status_code=500, content={"error": "Failed to persist"})
-    
-    log_event(f'WEBHOOK_STRIPE_SUCCESS session_id={session_id[:8]} amount={session.get("amount")}', '-', '-')
-    
-    return {
+
+    detail = f"amount={amount_value}" + (f" {event['currency']}" if event.get('currency') else '')
+    if event.get('tx_id'):
+        detail += f" tx_id={str(event['tx_id'])[:16]}"
+    log_event(f'WEBHOOK_{tag}_SUCCESS session_id={session_id[:8]} {detail}', '-', '-', sync=True)
+
+    result = {
         "success": True,
         "session_id": session_id,
         "invoice": invoice,
         "api_key_generated": api_key.get('id'),
         "customer_access": access_link,
     }
+    if provider == 'web3':
+        result["blockchain_tx"] = event.get('tx_id')
+    return result
+
+
+def process_webhook_event(provider: str, payload: dict) -> dict:
+    """Normalize one provider payload and settle it (the queue worker's handler)."""
+    if not isinstance(payload, dict):
+        raise WebhookError(400, "Webhook body must be a JSON object", retry=False)
+    event = WEBHOOK_NORMALIZERS[provider](payload)
+    if not event.get("processed"):
+        if event.get("reason", "").startswith("Ignored event type"):
+            log_event(f'WEBHOOK_{provider.upper()}_IGNORED event_type={event.get("event_type")}', '-', '-')
+            return {"received": True}
+        log_event(f'WEBHOOK_{provider.upper()}_NO_SESSION_ID', '-', '-')
+        raise WebhookError(400, event.get("reason", "Unprocessable webhook"), retry=False)
+    return settle_webhook_payment(event)
+
+
+# Webhooks are verified, written to a durable SQLite queue and acknowledged;
+# a worker pool per process settles them (webhook_queue.py). The pool starts
+# when the app starts in each worker process, so events left queued from
+# before a restart are settled without waiting for new provider traffic, and
+# stops on shutdown. WEBHOOK_ASYNC=0 settles inline before
+# answering, as before. Either way, provider redeliveries of an event id seen
+# in the last WEBHOOK_DEDUP_SECONDS are acknowledged and dropped.
+WEBHOOK_ASYNC = os.getenv("WEBHOOK_ASYNC", "1").lower() in ("1", "true", "yes")
+webhook_queue = None
+webhook_workers = None
+if not READ_ONLY_FS:
+    try:
+        from app.db.engine import get_engine as _get_engine
+        webhook_queue = WebhookQueue(
+            _get_engine(os.getenv("WEBHOOK_QUEUE_URL") or f"sqlite:///{DATA_DIR / 'webhook_queue.db'}"),
+            max_pending=int(os.getenv("WEBHOOK_MAX_PENDING", "10000")),
+            max_attempts=int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "8")),
+            dedup_seconds=float(os.getenv("WEBHOOK_DEDUP_SECONDS", str(7 * 86400))),
+        )
+        webhook_workers = WebhookWorkerPool(
+            webhook_queue, process_webhook_event, workers=int(os.getenv("WEBHOOK_WORKERS", "4")))
+    except Exception as e:
+        print(f"[WARN] Webhook queue unavailable ({e}); settling webhooks inline")
 
 
-@app.post('/webhooks/paypal')
-def webhook_paypal(payload: dict = Body(...), request: Request = None):
-    """PayPal webhook: PAYMENT.CAPTURE.COMPLETED -> mark session PAID."""
+@app.on_event("startup")
+def start_webhook_workers() -> None:
+    # Runs in every worker process (after any gunicorn fork), so each gets its own threads
+    if webhook_workers is not None:
+        webhook_workers.start()
+
+
+@app.on_event("shutdown")
+def stop_webhook_workers() -> None:
+    if webhook_workers is not None:
+        webhook_workers.close()
+
+
+def _verify_coinbase_signature(request: Request, body: bytes) -> bool:
+    if not COINBASE_WEBHOOK_SECRET:
+        return True
+    import hmac
+    signature = request.headers.get('X-CC-Webhook-Signature', '')
+    expected_sig = hmac.new(COINBASE_WEBHOOK_SECRET.encode('utf-8'), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(signature, expected_sig)
+
+
+async def ingest_webhook(provider: str, request: Request):
+    """Verify a provider webhook, queue it durably and acknowledge (or settle inline)."""
     if READ_ONLY_FS:
         return JSONResponse(status_code=503, content={"error": "Persistence disabled"})
-    
-    event_type = payload.get('event_type', '')
-    if event_type != 'PAYMENT.CAPTURE.COMPLETED':
-        log_event(f'WEBHOOK_PAYPAL_IGNORED event_type={event_type}', '-', '-')
-        return {"received": True}
-    
-    resource = payload.get('resource', {})
-    session_id = resource.get('custom_id') or resource.get('invoice_id', '')
-    
-    if not session_id:
-        log_event('WEBHOOK_PAYPAL_NO_SESSION_ID', '-', '-')
-        return JSONResponse(status_code=400, content={"error": "No session_id in webhook"})
-    
+
+    # Raw body: it is what gets signed, and what is queued
+    body = await request.body()
+    if provider == 'coinbase' and not _verify_coinbase_signature(request, body):
+        log_event('WEBHOOK_COINBASE_INVALID_SIGNATURE', '-', '-')
+        return JSONResponse(status_code=401, content={"error": "Invalid signature"})
     try:
-        sessions = load_sessions()
+        payload = json.loads(body.decode('utf-8'))
     except Exception as e:
-        return JSONResponse(status_code=500, content={"error": str(e)})
-    
-    session = next((s for s in sessions if s.get('id') == session_id), None)
-    if not session:
-        log_event(f'WEBHOOK_PAYPAL_SESSION_NOT_FOUND session_id={session_id[:8]}', '-', '-')
-        return JSONResponse(status_code=404, content={"error": "Session not found"})
-    
-    if session.get('status') in ['paid', 'failed']:
-        return {"success": True, "message": f"Session already in terminal state: {session.get('status')}"}
-    
-    if not validate_payment_state_transition(session.get('status', 'created'), 'paid'):
-        return JSONResponse(status_code=409, content={"error": "Invalid state transition"})
-    
-    session['status'] = 'paid'
-    session['payment_status'] = 'completed'
-    session['paid_at'] = datetime.utcnow().isoformat()
-    session['payment_provider'] = 'paypal'
-    session['paypal_capture_id'] = resource.get('id')
-    session['metadata']['webhook_sources'].append('paypal')
-    
-    try:
-        invoices = load_invoices()
-    except Exception:
-        invoices = []
-    
-    amount_value = float(resource.get('amount', {}).get('value', session.get('amount', 0)))
-    
-    # Get merchant and buyer countries for VAT calculation
-    merchant_id = session.get('merchant_id')
-    users = load_users()
-    merchant = next((u for u in users if u.get('id') == merchant_id), None)
-    seller_country = merchant.get('country', 'NL') if merchant else 'NL'
-    
-    buyer_country = session.get('metadata', {}).get('buyer_country') or session.get('metadata', {}).get('country') or 'NL'
-    buyer_vat = session.get('metadata', {}).get('buyer_vat_number') or session.get('metadata', {}).get('vat_number')
-    
-    # Calculate tax (international)
-    vat_rate, is_reverse_charge, vat_explanation = determine_tax_rate(seller_country, buyer_country, buyer_vat)
-    subtotal = amount_value / (1 + vat_rate / 100) if vat_rate > 0 else amount_value
-    vat_amount = amount_value - subtotal
-    
-    invoice = {
-        'id': str(uuid.uuid4()),
-        'session_id': session_id,
-        'merchant_id': session.get('merchant_id'),
-        'subtotal': round(subtotal, 2),
-        'vat_rate': vat_rate,
-        'vat_amount': round(vat_amount, 2),
-        'total': amount_value,
-        'amount': amount_value,
-        'currency': resource.get('amount', {}).get('currency_code', 'EUR'),
-        'seller_country': seller_country,
-        'buyer_country': buyer_country,
-        'buyer_vat': buyer_vat,
-        'is_reverse_charge': is_reverse_charge,
-        'mode': session.get('mode', 'test'),
-        'status': 'paid',
-        'payment_provider': 'paypal',
-        'paypal_capture_id': resource.get('id'),
-        'created_at': datetime.utcnow().isoformat(),
-        'notes': vat_explanation,
-    }
-    invoices.append(invoice)
-    
-    api_key = auto_unlock_api_keys(session.get('merchant_id'), session)
-    access_link = generate_customer_access_link(session_id, session.get('merchant_id'))
-    
+        return JSONResponse(status_code=400, content={"error": f"Invalid JSON: {str(e)}"})
+    if not isinstance(payload, dict):
+        return JSONResponse(status_code=400, content={"error": "Webhook body must be a JSON object"})
+
+    # Redeliveries share the provider's event id; without one, an identical body is the same event
+    event_key = webhook_event_key(provider, payload) or 'sha256:' + hashlib.sha256(body).hexdigest()
+
+    if webhook_queue is None:
+        try:
+            return await asyncio.to_thread(process_webhook_event, provider, payload)
+        except WebhookError as e:
+            return JSONResponse(status_code=e.status_code, content={"error": e.message})
+
+    # A retry burst against this worker is answered from memory, on the event loop
+    if webhook_queue.dedup.seen_locally(provider, event_key):
+        return {"received": True, "duplicate": True}
+
+    if not WEBHOOK_ASYNC:
+        if not await asyncio.to_thread(webhook_queue.dedup.claim, provider, event_key):
+            return {"received": True, "duplicate": True}
+        try:
+            return await asyncio.to_thread(process_webhook_event, provider, payload)
+        except WebhookError as e:
+            if e.retry:
+                await asyncio.to_thread(webhook_queue.dedup.release, provider, event_key)
+            return JSONResponse(status_code=e.status_code, content={"error": e.message})
+        except Exception:
+            await asyncio.to_thread(webhook_queue.dedup.release, provider, event_key)
+            raise
+
     try:
-        save_sessions(sessions)
-        save_invoices(invoices)
-    except Exception as e:
-        log_event(f'WEBHOOK_PAYPAL_PERSIST_FAILED {str(e)[:50]}', '-', '-')
-        return JSONResponse(status_code=500, content={"error": "Failed to persist"})
-    
-    log_event(f'WEBHOOK_PAYPAL_SUCCESS session_id={session_id[:8]} amount={amount_value}', '-', '-')
-    
-    return {
-        "success": True,
-        "session_id": session_id,
-        "invoice": invoice,
-        "api_key_generated": api_key.get('id'),
-        "customer_access": access_link,
-    }
+        queue_id = await asyncio.to_thread(webhook_queue.enqueue, provider, body, event_key)
+    except QueueFull:
+        return JSONResponse(status_code=503, headers={"Retry-After": "30"},
+                            content={"error": "Webhook queue is full, retry later"})
+    if queue_id is None:
+        return {"received": True, "duplicate": True}
+    webhook_workers.wake()
+    return {"received": True, "queued": queue_id}
+
+
+@app.post('/webhooks/stripe')
+async def webhook_stripe(request: Request):
+    """Stripe webhook: payment_intent.succeeded -> mark session PAID."""
+    return await ingest_webhook('stripe', request)
+
+
+@app.post('/webhooks/paypal')
+async def webhook_paypal(request: Request):
+    """PayPal webhook: PAYMENT.CAPTURE.COMPLETED -> mark session PAID."""
+    return await ingest_webhook('paypal', request)
 
 
 @app.post('/api/coinbase/create-charge')
@@ -4688,329 +4552,101 @@ def create_coinbase_charge(data: dict = Body(...)):
 async def webhook_coinbase(request: Request):
     """
     Coinbase Commerce webhook handler.
-    Handles charge:confirmed, charge:failed, charge:pending events.
+    Settles charge:confirmed events; the signature is checked before queueing.
     """
-    if READ_ONLY_FS:
-        return JSONResponse(status_code=503, content={"error": "Persistence disabled"})
-    
-    import hmac
-    import hashlib
-    
-    # Get raw body for signature verification
-    body = await request.body()
-    
-    # Verify webhook signature if secret is configured
-    if COINBASE_WEBHOOK_SECRET:
-        signature = request.headers.get('X-CC-Webhook-Signature', '')
-        expected_sig = hmac.new(
-            COINBASE_WEBHOOK_SECRET.encode('utf-8'),
-            body,
-            hashlib.sha256
-        ).hexdigest()
-        
-        if not hmac.compare_digest(signature, expected_sig):
-            log_event('WEBHOOK_COINBASE_INVALID_SIGNATURE', '-', '-')
-            return JSONResponse(status_code=401, content={"error": "Invalid signature"})
-    
-    try:
-        payload = json.loads(body.decode('utf-8'))
-    except Exception as e:
-        return JSONResponse(status_code=400, content={"error": f"Invalid JSON: {str(e)}"})
-    
-    event_type = payload.get('event', {}).get('type', '')
-    event_data = payload.get('event', {}).get('data', {})
-    
-    # Only process confirmed charges
-    if event_type != 'charge:confirmed':
-        log_event(f'WEBHOOK_COINBASE_IGNORED event_type={event_type}', '-', '-')
-        return {"received": True}
-    
-    metadata = event_data.get('metadata', {})
-    session_id = metadata.get('session_id', '')
-    
-    if not session_id:
-        log_event('WEBHOOK_COINBASE_NO_SESSION_ID', '-', '-')
-        return JSONResponse(status_code=400, content={"error": "No session_id in metadata"})
-    
-    try:
-        sessions = load_sessions()
-    except Exception as e:
-        return JSONResponse(status_code=500, content={"error": str(e)})
-    
-    session = next((s for s in sessions if s.get('id') == session_id), None)
-    if not session:
-        log_event(f'WEBHOOK_COINBASE_SESSION_NOT_FOUND session_id={session_id[:8]}', '-', '-')
-        return JSONResponse(status_code=404, content={"error": "Session not found"})
-    
-    if session.get('status') in ['paid', 'failed']:
-        return {"success": True, "message": f"Session already in terminal state: {session.get('status')}"}
-    
-    if not validate_payment_state_transition(session.get('status', 'created'), 'paid'):
-        return JSONResponse(status_code=409, content={"error": "Invalid state transition"})
-    
-    # Update session
-    session['status'] = 'paid'
-    session['payment_status'] = 'completed'
-    session['paid_at'] = datetime.utcnow().isoformat()
-    session['payment_provider'] = 'coinbase'
-    session['coinbase_charge_id'] = event_data.get('id')
-    session['metadata']['webhook_sources'].append('coinbase')
-    
-    # Get payment details
-    pricing = event_data.get('pricing', {})
-    local_price = pricing.get('local', {})
-    amount_value = float(local_price.get('amount', session.get('amount', 0)))
-    currency = local_price.get('currency', 'EUR')
-    
-    # Get crypto payment details
-    payments = event_data.get('payments', [])
-    crypto_payment = payments[0] if payments else {}
-    
-    # Get merchant and buyer countries for VAT calculation
-    merchant_id = session.get('merchant_id')
-    users = load_users()
-    merchant = next((u for u in users if u.get('id') == merchant_id), None)
-    seller_country = merchant.get('country', 'NL') if merchant else 'NL'
-    
-    buyer_country = session.get('metadata', {}).get('buyer_country') or session.get('metadata', {}).get('country') or 'NL'
-    buyer_vat = session.get('metadata', {}).get('buyer_vat_number') or session.get('metadata', {}).get('vat_number')
-    
-    # Calculate tax (international)
-    vat_rate, is_reverse_charge, vat_explanation = determine_tax_rate(seller_country, buyer_country, buyer_vat)
-    subtotal = amount_value / (1 + vat_rate / 100) if vat_rate > 0 else amount_value
-    vat_amount = amount_value - subtotal
-    
-    try:
-        invoices = load_invoices()
-    except Exception:
-        invoices = []
-    
-    invoice = {
-        'id': str(uuid.uuid4()),
-        'session_id': session_id,
-        'merchant_id': session.get('merchant_id'),
-        'subtotal': round(subtotal, 2),
-        'vat_rate': vat_rate,
-        'vat_amount': round(vat_amount, 2),
-        'total': amount_value,
-        'amount': amount_value,
-        'currency': currency,
-        'seller_country': seller_country,
-        'buyer_country': buyer_country,
-        'buyer_vat': buyer_vat,
-        'is_reverse_charge': is_reverse_charge,
-        'mode': session.get('mode', 'live'),
-        'status': 'paid',
-        'payment_provider': 'coinbase',
-        'coinbase_charge_id': event_data.get('id'),
-        'crypto_amount': crypto_payment.get('value', {}).get('crypto', {}).get('amount'),
-        'crypto_currency': crypto_payment.get('value', {}).get('crypto', {}).get('currency'),
-        'transaction_id': crypto_payment.get('transaction_id'),
-        'created_at': datetime.utcnow().isoformat(),
-        'notes': vat_explanation,
-    }
-    invoices.append(invoice)
-    
-    api_key = auto_unlock_api_keys(session.get('merchant_id'), session)
-    access_link = generate_customer_access_link(session_id, session.get('merchant_id'))
-    
-    try:
-        save_sessions(sessions)
-        save_invoices(invoices)
-    except Exception as e:
-        log_event(f'WEBHOOK_COINBASE_PERSIST_FAILED {str(e)[:50]}', '-', '-')
-        return JSONResponse(status_code=500, content={"error": "Failed to persist"})
-    
-    log_event(f'WEBHOOK_COINBASE_SUCCESS session_id={session_id[:8]} amount={amount_value} {currency}', '-', '-')
-    
-    return {
-        "success": True,
-        "session_id": session_id,
-        "invoice": invoice,
-        "api_key_generated": api_key.get('id'),
-        "customer_access": access_link,
-    }
-
+    return await ingest_webhook('coinbase', request)
 
 
 @app.post('/webhooks/onecom')
-def webhook_onecom(payload: dict = Body(...), request: Request = None):
+async def webhook_onecom(request: Request):
     """One.com webhook: payment.completed -> mark session PAID."""
-    if READ_ONLY_FS:
-        return JSONResponse(status_code=503, content={"error": "Persistence disabled"})
-    
-    event = payload.get('event', '')
-    if event != 'payment.completed':
-        log_event(f'WEBHOOK_ONECOM_IGNORED event={event}', '-', '-')
-        return {"received": True}
-    
-    session_id = payload.get('reference')
-    if not session_id:
-        log_event('WEBHOOK_ONECOM_NO_REFERENCE', '-', '-')
-        return JSONResponse(status_code=400, content={"error": "No reference (session_id) in webhook"})
-    
-    try:
-        sessions = load_sessions()
-    except Exception as e:
-        return JSONResponse(status_code=500, content={"error": str(e)})
-    
-    session = next((s for s in sessions if s.get('id') == session_id), None)
-    if not session:
-        log_event(f'WEBHOOK_ONECOM_SESSION_NOT_FOUND session_id={session_id[:8]}', '-', '-')
-        return JSONResponse(status_code=404, content={"error": "Session not found"})
-    
-    if session.get('status') in ['paid', 'failed']:
-        return {"success": True, "message": f"Session already in terminal state: {session.get('status')}"}
-    
-    if not validate_payment_state_transition(session.get('status', 'created'), 'paid'):
-        return JSONResponse(status_code=409, content={"error": "Invalid state transition"})
-    
-    session['status'] = 'paid'
-    session['payment_status'] = 'completed'
-    session['paid_at'] = datetime.utcnow().isoformat()
-    session['payment_provider'] = 'onecom'
-    session['onecom_txn_id'] = payload.get('payload', {}).get('txn_id')
-    session['metadata']['webhook_sources'].append('onecom')
-    
-    try:
-        invoices = load_invoices()
-    except Exception:
-        invoices = []
-    
-    invoice = {
-        'id': str(uuid.uuid4()),
-        'session_id': session_id,
-        'merchant_id': session.get('merchant_id'),
-        'amount': payload.get('amount', session.get('amount')),
-        'currency': payload.get('currency', 'USD'),
-        'mode': session.get('mode', 'test'),
-        'status': 'paid',
-        'payment_provider': 'onecom',
-        'onecom_txn_id': payload.get('payload', {}).get('txn_id'),
-        'created_at': datetime.utcnow().isoformat(),
-    }
-    invoices.append(invoice)
-    
-    api_key = auto_unlock_api_keys(session.get('merchant_id'), session)
-    access_link = generate_customer_access_link(session_id, session.get('merchant_id'))
-    
-    try:
-        save_sessions(sessions)
-        save_invoices(invoices)
-    except Exception as e:
-        log_event(f'WEBHOOK_ONECOM_PERSIST_FAILED {str(e)[:50]}', '-', '-')
-        return JSONResponse(status_code=500, content={"error": "Failed to persist"})
-    
-    log_event(f'WEBHOOK_ONECOM_SUCCESS session_id={session_id[:8]} amount={payload.get("amount")}', '-', '-')
-    
-    return {
-        "success": True,
-        "session_id": session_id,
-        "invoice": invoice,
-        "api_key_generated": api_key.get('id'),
-        "customer_access": access_link,
-    }
+    return await ingest_webhook('onecom', request)
 
 
 @app.post('/webhooks/web3')
-def webhook_web3(payload: dict = Body(...), request: Request = None):
+async def webhook_web3(request: Request):
     """Web3 webhook: blockchain payment verification."""
-    if READ_ONLY_FS:
-        return JSONResponse(status_code=503, content={"error": "Persistence disabled"})
-    
-    event = payload.get('event', '')
-    if event not in ['payment.confirmed', 'transfer.confirmed']:
-        log_event(f'WEBHOOK_WEB3_IGNORED event={event}', '-', '-')
-        return {"received": True}
-    
-    session_id = payload.get('session_id')
-    if not session_id:
-        return JSONResponse(status_code=400, content={"error": "No session_id"})
-    
-    try:
-        sessions = load_sessions()
-    except Exception as e:
-        return JSONResponse(status_code=500, content={"error": str(e)})
-    
-    session = next((s for s in sessions if s.get('id') == session_id), None)
-    if not session:
-        return JSONResponse(status_code=404, content={"error": "Session not found"})
-    
-    if session.get('status') in ['paid', 'failed']:
-        return {"success": True, "message": f"Already in {session.get('status')}"}
-    
-    if not validate_payment_state_transition(session.get('status', 'created'), 'paid'):
-        return JSONResponse(status_code=409, content={"error": "Invalid state transition"})
-    
-    session['status'] = 'paid'
-    session['payment_status'] = 'completed'
-    session['paid_at'] = datetime.utcnow().isoformat()
-    session['payment_provider'] = 'web3'
-    session['blockchain_tx_id'] = payload.get('blockchain_tx_id')
-    session['blockchain_network'] = payload.get('network')
-    session['metadata']['webhook_sources'].append('web3')
-    
-    try:
-        invoices = load_invoices()
-    except Exception:
-        invoices = []
-    
-    invoice = {
-        'id': str(uuid.uuid4()),
-        'session_id': session_id,
-        'merchant_id': session.get('merchant_id'),
-        'amount': payload.get('amount', session.get('amount')),
-        'mode': session.get('mode', 'test'),
-        'status': 'paid',
-        'payment_provider': 'web3',
-        'blockchain_tx_id': payload.get('blockchain_tx_id'),
-        'blockchain_network': payload.get('network'),
-        'created_at': datetime.utcnow().isoformat(),
-    }
-    invoices.append(invoice)
-    
-    api_key = auto_unlock_api_keys(session.get('merchant_id'), session)
-    access_link = generate_customer_access_link(session_id, session.get('merchant_id'))
-    
-    try:
-        save_sessions(sessions)
-        save_invoices(invoices)
-    except Exception as e:
-        return JSONResponse(status_code=500, content={"error": str(e)})
-    
-    log_event(f'WEBHOOK_WEB3_SUCCESS session_id={session_id[:8]} tx_id={payload.get("blockchain_tx_id")[:16]}', '-', '-')
-    
-    return {
-        "success": True,
-        "session_id": session_id,
-        "invoice": invoice,
-        "api_key_generated": api_key.get('id'),
-        "customer_access": access_link,
-        "blockchain_tx": payload.get('blockchain_tx_id'),
-    }
+    return await ingest_webhook('web3', request)
+
+
+@app.get('/admin/webhooks/stats')
+async def webhook_stats(admin: dict = Depends(require_admin)):
+    """Admin-only: webhook queue depth and lag per provider."""
+    if webhook_workers is None:
+        return {"async": False, "workers": 0, "providers": {}}
+    stats = await asyncio.to_thread(webhook_workers.stats)
+    return {"async": WEBHOOK_ASYNC, **stats}
 
 
 @app.get('/session/{session_id}/status')
 def get_session_status(session_id: str):
     """Public endpoint to check session payment status."""
     try:
-        sessions = load_sessions()
+        _, session = find_session(session_id)
     except Exception:
         return JSONResponse(status_code=500, content={"error": "Failed to load sessions"})
-    
-    session = next((s for s in sessions if s.get('id') == session_id), None)
     if not session:
         return JSONResponse(status_code=404, content={"error": "Session not found"})
     
-    return {
-        "session_id": session_id,
-        "status": session.get('status'),
-        "payment_status": session.get('payment_status'),
-        "payment_provider": session.get('payment_provider'),
-        "paid_at": session.get('paid_at'),
-        "amount": session.get('amount'),
-        "created_at": session.get('created_at'),
-    }
+    return session_status(session_id, session)
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+@app.get('/session/{session_id}/events')
+async def session_status_events(session_id: str, request: Request):
+    """Server-sent events: the session's status now, then each change until paid/failed.
+
+    Replaces polling /session/{id}/status. Comment lines keep idle proxies
+    from closing the stream; it ends after SESSION_EVENTS_MAX_SECONDS and
+    EventSource reconnects.
+    """
+    try:
+        _, session = await asyncio.to_thread(find_session, session_id)
+    except Exception:
+        return JSONResponse(status_code=500, content={"error": "Failed to load sessions"})
+    if not session:
+        return JSONResponse(status_code=404, content={"error": "Session not found"})
+    if not session_events.can_subscribe(session_id):
+        return JSONResponse(status_code=429, headers={"Retry-After": "10"},
+                            content={"error": "Too many listeners for this session"})
+
+    async def stream():
+        # Subscribed here, not before returning: a response that never starts
+        # streaming would otherwise hold its slot forever
+        try:
+            subscription = session_events.subscribe(session_id)
+        except TooManySubscribers:  # filled up since the check above
+            yield "retry: 10000\n\n"
+            return
+        with subscription:
+            last = session_status(session_id, session)
+            yield "retry: 3000\n" + _sse("status", last)
+            started = last_sent = time()
+            while last["status"] not in TERMINAL_STATUSES and time() - started < SESSION_EVENTS_MAX_SECONDS:
+                if await request.is_disconnected():
+                    return
+                current = await subscription.get(SESSION_EVENTS_RECHECK_SECONDS)
+                if current is None:
+                    # Catches updates made by other workers (or in the DB); the
+                    # file store only re-reads its log when it changed
+                    try:
+                        _, fresh = await asyncio.to_thread(find_session, session_id)
+                    except Exception:
+                        fresh = None
+                    current = session_status(session_id, fresh) if fresh else None
+                if current and (current["status"], current["payment_status"]) != (last["status"], last["payment_status"]):
+                    last = current
+                    yield _sse("status", current)
+                    last_sent = time()
+                elif time() - last_sent >= SESSION_EVENTS_HEARTBEAT_SECONDS:
+                    yield ": heartbeat\n\n"
+                    last_sent = time()
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 
 # === Payment Processing Endpoints ===
@@ -5058,11 +4694,6 @@ def process_payment(request: PaymentRequest):
         )
         
         # Save order to invoices file
-        try:
-            invoices = load_invoices()
-        except Exception:
-            invoices = []
-        
         order = {
             'id': order_id,
             'email': request.email,
@@ -5078,11 +4709,9 @@ def process_payment(request: PaymentRequest):
                 'Smart Contract Invoicing Integration'
             ],
         }
-        invoices.append(order)
-        
         if not READ_ONLY_FS:
             try:
-                save_invoices(invoices)
+                put_invoice(order)
             except Exception as e:
                 print(f"[WARN] Could not save invoice: {e}")
         
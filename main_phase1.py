@@ -12,18 +12,20 @@ Endpoints:
 Run: uvicorn main:app --reload
 """
 
-from fastapi import FastAPI, Depends, HTTPException, status, Request, Header, Body
+from fastapi import FastAPI, Depends, HTTPException, status, Request, Header, Body, Query
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from sqlalchemy import desc
+from sqlalchemy import and_, desc, or_, select
 from datetime import datetime, timezone, timedelta
 
 import os
 import logging
 import uuid
+from typing import Optional
 
-from db import get_db, engine, SessionLocal
+from db import get_db, get_async_db, engine, SessionLocal
 from models_phase1 import Base, Organization, User, Invoice, AuditLog, PaymentSession
 from schemas import (
     # Auth
@@ -48,8 +50,9 @@ from auth import (
     hash_password, verify_password,
     create_access_token, create_refresh_token, verify_token,
     get_client_ip,
-    log_audit_event, record_failed_login, record_successful_login,
-    check_account_lockout, create_email_verification_token,
+    audit_writer, log_audit_event, record_failed_login, record_successful_login,
+    check_account_lockout, check_account_lockout_async,
+    record_failed_login_async, record_successful_login_async, create_email_verification_token,
     create_password_reset_token, hash_token, verify_email_token, verify_password_reset_token
 )
 from payment import (
@@ -58,10 +61,13 @@ from payment import (
     process_onecom_webhook, process_web3_webhook
 )
 from rate_limit import limiter, RATE_LIMITS
+from pagination import MAX_PAGE_SIZE, decode_cursor, encode_cursor, parse_fields, project
 from slowapi.errors import RateLimitExceeded
 from invoices import (
     create_draft_invoice, finalize_invoice, mark_invoice_paid,
-    create_credit_note, update_draft_invoice, generate_invoice_number
+    create_credit_note, update_draft_invoice, generate_invoice_number,
+    create_draft_invoice_async, finalize_invoice_async, mark_invoice_paid_async,
+    create_credit_note_async, get_org_invoice_async
 )
 
 # ===== SETUP =====
@@ -89,6 +95,11 @@ logger = logging.getLogger(__name__)
 # Initialize database tables (optional - normally use alembic)
 Base.metadata.create_all(bind=engine)
 
+# ASYNC_DB=1 serves login and the invoice write endpoints (create, finalize,
+# mark-paid, credit-note) through an AsyncSession (asyncpg / aiosqlite), so a
+# slow query no longer blocks the event loop for every other request.
+ASYNC_DB = os.getenv("ASYNC_DB", "0").lower() in ("1", "true", "yes")
+
 # CORS configuration
 FRONTEND_ORIGINS = [
     "https://dashboard.apiblockchain.io",
@@ -133,12 +144,9 @@ def get_token_from_header(authorization: str = Header(None)) -> str:
     return parts[1]
 
 
-def get_current_user_from_db(db: Session, token: str) -> User:
-    """Verify token and get user from database."""
-    try:
-        payload = verify_token(token)
-    except HTTPException:
-        raise
+def _token_claims(token: str):
+    """(user_id, org_id) from a verified access token."""
+    payload = verify_token(token)
     
     user_id = payload.get("sub")
     org_id = payload.get("org_id")
@@ -148,21 +156,30 @@ def get_current_user_from_db(db: Session, token: str) -> User:
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid token claims"
         )
-    
-    user = db.query(User).filter(
-        User.id == int(user_id),
-        User.org_id == int(org_id)
-    ).first()
-    
+    return int(user_id), int(org_id)
+
+
+def _require_user(user: Optional[User]) -> User:
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="User not found"
         )
-    
     return user
 
 
+def get_current_user_from_db(db: Session, token: str) -> User:
+    """Verify token and get user from database."""
+    user_id, org_id = _token_claims(token)
+    
+    user = db.query(User).filter(
+        User.id == user_id,
+        User.org_id == org_id
+    ).first()
+    
+    return _require_user(user)
+
+
 def get_current_user(
     authorization: str = Header(None),
     db: Session = Depends(get_db)
@@ -172,6 +189,21 @@ def get_current_user(
     return get_current_user_from_db(db, token)
 
 
+async def get_current_user_async(
+    authorization: str = Header(None),
+    db: AsyncSession = Depends(get_async_db)
+) -> User:
+    """get_current_user on the async session (ASYNC_DB=1)."""
+    user_id, org_id = _token_claims(get_token_from_header(authorization))
+    user = await db.scalar(select(User).where(User.id == user_id, User.org_id == org_id))
+    return _require_user(user)
+
+
+# Dependencies for the endpoints that have an async path
+db_dependency = get_async_db if ASYNC_DB else get_db
+user_dependency = get_current_user_async if ASYNC_DB else get_current_user
+
+
 # ===== AUTHENTICATION ENDPOINTS =====
 
 @app.post("/auth/register", response_model=TokenResponse, tags=["Authentication"])
@@ -282,7 +314,7 @@ async def register(
 async def login(
     request: Request,
     credentials: LoginRequest,
-    db: Session = Depends(get_db)
+    db: Session = Depends(db_dependency)
 ):
     """
     Login with email and password.
@@ -292,7 +324,10 @@ async def login(
     ip_address = get_client_ip(request)
     
     # Find user by email
-    user = db.query(User).filter(User.email == credentials.email).first()
+    if ASYNC_DB:
+        user = await db.scalar(select(User).where(User.email == credentials.email))
+    else:
+        user = db.query(User).filter(User.email == credentials.email).first()
     
     if not user:
         raise HTTPException(
@@ -301,7 +336,11 @@ async def login(
         )
     
     # Check account lockout
-    if check_account_lockout(db, user):
+    if ASYNC_DB:
+        locked = await check_account_lockout_async(db, user, ip_address)
+    else:
+        locked = check_account_lockout(db, user, ip_address)
+    if locked:
         raise HTTPException(
             status_code=status.HTTP_429_TOO_MANY_REQUESTS,
             detail="Account locked due to failed login attempts. Try again in 15 minutes."
@@ -309,14 +348,20 @@ async def login(
     
     # Verify password
     if not verify_password(credentials.password, user.password_hash):
-        record_failed_login(db, user.org_id, user.id, ip_address)
+        if ASYNC_DB:
+            await record_failed_login_async(db, user.org_id, user.id, ip_address)
+        else:
+            record_failed_login(db, user.org_id, user.id, ip_address)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid email or password"
         )
     
     # Successful login
-    record_successful_login(db, user.org_id, user.id, ip_address)
+    if ASYNC_DB:
+        await record_successful_login_async(db, user.org_id, user.id, ip_address)
+    else:
+        record_successful_login(db, user.org_id, user.id, ip_address)
     
     # Generate tokens
     access_token = create_access_token(user.id, user.org_id)
@@ -774,40 +819,105 @@ async def update_organization(
 
 # ===== INVOICE ENDPOINTS =====
 
+async def _org_invoice(db, invoice_id: int, org_id: int) -> Invoice:
+    """Invoice `invoice_id` of org `org_id` on either session type, or 404."""
+    if ASYNC_DB:
+        invoice = await get_org_invoice_async(db, invoice_id, org_id)
+    else:
+        invoice = db.query(Invoice).filter(
+            Invoice.id == invoice_id,
+            Invoice.org_id == org_id
+        ).first()
+    
+    if not invoice:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Invoice not found"
+        )
+    return invoice
+
+
 @app.post("/invoices", response_model=InvoiceResponse, tags=["Invoices"])
 async def create_invoice(
     invoice_data: InvoiceCreate,
-    user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    user: User = Depends(user_dependency),
+    db: Session = Depends(db_dependency)
 ):
     """Create new draft invoice."""
     
-    invoice = create_draft_invoice(
-        db=db,
-        org_id=user.org_id,
-        created_by=user,
-        invoice_data=invoice_data
-    )
+    if ASYNC_DB:
+        invoice = await create_draft_invoice_async(db, user.org_id, user, invoice_data)
+    else:
+        invoice = create_draft_invoice(
+            db=db,
+            org_id=user.org_id,
+            created_by=user,
+            invoice_data=invoice_data
+        )
     
     return InvoiceResponse.from_orm(invoice)
 
 
-@app.get("/invoices", response_model=list[InvoiceResponse], tags=["Invoices"])
+@app.get("/invoices", tags=["Invoices"])
 async def list_invoices(
     status: str = None,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+    date_from: Optional[datetime] = Query(None, alias="from"),
+    date_to: Optional[datetime] = Query(None, alias="to"),
+    buyer_country: Optional[str] = None,
+    fields: Optional[str] = None,
     user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """List invoices for current organization."""
-    
+    """List invoices for current organization, newest first.
+
+    Filters: status, from/to (created_at), buyer_country (customer_country).
+    `fields=a,b` limits each item to those InvoiceResponse fields plus `id`.
+    With `limit`, returns {"items", "next_cursor"}; pass next_cursor as `after`.
+    """
+    try:
+        projection = parse_fields(fields, InvoiceResponse.model_fields)
+        cursor = decode_cursor(after) if after else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
     query = db.query(Invoice).filter(Invoice.org_id == user.org_id)
     
     if status:
         query = query.filter(Invoice.status == status)
-    
-    invoices = query.order_by(desc(Invoice.created_at)).all()
-    
-    return [InvoiceResponse.from_orm(inv) for inv in invoices]
+    if date_from:
+        query = query.filter(Invoice.created_at >= date_from)
+    if date_to:
+        query = query.filter(Invoice.created_at <= date_to)
+    if buyer_country:
+        query = query.filter(Invoice.customer_country == buyer_country.upper())
+    if cursor:
+        try:
+            cursor_at, cursor_id = datetime.fromisoformat(cursor[0]), int(cursor[1])
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        # Keyset: strictly older than the last row of the previous page
+        query = query.filter(or_(
+            Invoice.created_at < cursor_at,
+            and_(Invoice.created_at == cursor_at, Invoice.id < cursor_id),
+        ))
+    
+    query = query.order_by(desc(Invoice.created_at), desc(Invoice.id))
+    invoices = query.limit(limit + 1).all() if limit else query.all()
+    has_more = bool(limit) and len(invoices) > limit
+    invoices = invoices[:limit] if limit else invoices
+    
+    items = [InvoiceResponse.from_orm(inv) for inv in invoices]
+    if projection is not None:
+        items = [project(item.model_dump(mode="json"), projection) for item in items]
+    if not limit:
+        return items
+    next_cursor = None
+    if has_more:
+        last = invoices[-1]
+        next_cursor = encode_cursor(last.created_at.isoformat() if last.created_at else "", last.id)
+    return {"items": items, "next_cursor": next_cursor}
 
 
 @app.get("/invoices/{invoice_id}", response_model=InvoiceResponse, tags=["Invoices"])
@@ -860,23 +970,17 @@ async def update_invoice(
 @app.post("/invoices/{invoice_id}/finalize", response_model=InvoiceResponse, tags=["Invoices"])
 async def finalize_invoice_endpoint(
     invoice_id: int,
-    user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    user: User = Depends(user_dependency),
+    db: Session = Depends(db_dependency)
 ):
     """Finalize invoice (make it immutable and legally binding)."""
     
-    invoice = db.query(Invoice).filter(
-        Invoice.id == invoice_id,
-        Invoice.org_id == user.org_id
-    ).first()
-    
-    if not invoice:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Invoice not found"
-        )
+    invoice = await _org_invoice(db, invoice_id, user.org_id)
     
-    invoice = finalize_invoice(db, invoice, user)
+    if ASYNC_DB:
+        invoice = await finalize_invoice_async(db, invoice, user)
+    else:
+        invoice = finalize_invoice(db, invoice, user)
     
     return InvoiceResponse.from_orm(invoice)
 
@@ -885,23 +989,17 @@ async def finalize_invoice_endpoint(
 async def mark_paid_endpoint(
     invoice_id: int,
     req: InvoiceMarkPaidRequest,
-    user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    user: User = Depends(user_dependency),
+    db: Session = Depends(db_dependency)
 ):
     """Mark finalized invoice as paid."""
     
-    invoice = db.query(Invoice).filter(
-        Invoice.id == invoice_id,
-        Invoice.org_id == user.org_id
-    ).first()
+    invoice = await _org_invoice(db, invoice_id, user.org_id)
     
-    if not invoice:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Invoice not found"
-        )
-    
-    invoice = mark_invoice_paid(db, invoice, user, req.payment_date)
+    if ASYNC_DB:
+        invoice = await mark_invoice_paid_async(db, invoice, user, req.payment_date)
+    else:
+        invoice = mark_invoice_paid(db, invoice, user, req.payment_date)
     
     return InvoiceResponse.from_orm(invoice)
 
@@ -910,30 +1008,24 @@ async def mark_paid_endpoint(
 async def credit_note_endpoint(
     invoice_id: int,
     req: InvoiceCreditNoteRequest,
-    user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    user: User = Depends(user_dependency),
+    db: Session = Depends(db_dependency)
 ):
     """Create credit note (refund) for invoice."""
     
-    original_invoice = db.query(Invoice).filter(
-        Invoice.id == invoice_id,
-        Invoice.org_id == user.org_id
-    ).first()
+    original_invoice = await _org_invoice(db, invoice_id, user.org_id)
     
-    if not original_invoice:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Invoice not found"
+    if ASYNC_DB:
+        credit_note = await create_credit_note_async(db, original_invoice, req.percentage, user, req.reason)
+    else:
+        credit_note = create_credit_note(
+            db=db,
+            original_invoice=original_invoice,
+            percentage=req.percentage,
+            user=user,
+            reason=req.reason
         )
     
-    credit_note = create_credit_note(
-        db=db,
-        original_invoice=original_invoice,
-        percentage=req.percentage,
-        user=user,
-        reason=req.reason
-    )
-    
     return InvoiceResponse.from_orm(credit_note)
 
 
@@ -1359,6 +1451,7 @@ async def get_audit_logs(
             detail="Admin access required"
         )
     
+    audit_writer.flush()  # include events still queued for the batched insert
     logs = db.query(AuditLog).filter(
         AuditLog.org_id == user.org_id
     ).order_by(
@@ -90,6 +90,10 @@ class Invoice(Base):
         Index("idx_invoice_org", "org_id"),
         Index("idx_invoice_status", "status"),
         Index("idx_invoice_customer", "customer_email"),
+        # Newest-first keyset pagination of an org's invoices, optionally by status/country
+        Index("idx_invoice_org_created", "org_id", "created_at", "id"),
+        Index("idx_invoice_org_status_created", "org_id", "status", "created_at"),
+        Index("idx_invoice_org_country", "org_id", "customer_country"),
     )
     
     id = Column(Integer, primary_key=True)
@@ -0,0 +1,47 @@
+"""
+Helpers shared by the paginated list endpoints (main.py and main_phase1.py).
+
+Lists are ordered newest first on (created_at, id). A cursor is that pair for
+the last item of a page, base64url-encoded so clients treat it as opaque; the
+next page holds everything strictly older.
+"""
+
+import base64
+import json
+from typing import Iterable, List, Optional, Tuple
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+def encode_cursor(created_at, item_id) -> str:
+    raw = json.dumps([str(created_at or ""), str(item_id)], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, str]:
+    """Inverse of encode_cursor; raises ValueError for anything malformed."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, item_id = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except Exception:
+        raise ValueError("Invalid cursor")
+    return str(created_at), str(item_id)
+
+
+def parse_fields(fields: Optional[str], allowed: Iterable[str]) -> Optional[List[str]]:
+    """`fields=a,b` -> ["id", "a", "b"]; None when no projection was requested."""
+    if not fields:
+        return None
+    allowed = set(allowed)
+    requested = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in requested if f not in allowed]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return ["id"] + [f for f in dict.fromkeys(requested) if f != "id"]
+
+
+def project(item: dict, fields: Optional[List[str]]) -> dict:
+    if fields is None:
+        return item
+    return {f: item.get(f) for f in fields}
@@ -108,8 +108,35 @@ def generate_customer_access_link(
 
 
 # ===== WEBHOOK PROCESSING =====
+#
+# Normalizers turn a provider payload into one shape the shared settlement
+# routine (main.py's `settle_webhook_payment`) understands:
+#
+#   processed       False for events we ignore (with a `reason`)
+#   session_id      hosted checkout session being paid
+#   provider        "stripe", "paypal", "coinbase", "onecom", "web3"
+#   amount          amount charged, or None to use the session's amount
+#   currency        currency charged, or None
+#   apply_vat       split `amount` into subtotal + VAT on the invoice
+#   default_mode    invoice/session mode when the session has none
+#   session_fields  provider references stored on the session
+#   invoice_fields  provider references stored on the invoice
+#
+# The provider-specific keys returned before (intent_id, txn_id, tx_id, ...)
+# are still present.
 
-def process_stripe_webhook(webhook_data: Dict[str, Any], session: Dict[str, Any]) -> Dict[str, Any]:
+def _ignored(event_type) -> Dict[str, Any]:
+    return {"processed": False, "reason": f"Ignored event type: {event_type}", "event_type": event_type}
+
+
+def _to_float(value) -> Optional[float]:
+    try:
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def process_stripe_webhook(webhook_data: Dict[str, Any], session: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
     """
     Process a Stripe webhook.
     
@@ -117,80 +144,222 @@ def process_stripe_webhook(webhook_data: Dict[str, Any], session: Dict[str, Any]
     """
     event_type = webhook_data.get("type")
     
-    if event_type != "payment_intent.succeeded":
-        return {"processed": False, "reason": f"Ignored event type: {event_type}"}
+    if event_type not in ("payment_intent.succeeded", "charge.completed"):
+        return _ignored(event_type)
     
-    # Extract session_id from metadata
+    # Extract session_id from metadata (older integrations put it in the description)
     try:
         payment_intent = webhook_data.get("data", {}).get("object", {})
-        session_id = payment_intent.get("metadata", {}).get("session_id")
+        session_id = payment_intent.get("metadata", {}).get("session_id") or payment_intent.get("description")
         intent_id = payment_intent.get("id")
         
         if not session_id:
-            return {"processed": False, "reason": "No session_id in metadata"}
+            return {"processed": False, "reason": "No session_id in metadata", "event_type": event_type}
         
         return {
             "processed": True,
             "session_id": session_id,
             "provider": "stripe",
+            "event_type": event_type,
             "intent_id": intent_id,
-            "amount_cents": payment_intent.get("amount")
+            "amount_cents": payment_intent.get("amount"),
+            "amount": None,
+            "currency": None,
+            "apply_vat": False,
+            "default_mode": "test",
+            "session_fields": {"stripe_intent_id": intent_id},
+            "invoice_fields": {"stripe_intent_id": intent_id},
+        }
+    except Exception as e:
+        return {"processed": False, "reason": f"Failed to parse: {str(e)}", "event_type": event_type}
+
+
+def process_paypal_webhook(webhook_data: Dict[str, Any], session: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Process a PayPal webhook (PAYMENT.CAPTURE.COMPLETED).
+    """
+    event_type = webhook_data.get("event_type")
+    
+    if event_type != "PAYMENT.CAPTURE.COMPLETED":
+        return _ignored(event_type)
+    
+    try:
+        resource = webhook_data.get("resource", {})
+        session_id = resource.get("custom_id") or resource.get("invoice_id")
+        capture_id = resource.get("id")
+        amount = resource.get("amount", {})
+        
+        if not session_id:
+            return {"processed": False, "reason": "No session_id in webhook", "event_type": event_type}
+        
+        return {
+            "processed": True,
+            "session_id": session_id,
+            "provider": "paypal",
+            "event_type": event_type,
+            "capture_id": capture_id,
+            "amount": _to_float(amount.get("value")),
+            "currency": amount.get("currency_code", "EUR"),
+            "apply_vat": True,
+            "default_mode": "test",
+            "session_fields": {"paypal_capture_id": capture_id},
+            "invoice_fields": {"paypal_capture_id": capture_id},
+        }
+    except Exception as e:
+        return {"processed": False, "reason": f"Failed to parse: {str(e)}", "event_type": event_type}
+
+
+def process_coinbase_webhook(webhook_data: Dict[str, Any], session: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Process a Coinbase Commerce webhook (charge:confirmed).
+    
+    The signature is checked by the endpoint before the event is queued.
+    """
+    event = webhook_data.get("event", {})
+    event_type = event.get("type")
+    
+    if event_type != "charge:confirmed":
+        return _ignored(event_type)
+    
+    try:
+        charge = event.get("data", {})
+        session_id = charge.get("metadata", {}).get("session_id")
+        charge_id = charge.get("id")
+        local_price = charge.get("pricing", {}).get("local", {})
+        payments = charge.get("payments", [])
+        crypto = (payments[0] if payments else {}).get("value", {}).get("crypto", {})
+        
+        if not session_id:
+            return {"processed": False, "reason": "No session_id in metadata", "event_type": event_type}
+        
+        return {
+            "processed": True,
+            "session_id": session_id,
+            "provider": "coinbase",
+            "event_type": event_type,
+            "charge_id": charge_id,
+            "amount": _to_float(local_price.get("amount")),
+            "currency": local_price.get("currency", "EUR"),
+            "apply_vat": True,
+            "default_mode": "live",
+            "session_fields": {"coinbase_charge_id": charge_id},
+            "invoice_fields": {
+                "coinbase_charge_id": charge_id,
+                "crypto_amount": crypto.get("amount"),
+                "crypto_currency": crypto.get("currency"),
+                "transaction_id": (payments[0] if payments else {}).get("transaction_id"),
+            },
         }
     except Exception as e:
-        return {"processed": False, "reason": f"Failed to parse: {str(e)}"}
+        return {"processed": False, "reason": f"Failed to parse: {str(e)}", "event_type": event_type}
 
 
-def process_onecom_webhook(webhook_data: Dict[str, Any], session: Dict[str, Any]) -> Dict[str, Any]:
+def process_onecom_webhook(webhook_data: Dict[str, Any], session: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
     """
     Process a One.com webhook.
     """
-    event_type = webhook_data.get("type")
+    event_type = webhook_data.get("event") or webhook_data.get("type")
     
     if event_type != "payment.completed":
-        return {"processed": False, "reason": f"Ignored event type: {event_type}"}
+        return _ignored(event_type)
     
     try:
         session_id = webhook_data.get("reference")
-        txn_id = webhook_data.get("transaction_id")
+        txn_id = webhook_data.get("payload", {}).get("txn_id") or webhook_data.get("transaction_id")
         
         if not session_id:
-            return {"processed": False, "reason": "No reference (session_id) in webhook"}
+            return {"processed": False, "reason": "No reference (session_id) in webhook", "event_type": event_type}
         
         return {
             "processed": True,
             "session_id": session_id,
             "provider": "onecom",
+            "event_type": event_type,
             "txn_id": txn_id,
-            "amount_cents": webhook_data.get("amount")
+            "amount_cents": webhook_data.get("amount"),
+            "amount": _to_float(webhook_data.get("amount")),
+            "currency": webhook_data.get("currency", "USD"),
+            "apply_vat": False,
+            "default_mode": "test",
+            "session_fields": {"onecom_txn_id": txn_id},
+            "invoice_fields": {"onecom_txn_id": txn_id},
         }
     except Exception as e:
-        return {"processed": False, "reason": f"Failed to parse: {str(e)}"}
+        return {"processed": False, "reason": f"Failed to parse: {str(e)}", "event_type": event_type}
 
 
-def process_web3_webhook(webhook_data: Dict[str, Any], session: Dict[str, Any]) -> Dict[str, Any]:
+def process_web3_webhook(webhook_data: Dict[str, Any], session: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
     """
     Process a Web3/Blockchain webhook.
     """
-    event_type = webhook_data.get("type")
+    event_type = webhook_data.get("event") or webhook_data.get("type")
     
-    if event_type != "payment.confirmed":
-        return {"processed": False, "reason": f"Ignored event type: {event_type}"}
+    if event_type not in ("payment.confirmed", "transfer.confirmed"):
+        return _ignored(event_type)
     
     try:
         session_id = webhook_data.get("session_id")
-        tx_id = webhook_data.get("transaction_id")
+        tx_id = webhook_data.get("blockchain_tx_id") or webhook_data.get("transaction_id")
         network = webhook_data.get("network", "ethereum")
         
         if not session_id:
-            return {"processed": False, "reason": "No session_id in webhook"}
+            return {"processed": False, "reason": "No session_id in webhook", "event_type": event_type}
         
+        refs = {"blockchain_tx_id": tx_id, "blockchain_network": webhook_data.get("network")}
         return {
             "processed": True,
             "session_id": session_id,
             "provider": "web3",
+            "event_type": event_type,
             "tx_id": tx_id,
             "network": network,
-            "amount_cents": webhook_data.get("amount")
+            "amount_cents": webhook_data.get("amount"),
+            "amount": _to_float(webhook_data.get("amount")),
+            "currency": None,
+            "apply_vat": False,
+            "default_mode": "test",
+            "session_fields": dict(refs),
+            "invoice_fields": dict(refs),
         }
     except Exception as e:
-        return {"processed": False, "reason": f"Failed to parse: {str(e)}"}
+        return {"processed": False, "reason": f"Failed to parse: {str(e)}", "event_type": event_type}
+
+
+def webhook_event_key(provider: str, webhook_data: Dict[str, Any]) -> Optional[str]:
+    """
+    Stable id of one provider event, identical across the provider's redeliveries.
+    
+    Stripe `evt_...`, PayPal `WH-...` and the Coinbase event id are per event;
+    for web3 the transaction hash is the payment. Returns None when the payload
+    carries no id (the caller then keys on the raw body).
+    """
+    if provider == "stripe":
+        key = webhook_data.get("id")
+        if not key:
+            obj = webhook_data.get("data", {}).get("object", {})
+            key = obj.get("id") and f"{webhook_data.get('type')}:{obj.get('id')}"
+    elif provider == "paypal":
+        key = webhook_data.get("id")
+        if not key:
+            resource = webhook_data.get("resource", {})
+            key = resource.get("id") and f"{webhook_data.get('event_type')}:{resource.get('id')}"
+    elif provider == "coinbase":
+        key = webhook_data.get("event", {}).get("id") or webhook_data.get("id")
+    elif provider == "onecom":
+        txn_id = webhook_data.get("payload", {}).get("txn_id") or webhook_data.get("transaction_id")
+        key = webhook_data.get("id") or (txn_id and f"{webhook_data.get('event') or webhook_data.get('type')}:{txn_id}")
+    elif provider == "web3":
+        tx_id = webhook_data.get("blockchain_tx_id") or webhook_data.get("transaction_id")
+        key = tx_id and str(tx_id).lower()
+    else:
+        key = None
+    return str(key)[:200] if key else None
+
+
+WEBHOOK_NORMALIZERS = {
+    "stripe": process_stripe_webhook,
+    "paypal": process_paypal_webhook,
+    "coinbase": process_coinbase_webhook,
+    "onecom": process_onecom_webhook,
+    "web3": process_web3_webhook,
+}
@@ -0,0 +1,110 @@
+"""
+Content-addressed on-disk cache for rendered invoice PDFs.
+
+Entries are keyed by a sha256 of the render input (the `InvoicePDFRequest`
+fields), so an edited invoice naturally maps to a new entry and the key
+doubles as a strong ETag. Files live under `INVOICE_PDF_DIR/cache/<key>.pdf`.
+A file's mtime is bumped on every hit, and when the directory grows past
+`max_bytes` the least recently used files are removed. Eviction rescans the
+directory, so entries written by other workers are counted too.
+"""
+
+from pathlib import Path
+import hashlib
+import json
+import os
+import threading
+from typing import Optional
+
+
+def pdf_cache_key(fields: dict) -> str:
+    canonical = json.dumps(fields, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class PDFCache:
+    def __init__(self, directory: Path, max_bytes: int = 256 * 1024 * 1024, read_only: bool = False):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.read_only = read_only
+        self._lock = threading.Lock()
+        self._approx_bytes = None
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.pdf"
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            data = path.read_bytes()
+        except (FileNotFoundError, OSError):
+            self.misses += 1
+            return None
+        if not self.read_only:
+            try:
+                os.utime(path)  # LRU: recently used files survive eviction
+            except OSError:
+                pass
+        self.hits += 1
+        return data
+
+    def put(self, key: str, data: bytes) -> None:
+        if self.read_only:
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self._path(key)
+        tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+        with self._lock:
+            if self._approx_bytes is None:
+                self._approx_bytes = self._scan_size()
+            else:
+                self._approx_bytes += len(data)
+            if self._approx_bytes > self.max_bytes:
+                self._evict()
+
+    def invalidate(self, key: str) -> None:
+        if self.read_only:
+            return
+        try:
+            size = self._path(key).stat().st_size
+            self._path(key).unlink()
+        except FileNotFoundError:
+            return
+        with self._lock:
+            if self._approx_bytes is not None:
+                self._approx_bytes = max(0, self._approx_bytes - size)
+
+    def _entries(self):
+        try:
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith(".pdf") and entry.is_file():
+                    st = entry.stat()
+                    yield st.st_mtime_ns, st.st_size, entry.path
+        except FileNotFoundError:
+            return
+
+    def _scan_size(self) -> int:
+        return sum(size for _, size, _ in self._entries())
+
+    def _evict(self) -> None:
+        # Trim to 90% of the bound so we don't rescan on every put
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        target = int(self.max_bytes * 0.9)
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.unlink(path)
+                total -= size
+            except FileNotFoundError:
+                total -= size
+        self._approx_bytes = total
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"bytes": self._scan_size(), "max_bytes": self.max_bytes, "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,156 @@
+"""
+Bounded worker pool for CPU-bound PDF rendering.
+
+FPDF rendering is synchronous and can take long enough on big invoices to
+stall every other request on the same uvicorn worker. `PDFRenderPool` runs
+the render function in a process pool and lets async handlers await the
+result. At most `workers + max_queue` renders are in flight; beyond that
+`render()` raises `PDFPoolBusy` so the handler can answer 503 + Retry-After
+instead of piling up work.
+
+Where process pools are unavailable (e.g. AWS Lambda has no /dev/shm) or
+`workers` is 0, renders fall back to a thread pool so they still leave the
+event loop.
+
+The pool is created on first use, when the app already runs its audit
+writer, webhook and compaction threads. Forking such a process can hand a
+worker a lock that some other thread held at the time. So workers start from
+a clean "forkserver" process ("spawn" where that is unavailable) unless
+PDF_RENDER_START_METHOD says otherwise. They import the render function's
+module once on startup, so that module must be cheap and side-effect free to
+import (pdf_render.py, not main.py).
+"""
+
+import asyncio
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import math
+import multiprocessing
+import os
+import threading
+from time import time
+from typing import Callable, Optional
+
+
+class PDFPoolBusy(Exception):
+    """Raised when the render queue is full."""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"PDF render queue is full; retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+def _default_start_method() -> str:
+    return "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+
+def _timed_call(fn: Callable, args: tuple):
+    # Runs in the worker; wall-clock timestamps are comparable across processes.
+    started = time()
+    result = fn(*args)
+    return result, started, time()
+
+
+def _percentile(samples, pct: float) -> Optional[float]:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    idx = min(len(ordered) - 1, max(0, math.ceil(pct / 100 * len(ordered)) - 1))
+    return round(ordered[idx] * 1000, 2)
+
+
+class PDFRenderPool:
+    def __init__(self, workers: int = 2, max_queue: int = 16, start_method: Optional[str] = None,
+                 sample_size: int = 1000):
+        self.workers = max(0, workers)
+        self.max_queue = max(0, max_queue)
+        self.start_method = start_method
+        self._executor = None
+        self._mode = None
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._completed = 0
+        self._failed = 0
+        self._rejected = 0
+        self._queue_wait = deque(maxlen=sample_size)
+        self._render_time = deque(maxlen=sample_size)
+
+    @property
+    def capacity(self) -> int:
+        return max(1, self.workers) + self.max_queue
+
+    def _get_executor(self):
+        if self._executor is not None:
+            return self._executor
+        with self._lock:
+            if self._executor is None:
+                if self.workers > 0:
+                    try:
+                        ctx = multiprocessing.get_context(self.start_method or _default_start_method())
+                        self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=ctx)
+                        self._mode = "process"
+                    except (OSError, ValueError, NotImplementedError) as e:
+                        print(f"[WARN] PDF process pool unavailable, using threads: {e}")
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=max(1, self.workers),
+                                                        thread_name_prefix="pdf-render")
+                    self._mode = "thread"
+        return self._executor
+
+    def _retry_after(self) -> int:
+        avg = (sum(self._render_time) / len(self._render_time)) if self._render_time else 1.0
+        return max(1, math.ceil(avg * self._in_flight / max(1, self.workers)))
+
+    async def render(self, fn: Callable, *args) -> bytes:
+        """Run `fn(*args)` in the pool and await its result."""
+        with self._lock:
+            if self._in_flight >= self.capacity:
+                self._rejected += 1
+                raise PDFPoolBusy(self._retry_after())
+            self._in_flight += 1
+        submitted = time()
+        try:
+            loop = asyncio.get_running_loop()
+            result, started, finished = await loop.run_in_executor(self._get_executor(), _timed_call, fn, args)
+        except Exception:
+            with self._lock:
+                self._failed += 1
+            raise
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+        with self._lock:
+            self._completed += 1
+            self._queue_wait.append(max(0.0, started - submitted))
+            self._render_time.append(finished - started)
+        return result
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {
+                "mode": self._mode or "idle",
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "in_flight": self._in_flight,
+                "completed": self._completed,
+                "failed": self._failed,
+                "rejected": self._rejected,
+                "queue_wait_ms": {"p50": _percentile(self._queue_wait, 50), "p95": _percentile(self._queue_wait, 95),
+                                  "max": _percentile(self._queue_wait, 100)},
+                "render_ms": {"p50": _percentile(self._render_time, 50), "p95": _percentile(self._render_time, 95),
+                              "max": _percentile(self._render_time, 100)},
+            }
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+def pool_from_env() -> PDFRenderPool:
+    return PDFRenderPool(
+        workers=int(os.getenv("PDF_RENDER_WORKERS", "2")),
+        max_queue=int(os.getenv("PDF_RENDER_QUEUE", "16")),
+        start_method=os.getenv("PDF_RENDER_START_METHOD") or None,
+    )
@@ -0,0 +1,332 @@
+"""
+Invoice PDF rendering, kept free of import-time side effects.
+
+`render_invoice_pdf` runs in the PDF render pool's worker processes (see
+pdf_pool.py), which start from forkserver/spawn and import the function's
+module. Importing main.py there would redo its whole startup: copying the
+seed users.json over the live one, opening the webhook queue, the stores and
+the audit writers. This module only needs FPDF and pydantic.
+"""
+
+from datetime import datetime, timezone
+from typing import Optional
+
+from fpdf import FPDF
+from pydantic import BaseModel
+
+
+class InvoicePDFRequest(BaseModel):
+    # ========== HEADER SECTION ==========
+    logo_url: Optional[str] = None
+    invoice_number: Optional[str] = "INV-TEST-001"
+    invoice_date: Optional[str] = None  # e.g., "2026-02-12"
+    supply_date: Optional[str] = None  # If different from invoice date
+    currency: Optional[str] = "EUR"  # ISO code: EUR, USD, GBP, etc.
+    
+    # ========== SELLER INFORMATION (Legal Entity) ==========
+    seller: Optional[str] = "Example Seller"  # Legal business name
+    seller_address: Optional[str] = None  # Full address with country
+    seller_country: Optional[str] = None  # Country code or name
+    seller_registration_number: Optional[str] = None  # Company reg. number
+    seller_vat: Optional[str] = None  # VAT ID / Tax ID
+    seller_eori: Optional[str] = None  # EORI for international export
+    seller_email: Optional[str] = None
+    seller_phone: Optional[str] = None
+    
+    # ========== BUYER INFORMATION ==========
+    buyer: Optional[str] = "Example Buyer"  # Legal name
+    buyer_address: Optional[str] = None  # Full address with country
+    buyer_country: Optional[str] = None  # Country code or name
+    buyer_vat: Optional[str] = None  # VAT ID / Tax ID (for B2B reverse charge)
+    buyer_registration_number: Optional[str] = None  # Company reg. number
+    buyer_email: Optional[str] = None
+    buyer_phone: Optional[str] = None
+    buyer_type: Optional[str] = None  # "B2B" or "B2C" (affects tax treatment)
+    
+    # ========== DESCRIPTION TABLE (Tax-Safe Format) ==========
+    description: Optional[str] = "Service"  # Line item description
+    quantity: Optional[float] = 1.0
+    unit_price: Optional[float] = 100.0
+    net_amount: Optional[float] = None  # Subtotal before tax
+    vat_rate: Optional[float] = 0.0  # Tax rate percentage (e.g., 19.0 for 19%)
+    vat_amount: Optional[float] = None  # Tax amount
+    total_amount: Optional[float] = None  # Total amount gross
+    
+    # Legacy fields (for backward compatibility)
+    subtotal: Optional[float] = None  # Deprecated: use net_amount
+    amount: Optional[float] = None  # Deprecated: use total_amount
+    order_number: Optional[str] = None
+    due_date: Optional[str] = None
+    
+    # ========== TAX INFORMATION SECTION (Flexible) ==========
+    # Choose appropriate tax treatment statement
+    tax_treatment: Optional[str] = None  # E.g. "VAT calculated in accordance with local regulations"
+    is_reverse_charge: Optional[bool] = False  # EU reverse charge
+    is_export: Optional[bool] = False  # Export of services - VAT exempt
+    is_outside_scope: Optional[bool] = False  # Outside scope of VAT
+    tax_exempt_reason: Optional[str] = None  # E.g. "Charity donation", "Government agency"
+    
+    # ========== PAYMENT INFORMATION ==========
+    payment_terms: Optional[str] = None  # E.g. "14 days net", "Net 30"
+    payment_system: Optional[str] = "web2"  # web2 or web3
+    payment_provider: Optional[str] = None  # E.g. Stripe, PayPal
+    blockchain_tx_id: Optional[str] = None  # Blockchain reference
+    bank_name: Optional[str] = None
+    iban: Optional[str] = None
+    swift_bic: Optional[str] = None
+    alternative_payment_methods: Optional[str] = None  # Free text
+    late_payment_clause: Optional[str] = None  # E.g. interest rate info
+    
+    # ========== ADDITIONAL INFO ==========
+    notes: Optional[str] = None  # General notes
+    footer_statement: Optional[str] = None  # Legal footer text
+    registered_office: Optional[str] = None  # For footer
+
+
+def render_invoice_pdf(data: InvoicePDFRequest) -> bytes:
+    """Render universal international invoice PDF compliant with EU, UK, US, and global tax jurisdictions."""
+    pdf = FPDF()
+    pdf.add_page()
+    pdf.set_auto_page_break(auto=True, margin=10)
+    
+    # Normalize fields for backward compatibility
+    net_amount = data.net_amount or data.subtotal or (data.quantity * data.unit_price if data.quantity and data.unit_price else 0)
+    total_amount = data.total_amount or data.amount or (net_amount + (data.vat_amount or 0))
+    invoice_date = data.invoice_date or datetime.now(timezone.utc).date().isoformat()
+    currency = data.currency or "EUR"
+    
+    # ========== HEADER SECTION WITH TWO COLUMNS ==========
+    # Left side: Invoice title and numbers
+    # Right side: Seller company info
+    pdf.set_font("Arial", "B", size=20)
+    pdf.set_text_color(34, 139, 34)  # Nature green (Forest Green)
+    pdf.cell(100, 12, "INVOICE", ln=False)
+    
+    # Seller info on right
+    pdf.set_font("Arial", "B", size=10)
+    pdf.set_text_color(34, 139, 34)  # Nature green
+    pdf.cell(0, 6, "SELLER", ln=True, align="R")
+    pdf.set_font("Arial", size=9)
+    pdf.set_text_color(0, 0, 0)
+    
+    # Move to next line and create two-column layout
+    pdf.set_x(10)
+    pdf.set_font("Arial", size=9)
+    pdf.cell(95, 4, f"Invoice #: {data.invoice_number or 'N/A'}", ln=False)
+    pdf.set_x(110)
+    pdf.cell(0, 4, data.seller or "Unknown Seller", ln=True)
+    
+    pdf.set_x(10)
+    pdf.cell(95, 4, f"Invoice Date: {invoice_date}", ln=False)
+    pdf.set_x(110)
+    if data.seller_vat:
+        pdf.cell(0, 4, f"VAT: {data.seller_vat}", ln=True)
+    else:
+        pdf.ln(4)
+    
+    pdf.set_x(10)
+    if data.supply_date and data.supply_date != invoice_date:
+        pdf.cell(95, 4, f"Supply Date: {data.supply_date}", ln=False)
+    else:
+        pdf.cell(95, 4, "", ln=False)
+    pdf.set_x(110)
+    if data.seller_registration_number:
+        pdf.cell(0, 4, f"Reg: {data.seller_registration_number}", ln=True)
+    else:
+        pdf.ln(4)
+    
+    # Seller address
+    pdf.set_x(110)
+    if data.seller_address:
+        for line in data.seller_address.split('\n')[:2]:
+            if line.strip():
+                pdf.set_x(110)
+                pdf.cell(0, 4, line.strip(), ln=True)
+    pdf.set_x(110)
+    if data.seller_country:
+        pdf.cell(0, 4, f"Country: {data.seller_country}", ln=True)
+    if data.seller_email:
+        pdf.set_x(110)
+        pdf.cell(0, 4, f"Email: {data.seller_email}", ln=True)
+    
+    pdf.ln(5)
+    
+    # ========== BILLING ADDRESS (LEFT) & ADDITIONAL INFO (RIGHT) ==========
+    pdf.set_font("Arial", "B", size=11)
+    pdf.set_text_color(34, 139, 34)  # Nature green
+    pdf.cell(95, 6, "BILL TO", ln=False)
+    pdf.cell(0, 6, "ORDER INFORMATION", ln=True, align="R")
+    pdf.set_text_color(0, 0, 0)
+    pdf.set_font("Arial", size=9)
+    
+    # Bill to on left
+    pdf.set_x(10)
+    pdf.cell(95, 5, data.buyer or "Unknown Buyer", ln=False)
+    
+    # Order info on right
+    pdf.set_x(110)
+    if data.order_number:
+        pdf.cell(0, 5, f"Order #: {data.order_number}", ln=True)
+    else:
+        pdf.ln(5)
+    
+    # Buyer details
+    if data.buyer_vat:
+        pdf.set_x(10)
+        pdf.cell(95, 4, f"VAT: {data.buyer_vat}", ln=False)
+        pdf.set_x(110)
+        if data.due_date:
+            pdf.cell(0, 4, f"Due Date: {data.due_date}", ln=True)
+        else:
+            pdf.ln(4)
+    
+    if data.buyer_email:
+        pdf.set_x(10)
+        pdf.cell(95, 4, f"Email: {data.buyer_email}", ln=False)
+        pdf.set_x(110)
+        pdf.cell(0, 4, f"Currency: {currency}", ln=True)
+    elif currency:
+        pdf.set_x(110)
+        pdf.cell(0, 4, f"Currency: {currency}", ln=True)
+    
+    if data.buyer_address:
+        for line in data.buyer_address.split('\n')[:2]:
+            if line.strip():
+                pdf.set_x(10)
+                pdf.cell(95, 4, line.strip(), ln=True)
+    
+    pdf.ln(4)
+    
+    # ========== DESCRIPTION TABLE (Tax-Safe Format) ==========
+    pdf.set_font("Arial", "B", size=9)
+    pdf.set_fill_color(34, 139, 34)  # Nature green header
+    pdf.set_text_color(255, 255, 255)  # White text
+    pdf.cell(75, 7, "Description", border=1, fill=True, align="L")
+    pdf.cell(15, 7, "Qty", border=1, fill=True, align="C")
+    pdf.cell(25, 7, "Unit Price", border=1, fill=True, align="R")
+    pdf.cell(25, 7, "Net Amount", border=1, fill=True, align="R", ln=True)
+    
+    pdf.set_text_color(0, 0, 0)
+    pdf.set_font("Arial", size=9)
+    desc = (data.description or "Service")[:75]
+    pdf.cell(75, 6, desc, border=1, align="L")
+    pdf.cell(15, 6, f"{data.quantity:.0f}", border=1, align="C")
+    pdf.cell(25, 6, f"{currency} {data.unit_price:.2f}", border=1, align="R")
+    pdf.cell(25, 6, f"{currency} {net_amount:.2f}", border=1, align="R", ln=True)
+    pdf.ln(4)
+    
+    # ========== TAX CALCULATION SUMMARY ==========
+    x_right = 125
+    pdf.set_font("Arial", size=9)
+    
+    # Subtotal (Net)
+    pdf.set_x(x_right)
+    pdf.cell(35, 5, "Subtotal (Net):", align="L")
+    pdf.cell(0, 5, f"{currency} {net_amount:.2f}", align="R", ln=True)
+    
+    # VAT/Tax line (only if applicable)
+    if data.vat_amount and data.vat_amount > 0:
+        pdf.set_x(x_right)
+        vat_rate = data.vat_rate or 0
+        pdf.cell(35, 5, f"Tax ({vat_rate}%):", align="L")
+        pdf.cell(0, 5, f"{currency} {data.vat_amount:.2f}", align="R", ln=True)
+    elif data.is_reverse_charge or data.is_export or data.is_outside_scope or data.tax_exempt_reason:
+        pdf.set_x(x_right)
+        pdf.set_font("Arial", "I", size=8)
+        pdf.cell(0, 5, "Tax: 0.00 (see tax treatment)", align="R", ln=True)
+        pdf.set_font("Arial", size=9)
+    
+    # Total (Gross)
+    pdf.set_x(x_right)
+    pdf.set_font("Arial", "B", size=11)
+    pdf.set_text_color(34, 139, 34)  # Nature green
+    pdf.cell(35, 7, "TOTAL:", align="L")
+    pdf.cell(0, 7, f"{currency} {total_amount:.2f}", align="R", ln=True)
+    pdf.set_text_color(0, 0, 0)
+    pdf.ln(4)
+    
+    # ========== TAX INFORMATION SECTION (Flexible) ==========
+    if data.is_reverse_charge or data.is_export or data.is_outside_scope or data.tax_exempt_reason or data.tax_treatment:
+        pdf.set_font("Arial", "B", size=10)
+        pdf.set_text_color(34, 139, 34)  # Nature green
+        pdf.cell(0, 6, "TAX TREATMENT", ln=True)
+        pdf.set_text_color(0, 0, 0)
+        pdf.set_font("Arial", size=8)
+        
+        if data.is_reverse_charge and data.buyer_vat:
+            pdf.cell(0, 4, "VAT reverse charged to customer (B2B EU transaction).", ln=True)
+        if data.is_export:
+            pdf.cell(0, 4, "Export of services — VAT exempt per international trade rules.", ln=True)
+        if data.is_outside_scope:
+            pdf.cell(0, 4, "Transaction outside scope of VAT.", ln=True)
+        if data.tax_exempt_reason:
+            pdf.cell(0, 4, f"Tax exempt: {data.tax_exempt_reason}", ln=True)
+        if not (data.is_reverse_charge or data.is_export or data.is_outside_scope or data.tax_exempt_reason) and data.tax_treatment:
+            pdf.multi_cell(0, 4, data.tax_treatment)
+        elif not (data.is_reverse_charge or data.is_export or data.is_outside_scope or data.tax_exempt_reason):
+            pdf.cell(0, 4, "Tax calculated in accordance with local regulations.", ln=True)
+        pdf.ln(2)
+    
+    # ========== PAYMENT INFORMATION ==========
+    pdf.set_font("Arial", "B", size=10)
+    pdf.set_text_color(34, 139, 34)  # Nature green
+    pdf.cell(0, 6, "PAYMENT INFORMATION", ln=True)
+    pdf.set_text_color(0, 0, 0)
+    pdf.set_font("Arial", size=9)
+    
+    if data.payment_terms:
+        pdf.cell(0, 4, f"Terms: {data.payment_terms}", ln=True)
+    if data.due_date:
+        pdf.cell(0, 4, f"Due Date: {data.due_date}", ln=True)
+    
+    pdf.cell(0, 4, f"Method: {data.payment_provider or data.payment_system.upper()}", ln=True)
+    
+    if data.iban:
+        pdf.cell(0, 4, f"IBAN: {data.iban}", ln=True)
+    if data.swift_bic:
+        pdf.cell(0, 4, f"SWIFT/BIC: {data.swift_bic}", ln=True)
+    if data.bank_name:
+        pdf.cell(0, 4, f"Bank: {data.bank_name}", ln=True)
+    
+    if data.blockchain_tx_id:
+        pdf.cell(0, 4, f"Blockchain TX: {data.blockchain_tx_id}", ln=True)
+    
+    if data.alternative_payment_methods:
+        pdf.set_font("Arial", size=8)
+        pdf.multi_cell(0, 3, f"Other methods: {data.alternative_payment_methods}")
+        pdf.set_font("Arial", size=9)
+    
+    if data.late_payment_clause:
+        pdf.set_font("Arial", "I", size=8)
+        pdf.multi_cell(0, 3, f"Late payment: {data.late_payment_clause}")
+        pdf.set_font("Arial", size=9)
+    
+    pdf.ln(2)
+    
+    # ========== NOTES SECTION ==========
+    if data.notes:
+        pdf.set_font("Arial", "B", size=10)
+        pdf.set_text_color(0, 51, 102)
+        pdf.cell(0, 6, "NOTES", ln=True)
+        pdf.set_text_color(0, 0, 0)
+        pdf.set_font("Arial", size=8)
+        pdf.multi_cell(0, 4, data.notes)
+        pdf.ln(2)
+    
+    # ========== 7️⃣ FOOTER (Universal Legal Safety) ==========
+    pdf.set_font("Arial", "I", size=7)
+    pdf.set_text_color(100, 100, 100)
+    
+    footer_text = data.footer_statement or "This invoice is issued in accordance with applicable international tax regulations."
+    if data.registered_office:
+        footer_text += f" | Registered Office: {data.registered_office}"
+    if data.seller_registration_number:
+        footer_text += f" | Company Reg: {data.seller_registration_number}"
+    
+    pdf.multi_cell(0, 3, footer_text)
+    
+    # Generate PDF
+    pdf_str = pdf.output(dest='S')
+    if isinstance(pdf_str, (bytes, bytearray)):
+        return bytes(pdf_str)
+    return pdf_str.encode('latin-1')
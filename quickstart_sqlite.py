@@ -11,6 +11,7 @@ from sqlalchemy.orm import sessionmaker
 from models_phase1 import Base, Organization, User, Invoice, InvoiceLineItem, AuditLog
 from auth import hash_password, create_access_token
 from invoices import calculate_invoice_amounts
+import sequences
 
 # Use SQLite for quick testing
 DATABASE_URL = "sqlite:///./mijn_api_dev.db"
@@ -28,6 +29,7 @@ def create_tables():
     """Create all tables"""
     print("📊 Creating database tables...")
     Base.metadata.create_all(bind=engine)
+    sequences.metadata.create_all(bind=engine)
     print("✅ Tables created")
 
 
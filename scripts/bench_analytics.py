@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""Benchmark: /merchant/analytics queries over a synthetic invoice history.
+
+Run from the repo root:
+
+  python scripts/bench_analytics.py [invoices]
+
+Builds an `AnalyticsStore` from random invoices (default 1,000,000) spread
+over two years and times a few typical queries.
+"""
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from analytics_store import AnalyticsStore, np, parse_time  # noqa: E402
+
+
+def invoices(count):
+    rng = random.Random(42)
+    start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    for n in range(count):
+        yield {
+            "id": str(n),
+            "merchant_id": rng.randint(1, 50),
+            "currency": rng.choice(["EUR", "EUR", "USD", "GBP"]),
+            "payment_provider": rng.choice(["stripe", "paypal", "coinbase", "onecom", "web3"]),
+            "buyer_country": rng.choice(["NL", "DE", "BE", "FR", "US", "GB"]),
+            "vat_rate": rng.choice([21.0, 19.0, 0.0]),
+            "status": rng.choice(["paid", "issued"]),
+            "total": rng.randint(100, 100000) / 100,
+            "created_at": (start + timedelta(seconds=rng.randint(0, 2 * 365 * 86400))).isoformat(),
+        }
+
+
+def timed(label, fn, repeat=5):
+    best = min(_once(fn) for _ in range(repeat))
+    print(f"{label:<48} {best * 1000:8.1f} ms")
+
+
+def _once(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    store = AnalyticsStore()
+    start = time.perf_counter()
+    store.rebuild(invoices(count))
+    print(f"{count:,} invoices loaded in {time.perf_counter() - start:.1f} s (numpy: {np is not None})")
+
+    year = (parse_time("2025-01-01"), parse_time("2025-12-31", end=True))
+    everything = (parse_time("2025-01-01"), parse_time("2026-12-31", end=True))
+    timed("day x currency, one merchant, one year",
+          lambda: store.query(*year, "day", ["currency"], merchant_id=7))
+    timed("week x currency x provider, all merchants",
+          lambda: store.query(*everything, "week", ["currency", "provider"], scoped=False))
+    timed("month x all dimensions, all merchants",
+          lambda: store.query(*everything, "month", ["currency", "provider", "buyer_country", "vat_rate", "status"],
+                              scoped=False))
+    timed("hour x currency, all merchants, one year",
+          lambda: store.query(*year, "hour", ["currency"], scoped=False))
+
+
+if __name__ == "__main__":
+    main()
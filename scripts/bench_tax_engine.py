@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+"""Microbenchmark: tax decisions per second.
+
+Run from the repo root:
+
+  python scripts/bench_tax_engine.py [iterations]
+
+Compares the compiled lookup (`tax_engine.decide`) with evaluating the rules
+on every call (`tax_engine._rule`), over all known seller/buyer pairs.
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tax_engine  # noqa: E402
+
+
+def bench(fn, pairs, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for seller, buyer, b2b in pairs:
+            fn(seller, buyer, b2b)
+    elapsed = time.perf_counter() - start
+    return len(pairs) * iterations / elapsed
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    codes = list(tax_engine.GLOBAL_TAX_RATES)
+    pairs = [(s.lower(), b, b2b) for s in codes for b in codes for b2b in (False, True)]
+    raw_pairs = [(s.upper(), b, b2b) for s, b, b2b in pairs]
+    print(f"{len(pairs)} pairs x {iterations} iterations")
+    print(f"decide():  {bench(tax_engine.decide, pairs, iterations):,.0f} decisions/s")
+    print(f"_rule():   {bench(tax_engine._rule, raw_pairs, iterations):,.0f} decisions/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+"""Load test / replay: payment webhooks through the real endpoints.
+
+Run from the repo root:
+
+  python scripts/bench_webhooks.py [--events 5000] [--concurrency 50]
+  python scripts/bench_webhooks.py --inline             # WEBHOOK_ASYNC=0
+  python scripts/bench_webhooks.py --record peak.jsonl  # save the deliveries
+  python scripts/bench_webhooks.py --replay peak.jsonl  # send saved ones again
+  python scripts/bench_webhooks.py --url http://127.0.0.1:8000 --data-dir /srv/data
+
+Generates realistic Stripe / PayPal / Coinbase / One.com / web3 deliveries
+for freshly created checkout sessions. Coinbase deliveries carry a valid
+X-CC-Webhook-Signature. A share of deliveries is resent (`--duplicates`),
+as providers do on timeouts, and a share are event types we ignore.
+
+Without --url, main.app runs in-process (ASGI transport) on a throwaway
+DATA_DIR. With --url, the server must use --data-dir and the same
+COINBASE_WEBHOOK_SECRET. Sessions are seeded there and the results read
+back from there.
+
+Reports acknowledged events/sec, ack latency p50/p99, settlement throughput
+and settle lag (received -> settled, from the queue), how duplicates were
+answered, sessions with more than one invoice (should be 0), and how much
+each data file grew.
+"""
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+PROVIDERS = ["stripe", "paypal", "coinbase", "onecom", "web3"]
+BENCH_SECRET = "bench-coinbase-secret"
+
+
+# ----- payloads -----
+
+def _stripe(rng, session_id, amount, ignored):
+    intent = f"pi_{uuid.UUID(int=rng.getrandbits(128)).hex[:24]}"
+    return {
+        "id": f"evt_{uuid.UUID(int=rng.getrandbits(128)).hex[:24]}",
+        "object": "event",
+        "type": "charge.refunded" if ignored else "payment_intent.succeeded",
+        "created": int(time.time()),
+        "livemode": False,
+        "data": {"object": {"id": intent, "object": "payment_intent", "amount": int(amount * 100),
+                            "currency": "eur", "status": "succeeded", "metadata": {"session_id": session_id}}},
+    }
+
+
+def _paypal(rng, session_id, amount, ignored):
+    return {
+        "id": f"WH-{rng.getrandbits(48):012X}-{rng.getrandbits(32):08X}",
+        "event_version": "1.0",
+        "event_type": "PAYMENT.CAPTURE.DENIED" if ignored else "PAYMENT.CAPTURE.COMPLETED",
+        "resource_type": "capture",
+        "resource": {"id": f"{rng.getrandbits(64):016X}", "status": "COMPLETED", "custom_id": session_id,
+                     "amount": {"currency_code": "EUR", "value": f"{amount:.2f}"}},
+    }
+
+
+def _coinbase(rng, session_id, amount, ignored):
+    return {
+        "id": rng.randint(1, 10**9),
+        "scheduled_for": time.strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "event": {
+            "id": str(uuid.UUID(int=rng.getrandbits(128))),
+            "type": "charge:pending" if ignored else "charge:confirmed",
+            "api_version": "2018-03-22",
+            "data": {
+                "id": str(uuid.UUID(int=rng.getrandbits(128))),
+                "code": f"{rng.getrandbits(32):08X}",
+                "metadata": {"session_id": session_id},
+                "pricing": {"local": {"amount": f"{amount:.2f}", "currency": "EUR"}},
+                "payments": [{"transaction_id": f"0x{rng.getrandbits(256):064x}",
+                              "value": {"crypto": {"amount": f"{amount / 2500:.8f}", "currency": "ETH"}}}],
+            },
+        },
+    }
+
+
+def _onecom(rng, session_id, amount, ignored):
+    return {
+        "id": f"oc_{rng.getrandbits(64):016x}",
+        "event": "payment.pending" if ignored else "payment.completed",
+        "reference": session_id,
+        "amount": amount,
+        "currency": "EUR",
+        "payload": {"txn_id": f"txn_{rng.getrandbits(48):012x}"},
+    }
+
+
+def _web3(rng, session_id, amount, ignored):
+    return {
+        "event": "payment.pending" if ignored else "payment.confirmed",
+        "session_id": session_id,
+        "blockchain_tx_id": f"0x{rng.getrandbits(256):064x}",
+        "network": rng.choice(["ethereum", "polygon", "base"]),
+        "amount": amount,
+    }
+
+
+PAYLOADS = {"stripe": _stripe, "paypal": _paypal, "coinbase": _coinbase, "onecom": _onecom, "web3": _web3}
+
+
+def delivery(provider, payload, secret):
+    body = json.dumps(payload, separators=(",", ":"))
+    headers = {"Content-Type": "application/json"}
+    if provider == "coinbase":
+        headers["X-CC-Webhook-Signature"] = hmac.new(secret.encode(), body.encode(), hashlib.sha256).hexdigest()
+    return {"provider": provider, "headers": headers, "body": body}
+
+
+def generate(args, secret):
+    """Return (sessions to seed, deliveries in send order)."""
+    rng = random.Random(args.seed)
+    providers = args.providers.split(",")
+    sessions, deliveries = [], []
+    for n in range(args.events):
+        session_id = f"bench-{args.seed}-{n:07d}"
+        amount = rng.randint(500, 50000) / 100
+        sessions.append({"id": session_id, "merchant_id": rng.randint(1, 20), "amount": amount,
+                         "currency": "EUR", "status": "created", "mode": "test", "metadata": {"buyer_country": "NL"}})
+        provider = rng.choice(providers)
+        payload = PAYLOADS[provider](rng, session_id, amount, rng.random() < args.ignored)
+        deliveries.append(delivery(provider, payload, secret))
+    # Redeliveries land a little later than the original, interleaved with new traffic
+    for d in rng.sample(deliveries, int(len(deliveries) * args.duplicates)):
+        at = min(len(deliveries), deliveries.index(d) + rng.randint(1, 200))
+        deliveries.insert(at, {**d, "redelivery": True})
+    return sessions, deliveries
+
+
+# ----- measuring -----
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def data_sizes(data_dir: Path):
+    return {p.name: p.stat().st_size for p in data_dir.iterdir() if p.is_file()}
+
+
+async def fire(client, deliveries, concurrency):
+    latencies, statuses, duplicates = [], {}, 0
+    pending = iter(deliveries)
+
+    async def worker():
+        nonlocal duplicates
+        for d in pending:
+            start = time.perf_counter()
+            r = await client.post(f"/webhooks/{d['provider']}", content=d["body"], headers=d["headers"])
+            latencies.append(time.perf_counter() - start)
+            statuses[r.status_code] = statuses.get(r.status_code, 0) + 1
+            if r.status_code == 200 and r.json().get("duplicate"):
+                duplicates += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return time.perf_counter() - start, latencies, statuses, duplicates
+
+
+def wait_settled(queue, since, timeout):
+    """Block until nothing received after `since` is waiting; returns settle lags."""
+    from sqlalchemy import select
+    from webhook_queue import DONE, PENDING, PROCESSING, webhook_events as t
+
+    deadline = time.time() + timeout
+    while queue.pending() and time.time() < deadline:
+        time.sleep(0.05)
+    with queue.engine.connect() as conn:
+        rows = conn.execute(select(t.c.state, t.c.received_at, t.c.processed_at)
+                            .where(t.c.received_at >= since)).all()
+    lags = [done - received for state, received, done in rows if state == DONE]
+    last_settled = max((done for state, _, done in rows if state == DONE), default=since)
+    waiting = sum(1 for state, _, _ in rows if state in (PENDING, PROCESSING))
+    return lags, last_settled, waiting, len(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--events", type=int, default=5000, help="distinct provider events (one per session)")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--providers", default=",".join(PROVIDERS))
+    parser.add_argument("--duplicates", type=float, default=0.1, help="share of events delivered twice")
+    parser.add_argument("--ignored", type=float, default=0.05, help="share of event types we ignore")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--inline", action="store_true", help="settle before answering (WEBHOOK_ASYNC=0)")
+    parser.add_argument("--url", help="local server to target instead of the in-process app")
+    parser.add_argument("--data-dir", help="DATA_DIR (required with --url; default: a temp dir)")
+    parser.add_argument("--record", help="write the generated sessions and deliveries to this JSONL file")
+    parser.add_argument("--replay", help="send deliveries recorded with --record instead of generating")
+    parser.add_argument("--timeout", type=float, default=300, help="seconds to wait for the queue to drain")
+    args = parser.parse_args()
+
+    if args.url and not args.data_dir:
+        parser.error("--url needs --data-dir (the server's DATA_DIR)")
+    data_dir = Path(args.data_dir or tempfile.mkdtemp(prefix="bench-webhooks-"))
+    data_dir.mkdir(parents=True, exist_ok=True)
+    secret = os.environ.setdefault("COINBASE_WEBHOOK_SECRET", BENCH_SECRET)
+
+    if args.replay:
+        with open(args.replay, encoding="utf-8") as fh:
+            records = [json.loads(line) for line in fh if line.strip()]
+        sessions = [r["session"] for r in records if "session" in r]
+        deliveries = [r["delivery"] for r in records if "delivery" in r]
+    else:
+        sessions, deliveries = generate(args, secret)
+    if args.record:
+        with open(args.record, "w", encoding="utf-8") as fh:
+            for s in sessions:
+                fh.write(json.dumps({"session": s}) + "\n")
+            for d in deliveries:
+                fh.write(json.dumps({"delivery": d}) + "\n")
+
+    # Seed sessions straight into the store the app reads
+    from session_store import SessionStore
+    seeded = SessionStore(data_dir / "sessions.json")
+    for s in sessions:
+        seeded.create_session(dict(s))
+    seeded.compact()
+
+    import httpx
+    from app.db.engine import get_engine
+    from invoice_store import InvoiceStore
+    from webhook_queue import WebhookQueue
+
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, timeout=60)
+        queue = None if args.inline else WebhookQueue(get_engine(f"sqlite:///{data_dir / 'webhook_queue.db'}"))
+    else:
+        os.environ["DATA_DIR"] = str(data_dir)
+        os.environ.setdefault("JWT_SECRET_KEY", "bench-secret")
+        os.environ["WEBHOOK_ASYNC"] = "0" if args.inline else "1"
+        import main as app_main
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app_main.app), base_url="http://bench", timeout=60)
+        queue = None if args.inline else app_main.webhook_queue
+
+    before = data_sizes(data_dir)
+    started_at = time.time()
+    redeliveries = sum(1 for d in deliveries if d.get("redelivery"))
+    print(f"{len(deliveries):,} deliveries ({len(deliveries) - redeliveries:,} events + {redeliveries:,} redeliveries), "
+          f"concurrency {args.concurrency}, {'inline' if args.inline else 'queued'}, "
+          f"{'against ' + args.url if args.url else 'in-process'}, DATA_DIR {data_dir}")
+
+    async def run():
+        async with client:
+            return await fire(client, deliveries, args.concurrency)
+
+    elapsed, latencies, statuses, duplicates = asyncio.run(run())
+    print(f"acknowledged   {len(latencies) / elapsed:10.1f} events/s   "
+          f"p50 {percentile(latencies, 50) * 1000:.1f} ms   p99 {percentile(latencies, 99) * 1000:.1f} ms   "
+          f"statuses {dict(sorted(statuses.items()))}")
+
+    if queue is not None:
+        lags, last_settled, waiting, queued = wait_settled(queue, started_at, args.timeout)
+        span = max(last_settled - started_at, 1e-9)
+        print(f"settled        {len(lags) / span:10.1f} events/s   "
+              f"lag p50 {percentile(lags, 50) * 1000:.1f} ms   p99 {percentile(lags, 99) * 1000:.1f} ms   "
+              f"({len(lags):,}/{queued:,} queued events done, {waiting:,} still waiting)")
+
+    invoices = InvoiceStore(data_dir / "invoices.json", read_only=True)
+    per_session = [len(invoices.for_session(s["id"])) for s in sessions]
+    print(f"duplicates     {duplicates:,} answered as duplicate of {redeliveries:,} redeliveries; "
+          f"sessions with >1 invoice: {sum(1 for n in per_session if n > 1)}; "
+          f"paid sessions: {sum(1 for n in per_session if n)}")
+
+    after = data_sizes(data_dir)
+    print("data growth")
+    for name in sorted(after):
+        grown = after[name] - before.get(name, 0)
+        if grown:
+            print(f"  {name:<32} {grown / 1024:10.1f} KiB   ({grown / max(len(deliveries), 1):.0f} B/delivery)")
+
+
+if __name__ == "__main__":
+    main()
@@ -8,11 +8,13 @@ Example:
 from app.db.session import engine, Base
 import app.models.hosted_session as hs
 import models as legacy_models
+import sequences
 
 def main():
     # Import Base from app.db.session (already defined there)
     # Create all tables known to SQLAlchemy metadata
     Base.metadata.create_all(bind=engine)
+    sequences.metadata.create_all(bind=engine)
     print("DB initialized")
 
 if __name__ == '__main__':
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+"""Rebuild the /merchant/usage and /merchant/analytics aggregates from the command line.
+
+Run from the repo root, with the same DATA_DIR as the API:
+
+  DATA_DIR=/data python scripts/rebuild_usage_rollups.py
+
+The rollups live in each API worker's memory, so this can't reach into the
+workers directly. Instead it recomputes them here, to check the data and
+report counts, and then compacts the invoice store. That writes a new
+snapshot, and every worker reloads and rebuilds its rollups from it on its
+next invoice read. `POST /admin/usage/rebuild` only rebuilds the worker that
+happens to serve the request.
+"""
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from analytics_store import AnalyticsStore  # noqa: E402
+from invoice_store import InvoiceStore  # noqa: E402
+from usage_rollup import UsageRollup  # noqa: E402
+
+
+def main():
+    path = Path(os.getenv("DATA_DIR", "/tmp")) / "invoices.json"
+    if not path.exists():
+        sys.exit(f"No invoice store at {path}")
+    store = InvoiceStore(path)
+    started = time.perf_counter()
+    merchants = store.rebuild_listener(UsageRollup())
+    rows = store.rebuild_listener(AnalyticsStore())
+    store.compact()
+    print(f"{len(store)} invoices: {merchants} merchant rollups, {rows} analytics rows "
+          f"in {time.perf_counter() - started:.2f}s; workers rebuild from the new snapshot on their next read")
+
+
+if __name__ == "__main__":
+    main()
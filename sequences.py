@@ -0,0 +1,173 @@
+"""
+Document number allocation (invoices, credit notes).
+
+Numbers come from a counter keyed by (scope, year, prefix) instead of
+scanning existing invoices for the current maximum. Two backends:
+
+- `FileSequenceAllocator` keeps the counters in a small JSON file next to the
+  other JSON stores. An exclusive `fcntl.flock` on a sidecar lock file makes
+  reservations atomic across gunicorn workers (thread lock only on platforms
+  without fcntl).
+- `reserve_sql()` keeps the counters in the `sequence_counters` table and
+  increments them inside the caller's transaction, so the row stays locked
+  until the invoice itself is committed. The table comes from the
+  `20260301_sequence_counters` migration; scripts that build their schema
+  with `create_all()` should include this module's `metadata` too.
+
+Both support reserving a block of N numbers in one call for bulk imports.
+The first time a key is seen, an optional `seed()` callable supplies the
+highest number already in use so existing numbering continues.
+"""
+
+from pathlib import Path
+import json
+import os
+import threading
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import Column, Integer, MetaData, String, Table, and_, insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+try:
+    import fcntl
+except ImportError:  # Windows dev machines
+    fcntl = None
+
+Seed = Optional[Callable[[], int]]
+
+metadata = MetaData()
+
+sequence_counters = Table(
+    "sequence_counters",
+    metadata,
+    Column("scope", String(100), primary_key=True),  # e.g. "merchant:3", "org:12"
+    Column("year", Integer, primary_key=True),        # 0 for sequences that never reset
+    Column("prefix", String(20), primary_key=True),   # "INV", "CN", ...
+    Column("last_value", Integer, nullable=False, default=0),
+)
+
+
+def format_number(prefix: str, year: int, value: int) -> str:
+    """INV, 2026, 42 -> INV-2026-0042"""
+    return f"{prefix}-{year}-{value:04d}"
+
+
+def max_sequence(numbers, prefix: str, year: int) -> int:
+    """Highest NNNN among strings shaped like PREFIX-YEAR-NNNN (used for seeding)."""
+    head = f"{prefix}-{year}-"
+    max_num = 0
+    for num in numbers:
+        if isinstance(num, str) and num.startswith(head):
+            try:
+                max_num = max(max_num, int(num.split("-")[-1]))
+            except (ValueError, IndexError):
+                pass
+    return max_num
+
+
+# ===== FILE BACKEND =====
+
+class FileSequenceAllocator:
+    def __init__(self, path: Path, read_only: bool = False):
+        self.path = Path(path)
+        self.lock_path = self.path.with_suffix(".lock")
+        self.read_only = read_only
+        self._thread_lock = threading.Lock()
+        # Used instead of the file when the filesystem is read-only
+        self._memory: Dict[str, int] = {}
+
+    @staticmethod
+    def _key(scope: str, year: int, prefix: str) -> str:
+        return f"{scope}|{year}|{prefix}"
+
+    def _read(self) -> Dict[str, int]:
+        try:
+            data = json.loads(self.path.read_text(encoding="utf-8") or "{}")
+            return data if isinstance(data, dict) else {}
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _write(self, counters: Dict[str, int]) -> None:
+        tmp = self.path.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as fh:
+            fh.write(json.dumps(counters, indent=4, sort_keys=True))
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(tmp, self.path)
+
+    def _update(self, key: str, advance: Callable[[int], int], seed: Seed) -> int:
+        """Replace the counter with `advance(last)` under the locks; returns the previous value."""
+        with self._thread_lock:
+            if self.read_only:
+                last = self._memory.get(key)
+                if last is None:
+                    last = seed() if seed else 0
+                self._memory[key] = advance(last)
+                return last
+
+            fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                if fcntl:
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+                counters = self._read()
+                last = counters.get(key)
+                if last is None:
+                    last = seed() if seed else 0
+                new = advance(last)
+                if new != counters.get(key):
+                    counters[key] = new
+                    self._write(counters)
+            finally:
+                if fcntl:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+                os.close(fd)
+        return last
+
+    def reserve(self, scope: str, year: int, prefix: str, count: int = 1, seed: Seed = None) -> range:
+        """Atomically reserve `count` consecutive numbers and return them as a range."""
+        if count < 1:
+            raise ValueError("count must be >= 1")
+        last = self._update(self._key(scope, year, prefix), lambda last: last + count, seed)
+        return range(last + 1, last + count + 1)
+
+    def observe(self, scope: str, year: int, prefix: str, value: int, seed: Seed = None) -> None:
+        """Record a manually assigned number so later reservations continue after it."""
+        self._update(self._key(scope, year, prefix), lambda last: max(last, value), seed)
+
+    def next(self, scope: str, year: int, prefix: str, seed: Seed = None) -> int:
+        return self.reserve(scope, year, prefix, 1, seed)[0]
+
+
+# ===== SQL BACKEND =====
+
+def reserve_sql(db, scope: str, year: int, prefix: str, count: int = 1, seed: Seed = None) -> range:
+    """Reserve `count` numbers using the caller's session (not committed here).
+
+    The UPDATE takes a row lock that is held until the caller commits, so
+    concurrent workers queue up instead of handing out duplicates.
+    """
+    if count < 1:
+        raise ValueError("count must be >= 1")
+    t = sequence_counters
+    match = and_(t.c.scope == scope, t.c.year == year, t.c.prefix == prefix)
+
+    result = db.execute(update(t).where(match).values(last_value=t.c.last_value + count))
+    if result.rowcount == 0:
+        start = seed() if seed else 0
+        try:
+            with db.begin_nested():
+                db.execute(insert(t).values(scope=scope, year=year, prefix=prefix, last_value=start + count))
+        except IntegrityError:
+            # Another worker created the row first; fall back to incrementing it.
+            db.execute(update(t).where(match).values(last_value=t.c.last_value + count))
+
+    last = db.execute(select(t.c.last_value).where(match)).scalar_one()
+    return range(last - count + 1, last + 1)
+
+
+def next_sql(db, scope: str, year: int, prefix: str, seed: Seed = None) -> int:
+    return reserve_sql(db, scope, year, prefix, 1, seed)[0]
+
+
+def format_block(prefix: str, year: int, block: range) -> List[str]:
+    return [format_number(prefix, year, n) for n in block]
@@ -0,0 +1,140 @@
+"""
+In-process pub/sub for checkout session status, behind
+`GET /session/{id}/events` (server-sent events).
+
+Shops and the hosted checkout used to poll `GET /session/{id}/status`. Now they
+can hold one SSE stream that receives each status change as it happens.
+
+- `SessionEventHub` is registered as a `SessionStore` listener (see
+  invoice_store.py). Every session write that changes `status` or
+  `payment_status` is published to that session's subscribers. That covers
+  `complete_session`, webhook settlement and anything else that updates a
+  session. Because listeners also run when a process replays log lines
+  written by other workers, a stream sees another worker's update the next
+  time the store is read. The endpoint re-reads the session every few
+  seconds for that. Sessions in the DB backend are published explicitly.
+- `publish` may be called from any thread. Each subscriber holds its event
+  loop and is handed events with `call_soon_threadsafe`.
+- Subscribers are bounded per session and in total. Each one buffers at most
+  `backlog` events and drops the oldest first, since only the latest status
+  matters.
+"""
+
+import asyncio
+from collections import deque
+import threading
+from typing import Dict, Iterable, Optional, Set
+
+STATUS_FIELDS = ("status", "payment_status", "payment_provider", "paid_at", "amount", "created_at")
+
+
+class TooManySubscribers(Exception):
+    pass
+
+
+def session_status(session_id: str, session: dict) -> dict:
+    """Public status view of a session (the `/session/{id}/status` response)."""
+    return {"session_id": session_id, **{field: session.get(field) for field in STATUS_FIELDS}}
+
+
+class Subscription:
+    def __init__(self, hub: "SessionEventHub", session_id: str, loop: asyncio.AbstractEventLoop, backlog: int):
+        self.hub = hub
+        self.session_id = session_id
+        self.loop = loop
+        self._pending: deque = deque(maxlen=backlog)
+        self._ready = asyncio.Event()
+
+    def _deliver(self, payload: dict) -> None:
+        self._pending.append(payload)
+        self._ready.set()
+
+    async def get(self, timeout: float) -> Optional[dict]:
+        """Next published status, or None after `timeout` seconds without one."""
+        if not self._pending:
+            self._ready.clear()
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                return None
+        return self._pending.popleft() if self._pending else None
+
+    def close(self) -> None:
+        self.hub._unsubscribe(self)
+
+    def __enter__(self) -> "Subscription":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+class SessionEventHub:
+    def __init__(self, max_per_session: int = 8, max_total: int = 10_000, backlog: int = 16):
+        self.max_per_session = max_per_session
+        self.max_total = max_total
+        self.backlog = backlog
+        self._subs: Dict[str, Set[Subscription]] = {}
+        self._total = 0
+        self._lock = threading.Lock()
+        self.published = 0
+
+    def can_subscribe(self, session_id: str) -> bool:
+        """Whether `subscribe` would currently succeed (checked before starting a stream)."""
+        with self._lock:
+            subs = self._subs.get(str(session_id), ())
+            return len(subs) < self.max_per_session and self._total < self.max_total
+
+    def subscribe(self, session_id: str) -> Subscription:
+        """Subscribe from inside the event loop that will consume the events."""
+        sub = Subscription(self, str(session_id), asyncio.get_running_loop(), self.backlog)
+        with self._lock:
+            subs = self._subs.setdefault(sub.session_id, set())
+            if len(subs) >= self.max_per_session or self._total >= self.max_total:
+                if not subs:
+                    del self._subs[sub.session_id]
+                raise TooManySubscribers(f"too many listeners for session {sub.session_id}")
+            subs.add(sub)
+            self._total += 1
+        return sub
+
+    def _unsubscribe(self, sub: Subscription) -> None:
+        with self._lock:
+            subs = self._subs.get(sub.session_id)
+            if subs and sub in subs:
+                subs.discard(sub)
+                self._total -= 1
+                if not subs:
+                    del self._subs[sub.session_id]
+
+    def publish(self, session_id: str, payload: dict) -> int:
+        """Hand `payload` to the session's subscribers; returns how many there were."""
+        with self._lock:
+            subs = list(self._subs.get(str(session_id), ()))
+        for sub in subs:
+            try:
+                sub.loop.call_soon_threadsafe(sub._deliver, payload)
+            except RuntimeError:  # its loop has shut down
+                sub.close()
+        if subs:
+            self.published += 1
+        return len(subs)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"sessions": len(self._subs), "subscribers": self._total, "published": self.published}
+
+    # ----- SessionStore listener -----
+
+    def reset(self) -> None:
+        pass
+
+    def rebuild(self, sessions: Iterable[dict]) -> int:
+        return 0
+
+    def apply(self, old: Optional[dict], new: Optional[dict]) -> None:
+        if new is None or new.get("id") is None or str(new["id"]) not in self._subs:
+            return
+        if old is not None and (old.get("status"), old.get("payment_status")) == (new.get("status"), new.get("payment_status")):
+            return
+        self.publish(new["id"], session_status(str(new["id"]), new))
@@ -0,0 +1,248 @@
+"""
+File-backed hosted checkout sessions.
+
+Each webhook handler used to load all of sessions.json, scan it for one id
+and write the whole file back. `SessionStore` keeps sessions in the same
+snapshot + append-only log layout as `InvoiceStore`, so a lookup is a dict
+access and an update appends a single line.
+
+Sessions don't stay in the hot set forever. Paid and failed sessions older
+than `archive_after_seconds`, and sessions nobody finished after
+`abandon_after_seconds`, move to `sessions_archive.jsonl`. Archival runs with
+compaction, and at least every `archive_interval_seconds`. An archived
+session can still be looked up by id through an offset index into the
+archive, so a late webhook still finds it. Updating an archived session
+brings it back into the hot set.
+
+The archive itself is kept for `archive_retention_seconds`. At most every
+`archive_prune_interval_seconds`, archival rewrites it without sessions past
+retention, superseded copies and sessions that were brought back, so the file
+and the index over it stop growing once traffic is steady. Other processes
+notice the rewritten file (new inode) and re-index it.
+
+`SessionBackend` is the interface shared with the DB-backed sessions in
+`app/db/sessions.py`, so handlers are written once for both.
+"""
+
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+import json
+import os
+import threading
+from time import monotonic
+from typing import Dict, List, Optional, Protocol
+
+from invoice_store import InvoiceStore
+
+TERMINAL_STATUSES = ("paid", "failed")
+
+
+class SessionBackend(Protocol):
+    def create_session(self, session_dict: Dict) -> Dict: ...
+
+    def get_session(self, session_id: str) -> Optional[Dict]: ...
+
+    def update_session(self, session_id: str, updates: Dict) -> Optional[Dict]: ...
+
+
+def _age_seconds(session: dict, now: datetime) -> Optional[float]:
+    stamp = session.get("paid_at") or session.get("created_at")
+    if not stamp or not isinstance(stamp, str):
+        return None
+    try:
+        parsed = datetime.fromisoformat(stamp.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)  # written with utcnow()
+    return (now - parsed).total_seconds()
+
+
+class SessionStore(InvoiceStore):
+    kind = "session"
+    indexed_fields = ("merchant_id", "status")
+
+    def __init__(self, snapshot_path: Path, log_path: Optional[Path] = None, archive_path: Optional[Path] = None,
+                 read_only: bool = False, compact_threshold: int = 1000,
+                 archive_after_seconds: float = 7 * 86400, abandon_after_seconds: float = 30 * 86400,
+                 archive_interval_seconds: float = 3600,
+                 archive_retention_seconds: Optional[float] = 365 * 86400,
+                 archive_prune_interval_seconds: float = 86400):
+        super().__init__(snapshot_path, log_path=log_path, read_only=read_only, compact_threshold=compact_threshold)
+        self.archive_path = Path(archive_path) if archive_path else self.snapshot_path.with_name(
+            self.snapshot_path.stem + "_archive.jsonl")
+        self.archive_after_seconds = archive_after_seconds
+        self.abandon_after_seconds = abandon_after_seconds
+        self.archive_interval_seconds = archive_interval_seconds
+        self.archive_retention_seconds = archive_retention_seconds  # None keeps archived sessions forever
+        self.archive_prune_interval_seconds = archive_prune_interval_seconds
+        self._archive_lock = threading.Lock()
+        self._archive_index: Dict[str, int] = {}
+        self._archive_offset = 0
+        self._archive_inode: Optional[int] = None
+        self._next_archive = monotonic() + archive_interval_seconds
+        self._next_prune = monotonic()
+
+    # ----- SessionBackend -----
+
+    def create_session(self, session_dict: Dict) -> Dict:
+        return self.put(session_dict)
+
+    def get_session(self, session_id: str) -> Optional[Dict]:
+        session = self.get(session_id)
+        if session is None:
+            session = self._read_archived(str(session_id))
+        return session
+
+    @contextmanager
+    def locked(self):
+        """Hold the store's lock (this process and others) across several reads and writes."""
+        with self._lock, self._write_lock():
+            yield self
+
+    def update_session(self, session_id: str, updates: Dict) -> Optional[Dict]:
+        # Held across read and write so concurrent workers' updates don't overwrite each other
+        with self._lock, self._write_lock():
+            current = self.get_session(session_id)
+            if current is None:
+                return None
+            current.update(updates)
+            return self.put(current)
+
+    # ----- archive -----
+
+    def _scan_archive(self, fh) -> None:
+        """Index archive lines appended since the last scan (by any process).
+
+        A pruned archive is a new file, so the index starts over when the inode changes.
+        """
+        inode = os.fstat(fh.fileno()).st_ino
+        if inode != self._archive_inode:
+            self._archive_index.clear()
+            self._archive_offset = 0
+            self._archive_inode = inode
+        fh.seek(self._archive_offset)
+        chunk = fh.read()
+        end = chunk.rfind(b"\n") + 1
+        pos = self._archive_offset
+        for raw in chunk[:end].splitlines(keepends=True):
+            try:
+                session_id = json.loads(raw).get("id")
+            except (ValueError, AttributeError):
+                session_id = None
+            if session_id is not None:
+                self._archive_index[str(session_id)] = pos
+            pos += len(raw)
+        self._archive_offset += end
+
+    def _read_archived(self, session_id: str) -> Optional[dict]:
+        with self._archive_lock:
+            try:
+                fh = open(self.archive_path, "rb")
+            except FileNotFoundError:
+                return None
+            # Scan and read through one handle so a concurrent prune can't move the offsets
+            with fh:
+                self._scan_archive(fh)
+                offset = self._archive_index.get(session_id)
+                if offset is None:
+                    return None
+                fh.seek(offset)
+                return json.loads(fh.readline())
+
+    def _expired(self, session: dict, now: datetime) -> bool:
+        age = _age_seconds(session, now)
+        if age is None:
+            return False
+        if session.get("status") in TERMINAL_STATUSES:
+            return age >= self.archive_after_seconds
+        return age >= self.abandon_after_seconds
+
+    def archive_expired(self, now: Optional[datetime] = None) -> int:
+        """Move expired sessions to the archive; returns how many moved."""
+        if self.read_only:
+            return 0
+        now = now or datetime.now(timezone.utc)
+        with self._lock, self._write_lock():
+            self._refresh()
+            expired: List[dict] = [s for s in self._records.values() if s.get("id") is not None and self._expired(s, now)]
+            if expired:
+                # Archive first, then drop from the hot set: a crash in between
+                # leaves a duplicate, never a lost session.
+                data = "".join(json.dumps(s, default=str) + "\n" for s in expired).encode("utf-8")
+                fd = os.open(self.archive_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+                try:
+                    os.write(fd, data)
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+                self._append({"op": "delete", "id": str(s["id"])} for s in expired)
+                self._replay_log()
+            if monotonic() >= self._next_prune:
+                self._prune_archive(now)
+            self._next_archive = monotonic() + self.archive_interval_seconds
+        return len(expired)
+
+    def _prune_archive(self, now: datetime) -> int:
+        """Rewrite the archive without dead entries; returns how many lines were dropped.
+
+        Called under the write lock, after the hot set was refreshed.
+        """
+        self._next_prune = monotonic() + self.archive_prune_interval_seconds
+        try:
+            with open(self.archive_path, "rb") as fh:
+                lines = fh.read().splitlines(keepends=True)
+        except FileNotFoundError:
+            return 0
+        latest: Dict[str, int] = {}
+        sessions: List[Optional[dict]] = []
+        for n, raw in enumerate(lines):
+            try:
+                session = json.loads(raw)
+            except ValueError:
+                session = None
+            if not isinstance(session, dict) or session.get("id") is None:
+                session = None
+            else:
+                latest[str(session["id"])] = n
+            sessions.append(session)
+
+        def keep(n: int, session: Optional[dict]) -> bool:
+            if session is None or not lines[n].endswith(b"\n"):
+                return False
+            session_id = str(session["id"])
+            if latest[session_id] != n or session_id in self._records:
+                return False  # superseded by a later copy, or back in the hot set
+            if self.archive_retention_seconds is None:
+                return True
+            age = _age_seconds(session, now)
+            return age is None or age < self.archive_retention_seconds
+
+        kept = [raw for n, (raw, session) in enumerate(zip(lines, sessions)) if keep(n, session)]
+        dropped = len(lines) - len(kept)
+        if dropped:
+            tmp = self.archive_path.with_suffix(".tmp")
+            with open(tmp, "wb") as fh:
+                fh.write(b"".join(kept))
+                fh.flush()
+                os.fsync(fh.fileno())
+            os.replace(tmp, self.archive_path)
+        return dropped
+
+    def _should_compact(self) -> bool:
+        return super()._should_compact() or monotonic() >= self._next_archive
+
+    def compact(self) -> None:
+        self.archive_expired()
+        super().compact()
+
+    def stats(self) -> dict:
+        with self._archive_lock:
+            try:
+                with open(self.archive_path, "rb") as fh:
+                    self._scan_archive(fh)
+            except FileNotFoundError:
+                pass
+            archived = len(self._archive_index)
+        return {"active": len(self), "archived": archived}
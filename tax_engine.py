@@ -0,0 +1,399 @@
+"""
+Single source for tax determination.
+
+The rate tables, region membership and country compliance rules used to be
+spread over main.py, invoices.py and vat_engine.py, each re-deriving the
+seller/buyer rules on every call. They now live here and are compiled once at
+import:
+
+- `REGION_BY_COUNTRY` maps a country code straight to its region;
+- `_DECISIONS` holds the `TaxDecision` for every (seller, buyer, b2b)
+  combination of known countries.
+
+`decide()` is a dict lookup for known countries and falls back to an LRU
+cache for codes outside the tables. See scripts/bench_tax_engine.py for
+decisions per second.
+"""
+
+from dataclasses import dataclass
+from functools import lru_cache
+
+# INTERNATIONAL TAX RATES DATABASE (2026)
+# Format: 'COUNTRY_CODE': tax_rate_percentage
+
+# EU countries - VAT rates
+EU_COUNTRIES = {
+    'AT': 20.0,  'BE': 21.0,  'BG': 20.0,  'HR': 25.0,  'CY': 19.0,
+    'CZ': 21.0,  'DK': 25.0,  'EE': 22.0,  'FI': 25.5,  'FR': 20.0,
+    'DE': 19.0,  'GR': 24.0,  'HU': 27.0,  'IE': 23.0,  'IT': 22.0,
+    'LV': 21.0,  'LT': 21.0,  'LU': 17.0,  'MT': 18.0,  'NL': 21.0,
+    'PL': 23.0,  'PT': 23.0,  'RO': 19.0,  'SK': 20.0,  'SI': 22.0,
+    'ES': 21.0,  'SE': 25.0,
+}
+
+# Non-EU Europe
+NON_EU_EUROPE = {
+    'GB': 20.0,   # United Kingdom (post-Brexit)
+    'CH': 7.7,    # Switzerland
+    'NO': 25.0,   # Norway
+    'IS': 24.0,   # Iceland
+    'UA': 20.0,   # Ukraine
+    'RU': 18.0,   # Russia
+    'TR': 18.0,   # Turkey
+}
+
+# Americas
+AMERICAS = {
+    'US': 0.0,    # No federal sales tax (state-level handling)
+    'CA': 5.0,    # Canada GST (plus PST per province)
+    'MX': 16.0,   # Mexico
+    'BR': 15.0,   # Brazil (ICMS average)
+    'AR': 21.0,   # Argentina
+    'CL': 19.0,   # Chile
+    'CO': 19.0,   # Colombia
+}
+
+# Asia-Pacific
+ASIA_PACIFIC = {
+    'AU': 10.0,   # Australia GST
+    'NZ': 15.0,   # New Zealand GST
+    'JP': 10.0,   # Japan Consumption Tax
+    'KR': 10.0,   # South Korea
+    'CN': 13.0,   # China (VAT average)
+    'IN': 18.0,   # India (CGST average)
+    'SG': 8.0,    # Singapore GST
+    'TH': 7.0,    # Thailand VAT
+    'ID': 11.0,   # Indonesia
+    'MY': 6.0,    # Malaysia SST
+}
+
+# Middle East & Africa
+MIDDLE_EAST_AFRICA = {
+    'AE': 5.0,    # UAE VAT
+    'SA': 15.0,   # Saudi Arabia VAT
+    'EG': 14.0,   # Egypt VAT
+    'ZA': 15.0,   # South Africa VAT
+    'NG': 7.5,    # Nigeria VAT
+}
+
+# Combine all into global tax database
+GLOBAL_TAX_RATES = {
+    **EU_COUNTRIES,
+    **NON_EU_EUROPE,
+    **AMERICAS,
+    **ASIA_PACIFIC,
+    **MIDDLE_EAST_AFRICA,
+}
+
+# Regions for tax rule determination
+TAX_REGIONS = {
+    'EU': set(EU_COUNTRIES.keys()),
+    'ECEA': set(NON_EU_EUROPE.keys()),  # Europe, Caucasus, Central Asia
+    'AMERICAS': set(AMERICAS.keys()),
+    'ASIA_PACIFIC': set(ASIA_PACIFIC.keys()),
+    'MIDDLE_EAST_AFRICA': set(MIDDLE_EAST_AFRICA.keys()),
+}
+
+# Country-specific VAT & compliance database
+COUNTRY_VAT_RULES = {
+    "NL": {
+        "name": "Netherlands",
+        "standard_rate": 21.0,
+        "reduced_rates": [9.0],  # Food, books, medicines
+        "oss_threshold": 10000,  # EUR
+        "currency": "EUR",
+        "tax_authority": "Belastingdienst",
+        "vat_return_frequency": "Quarterly",
+        "invoice_requirements": [
+            "Sequential invoice number",
+            "VAT identification number",
+            "Date of supply",
+            "Customer VAT number (B2B)",
+            "Reverse charge notation (EU B2B)"
+        ],
+        "reverse_charge_phrase": "Verlegd naar u - BTW-heffing bij afnemer",
+        "digital_reporting": "Yes - SAF-T required",
+        "record_retention_years": 7,
+    },
+    "DE": {
+        "name": "Germany",
+        "standard_rate": 19.0,
+        "reduced_rates": [7.0],
+        "oss_threshold": 10000,
+        "currency": "EUR",
+        "tax_authority": "Bundeszentralamt für Steuern",
+        "vat_return_frequency": "Monthly/Quarterly",
+        "invoice_requirements": [
+            "Rechnungsnummer (invoice number)",
+            "Steuernummer (tax number)",
+            "Reverse charge: 'Steuerschuldnerschaft des Leistungsempfängers'",
+            "GoBD compliant archiving"
+        ],
+        "reverse_charge_phrase": "Steuerschuldnerschaft des Leistungsempfängers gemäß §13b UStG",
+        "digital_reporting": "Yes - GoBD compliance required",
+        "record_retention_years": 10,
+    },
+    "FR": {
+        "name": "France",
+        "standard_rate": 20.0,
+        "reduced_rates": [10.0, 5.5, 2.1],
+        "oss_threshold": 10000,
+        "currency": "EUR",
+        "tax_authority": "Direction Générale des Finances Publiques (DGFiP)",
+        "vat_return_frequency": "Monthly",
+        "invoice_requirements": [
+            "Numéro de TVA intracommunautaire",
+            "Autoliquidation mention (reverse charge)",
+            "Electronic invoicing mandatory from 2026"
+        ],
+        "reverse_charge_phrase": "Autoliquidation - Article 283-2 du CGI",
+        "digital_reporting": "Yes - E-invoicing mandatory 2026",
+        "record_retention_years": 6,
+    },
+    "BE": {
+        "name": "Belgium",
+        "standard_rate": 21.0,
+        "reduced_rates": [12.0, 6.0],
+        "oss_threshold": 10000,
+        "currency": "EUR",
+        "tax_authority": "FOD Financiën / SPF Finances",
+        "vat_return_frequency": "Monthly/Quarterly",
+        "invoice_requirements": [
+            "BTW-nummer / Numéro de TVA",
+            "Sequential numbering per fiscal year",
+            "Reverse charge: 'Autoliquidation / Verlegde BTW'"
+        ],
+        "reverse_charge_phrase": "Autoliquidation / Verlegde BTW - Art. 51 §2 1° WBTW/CTVA",
+        "digital_reporting": "Yes - Mandatory listing required",
+        "record_retention_years": 7,
+    },
+    "GB": {
+        "name": "United Kingdom",
+        "standard_rate": 20.0,
+        "reduced_rates": [5.0, 0.0],
+        "oss_threshold": 0,  # Post-Brexit: no EU OSS
+        "currency": "GBP",
+        "tax_authority": "HM Revenue & Customs (HMRC)",
+        "vat_return_frequency": "Quarterly",
+        "invoice_requirements": [
+            "VAT registration number",
+            "Unique sequential invoice number",
+            "Making Tax Digital (MTD) compliance",
+            "No reverse charge for EU (post-Brexit)"
+        ],
+        "reverse_charge_phrase": "Reverse charge: Customer to account for VAT",
+        "digital_reporting": "Yes - Making Tax Digital mandatory",
+        "record_retention_years": 6,
+        "special_notes": "Post-Brexit: EU B2B treated as exports (0% VAT with proof)"
+    },
+    "US": {
+        "name": "United States",
+        "standard_rate": 0.0,  # No federal VAT
+        "reduced_rates": [],
+        "oss_threshold": 0,
+        "currency": "USD",
+        "tax_authority": "State-specific (no federal VAT)",
+        "vat_return_frequency": "State-dependent",
+        "invoice_requirements": [
+            "Sales tax varies by state",
+            "Economic nexus rules apply",
+            "Marketplace facilitator laws"
+        ],
+        "reverse_charge_phrase": "N/A - Use tax applies",
+        "digital_reporting": "State-dependent",
+        "record_retention_years": 7,
+        "special_notes": "No VAT - Sales tax system. Each state has different rates (0-10%). Economic nexus: $100k+ or 200+ transactions."
+    },
+    "ES": {
+        "name": "Spain",
+        "standard_rate": 21.0,
+        "reduced_rates": [10.0, 4.0],
+        "oss_threshold": 10000,
+        "currency": "EUR",
+        "tax_authority": "Agencia Tributaria",
+        "vat_return_frequency": "Quarterly/Monthly",
+        "invoice_requirements": [
+            "NIF (tax ID) or VAT number",
+            "Reverse charge: 'Inversión del sujeto pasivo'",
+            "SII (Immediate Supply of Information) for large companies"
+        ],
+        "reverse_charge_phrase": "Inversión del sujeto pasivo - Art. 84.Uno.2º LIVA",
+        "digital_reporting": "Yes - SII for turnover >6M EUR",
+        "record_retention_years": 4,
+    },
+    "IT": {
+        "name": "Italy",
+        "standard_rate": 22.0,
+        "reduced_rates": [10.0, 5.0, 4.0],
+        "oss_threshold": 10000,
+        "currency": "EUR",
+        "tax_authority": "Agenzia delle Entrate",
+        "vat_return_frequency": "Monthly/Quarterly",
+        "invoice_requirements": [
+            "Partita IVA (VAT number)",
+            "SDI (electronic invoicing) mandatory",
+            "Reverse charge: 'Inversione contabile - Reverse charge'"
+        ],
+        "reverse_charge_phrase": "Inversione contabile art. 17 c. 6 DPR 633/72",
+        "digital_reporting": "Yes - FatturaPA (SDI) mandatory",
+        "record_retention_years": 10,
+    },
+    "SE": {
+        "name": "Sweden",
+        "standard_rate": 25.0,
+        "reduced_rates": [12.0, 6.0],
+        "oss_threshold": 10000,
+        "currency": "SEK",
+        "tax_authority": "Skatteverket",
+        "vat_return_frequency": "Monthly",
+        "invoice_requirements": [
+            "Organisationsnummer and VAT number",
+            "Reverse charge: 'Omvänd skattskyldighet'",
+            "Electronic invoicing recommended"
+        ],
+        "reverse_charge_phrase": "Omvänd skattskyldighet enligt 1 kap. 2 § ML",
+        "digital_reporting": "Yes - SIE format for accounting",
+        "record_retention_years": 7,
+    },
+    "PL": {
+        "name": "Poland",
+        "standard_rate": 23.0,
+        "reduced_rates": [8.0, 5.0],
+        "oss_threshold": 10000,
+        "currency": "PLN",
+        "tax_authority": "Krajowa Administracja Skarbowa",
+        "vat_return_frequency": "Monthly",
+        "invoice_requirements": [
+            "NIP number (tax ID)",
+            "KSeF (structured electronic invoices) from 2024",
+            "Split payment mechanism for high-risk goods"
+        ],
+        "reverse_charge_phrase": "Odwrotne obciążenie - Art. 17 ust. 1 pkt 4 Ustawy o VAT",
+        "digital_reporting": "Yes - KSeF mandatory from 2024",
+        "record_retention_years": 5,
+    },
+}
+
+REGION_BY_COUNTRY = {
+    country: region for region, countries in TAX_REGIONS.items() for country in countries
+}
+
+DEFAULT_COUNTRY = 'NL'
+
+
+@dataclass(frozen=True)
+class TaxDecision:
+    rate: float
+    reverse_charge: bool
+    jurisdiction: str
+    explanation: str
+
+
+def region_for(country: str) -> str:
+    """Region for an upper-case country code ('OTHER' when unknown)."""
+    return REGION_BY_COUNTRY.get(country, 'OTHER')
+
+
+def get_tax_rate(country: str) -> float:
+    """Get standard tax rate for a country"""
+    return GLOBAL_TAX_RATES.get(country.upper(), 0.0)
+
+
+def _rule(seller: str, buyer: str, b2b: bool) -> TaxDecision:
+    """The actual rules; only called while compiling the table or on a cache miss."""
+    seller_region = region_for(seller)
+    buyer_region = region_for(buyer)
+
+    # === EU RULES ===
+    if seller_region == 'EU' and buyer_region == 'EU':
+        if seller == buyer:
+            # Same country - charge local VAT
+            rate = EU_COUNTRIES[seller]
+            return TaxDecision(rate, False, seller, f"Domestic (EU) - {seller} VAT {rate}%")
+        if b2b:
+            # B2B with VAT number - reverse charge (0%)
+            return TaxDecision(0.0, True, buyer, f"EU B2B Reverse Charge - {seller} to {buyer}")
+        # B2C - charge seller's VAT
+        rate = EU_COUNTRIES[seller]
+        return TaxDecision(rate, False, seller, f"EU B2C - {seller} VAT {rate}%")
+    if seller_region == 'EU':
+        # EU seller selling to non-EU
+        return TaxDecision(0.0, False, seller, f"Export from {seller} - 0% VAT")
+    if buyer_region == 'EU':
+        # Non-EU seller selling to EU
+        rate = EU_COUNTRIES[buyer]
+        return TaxDecision(rate, False, buyer, f"Import to {buyer} - {buyer} VAT {rate}%")
+
+    # === US RULES (simplified - destination tax per state) ===
+    if seller == 'US' and buyer == 'US':
+        return TaxDecision(0.0, False, 'US', "US - Sales tax applies per state (state code required)")
+    if seller == 'US':
+        return TaxDecision(0.0, False, seller, "US Export - 0% tax")
+    if buyer == 'US':
+        return TaxDecision(0.0, False, buyer, "Import to US - federal 0% (state tax may apply)")
+
+    # === CANADA RULES (GST only) ===
+    if seller == 'CA' and buyer == 'CA':
+        return TaxDecision(5.0, False, 'CA', "Canada Domestic - GST applies")
+    if seller == 'CA':
+        return TaxDecision(0.0, False, seller, "Canadian Export - 0% tax")
+    if buyer == 'CA':
+        return TaxDecision(5.0, False, buyer, "Import to Canada - GST 5%")
+
+    # === DEFAULT: Same country or seller's rate (origin principle) ===
+    rate = get_tax_rate(seller)
+    if seller == buyer:
+        return TaxDecision(rate, False, seller, f"Domestic - {seller} rate {rate}%")
+    return TaxDecision(rate, False, seller, f"International - {seller} rate applies {rate}%")
+
+
+_DECISIONS = {
+    (seller, buyer, b2b): _rule(seller, buyer, b2b)
+    for seller in GLOBAL_TAX_RATES
+    for buyer in GLOBAL_TAX_RATES
+    for b2b in (False, True)
+}
+
+
+@lru_cache(maxsize=1024)
+def _decide_uncompiled(seller: str, buyer: str, b2b: bool) -> TaxDecision:
+    return _rule(seller, buyer, b2b)
+
+
+def decide(seller_country: str, buyer_country: str, b2b: bool = False) -> TaxDecision:
+    """
+    Tax decision for a sale. Empty seller defaults to NL, empty buyer to the seller.
+    `b2b` means the buyer supplied a VAT/tax id (enables EU reverse charge).
+    """
+    seller = seller_country.upper() if seller_country else DEFAULT_COUNTRY
+    buyer = buyer_country.upper() if buyer_country else seller
+    key = (seller, buyer, bool(b2b))
+    decision = _DECISIONS.get(key)
+    if decision is None:
+        decision = _decide_uncompiled(*key)
+    return decision
+
+
+_DEFAULT_COUNTRY_INFO = {
+    "standard_rate": 20.0,
+    "reduced_rates": [10.0],
+    "oss_threshold": 10000,
+    "currency": "EUR",
+    "tax_authority": "Local tax authority",
+    "vat_return_frequency": "Quarterly",
+    "invoice_requirements": ["VAT number", "Sequential numbering", "Reverse charge notation for EU B2B"],
+    "reverse_charge_phrase": "Reverse charge applies - VAT payable by customer",
+    "digital_reporting": "Check local requirements",
+    "record_retention_years": 7,
+}
+
+
+def get_country_vat_info(country_code: str) -> dict:
+    """Get VAT rules for a specific country. Returns generic EU rules if country not found."""
+    country = country_code.upper() if country_code else "XX"
+    if country in COUNTRY_VAT_RULES:
+        return COUNTRY_VAT_RULES[country]
+    info = {"name": country, **_DEFAULT_COUNTRY_INFO}
+    info["reduced_rates"] = list(info["reduced_rates"])
+    info["invoice_requirements"] = list(info["invoice_requirements"])
+    return info
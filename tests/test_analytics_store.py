@@ -0,0 +1,157 @@
+import json
+import random
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi.testclient import TestClient
+
+import analytics_store
+import main
+from analytics_store import AnalyticsStore, parse_time
+from invoice_store import InvoiceStore
+
+client = TestClient(main.app)
+START = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+def _invoices(n=400, seed=3):
+    rng = random.Random(seed)
+    return [{
+        "id": f"inv-{i}",
+        "merchant_id": rng.choice([1, 2, None]),
+        "created_by": rng.choice(["shop1", "shop2", None]),
+        "currency": rng.choice(["EUR", "usd"]),
+        "payment_provider": rng.choice(["stripe", "paypal", "coinbase", None]),
+        "payment_system": rng.choice(["web2", "web3"]),
+        "buyer_country": rng.choice(["NL", "de", None]),
+        "vat_rate": rng.choice([21.0, 19, 0, None]),
+        "status": rng.choice(["issued", "paid"]),
+        "total": f"{rng.randint(-500, 50000) / 100:.2f}",
+        "created_at": (START + timedelta(minutes=rng.randint(0, 60 * 24 * 90))).isoformat(),
+    } for i in range(n)]
+
+
+def _reference(invoices, start, end, granularity, group_by, merchant_id, created_by):
+    acc = defaultdict(lambda: [0, 0])
+    for inv in invoices:
+        created = datetime.fromisoformat(inv["created_at"])
+        if not start <= created.timestamp() <= end:
+            continue
+        if not ((merchant_id is not None and inv["merchant_id"] == merchant_id)
+                or (created_by is not None and inv["created_by"] == created_by)):
+            continue
+        if granularity == "week":
+            period = (created - timedelta(days=created.weekday())).strftime("%Y-%m-%d")
+        else:
+            period = created.strftime({"hour": "%Y-%m-%dT%H:00Z", "day": "%Y-%m-%d", "month": "%Y-%m"}[granularity])
+        values = dict(zip(analytics_store.DIMENSIONS, analytics_store._dimension_values(inv)))
+        entry = acc[(period,) + tuple(values[d] for d in group_by)]
+        entry[0] += 1
+        entry[1] += round(float(inv["total"]) * 100)
+    return {key: tuple(v) for key, v in acc.items()}
+
+
+def _as_dict(rows, group_by):
+    return {(r["period"],) + tuple(r[d] for d in group_by): (r["count"], r["amount_cents"]) for r in rows}
+
+
+@pytest.mark.parametrize("use_numpy", [True, False])
+@pytest.mark.parametrize("granularity", ["hour", "day", "week", "month"])
+def test_query_matches_row_by_row_aggregation(monkeypatch, use_numpy, granularity):
+    if use_numpy and analytics_store.np is None:
+        pytest.skip("numpy not installed")
+    if not use_numpy:
+        monkeypatch.setattr(analytics_store, "np", None)
+    invoices = _invoices()
+    store = AnalyticsStore()
+    store.rebuild(invoices)
+    start, end = parse_time("2026-01-10"), parse_time("2026-03-15", end=True)
+    group_by = ["currency", "provider", "vat_rate"]
+    rows = store.query(start, end, granularity, group_by, merchant_id=1, created_by="shop1")
+    assert _as_dict(rows, group_by) == _reference(invoices, start, end, granularity, group_by, 1, "shop1")
+    assert [r["period"] for r in rows] == sorted(r["period"] for r in rows)
+
+
+def test_store_listener_keeps_columns_in_sync(tmp_path):
+    snapshot = tmp_path / "invoices.json"
+    snapshot.write_text("[]", encoding="utf-8")
+    store = InvoiceStore(snapshot)
+    analytics = AnalyticsStore()
+    store.add_listener(analytics)
+
+    invoices = {inv["id"]: inv for inv in _invoices(300, seed=9)}
+    rng = random.Random(1)
+    for inv in invoices.values():
+        store.put(inv)
+    for inv_id in rng.sample(sorted(invoices), 120):
+        invoices[inv_id] = dict(invoices[inv_id], status="void", total="1.00")
+        store.put(invoices[inv_id])
+    for inv_id in rng.sample(sorted(invoices), 80):
+        store.delete(inv_id)
+        del invoices[inv_id]
+
+    start, end = parse_time("2026-01-01"), parse_time("2026-12-31", end=True)
+    rows = analytics.query(start, end, "month", ["status"], scoped=False)
+    expected = _reference(invoices.values(), start, end, "month", ["status"], 1, None)
+    expected_all = defaultdict(lambda: [0, 0])
+    for inv in invoices.values():
+        key = (inv["created_at"][:7], inv["status"])
+        expected_all[key][0] += 1
+        expected_all[key][1] += round(float(inv["total"]) * 100)
+    assert _as_dict(rows, ["status"]) == {k: tuple(v) for k, v in expected_all.items()}
+    assert _as_dict(analytics.query(start, end, "month", ["status"], merchant_id=1), ["status"]) == expected
+    assert analytics.stats()["rows"] == len(invoices)
+
+
+def test_analytics_endpoint(tmp_path, monkeypatch):
+    snapshot = tmp_path / "invoices.json"
+    snapshot.write_text("[]", encoding="utf-8")
+    store = InvoiceStore(snapshot)
+    analytics = AnalyticsStore()
+    store.add_listener(analytics)
+    for n in range(6):
+        store.put({"id": f"i{n}", "merchant_id": 7, "currency": "EUR", "total": 10 + n,
+                   "payment_provider": "stripe" if n % 2 else "paypal",
+                   "created_at": f"2026-03-0{n + 1}T09:00:00"})
+    store.put({"id": "other", "merchant_id": 8, "total": 99, "created_at": "2026-03-01T09:00:00"})
+    monkeypatch.setattr(main, "invoice_store", store)
+    monkeypatch.setattr(main, "analytics_store", analytics)
+    main.app.dependency_overrides[main.get_current_user] = lambda: {"id": 7, "name": "shop7", "role": "user"}
+    try:
+        r = client.get("/merchant/analytics", params={"granularity": "month", "group_by": "provider",
+                                                       "from": "2026-03-01", "to": "2026-03-31"})
+        assert r.status_code == 200
+        body = r.json()
+        assert body["group_by"] == ["currency", "provider"]
+        assert body["series"] == [
+            {"period": "2026-03", "currency": "EUR", "provider": "paypal", "count": 3, "amount": 36.0},
+            {"period": "2026-03", "currency": "EUR", "provider": "stripe", "count": 3, "amount": 39.0},
+        ]
+        r = client.get("/merchant/analytics", params={"granularity": "hour", "from": "2020-01-01"})
+        assert r.status_code == 400
+        r = client.get("/merchant/analytics", params={"group_by": "colour"})
+        assert r.status_code == 400
+    finally:
+        main.app.dependency_overrides.pop(main.get_current_user, None)
+
+
+def test_analytics_built_on_first_query(tmp_path, monkeypatch):
+    snapshot = tmp_path / "invoices.json"
+    snapshot.write_text(json.dumps([{"id": "i1", "merchant_id": 7, "total": 5, "created_at": "2026-03-01T09:00:00"}]),
+                        encoding="utf-8")
+    store = InvoiceStore(snapshot)
+    analytics = AnalyticsStore()
+    store.get("i1")  # loaded before analytics is attached, as in a worker that served other requests
+    monkeypatch.setattr(main, "invoice_store", store)
+    monkeypatch.setattr(main, "analytics_store", analytics)
+    main.app.dependency_overrides[main.get_current_user] = lambda: {"id": 7, "name": "shop7", "role": "user"}
+    try:
+        assert analytics.stats()["rows"] == 0
+        params = {"granularity": "month", "from": "2026-03-01", "to": "2026-03-31"}
+        assert client.get("/merchant/analytics", params=params).json()["series"][0]["count"] == 1
+        store.put({"id": "i2", "merchant_id": 7, "total": 6, "created_at": "2026-03-02T09:00:00"})
+        assert client.get("/merchant/analytics", params=params).json()["series"][0]["count"] == 2
+        assert analytics.stats()["rows"] == 2
+    finally:
+        main.app.dependency_overrides.pop(main.get_current_user, None)
@@ -0,0 +1,50 @@
+import time
+
+from api_key_cache import APIKeyCache
+
+
+def test_hit_miss_and_copy():
+    cache = APIKeyCache(ttl_seconds=60)
+    assert cache.get("h1") == (False, None)
+    cache.set("h1", {"key": {"id": 1}, "user": {"id": 5}})
+    found, principal = cache.get("h1")
+    assert found and principal["user"]["id"] == 5
+    principal["user"]["id"] = 99
+    assert cache.get("h1")[1]["user"]["id"] == 5
+    assert cache.stats() == {"entries": 1, "hits": 2, "misses": 1}
+
+
+def test_negative_entries_use_short_ttl():
+    cache = APIKeyCache(ttl_seconds=60, negative_ttl_seconds=0.05)
+    cache.set("bad", None)
+    assert cache.get("bad") == (True, None)
+    time.sleep(0.06)
+    assert cache.get("bad") == (False, None)
+
+
+def test_lru_eviction_and_invalidate():
+    cache = APIKeyCache(max_entries=2)
+    cache.set("a", {"n": 1})
+    cache.set("b", {"n": 2})
+    cache.get("a")
+    cache.set("c", {"n": 3})
+    assert cache.get("b")[0] is False
+    assert cache.get("a")[0] and cache.get("c")[0]
+    cache.invalidate("a")
+    assert cache.get("a")[0] is False
+    cache.invalidate()
+    assert cache.stats()["entries"] == 0
+
+
+def test_source_file_change_empties_the_cache(tmp_path):
+    from file_store import atomic_write_text
+
+    source = tmp_path / "api_keys.json"
+    atomic_write_text(source, "[]")
+    cache = APIKeyCache(ttl_seconds=60, source=source)
+    cache.get("h1")
+    cache.set("h1", {"key": {"id": 1}})
+    assert cache.get("h1")[0]
+    # Another worker revokes a key: the file is replaced
+    atomic_write_text(source, "[{}]")
+    assert cache.get("h1") == (False, None)
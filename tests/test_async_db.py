@@ -0,0 +1,78 @@
+import asyncio
+import os
+
+os.environ.setdefault("JWT_SECRET_KEY", "test-secret")
+
+from sqlalchemy import func, select  # noqa: E402
+
+from app.db import engine as db_engine  # noqa: E402
+from auth import (  # noqa: E402
+    audit_writer, check_account_lockout_async, record_failed_login_async, record_successful_login_async,
+)
+from invoices import (  # noqa: E402
+    create_credit_note_async, create_draft_invoice_async, finalize_invoice_async,
+    get_org_invoice_async, mark_invoice_paid_async,
+)
+from models_phase1 import AuditLog, Base, Organization, User  # noqa: E402
+from schemas import InvoiceCreate, InvoiceLineItemCreate  # noqa: E402
+import sequences  # noqa: E402
+
+
+def test_async_url_maps_drivers():
+    assert db_engine.async_url("sqlite:///./dev.db") == "sqlite+aiosqlite:///./dev.db"
+    assert db_engine.async_url("postgres://u:p@db/app") == "postgresql+asyncpg://u:p@db/app"
+    assert db_engine.async_url("postgresql+psycopg2://u:p@db/app") == "postgresql+asyncpg://u:p@db/app"
+
+
+def test_invoice_lifecycle_and_login_on_async_session(tmp_path):
+    async def scenario():
+        url = f"sqlite:///{tmp_path / 'async.db'}"
+        engine = db_engine.get_async_engine(url)
+        try:
+            async with engine.begin() as conn:
+                await conn.run_sync(Base.metadata.create_all)
+                await conn.run_sync(sequences.metadata.create_all)
+            await lifecycle(url)
+            assert any("aiosqlite" in key for key in db_engine.pool_metrics())
+        finally:
+            await engine.dispose()
+
+    async def lifecycle(url):
+        async with db_engine.get_async_sessionmaker(url)() as db:
+            org = Organization(name="Org", slug="org", owner_id=1, country="NL", currency="EUR")
+            db.add(org)
+            await db.flush()
+            user = User(org_id=org.id, email="a@b.nl", password_hash="x", name="A", role="admin")
+            db.add(user)
+            await db.commit()
+
+            data = InvoiceCreate(customer_email="c@d.de", customer_name="C", customer_country="DE",
+                                 line_items=[InvoiceLineItemCreate(description="x", quantity=2,
+                                                                   unit_price=1000, tax_rate="21")])
+            first = await create_draft_invoice_async(db, org.id, user, data)
+            second = await create_draft_invoice_async(db, org.id, user, data)
+            assert int(second.number[-4:]) == int(first.number[-4:]) + 1
+            assert first.status == "draft" and first.created_at is not None
+
+            invoice = await get_org_invoice_async(db, first.id, org.id)
+            assert await get_org_invoice_async(db, first.id, org.id + 1) is None
+            invoice = await finalize_invoice_async(db, invoice, user)
+            invoice = await mark_invoice_paid_async(db, invoice, user)
+            assert invoice.status == "paid" and invoice.updated_at is not None
+
+            credit = await create_credit_note_async(db, invoice, 50, user, "refund")
+            assert credit.amount_total == -(invoice.amount_total // 2)
+            assert credit.created_from_invoice_id == invoice.id
+
+            for _ in range(5):
+                await record_failed_login_async(db, org.id, user.id, "127.0.0.1")
+            assert await check_account_lockout_async(db, user) is True
+            await record_successful_login_async(db, org.id, user.id, "127.0.0.1")
+            await db.refresh(user)
+            assert user.last_login is not None
+
+            audit_writer.flush()  # INVOICE_CREATED rows are batched
+            events = await db.scalar(select(func.count(AuditLog.id)).where(AuditLog.entity_type == "invoice"))
+            assert events == 5  # 2 created, finalized, paid, credit note
+
+    asyncio.run(scenario())
@@ -0,0 +1,111 @@
+from datetime import datetime, timedelta, timezone
+import os
+
+from fastapi.testclient import TestClient
+
+import audit_log
+import main
+from audit_log import AuditLogFile
+
+START = datetime(2026, 3, 1, tzinfo=timezone.utc)
+
+
+def _line(n, event="LOGIN_SUCCESS", user="alice", ip="10.0.0.1"):
+    return f"{(START + timedelta(minutes=n)).isoformat()} | {ip} | {user} | {event}\n"
+
+
+def test_rotates_into_segments_and_reads_the_tail(tmp_path):
+    log = AuditLogFile(tmp_path / "audit.log", max_segment_bytes=2000, index_every=5)
+    for n in range(0, 200, 10):
+        log.append([_line(m) for m in range(n, n + 10)])
+
+    assert len(log.segments()) > 3
+    assert log.count() == 200
+    assert log.tail(3) == [_line(n).rstrip("\n") for n in (197, 198, 199)]
+
+    # Sealed segments persist their index; a fresh reader agrees
+    assert (tmp_path / "audit.log.1.idx").exists()
+    assert AuditLogFile(tmp_path / "audit.log", max_segment_bytes=2000).count() == 200
+
+
+def test_filters_and_time_range(tmp_path):
+    log = AuditLogFile(tmp_path / "audit.log", max_segment_bytes=4000, index_every=10, skew_seconds=0)
+    lines = []
+    for n in range(300):
+        if n % 3 == 0:
+            lines.append(_line(n, "LOGIN_FAIL", user="mallory", ip="6.6.6.6"))
+        else:
+            lines.append(_line(n, f"INVOICE_UPDATED id={n} status=paid", user="bob"))
+    log.append(lines)
+
+    fails = log.query(limit=1000, event="LOGIN_FAIL")
+    assert len(fails) == 100 and all("| mallory |" in line for line in fails)
+    assert log.query(limit=2, username="bob", event="INVOICE_UPDATED") == [
+        _line(n, f"INVOICE_UPDATED id={n} status=paid", user="bob").rstrip("\n") for n in (298, 299)
+    ]
+    assert log.query(ip="1.1.1.1") == []
+
+    since = (START + timedelta(minutes=100)).timestamp()
+    until = (START + timedelta(minutes=109)).timestamp()
+    window = log.query(limit=1000, since=since, until=until)
+    assert window == [lines[n].rstrip("\n") for n in range(100, 110)]
+    assert log.query(limit=1000, since=since, until=until, ip="6.6.6.6") == [
+        lines[n].rstrip("\n") for n in (102, 105, 108)
+    ]
+
+
+def test_rotation_is_once_per_file_and_never_fails_a_written_batch(tmp_path, monkeypatch):
+    path = tmp_path / "audit.log"
+    first = AuditLogFile(path, max_segment_bytes=150)
+    second = AuditLogFile(path, max_segment_bytes=150)  # another worker
+    first.append([_line(n) for n in range(3)])
+    assert [p.name for p in first.segments()] == ["audit.log.1"]
+
+    # Both workers saw the same full file: only the first rotation happens
+    with open(path, "a", encoding="utf-8") as fh:
+        fh.writelines(_line(n) for n in range(3, 6))
+    inode = os.stat(path).st_ino
+    first._rotate(inode)
+    second._rotate(inode)
+    second.append([_line(6)])
+    second._rotate(inode)
+    assert [p.name for p in first.segments()] == ["audit.log.1", "audit.log.2", "audit.log"]
+
+    def broken(*args):
+        raise PermissionError("read-only")
+
+    monkeypatch.setattr(audit_log.os, "link", broken)
+    first.append([_line(n) for n in range(7, 10)])  # rotation fails, the batch is still written once
+    monkeypatch.undo()
+    assert first.count() == 10 and first.tail(1) == [_line(9).rstrip("\n")]
+    first.append([_line(10)])
+    assert [p.name for p in first.segments()] == ["audit.log.1", "audit.log.2", "audit.log.3"]
+    assert first.count() == 11
+
+
+def test_partial_line_is_not_read_until_complete(tmp_path):
+    log = AuditLogFile(tmp_path / "audit.log")
+    log.append([_line(0)])
+    with open(tmp_path / "audit.log", "a", encoding="utf-8") as fh:
+        fh.write(_line(1)[:20])
+    assert log.count() == 1
+    with open(tmp_path / "audit.log", "a", encoding="utf-8") as fh:
+        fh.write(_line(1)[20:])
+    assert log.count() == 2 and log.tail(1) == [_line(1).rstrip("\n")]
+
+
+def test_admin_logs_endpoint_filters(tmp_path, monkeypatch):
+    log = AuditLogFile(tmp_path / "audit.log")
+    log.append([_line(n, "LOGIN_FAIL" if n % 2 else "LOGIN_SUCCESS") for n in range(10)])
+    monkeypatch.setattr(main, "audit_log_file", log)
+    main.app.dependency_overrides[main.require_admin] = lambda: {"id": 1, "name": "root", "role": "admin"}
+    try:
+        client = TestClient(main.app)
+        r = client.get("/admin/logs", params={"event": "LOGIN_FAIL", "limit": 2})
+        assert r.status_code == 200
+        assert r.json() == {"count": 10, "logs": [_line(n, "LOGIN_FAIL").rstrip("\n") for n in (7, 9)]}
+        r = client.get("/admin/logs", params={"since": "2026-03-01T00:08:00Z"})
+        assert len(r.json()["logs"]) == 2
+        assert client.get("/admin/logs", params={"until": "yesterday"}).status_code == 400
+    finally:
+        main.app.dependency_overrides.pop(main.require_admin, None)
@@ -0,0 +1,122 @@
+import os
+import time
+
+os.environ.setdefault("JWT_SECRET_KEY", "test-secret")
+
+from sqlalchemy import select  # noqa: E402
+
+import auth  # noqa: E402
+from app.db import engine as db_engine  # noqa: E402
+from audit_writer import AuditWriter, PartialWrite, file_sink  # noqa: E402
+from models_phase1 import AuditLog, Base  # noqa: E402
+
+
+def test_batches_by_size_and_time(tmp_path):
+    path = tmp_path / "audit.log"
+    batches = []
+    sink = file_sink(path)
+    writer = AuditWriter(lambda lines: (batches.append(len(lines)), sink(lines)), max_batch=10, flush_interval=0.2)
+    for n in range(25):
+        writer.submit(f"event {n}\n")
+    deadline = time.time() + 5
+    while writer.stats()["written"] < 25 and time.time() < deadline:
+        time.sleep(0.05)
+    assert path.read_text().splitlines() == [f"event {n}" for n in range(25)]
+    assert sum(batches) == 25 and len(batches) <= 4
+    writer.close()
+
+
+def test_sync_submit_writes_queue_in_order_and_close_drains(tmp_path):
+    path = tmp_path / "audit.log"
+    writer = AuditWriter(file_sink(path), max_batch=100, flush_interval=60)
+    writer.submit("a\n")
+    writer.submit("b\n")
+    writer.submit("critical\n", sync=True)
+    assert path.read_text() == "a\nb\ncritical\n"
+
+    writer.submit("c\n")
+    writer.close()
+    assert path.read_text().endswith("critical\nc\n")
+    writer.submit("after close\n")  # written inline once the thread is gone
+    assert path.read_text().endswith("after close\n")
+
+
+def test_failed_batches_are_retried():
+    calls, written = [], []
+
+    def flaky(batch):
+        calls.append(len(batch))
+        if len(calls) == 1:
+            raise OSError("disk full")
+        written.extend(batch)
+
+    writer = AuditWriter(flaky, max_batch=100, flush_interval=60)
+    writer.submit(1)
+    writer.submit(2)
+    assert writer.flush() == 0
+    assert writer.flush() == 2
+    assert written == [1, 2] and writer.stats()["failures"] == 1
+    writer.close()
+
+
+def test_partial_writes_are_not_repeated_and_poison_events_are_dead_lettered():
+    written, dead = [], []
+
+    def sink(batch):
+        for n, item in enumerate(batch):
+            if item == "bad":
+                raise PartialWrite(n, ValueError("bad row")) if n else ValueError("bad row")
+            written.append(item)
+
+    writer = AuditWriter(sink, max_batch=100, flush_interval=60, max_attempts=2,
+                         dead_letter=lambda item, error: dead.append((item, str(error))))
+    for item in ("a", "bad", "c", "d"):
+        writer.submit(item)
+    assert writer.flush() == 1  # "a" committed before the failure
+    assert writer.flush() == 0  # second failure in a row: retry one event at a time
+    assert writer.flush() == 0
+    assert writer.flush() == 2  # "bad" failed twice on its own: dead-lettered, the rest goes through
+    assert written == ["a", "c", "d"] and dead == [("bad", "bad row")]
+    assert writer.stats()["queued"] == 0 and writer.stats()["dead"] == 1
+    writer.close()
+
+
+def test_audit_rows_are_batched_except_sync_events(tmp_path, monkeypatch):
+    monkeypatch.setattr(auth, "AUDIT_ASYNC", True)
+    url = f"sqlite:///{tmp_path / 'audit.db'}"
+    Base.metadata.create_all(bind=db_engine.get_engine(url))
+    factory = db_engine.get_sessionmaker(url)
+
+    with db_engine.session_scope(factory) as db:
+        auth.log_audit_event(db, 1, "LOGIN_SUCCESS", "user", entity_id=5, user_id=5, details={"k": "v"})
+        auth.log_audit_event(db, 1, "INVOICE_CREATED", "invoice", entity_id=9)
+        assert [r.event_type for r in db.scalars(select(AuditLog))] == []
+        auth.log_audit_event(db, 1, "INVOICE_FINALIZED", "invoice", entity_id=9)
+        assert [r.event_type for r in db.scalars(select(AuditLog))] == ["INVOICE_FINALIZED"]
+
+    auth.audit_writer.flush()
+    with db_engine.session_scope(factory) as db:
+        rows = db.scalars(select(AuditLog).order_by(AuditLog.id)).all()
+        assert [r.event_type for r in rows] == ["INVOICE_FINALIZED", "LOGIN_SUCCESS", "INVOICE_CREATED"]
+        assert rows[1].details == {"k": "v"} and rows[1].created_at is not None
+
+
+def test_audit_sink_commits_per_engine_in_order(tmp_path, monkeypatch):
+    good = db_engine.get_engine(f"sqlite:///{tmp_path / 'good.db'}")
+    missing = db_engine.get_engine(f"sqlite:///{tmp_path / 'missing.db'}")  # no audit_logs table
+    Base.metadata.create_all(bind=good)
+    monkeypatch.setattr(auth, "AUDIT_DEAD_LETTER_FILE", str(tmp_path / "dead.jsonl"))
+    writer = AuditWriter(auth._insert_audit_rows, flush_interval=60, max_attempts=2,
+                         dead_letter=auth._dead_letter_audit_row)
+    for bind, event in ((good, "A"), (missing, "B"), (good, "C")):
+        writer.submit((bind, auth._audit_row(1, event, "invoice")))
+    assert writer.flush() == 1  # A committed, B's engine fails
+    assert [writer.flush() for _ in range(3)] == [0, 0, 1]  # B alone twice, then dead-lettered
+    assert writer.stats()["dead"] == 1
+    writer.close()
+
+    factory = db_engine.get_sessionmaker(f"sqlite:///{tmp_path / 'good.db'}")
+    with db_engine.session_scope(factory) as db:
+        assert [r.event_type for r in db.scalars(select(AuditLog).order_by(AuditLog.id))] == ["A", "C"]
+    [line] = (tmp_path / "dead.jsonl").read_text().splitlines()
+    assert '"event_type": "B"' in line
@@ -0,0 +1,71 @@
+import gzip
+
+import pytest
+from fastapi.testclient import TestClient
+
+import checkout_page
+import main
+from checkout_page import CompiledTemplate, MerchantNames, accepted_encoding
+from file_store import JsonFile
+from session_store import SessionStore
+
+
+def test_template_binds_static_fields_and_escapes_the_rest():
+    tpl = CompiledTemplate("<a href='{{url}}'>{{name}}</a>{{name}}", url="/x?a=1&b=2")
+    assert tpl.fields == ["name", "name"]
+    assert tpl.render(name="<b>") == "<a href='/x?a=1&amp;b=2'>&lt;b&gt;</a>&lt;b&gt;"
+
+    page = checkout_page.render_checkout({"id": "s1", "amount": 3, "success_url": 'https://x/"ok'}, "A & B")
+    assert 'data-success-url="https://x/&quot;ok"' in page
+    assert "A &amp; B" in page and "$3.00" in page and "{{" not in page
+
+
+def test_accepted_encoding(monkeypatch):
+    assert accepted_encoding("gzip, deflate") == "gzip"
+    assert accepted_encoding("gzip;q=0, identity") is None
+    assert accepted_encoding(None) is None
+    monkeypatch.setattr(checkout_page, "brotli", None)
+    assert accepted_encoding("br, gzip") == "gzip"
+
+
+def test_merchant_names_rebuild_only_when_users_change(tmp_path):
+    users = JsonFile(tmp_path / "users.json")
+    users.write([{"id": 1, "name": "Shop"}])
+    names = MerchantNames(users)
+    reads = []
+    original = users.read
+    users.read = lambda: reads.append(1) or original()
+    assert names.get(1) == "Shop" and names.get(1) == "Shop"
+    assert len(reads) == 1
+    users.write([{"id": 1, "name": "Renamed"}, {"id": 2}])
+    assert names.get(1) == "Renamed" and names.get(2) is None
+    assert len(reads) == 2
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    sessions = SessionStore(tmp_path / "sessions.json")
+    sessions.create_session({"id": "sess-1", "merchant_id": 7, "amount": 12.5, "status": "created"})
+    users = JsonFile(tmp_path / "users.json")
+    users.write([{"id": 7, "name": "Corner <Shop>"}])
+    monkeypatch.setattr(main, "session_store", sessions)
+    monkeypatch.setattr(main, "_db_session_backend", lambda: None)
+    monkeypatch.setattr(main, "merchant_names", MerchantNames(users))
+    return TestClient(main.app)
+
+
+def test_checkout_page_and_assets(client):
+    r = client.get("/checkout?session=sess-1", headers={"Accept-Encoding": "gzip"})
+    assert r.status_code == 200
+    assert r.headers["content-encoding"] == "gzip" and r.headers["cache-control"] == "no-store"
+    assert "Corner &lt;Shop&gt;" in r.text and 'data-session-id="sess-1"' in r.text
+    assert client.get("/checkout?session=nope").status_code == 404
+
+    css = checkout_page.asset_url("css")
+    assert css in r.text
+    r = client.get(css, headers={"Accept-Encoding": "gzip"})
+    assert r.status_code == 200 and "immutable" in r.headers["cache-control"]
+    assert r.text == checkout_page.CSS
+    assert gzip.decompress(checkout_page.ASSETS[css.rsplit("/", 1)[1]].body("gzip")).decode() == checkout_page.CSS
+    assert client.get(css, headers={"If-None-Match": r.headers["etag"]}).status_code == 304
+    assert client.get(checkout_page.ASSET_PREFIX + "checkout.old.css").status_code == 404
@@ -0,0 +1,47 @@
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import TimeoutError as PoolTimeout
+
+from app.db import engine as db_engine
+
+
+def _engine(tmp_path, monkeypatch, **env):
+    for name, value in env.items():
+        monkeypatch.setenv(name, str(value))
+    return db_engine.create_pooled_engine(f"sqlite:///{tmp_path / 'pool.db'}")
+
+
+def test_pool_settings_and_metrics(tmp_path, monkeypatch):
+    engine = _engine(tmp_path, monkeypatch, DB_POOL_SIZE=1, DB_MAX_OVERFLOW=0, DB_POOL_TIMEOUT=1)
+    assert engine.pool.size() == 1
+    assert engine.echo is False
+
+    factory = db_engine.sessionmaker(bind=engine)
+    for _ in range(3):
+        with db_engine.session_scope(factory) as db:
+            db.execute(text("select 1"))
+    assert engine.pool.checkedout() == 0
+
+    held = engine.connect()
+    with pytest.raises(PoolTimeout):
+        engine.connect()
+    held.close()
+
+    stats = engine.pool.stats.snapshot()
+    assert stats["checkouts"] == 4
+    assert stats["timeouts"] == 1
+    assert stats["connects"] == 1
+    assert stats["peak_checked_out"] == 1
+    assert stats["wait_ms"]["max"] >= 900
+
+
+def test_echo_is_off_in_production(tmp_path, monkeypatch):
+    assert _engine(tmp_path, monkeypatch, DB_ECHO=1).echo is True
+    assert _engine(tmp_path, monkeypatch, DB_ECHO=1, RAILWAY_ENVIRONMENT="production").echo is False
+
+
+def test_one_engine_per_url(tmp_path):
+    url = f"sqlite:///{tmp_path / 'shared.db'}"
+    assert db_engine.get_engine(url) is db_engine.get_engine(url)
+    assert db_engine.get_sessionmaker(url).kw["bind"] is db_engine.get_engine(url)
+    assert url in db_engine.pool_metrics()
@@ -0,0 +1,86 @@
+import multiprocessing
+import os
+
+import pytest
+
+from file_store import JsonFile, atomic_write_text, file_lock
+from invoice_store import InvoiceStore
+
+needs_fork = pytest.mark.skipif(not hasattr(os, "fork"), reason="fork start method only")
+
+
+def _bump(path, times):
+    store = JsonFile(path, default=dict)
+    for _ in range(times):
+        with store.transaction() as data:
+            data["n"] = data.get("n", 0) + 1
+
+
+def _put_invoices(path, worker, count):
+    store = InvoiceStore(path, compact_threshold=25)
+    for n in range(count):
+        store.put({"id": f"w{worker}-{n}", "merchant_id": worker, "created_at": f"2026-01-01T00:00:{n:02d}"})
+    store.compact()
+
+
+@needs_fork
+def test_transactions_from_several_processes_lose_no_updates(tmp_path):
+    path = tmp_path / "counter.json"
+    ctx = multiprocessing.get_context("fork")
+    procs = [ctx.Process(target=_bump, args=(path, 50)) for _ in range(4)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+    assert JsonFile(path, default=dict).read() == {"n": 200}
+    assert [p.name for p in tmp_path.iterdir() if p.suffix == ".tmp"] == []
+
+
+def test_failed_transaction_writes_nothing(tmp_path):
+    users = JsonFile(tmp_path / "users.json")
+    users.write([{"id": 1}])
+    with pytest.raises(ValueError):
+        with users.transaction() as data:
+            data.append({"id": 2})
+            raise ValueError("abort")
+    assert users.read() == [{"id": 1}]
+
+    # Re-entrant in one thread: a nested write doesn't deadlock
+    with users.transaction() as data:
+        users.write([])
+        data.append({"id": 3})
+    assert users.read() == [{"id": 1}, {"id": 3}]
+
+
+def test_atomic_write_keeps_old_content_on_failure(tmp_path, monkeypatch):
+    path = tmp_path / "api_keys.json"
+    atomic_write_text(path, "[1]")
+
+    def boom(src, dst):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(os, "replace", boom)
+    with pytest.raises(OSError):
+        atomic_write_text(path, "[2]")
+    assert path.read_text() == "[1]"
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["api_keys.json"]
+
+
+@needs_fork
+def test_invoice_store_workers_and_compaction_lose_nothing(tmp_path):
+    path = tmp_path / "invoices.json"
+    path.write_text("[]", encoding="utf-8")
+    ctx = multiprocessing.get_context("fork")
+    procs = [ctx.Process(target=_put_invoices, args=(path, w, 60)) for w in range(3)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+    store = InvoiceStore(path)
+    assert len(store) == 180
+    assert len(store.for_merchant(2)) == 60
+
+
+def test_file_lock_is_shared_per_path(tmp_path):
+    assert file_lock(tmp_path / "a.json") is file_lock(tmp_path / "a.json")
+    assert file_lock(tmp_path / "a.json") is not file_lock(tmp_path / "b.json")
@@ -0,0 +1,70 @@
+import io
+import zipfile
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from invoice_store import InvoiceStore
+from pdf_cache import PDFCache
+from pdf_pool import PDFPoolBusy
+
+client = TestClient(main.app)
+
+
+@pytest.fixture
+def export(tmp_path, monkeypatch):
+    snapshot = tmp_path / "invoices.json"
+    snapshot.write_text("[]", encoding="utf-8")
+    store = InvoiceStore(snapshot)
+    rows = [
+        ("inv-1", 7, "paid", "2026-03-01"),
+        ("inv-2", 7, "issued", "2026-03-05"),
+        ("inv-3", 7, "paid", "2026-04-02"),  # outside the range
+        ("inv-4", 8, "paid", "2026-03-02"),  # another merchant
+        ("bad", 7, "paid", "2026-03-03"),
+        ("busy", 7, "paid", "2026-03-04"),
+    ]
+    for inv_id, merchant, status, day in rows:
+        store.put({"id": inv_id, "invoice_number": f"INV-{inv_id}", "merchant_id": merchant, "status": status,
+                   "items": [], "created_at": f"{day}T09:00:00+00:00"})
+    store.put({"id": "cn-1", "type": "credit_note", "merchant_id": 7, "created_at": "2026-03-01T09:00:00+00:00"})
+
+    async def fake_render(req):
+        if req.invoice_number == "INV-bad":
+            raise ValueError("corrupt invoice")
+        if req.invoice_number == "INV-busy":
+            raise PDFPoolBusy(1)
+        return f"%PDF {req.invoice_number}".encode()
+
+    monkeypatch.setattr(main, "invoice_store", store)
+    monkeypatch.setattr(main, "pdf_cache", PDFCache(tmp_path / "cache"))
+    monkeypatch.setattr(main, "render_invoice_pdf_async", fake_render)
+    monkeypatch.setattr(main, "EXPORT_RENDER_WAIT_SECONDS", 0.3)
+    monkeypatch.setattr(main, "EXPORT_PAGE_SIZE", 2)  # several pages per export
+    monkeypatch.setattr(store, "all", None)  # never copies the whole store
+    main.app.dependency_overrides[main.get_current_user] = lambda: {"id": 7, "name": "shop7", "role": "user"}
+    yield
+    main.app.dependency_overrides.pop(main.get_current_user, None)
+
+
+def _entries(response):
+    assert response.status_code == 200
+    with zipfile.ZipFile(io.BytesIO(response.content)) as zf:
+        return {name: zf.read(name) for name in zf.namelist()}
+
+
+def test_export_filters_scopes_and_reports_failed_renders(export):
+    entries = _entries(client.get("/invoices/export.zip", params={"from": "2026-03-01", "to": "2026-03-31"}))
+    assert sorted(entries) == ["INV-bad.error.txt", "INV-busy.error.txt", "INV-inv-1.pdf", "INV-inv-2.pdf"]
+    assert entries["INV-inv-1.pdf"] == b"%PDF INV-inv-1"
+    assert b"busy" in entries["INV-busy.error.txt"] and b"ValueError" in entries["INV-bad.error.txt"]
+
+    entries = _entries(client.get("/invoices/export.zip", params={"status": "issued"}))
+    assert list(entries) == ["INV-inv-2.pdf"]
+
+
+def test_admin_exports_every_merchant(export):
+    main.app.dependency_overrides[main.get_current_user] = lambda: {"id": 1, "name": "root", "role": "admin"}
+    entries = _entries(client.get("/invoices/export.zip", params={"from": "2026-03-02", "to": "2026-03-02"}))
+    assert list(entries) == ["INV-inv-4.pdf"]
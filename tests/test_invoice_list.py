@@ -0,0 +1,62 @@
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from invoice_store import InvoiceStore
+
+client = TestClient(main.app)
+
+
+@pytest.fixture
+def invoices(tmp_path, monkeypatch):
+    snapshot = tmp_path / "invoices.json"
+    snapshot.write_text("[]", encoding="utf-8")
+    store = InvoiceStore(snapshot)
+    for n in range(12):
+        store.put({
+            "id": f"inv-{n:02d}",
+            "invoice_number": f"INV-2026-{n:04d}",
+            "merchant_id": 7 if n < 10 else 8,
+            "status": "paid" if n % 2 else "issued",
+            "buyer_country": "DE" if n % 3 == 0 else "NL",
+            "payment_system": "web2",
+            "total": n,
+            "created_at": f"2026-03-{n + 1:02d}T09:00:00+00:00",
+        })
+    monkeypatch.setattr(main, "invoice_store", store)
+    main.app.dependency_overrides[main.get_current_user] = lambda: {"id": 7, "name": "shop7", "role": "user"}
+    yield store
+    main.app.dependency_overrides.pop(main.get_current_user, None)
+
+
+def test_paginates_callers_invoices_newest_first(invoices):
+    ids, cursor = [], None
+    while True:
+        params = {"limit": 4, "fields": "invoice_number,total"}
+        if cursor:
+            params["after"] = cursor
+        r = client.get("/invoices", params=params)
+        assert r.status_code == 200, r.text
+        body = r.json()
+        assert all(set(item) == {"id", "invoice_number", "total"} for item in body["items"])
+        ids += [item["id"] for item in body["items"]]
+        cursor = body["next_cursor"]
+        if not cursor:
+            break
+    assert ids == [f"inv-{n:02d}" for n in range(9, -1, -1)]
+
+
+def test_filters_and_legacy_list(invoices):
+    r = client.get("/invoices", params={"status": "paid", "buyer_country": "nl", "from": "2026-03-03", "to": "2026-03-08"})
+    assert r.status_code == 200
+    assert [i["id"] for i in r.json()] == ["inv-07", "inv-05"]
+
+    r = client.get("/invoices")
+    assert isinstance(r.json(), list) and len(r.json()) == 10
+
+
+def test_rejects_bad_fields_and_cursor(invoices):
+    assert client.get("/invoices", params={"fields": "nope"}).status_code == 400
+    assert client.get("/invoices", params={"limit": 5, "after": "!!"}).status_code == 400
@@ -0,0 +1,102 @@
+import json
+
+from invoice_store import InvoiceStore
+
+
+def _store(tmp_path, **kwargs):
+    snapshot = tmp_path / "invoices.json"
+    snapshot.write_text(json.dumps([{"id": "legacy-1", "created_by": "alice", "total": 10}]), encoding="utf-8")
+    return InvoiceStore(snapshot, **kwargs)
+
+
+def test_put_and_indexes(tmp_path):
+    store = _store(tmp_path)
+    store.put({"id": "a", "merchant_id": 1, "session_id": "s1", "total": 5})
+    store.put({"id": "b", "merchant_id": 2, "total": 7})
+    store.put({"id": "a", "merchant_id": 1, "session_id": "s1", "total": 6})
+
+    assert len(store) == 3
+    assert store.get("a")["total"] == 6
+    assert [i["id"] for i in store.for_merchant(merchant_id=1, created_by="alice")] == ["legacy-1", "a"]
+    assert [i["id"] for i in store.for_session("s1")] == ["a"]
+    # Snapshot is untouched; writes only go to the log
+    assert len(json.loads((tmp_path / "invoices.json").read_text())) == 1
+    assert len((tmp_path / "invoices.jsonl").read_text().splitlines()) == 3
+
+
+def test_returned_records_are_copies(tmp_path):
+    store = _store(tmp_path)
+    inv = store.get("legacy-1")
+    inv["total"] = 999
+    assert store.get("legacy-1")["total"] == 10
+
+
+def test_second_instance_sees_appends(tmp_path):
+    first = _store(tmp_path)
+    second = InvoiceStore(tmp_path / "invoices.json")
+    assert len(second) == 1
+    first.put({"id": "x", "merchant_id": 3})
+    assert second.get("x") == {"id": "x", "merchant_id": 3}
+
+
+def test_replace_all_writes_only_changes(tmp_path):
+    store = _store(tmp_path)
+    store.put({"id": "a", "total": 1})
+    invoices = store.all()
+    invoices[1]["total"] = 2
+    invoices.append({"id": "c", "total": 3})
+    store.replace_all(invoices)
+    lines = (tmp_path / "invoices.jsonl").read_text().splitlines()
+    assert len(lines) == 3
+    assert [i["total"] for i in store.all()] == [10, 2, 3]
+
+
+def test_compact_folds_log_into_snapshot(tmp_path):
+    store = _store(tmp_path)
+    for n in range(5):
+        store.put({"id": f"inv-{n}", "merchant_id": 1})
+    store.delete("inv-0")
+    store.compact()
+
+    assert (tmp_path / "invoices.jsonl").read_text() == ""
+    snapshot = json.loads((tmp_path / "invoices.json").read_text())
+    assert [i["id"] for i in snapshot] == ["legacy-1", "inv-1", "inv-2", "inv-3", "inv-4"]
+    reopened = InvoiceStore(tmp_path / "invoices.json")
+    assert len(reopened.for_merchant(merchant_id=1)) == 4
+
+
+def test_read_only_store_rejects_writes(tmp_path):
+    store = _store(tmp_path, read_only=True)
+    try:
+        store.put({"id": "a"})
+    except RuntimeError:
+        pass
+    else:
+        raise AssertionError("expected RuntimeError")
+
+
+def test_page_keyset_and_filters(tmp_path):
+    store = _store(tmp_path)
+    for n in range(30):
+        store.put({
+            "id": f"inv-{n:02d}",
+            "merchant_id": 1 if n % 3 else 2,
+            "status": "paid" if n % 2 else "issued",
+            "created_at": f"2026-03-{n % 28 + 1:02d}T10:00:00",
+        })
+
+    seen, after = [], None
+    while True:
+        page, after = store.page(limit=7, after=after, merchant_id=1)
+        seen += [inv["id"] for inv in page]
+        if after is None:
+            break
+    expected = sorted((inv for inv in store.for_merchant(merchant_id=1)), key=lambda i: (i["created_at"], i["id"]), reverse=True)
+    assert seen == [inv["id"] for inv in expected]
+
+    page, _ = store.page(limit=100, where={"status": "paid"}, created_from="2026-03-05", created_to="2026-03-10")
+    assert page and all(inv["status"] == "paid" and "2026-03-05" <= inv["created_at"][:10] <= "2026-03-10" for inv in page)
+
+    # status changes move the record between index buckets
+    store.put({"id": "inv-01", "merchant_id": 1, "status": "void", "created_at": "2026-03-02T10:00:00"})
+    assert [i["id"] for i in store.page(limit=10, where={"status": "void"})[0]] == ["inv-01"]
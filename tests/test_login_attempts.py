@@ -0,0 +1,87 @@
+from app.db.engine import get_engine
+from login_attempts import LoginAttemptTracker, MemoryAttemptBackend, SQLAttemptBackend, backend_from_env
+
+
+class Clock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def _tracker(backend, clock, **kwargs):
+    return LoginAttemptTracker(backend, max_attempts=3, window_seconds=60, lockout_seconds=300,
+                               max_ip_attempts=5, clock=clock, **kwargs)
+
+
+def test_sliding_window_lock_and_reset():
+    clock = Clock(1_000_040.0)  # 20 s into a 60 s window
+    tracker = _tracker(MemoryAttemptBackend(), clock)
+    assert not tracker.record_failure("alice", "1.2.3.4")
+    assert not tracker.record_failure("alice", "1.2.3.4")
+
+    # Next window, 30 s in: the two earlier failures still count for half
+    clock.now += 70
+    assert not tracker.record_failure("alice", "1.2.3.4")  # 2 * 0.5 + 1 = 2
+    assert tracker.record_failure("alice", "1.2.3.4")      # 2 * 0.5 + 2 = 3 -> locked
+    assert tracker.is_locked("alice")
+    assert not tracker.is_locked("bob", "5.6.7.8")
+
+    clock.now += 301
+    assert not tracker.is_locked("alice")
+
+    tracker.record_failure("alice")
+    tracker.record_success("alice")
+    assert not tracker.record_failure("alice") and not tracker.record_failure("alice")
+
+
+def test_ip_lock_covers_every_user():
+    tracker = _tracker(MemoryAttemptBackend(), Clock())
+    for n in range(5):
+        tracker.record_failure(f"user{n}", "9.9.9.9")
+    assert tracker.is_locked("someone-else", "9.9.9.9")
+    assert not tracker.is_locked("someone-else", "8.8.8.8")
+
+
+def test_sql_backend_is_shared_between_workers(tmp_path):
+    engine = get_engine(f"sqlite:///{tmp_path / 'attempts.db'}")
+    clock = Clock()
+    worker_a = _tracker(SQLAttemptBackend(engine), clock, namespace="api:")
+    worker_b = _tracker(SQLAttemptBackend(engine), clock, namespace="api:")
+    other_app = _tracker(SQLAttemptBackend(engine), clock, namespace="org:")
+
+    worker_a.record_failure("carol")
+    worker_b.record_failure("carol")
+    assert worker_a.record_failure("carol")
+    assert worker_b.is_locked("carol")
+    assert not other_app.is_locked("carol")
+
+    worker_b.record_success("carol")
+    assert not worker_a.is_locked("carol")
+
+
+def test_memory_backend_evicts_least_recent():
+    backend = MemoryAttemptBackend(max_entries=2)
+    for key in ("a", "b", "c"):
+        backend.hit(key, 1, 60)
+    assert backend.hit("a", 1, 60) == (0, 1)  # "a" was evicted, counting restarts
+    assert backend.hit("c", 1, 60) == (0, 2)
+
+
+def test_memory_backend_keeps_live_locks_over_expired_ones():
+    backend = MemoryAttemptBackend(max_entries=2)
+    backend.lock("long", 500.0)
+    backend.lock("short", 100.0)
+    backend.lock("new", 400.0)
+    assert backend.locked_until(["long"]) == 500.0 and backend.locked_until(["short"]) == 0.0
+
+
+def test_default_url_selects_the_shared_sql_backend(tmp_path, monkeypatch):
+    for name in ("LOGIN_ATTEMPTS_BACKEND", "LOGIN_ATTEMPTS_URL", "DATABASE_URL"):
+        monkeypatch.delenv(name, raising=False)
+    url = f"sqlite:///{tmp_path / 'attempts.db'}"
+    assert isinstance(backend_from_env(url), SQLAttemptBackend)
+    assert isinstance(backend_from_env(), MemoryAttemptBackend)
+    monkeypatch.setenv("LOGIN_ATTEMPTS_BACKEND", "memory")
+    assert isinstance(backend_from_env(url), MemoryAttemptBackend)
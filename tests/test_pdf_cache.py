@@ -0,0 +1,67 @@
+import os
+import time
+
+from fastapi.testclient import TestClient
+
+import main
+from invoice_store import InvoiceStore
+from pdf_cache import PDFCache, pdf_cache_key
+
+
+def test_key_is_stable_and_content_addressed():
+    a = pdf_cache_key({"invoice_number": "INV-1", "total_amount": 10.0})
+    b = pdf_cache_key({"total_amount": 10.0, "invoice_number": "INV-1"})
+    c = pdf_cache_key({"invoice_number": "INV-1", "total_amount": 11.0})
+    assert a == b
+    assert a != c
+
+
+def test_get_put_invalidate(tmp_path):
+    cache = PDFCache(tmp_path)
+    assert cache.get("k") is None
+    cache.put("k", b"%PDF-1")
+    assert cache.get("k") == b"%PDF-1"
+    cache.invalidate("k")
+    assert cache.get("k") is None
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = PDFCache(tmp_path, max_bytes=250)
+    cache.put("old", b"x" * 100)
+    cache.put("used", b"x" * 100)
+    # make "old" clearly older, then touch "used"
+    past = time.time() - 60
+    os.utime(tmp_path / "old.pdf", (past, past))
+    os.utime(tmp_path / "used.pdf", (past, past))
+    cache.get("used")
+    cache.put("new", b"x" * 100)
+    assert cache.get("old") is None
+    assert cache.get("used") is not None
+    assert cache.get("new") is not None
+
+
+def test_pdf_endpoint_revalidates_with_strong_and_weak_etags(tmp_path, monkeypatch):
+    store = InvoiceStore(tmp_path / "invoices.json")
+    store.put({"id": "inv-1", "invoice_number": "INV-1", "merchant_id": 7, "items": []})
+    renders = []
+
+    async def fake_render(req):
+        renders.append(req.invoice_number)
+        return b"%PDF-fake"
+
+    monkeypatch.setattr(main, "invoice_store", store)
+    monkeypatch.setattr(main, "pdf_cache", PDFCache(tmp_path / "cache"))
+    monkeypatch.setattr(main, "render_invoice_pdf_async", fake_render)
+    main.app.dependency_overrides[main.get_current_user] = lambda: {"id": 7, "name": "shop7", "role": "user"}
+    try:
+        client = TestClient(main.app)
+        r = client.get("/invoices/inv-1/pdf")
+        assert r.status_code == 200 and r.content == b"%PDF-fake"
+        etag = r.headers["etag"]
+        for header in (etag, f"W/{etag}", f'"other", W/{etag}', "*"):
+            r = client.get("/invoices/inv-1/pdf", headers={"If-None-Match": header})
+            assert r.status_code == 304 and r.headers["etag"] == etag
+        assert client.get("/invoices/inv-1/pdf", headers={"If-None-Match": 'W/"other"'}).status_code == 200
+        assert renders == ["INV-1"]  # the second 200 came from the cache
+    finally:
+        main.app.dependency_overrides.pop(main.get_current_user, None)
@@ -0,0 +1,57 @@
+import asyncio
+import sys
+import time
+
+import pytest
+
+from pdf_pool import PDFPoolBusy, PDFRenderPool
+from pdf_render import InvoicePDFRequest, render_invoice_pdf
+
+
+def _slow_render(delay):
+    time.sleep(delay)
+    return b"%PDF-fake"
+
+
+def test_render_in_process_pool_records_metrics():
+    pool = PDFRenderPool(workers=1, max_queue=2)
+    try:
+        assert asyncio.run(pool.render(_slow_render, 0)) == b"%PDF-fake"
+        m = pool.metrics()
+        assert m["mode"] == "process"
+        assert pool._executor._mp_context.get_start_method() in ("forkserver", "spawn")
+        assert m["completed"] == 1 and m["in_flight"] == 0
+        assert m["render_ms"]["p50"] is not None
+    finally:
+        pool.shutdown()
+
+
+def _render_in_worker(req):
+    return render_invoice_pdf(req)[:4], "main" in sys.modules
+
+
+def test_workers_render_without_importing_the_app():
+    pool = PDFRenderPool(workers=1, max_queue=0)
+    try:
+        head, imported_main = asyncio.run(pool.render(_render_in_worker, InvoicePDFRequest(invoice_number="INV-1")))
+        assert head == b"%PDF" and imported_main is False
+    finally:
+        pool.shutdown()
+
+
+def test_saturated_pool_rejects_with_retry_after():
+    pool = PDFRenderPool(workers=0, max_queue=1)  # thread fallback, capacity 2
+
+    async def scenario():
+        tasks = [asyncio.create_task(pool.render(_slow_render, 0.2)) for _ in range(2)]
+        await asyncio.sleep(0.05)
+        with pytest.raises(PDFPoolBusy) as exc:
+            await pool.render(_slow_render, 0)
+        assert exc.value.retry_after >= 1
+        return await asyncio.gather(*tasks)
+
+    try:
+        assert asyncio.run(scenario()) == [b"%PDF-fake", b"%PDF-fake"]
+        assert pool.metrics()["rejected"] == 1
+    finally:
+        pool.shutdown()
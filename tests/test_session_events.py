@@ -0,0 +1,105 @@
+import asyncio
+import json
+import threading
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from session_events import SessionEventHub, TooManySubscribers
+from session_store import SessionStore
+
+
+def test_hub_delivers_from_other_threads_and_bounds_subscribers():
+    hub = SessionEventHub(max_per_session=2, backlog=2)
+
+    async def scenario():
+        with hub.subscribe("s1") as first, hub.subscribe("s1"):
+            with pytest.raises(TooManySubscribers):
+                hub.subscribe("s1")
+            assert await first.get(0.01) is None
+            t = threading.Thread(target=lambda: [hub.publish("s1", {"n": n}) for n in range(3)])
+            t.start()
+            t.join()
+            # Only the latest `backlog` events are kept
+            assert [await first.get(1), await first.get(1)] == [{"n": 1}, {"n": 2}]
+        assert hub.stats()["subscribers"] == 0
+        assert hub.publish("s1", {"n": 9}) == 0
+
+    asyncio.run(scenario())
+
+
+def test_store_writes_publish_status_changes_only(tmp_path):
+    hub = SessionEventHub()
+    store = SessionStore(tmp_path / "sessions.json")
+    store.add_listener(hub)
+    store.create_session({"id": "s1", "status": "created"})
+
+    async def scenario():
+        with hub.subscribe("s1") as sub:
+            store.update_session("s1", {"metadata": {"note": "x"}})
+            store.update_session("s1", {"status": "paid", "payment_status": "completed"})
+            event = await sub.get(1)
+            assert event["status"] == "paid" and event["session_id"] == "s1"
+            assert await sub.get(0.01) is None
+
+    asyncio.run(scenario())
+
+
+def _events(lines):
+    return [json.loads(line[len("data: "):]) for line in lines if line.startswith("data: ")]
+
+
+def test_sse_stream_pushes_payment(tmp_path, monkeypatch):
+    sessions = SessionStore(tmp_path / "sessions.json")
+    invoices = main.InvoiceStore(tmp_path / "invoices.json")
+    hub = SessionEventHub()
+    sessions.add_listener(hub)
+    sessions.create_session({"id": "sess-1", "merchant_id": 1, "amount": 5, "status": "created"})
+    monkeypatch.setattr(main, "session_store", sessions)
+    monkeypatch.setattr(main, "invoice_store", invoices)
+    monkeypatch.setattr(main, "session_events", hub)
+    monkeypatch.setattr(main, "_db_session_backend", lambda: None)
+    monkeypatch.setattr(main, "SESSION_EVENTS_RECHECK_SECONDS", 0.05)
+    client = TestClient(main.app)
+
+    def pay_when_subscribed():
+        for _ in range(200):
+            if hub.stats()["subscribers"]:
+                break
+            threading.Event().wait(0.01)
+        main.complete_session("sess-1", {"payment_system": "web2"})
+
+    payer = threading.Thread(target=pay_when_subscribed)
+    payer.start()
+    with client.stream("GET", "/session/sess-1/events") as r:
+        assert r.headers["content-type"].startswith("text/event-stream")
+        events = _events(list(r.iter_lines()))
+    payer.join()
+    assert [e["status"] for e in events] == ["created", "paid"]
+
+    # Already terminal: one event and the stream ends
+    with client.stream("GET", "/session/sess-1/events") as r:
+        assert [e["status"] for e in _events(list(r.iter_lines()))] == ["paid"]
+    assert client.get("/session/nope/events").status_code == 404
+    assert hub.stats()["subscribers"] == 0
+
+
+def test_stream_holds_no_slot_until_it_starts(tmp_path, monkeypatch):
+    sessions = SessionStore(tmp_path / "sessions.json")
+    sessions.create_session({"id": "sess-1", "status": "created"})
+    hub = SessionEventHub(max_per_session=1)
+    monkeypatch.setattr(main, "session_store", sessions)
+    monkeypatch.setattr(main, "session_events", hub)
+    monkeypatch.setattr(main, "_db_session_backend", lambda: None)
+
+    async def scenario():
+        # A response that is never sent (client gone, middleware error) leaks nothing
+        response = await main.session_status_events("sess-1", request=None)
+        assert response.status_code == 200 and hub.stats()["subscribers"] == 0
+        with hub.subscribe("sess-1"):
+            response = await main.session_status_events("sess-1", request=None)
+            assert response.status_code == 429
+        assert hub.can_subscribe("sess-1")
+
+    asyncio.run(scenario())
@@ -0,0 +1,87 @@
+import json
+from datetime import datetime, timedelta, timezone
+
+from session_store import SessionStore
+
+NOW = datetime.now(timezone.utc)
+
+
+def _stamp(days_ago):
+    return (NOW - timedelta(days=days_ago)).replace(tzinfo=None).isoformat()
+
+
+def test_updates_append_one_line(tmp_path):
+    store = SessionStore(tmp_path / "sessions.json")
+    for n in range(50):
+        store.create_session({"id": f"s{n}", "status": "created", "created_at": _stamp(0), "metadata": {}})
+    before = store.log_path.stat().st_size
+
+    updated = store.update_session("s7", {"status": "paid", "paid_at": _stamp(0)})
+    assert updated["status"] == "paid"
+    log = store.log_path.read_text(encoding="utf-8").splitlines()
+    assert len(log) == 51
+    assert store.log_path.stat().st_size - before == len(log[-1]) + 1
+
+    other = SessionStore(tmp_path / "sessions.json")
+    assert other.get_session("s7")["status"] == "paid"
+    assert store.update_session("missing", {"status": "paid"}) is None
+
+
+def test_expired_sessions_are_archived_but_resolvable(tmp_path):
+    store = SessionStore(tmp_path / "sessions.json", archive_after_seconds=7 * 86400,
+                         abandon_after_seconds=30 * 86400)
+    store.create_session({"id": "fresh-paid", "status": "paid", "created_at": _stamp(10), "paid_at": _stamp(1)})
+    store.create_session({"id": "old-paid", "status": "paid", "created_at": _stamp(20), "paid_at": _stamp(8)})
+    store.create_session({"id": "old-failed", "status": "failed", "created_at": _stamp(9)})
+    store.create_session({"id": "pending", "status": "created", "created_at": _stamp(20)})
+    store.create_session({"id": "abandoned", "status": "created", "created_at": _stamp(31)})
+
+    assert store.archive_expired(now=NOW) == 3
+    assert sorted(s["id"] for s in store.all()) == ["fresh-paid", "pending"]
+    assert store.stats() == {"active": 2, "archived": 3}
+
+    # Lookups by id still work, from this process and a fresh one
+    assert store.get_session("old-paid")["paid_at"] == _stamp(8)
+    other = SessionStore(tmp_path / "sessions.json")
+    assert other.get_session("abandoned")["status"] == "created"
+    assert other.get_session("nope") is None
+
+    # A late update brings the session back into the hot set
+    store.update_session("abandoned", {"status": "paid", "paid_at": _stamp(0)})
+    assert store.get("abandoned")["status"] == "paid"
+    assert other.get_session("abandoned")["status"] == "paid"
+
+    store.compact()
+    snapshot = json.loads(store.snapshot_path.read_text(encoding="utf-8"))
+    assert sorted(s["id"] for s in snapshot) == ["abandoned", "fresh-paid", "pending"]
+
+
+def test_archive_prune_drops_expired_and_superseded_entries(tmp_path):
+    store = SessionStore(tmp_path / "sessions.json", archive_after_seconds=7 * 86400,
+                         archive_retention_seconds=90 * 86400)
+    other = SessionStore(tmp_path / "sessions.json")
+    store.create_session({"id": "ancient", "status": "paid", "created_at": _stamp(200), "paid_at": _stamp(100)})
+    store.create_session({"id": "kept", "status": "paid", "created_at": _stamp(20), "paid_at": _stamp(10)})
+    store.create_session({"id": "revived", "status": "failed", "created_at": _stamp(20)})
+    store._next_prune = float("inf")
+    assert store.archive_expired(now=NOW) == 3
+    assert other.get_session("ancient")["status"] == "paid"
+
+    # Archived twice: only the newest copy survives a prune
+    store.update_session("kept", {"note": "late webhook"})
+    store.archive_expired(now=NOW)
+    # Back in the hot set: its archived copy is dead weight
+    store.update_session("revived", {"status": "paid", "paid_at": _stamp(0)})
+    assert len(store.archive_path.read_text(encoding="utf-8").splitlines()) == 4
+
+    store._next_prune = 0
+    store.archive_expired(now=NOW)
+    archived = [json.loads(line) for line in store.archive_path.read_text(encoding="utf-8").splitlines()]
+    assert archived == [store.get_session("kept")]
+    assert archived[0]["note"] == "late webhook"
+    assert store.stats() == {"active": 1, "archived": 1}
+
+    # The other process saw the old file; it re-indexes the rewritten one
+    assert other.get_session("ancient") is None
+    assert other.get_session("kept")["note"] == "late webhook"
+    assert other.get_session("revived")["status"] == "paid"
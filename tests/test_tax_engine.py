@@ -0,0 +1,39 @@
+from tax_engine import COUNTRY_VAT_RULES, GLOBAL_TAX_RATES, _DECISIONS, decide, get_country_vat_info, region_for
+
+
+def test_region_index():
+    assert region_for("NL") == "EU"
+    assert region_for("GB") == "ECEA"
+    assert region_for("XX") == "OTHER"
+
+
+def test_eu_decisions():
+    assert decide("NL", "NL").rate == 21.0
+    rc = decide("NL", "DE", b2b=True)
+    assert rc.rate == 0.0 and rc.reverse_charge and rc.jurisdiction == "DE"
+    b2c = decide("nl", "de")
+    assert b2c.rate == 21.0 and not b2c.reverse_charge
+    assert decide("NL", "US").explanation == "Export from NL - 0% VAT"
+    assert decide("US", "FR").rate == 20.0
+
+
+def test_defaults_and_other_regions():
+    # empty seller -> NL, empty buyer -> seller
+    assert decide(None, None).explanation == "Domestic (EU) - NL VAT 21.0%"
+    assert decide("CH", "CA").rate == 5.0
+    assert decide("AU", "JP").explanation == "International - AU rate applies 10.0%"
+    # unknown codes take the uncompiled (cached) path
+    assert decide("ZZ", "ZZ").rate == 0.0
+
+
+def test_table_covers_known_pairs():
+    assert len(_DECISIONS) == len(GLOBAL_TAX_RATES) ** 2 * 2
+    assert decide("SE", "PL", True) is _DECISIONS[("SE", "PL", True)]
+
+
+def test_country_rules_agree_with_rate_table():
+    for code, info in COUNTRY_VAT_RULES.items():
+        assert info["standard_rate"] == GLOBAL_TAX_RATES[code], code
+    fallback = get_country_vat_info("xx")
+    fallback["reduced_rates"].append(1.0)
+    assert get_country_vat_info("xx")["reduced_rates"] == [10.0]
@@ -0,0 +1,74 @@
+import json
+import random
+from datetime import date, timedelta
+
+from invoice_store import InvoiceStore
+from usage_rollup import UsageRollup
+
+TODAY = date(2026, 3, 20)
+
+
+def _reference(invoices, merchant_id, created_by):
+    """The aggregation /merchant/usage used to do on every request."""
+    mine = [i for i in invoices
+            if (merchant_id is not None and i.get("merchant_id") == merchant_id)
+            or (created_by is not None and i.get("created_by") == created_by)]
+    web2 = [i for i in mine if (i.get("payment_system") or "web2") == "web2"]
+    web3 = [i for i in mine if i.get("payment_system") == "web3"]
+    total = lambda lst: round(sum(float(i.get("total") or 0) for i in lst), 2)
+    days = {(TODAY - timedelta(days=n)).isoformat(): 0.0 for n in range(30)}
+    for inv in mine:
+        d = inv["created_at"][:10]
+        if d in days:
+            days[d] += float(inv.get("total") or 0)
+    return {
+        "total_invoices": len(mine), "web2_count": len(web2), "web3_count": len(web3),
+        "web2_total": total(web2), "web3_total": total(web3), "total_amount": total(mine),
+        "revenue": [{"date": d, "amount": round(a, 2)} for d, a in sorted(days.items())],
+    }
+
+
+def test_rollup_tracks_store_changes(tmp_path):
+    snapshot = tmp_path / "invoices.json"
+    snapshot.write_text(json.dumps([{"id": "legacy", "created_by": "shop1", "total": "12.50",
+                                     "created_at": "2026-03-19T08:00:00"}]), encoding="utf-8")
+    store = InvoiceStore(snapshot)
+    rollup = UsageRollup()
+    store.add_listener(rollup)
+
+    rng = random.Random(5)
+    for n in range(200):
+        inv_id = f"inv-{rng.randint(0, 60)}"
+        if rng.random() < 0.1:
+            store.delete(inv_id)
+            continue
+        store.put({
+            "id": inv_id,
+            "merchant_id": rng.choice([1, 2, None]),
+            "created_by": rng.choice(["shop1", "shop2", None]),
+            "payment_system": rng.choice(["web2", "web3", None]),
+            "status": rng.choice(["issued", "paid", "void"]),
+            "total": round(rng.uniform(-50, 500), 2),
+            "created_at": f"{(TODAY - timedelta(days=rng.randint(0, 40))).isoformat()}T12:00:00+00:00",
+        })
+
+    for merchant_id, name in [(1, "shop1"), (2, "shop2"), (1, None), (3, "nobody")]:
+        assert rollup.usage(merchant_id, name, today=TODAY) == _reference(store.all(), merchant_id, name)
+
+    expected = rollup.usage(1, "shop1", today=TODAY)
+    assert store.rebuild_listener(rollup) >= 2
+    assert rollup.usage(1, "shop1", today=TODAY) == expected
+
+
+def test_rollup_sees_other_process_writes(tmp_path):
+    snapshot = tmp_path / "invoices.json"
+    snapshot.write_text("[]", encoding="utf-8")
+    store, other = InvoiceStore(snapshot), InvoiceStore(snapshot)
+    rollup = UsageRollup()
+    store.add_listener(rollup)
+    store.sync()
+
+    other.put({"id": "x", "merchant_id": 9, "total": 10, "payment_system": "web3", "created_at": "2026-03-20"})
+    store.sync()
+    usage = rollup.usage(9, None, today=TODAY)
+    assert usage["web3_count"] == 1 and usage["revenue"][-1] == {"date": "2026-03-20", "amount": 10.0}
@@ -0,0 +1,80 @@
+import asyncio
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from test_vies_client import FakeVIES
+from vies_client import VIESClient
+
+client = TestClient(main.app)
+
+
+@pytest.fixture
+def vies(tmp_path, monkeypatch):
+    fake = FakeVIES()
+    vies_client = VIESClient(wsdl_url=fake.url + "/wsdl", wsdl_cache_path=tmp_path / "vies.wsdl", timeout=5)
+    monkeypatch.setattr(main, "get_vies_client", lambda: vies_client)
+    yield fake
+    vies_client.shutdown()
+    fake.close()
+
+
+def test_batch_dedupes_and_uses_cache(vies):
+    numbers = ["NL123456781", "nl 123456781", "DE123456780", "US123456789", "X"]
+    r = client.post("/validate-vat/batch", json={"vat_numbers": numbers})
+    assert r.status_code == 200
+    body = r.json()
+    assert body["count"] == 4
+    assert body["duplicates"] == 1
+    by_number = {res["vat_number"]: res for res in body["results"]}
+    assert by_number["NL123456781"]["valid"] is True
+    assert by_number["DE123456780"]["valid"] is False
+    assert "only available for EU countries" in by_number["US123456789"]["message"]
+    assert by_number["X"]["valid"] is False
+    assert vies.calls == 2
+
+    # second round is answered from the cache
+    client.post("/validate-vat/batch", json={"vat_numbers": numbers[:3]})
+    assert vies.calls == 2
+
+
+def test_batch_streams_ndjson(vies):
+    numbers = [f"NL12345678{i}" for i in range(10)]
+    r = client.post("/validate-vat/batch", json={"vat_numbers": numbers, "stream": True})
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("application/x-ndjson")
+    rows = [json.loads(line) for line in r.text.splitlines()]
+    assert sorted(row["vat_number"] for row in rows) == sorted(numbers)
+    assert sum(1 for row in rows if row["valid"]) == 1
+
+
+def test_batch_rejects_oversized(monkeypatch):
+    monkeypatch.setattr(main, "VAT_BATCH_MAX_SIZE", 2)
+    r = client.post("/validate-vat/batch", json={"vat_numbers": ["NL1", "NL2", "NL3"]})
+    assert r.status_code == 400
+    r = client.post("/validate-vat/batch", json={"vat_numbers": []})
+    assert r.status_code == 400
+
+
+def test_country_cap_is_shared_across_requests(vies, monkeypatch):
+    monkeypatch.setattr(main, "VIES_PER_COUNTRY_CONCURRENCY", 1)
+    monkeypatch.setattr(main, "_vies_country_limits", main.weakref.WeakKeyDictionary())
+
+    async def scenario():
+        first = main._vies_semaphore("NL")
+        assert main._vies_semaphore("NL") is first and main._vies_semaphore("DE") is not first
+        await first.acquire()  # another request holds the only NL slot
+        pending = asyncio.ensure_future(main.check_vat_number("NL123456781"))
+        await asyncio.sleep(0.2)
+        assert not pending.done() and vies.calls == 0
+        first.release()
+        assert (await pending)["valid"] is True
+
+    asyncio.run(scenario())
+
+    # Same normalization (and so the same cache key) as the VIES client
+    r = client.post("/validate-vat/batch", json={"vat_numbers": ["nl-1234.567.81", "NL 123456781"]})
+    assert r.json()["count"] == 1 and r.json()["results"][0]["vat_number"] == "NL123456781"
+    assert vies.calls == 1
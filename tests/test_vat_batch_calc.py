@@ -0,0 +1,64 @@
+import random
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+import vat_engine
+from vat_engine import calculate_vat, calculate_vat_batch
+
+client = TestClient(main.app)
+
+PRICES = ["10.00", "0.005", "-0.005", "1.005", "2.675", 0.015, "1e2", "19.99", "-3.50", 12]
+RATES = ["21", "9", "5.5", "25.5", "12.345", "0", None, 19]
+
+
+def _random_invoices(rng, count):
+    invoices = []
+    for _ in range(count):
+        inv = {
+            "items": [
+                {"qty": rng.choice([1, 2, 3, -1, "4"]), "unit_price": rng.choice(PRICES), "vat_rate": rng.choice(RATES)}
+                for _ in range(rng.randint(0, 12))
+            ],
+        }
+        if rng.random() < 0.8:
+            inv["shop"] = {"country": rng.choice(["NL", "DE", "US"])}
+        if rng.random() < 0.8:
+            inv["customer"] = {"country": rng.choice(["NL", "DE", "US"]), "vat_number": rng.choice(["", "DE1"])}
+        invoices.append(inv)
+    return invoices
+
+
+@pytest.mark.parametrize("use_numpy", [True, False])
+def test_batch_matches_decimal_calculator(monkeypatch, use_numpy):
+    if not use_numpy:
+        monkeypatch.setattr(vat_engine, "np", None)
+    elif vat_engine.np is None:
+        pytest.skip("numpy not installed")
+    rng = random.Random(7)
+    invoices = _random_invoices(rng, 200)
+    result = calculate_vat_batch({"invoices": invoices})
+    assert [calculate_vat(inv) for inv in invoices] == result["invoices"]
+
+
+def test_columnar_input_and_reverse_charge():
+    payload = {
+        "invoices": [
+            {"id": "a", "shop": {"country": "NL"}, "customer": {"country": "NL"}},
+            {"id": "b", "shop": {"country": "NL"}, "customer": {"country": "DE", "vat_number": "DE1"}},
+        ],
+        "lines": {"invoice": [0, 0, 1], "qty": [2, 1, 3], "unit_price": ["10.00", "0.05", "1.00"], "vat_rate": ["21", "21", "21"]},
+    }
+    result = calculate_vat_batch(payload)
+    assert result["invoices"][0] == {"id": "a", "subtotal": "20.05", "vat_total": "4.21", "total": "24.26"}
+    assert result["invoices"][1] == {"id": "b", "subtotal": "3.00", "vat_total": "0.00", "total": "3.00"}
+    assert result["lines"]["vat_cents"] == [420, 1, 0]
+
+
+def test_batch_endpoint():
+    r = client.post("/calculate-vat/batch", json={"invoices": [{"items": [{"qty": 1, "unit_price": "100", "vat_rate": "21"}]}]})
+    assert r.status_code == 200
+    assert r.json()["invoices"][0]["total"] == "121.00"
+    r = client.post("/calculate-vat/batch", json={"lines": {"invoice": [0], "qty": [1, 2]}})
+    assert r.status_code == 400
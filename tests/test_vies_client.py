@@ -0,0 +1,191 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from vies_client import VIESClient, VIESUnavailable
+
+TNS = "urn:ec.europa.eu:taxud:vies:services:checkVat:types"
+
+WSDL = """<?xml version="1.0" encoding="UTF-8"?>
+<wsdl:definitions xmlns:wsdl="http://schemas.xmlsoap.org/wsdl/"
+    xmlns:soap="http://schemas.xmlsoap.org/wsdl/soap/"
+    xmlns:xsd="http://www.w3.org/2001/XMLSchema"
+    xmlns:tns1="{tns}"
+    xmlns:impl="urn:ec.europa.eu:taxud:vies:services:checkVat"
+    targetNamespace="urn:ec.europa.eu:taxud:vies:services:checkVat">
+  <wsdl:types>
+    <xsd:schema elementFormDefault="qualified" targetNamespace="{tns}">
+      <xsd:element name="checkVat">
+        <xsd:complexType><xsd:sequence>
+          <xsd:element name="countryCode" type="xsd:string"/>
+          <xsd:element name="vatNumber" type="xsd:string"/>
+        </xsd:sequence></xsd:complexType>
+      </xsd:element>
+      <xsd:element name="checkVatResponse">
+        <xsd:complexType><xsd:sequence>
+          <xsd:element name="countryCode" type="xsd:string"/>
+          <xsd:element name="vatNumber" type="xsd:string"/>
+          <xsd:element name="valid" type="xsd:boolean"/>
+          <xsd:element name="name" type="xsd:string" minOccurs="0"/>
+          <xsd:element name="address" type="xsd:string" minOccurs="0"/>
+        </xsd:sequence></xsd:complexType>
+      </xsd:element>
+    </xsd:schema>
+  </wsdl:types>
+  <wsdl:message name="checkVatRequest"><wsdl:part name="parameters" element="tns1:checkVat"/></wsdl:message>
+  <wsdl:message name="checkVatResponse"><wsdl:part name="parameters" element="tns1:checkVatResponse"/></wsdl:message>
+  <wsdl:portType name="checkVatPortType">
+    <wsdl:operation name="checkVat">
+      <wsdl:input message="impl:checkVatRequest"/>
+      <wsdl:output message="impl:checkVatResponse"/>
+    </wsdl:operation>
+  </wsdl:portType>
+  <wsdl:binding name="checkVatBinding" type="impl:checkVatPortType">
+    <soap:binding style="document" transport="http://schemas.xmlsoap.org/soap/http"/>
+    <wsdl:operation name="checkVat">
+      <soap:operation soapAction=""/>
+      <wsdl:input><soap:body use="literal"/></wsdl:input>
+      <wsdl:output><soap:body use="literal"/></wsdl:output>
+    </wsdl:operation>
+  </wsdl:binding>
+  <wsdl:service name="checkVatService">
+    <wsdl:port name="checkVatPort" binding="impl:checkVatBinding">
+      <soap:address location="{endpoint}"/>
+    </wsdl:port>
+  </wsdl:service>
+</wsdl:definitions>
+"""
+
+RESPONSE = """<?xml version="1.0" encoding="UTF-8"?>
+<env:Envelope xmlns:env="http://schemas.xmlsoap.org/soap/envelope/">
+  <env:Body>
+    <ns2:checkVatResponse xmlns:ns2="{tns}">
+      <ns2:countryCode>{country}</ns2:countryCode>
+      <ns2:vatNumber>{number}</ns2:vatNumber>
+      <ns2:valid>{valid}</ns2:valid>
+      <ns2:name>ACME BV</ns2:name>
+      <ns2:address>Main St 1</ns2:address>
+    </ns2:checkVatResponse>
+  </env:Body>
+</env:Envelope>
+"""
+
+FAULT = """<?xml version="1.0" encoding="UTF-8"?>
+<env:Envelope xmlns:env="http://schemas.xmlsoap.org/soap/envelope/">
+  <env:Body>
+    <env:Fault><faultcode>env:Server</faultcode><faultstring>{fault}</faultstring></env:Fault>
+  </env:Body>
+</env:Envelope>
+"""
+
+
+class FakeVIES:
+    """checkVat over HTTP. Numbers ending in 1 are valid, "BAD" faults with
+    INVALID_INPUT, and `fault` (when set) is returned for every call."""
+
+    def __init__(self):
+        self.calls = 0
+        self.fault = None
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, body):
+                data = body.encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "text/xml; charset=utf-8")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                self._send(200, WSDL.format(tns=TNS, endpoint=fake.url + "/soap"))
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode("utf-8")
+                fake.calls += 1
+                country = body.split("countryCode>")[1].split("<")[0]
+                number = body.split("vatNumber>")[1].split("<")[0]
+                if fake.fault:
+                    return self._send(500, FAULT.format(fault=fake.fault))
+                if number == "BAD":
+                    return self._send(500, FAULT.format(fault="INVALID_INPUT"))
+                valid = "true" if number.endswith("1") else "false"
+                self._send(200, RESPONSE.format(tns=TNS, country=country, number=number, valid=valid))
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def vies():
+    fake = FakeVIES()
+    yield fake
+    fake.close()
+
+
+def _client(vies, tmp_path, **kwargs):
+    return VIESClient(wsdl_url=vies.url + "/wsdl", wsdl_cache_path=tmp_path / "vies.wsdl", timeout=5, **kwargs)
+
+
+def test_valid_number_is_cached(vies, tmp_path):
+    client = _client(vies, tmp_path)
+    first = client.check("NL", "123456781")
+    assert first["valid"] is True
+    assert first["name"] == "ACME BV"
+    assert first["cached"] is False
+    assert (tmp_path / "vies.wsdl").exists()
+
+    second = client.check("nl", "1234 56781")
+    assert second["valid"] is True
+    assert second["cached"] is True
+    assert vies.calls == 1
+
+
+def test_invalid_input_is_negatively_cached(vies, tmp_path):
+    client = _client(vies, tmp_path, negative_ttl_seconds=0)
+    result = client.check("NL", "BAD")
+    assert result["valid"] is False
+    assert "INVALID_INPUT" in result["fault"]
+    # zero negative TTL: asks VIES again
+    client.check("NL", "BAD")
+    assert vies.calls == 2
+
+    client = _client(vies, tmp_path)
+    client.check("NL", "123456780")
+    assert client.check("NL", "123456780")["cached"] is True
+    assert vies.calls == 3
+
+
+def test_breaker_opens_after_consecutive_faults(vies, tmp_path):
+    client = _client(vies, tmp_path, failure_threshold=2, reset_seconds=60)
+    vies.fault = "MS_UNAVAILABLE"
+    for _ in range(2):
+        with pytest.raises(VIESUnavailable) as exc:
+            client.check("DE", "123456781")
+        assert exc.value.fault and "MS_UNAVAILABLE" in exc.value.fault
+    assert client.breaker_open
+
+    with pytest.raises(VIESUnavailable) as exc:
+        client.check("DE", "123456781")
+    assert exc.value.fault is None
+    assert vies.calls == 2
+
+
+def test_breaker_half_open_recovers(vies, tmp_path):
+    client = _client(vies, tmp_path, failure_threshold=1, reset_seconds=0)
+    vies.fault = "SERVICE_UNAVAILABLE"
+    with pytest.raises(VIESUnavailable):
+        client.check("DE", "123456781")
+    vies.fault = None
+    assert client.check("DE", "123456781")["valid"] is True
+    assert not client.breaker_open
@@ -0,0 +1,272 @@
+import json
+import threading
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from app.db.engine import get_engine
+from invoice_store import InvoiceStore
+from payment import webhook_event_key
+from session_store import SessionStore
+from webhook_queue import QueueFull, WebhookError, WebhookQueue, WebhookWorkerPool
+
+
+class Clock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def _queue(tmp_path, **kwargs):
+    return WebhookQueue(get_engine(f"sqlite:///{tmp_path / 'queue.db'}"), **kwargs)
+
+
+def test_events_survive_a_restart_and_leases_expire(tmp_path):
+    clock = Clock()
+    queue = _queue(tmp_path, lease_seconds=30, clock=clock)
+    first = queue.enqueue("stripe", b'{"n": 1}')
+    queue.enqueue("paypal", '{"n": 2}')
+
+    # A worker claims the first event and dies before settling it
+    assert [e.id for e in queue.claim(1)] == [first]
+
+    again = _queue(tmp_path, lease_seconds=30, clock=clock)
+    [other] = again.claim(5)
+    assert other.provider == "paypal"
+    again.complete(other)
+    assert again.claim(5) == []
+    clock.now += 31
+    [item] = again.claim(5)
+    assert item.id == first and item.attempts == 2 and item.payload() == {"n": 1}
+
+
+def test_retries_back_off_then_park_as_dead(tmp_path):
+    clock = Clock()
+    queue = _queue(tmp_path, max_attempts=2, retry_base_seconds=10, clock=clock)
+    calls = []
+
+    def handler(provider, payload):
+        calls.append(payload)
+        raise RuntimeError("store down")
+
+    pool = WebhookWorkerPool(queue, handler)
+    queue.enqueue("onecom", "{}")
+    assert pool.drain() == 1
+    assert pool.drain() == 0  # backing off
+    clock.now += 10
+    assert pool.drain() == 1
+    assert len(calls) == 2
+    assert queue.lag()["onecom"]["dead"] == 1
+
+    def permanent(provider, payload):
+        raise WebhookError(409, "Invalid state transition", retry=False)
+
+    queue.enqueue("web3", "{}")
+    [item] = queue.claim(1)
+    WebhookWorkerPool(queue, permanent).run_one(item)
+    assert queue.lag()["web3"]["dead"] == 1
+
+
+def test_backpressure_and_lag(tmp_path):
+    clock = Clock()
+    queue = _queue(tmp_path, max_pending=2, clock=clock)
+    queue.enqueue("stripe", "{}")
+    clock.now += 5
+    queue.enqueue("stripe", "{}")
+    with pytest.raises(QueueFull):
+        queue.enqueue("stripe", "{}")
+
+    clock.now += 5
+    assert queue.lag()["stripe"]["pending"] == 2
+    assert queue.lag()["stripe"]["oldest_age_seconds"] == 10
+    WebhookWorkerPool(queue, lambda provider, payload: {"ok": True}).drain()
+    lag = queue.lag()["stripe"]
+    assert lag["pending"] == 0 and lag["last_settle_lag_seconds"] == 5  # the newer event settled last
+    queue.enqueue("stripe", "{}")  # room again
+
+
+def test_duplicate_event_ids_are_queued_once_across_workers(tmp_path):
+    clock = Clock()
+    queue = _queue(tmp_path, max_attempts=1, dedup_seconds=3600, clock=clock)
+    assert queue.enqueue("stripe", "{}", "evt_1") is not None
+    assert queue.enqueue("stripe", "{}", "evt_1") is None      # this worker's cache
+    assert queue.enqueue("paypal", "{}", "evt_1") is not None  # keys are per provider
+
+    # Other workers have empty caches and race on the same redelivery
+    others = [_queue(tmp_path, clock=clock) for _ in range(6)]
+    ids = []
+    threads = [threading.Thread(target=lambda q=q: ids.append(q.enqueue("web3", "{}", "0xabc"))) for q in others]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len([i for i in ids if i is not None]) == 1
+    assert others[0].enqueue("stripe", "{}", "evt_1") is None
+    assert queue.pending() == 3
+
+    # A dead event gives its key back; expired keys are purged
+    pool = WebhookWorkerPool(queue, lambda provider, payload: 1 / 0)
+    assert pool.drain() == 3
+    assert _queue(tmp_path, clock=clock).enqueue("stripe", "{}", "evt_1") is not None
+    clock.now += 3601
+    assert queue.purge() >= 1
+    assert _queue(tmp_path, clock=clock).enqueue("paypal", "{}", "evt_1") is not None
+
+
+def test_event_keys_per_provider():
+    assert webhook_event_key("stripe", {"id": "evt_9", "type": "payment_intent.succeeded"}) == "evt_9"
+    assert webhook_event_key("paypal", {"event_type": "X", "resource": {"id": "cap_1"}}) == "X:cap_1"
+    assert webhook_event_key("coinbase", {"id": 1, "event": {"id": "ev-2"}}) == "ev-2"
+    assert webhook_event_key("web3", {"event": "payment.confirmed", "blockchain_tx_id": "0xABC"}) == "0xabc"
+    assert webhook_event_key("onecom", {"event": "payment.completed"}) is None
+
+
+@pytest.fixture
+def stores(tmp_path, monkeypatch):
+    sessions = SessionStore(tmp_path / "sessions.json")
+    invoices = InvoiceStore(tmp_path / "invoices.json")
+    monkeypatch.setattr(main, "session_store", sessions)
+    monkeypatch.setattr(main, "invoice_store", invoices)
+    monkeypatch.setattr(main, "_db_session_backend", lambda: None)
+    monkeypatch.setattr(main, "auto_unlock_api_keys", lambda merchant_id, session: {"id": 1})
+    monkeypatch.setattr(main, "SECRET_KEY", "test-secret")
+    queue = _queue(tmp_path)
+    monkeypatch.setattr(main, "webhook_queue", queue)
+    monkeypatch.setattr(main, "webhook_workers", WebhookWorkerPool(queue, main.process_webhook_event, workers=0))
+    monkeypatch.setattr(main, "WEBHOOK_ASYNC", True)
+    sessions.create_session({"id": "sess-0001", "merchant_id": 3, "amount": 40, "status": "created",
+                             "mode": "test", "metadata": {}})
+    return sessions, invoices
+
+
+def test_webhook_is_acknowledged_before_settlement(stores):
+    sessions, invoices = stores
+    client = TestClient(main.app)
+    body = {"type": "payment_intent.succeeded",
+            "data": {"object": {"id": "pi_1", "metadata": {"session_id": "sess-0001"}}}}
+    r = client.post("/webhooks/stripe", content=json.dumps(body))
+    assert r.status_code == 200 and r.json()["received"] is True
+    assert sessions.get_session("sess-0001")["status"] == "created"
+
+    assert client.post("/webhooks/stripe", content=b"not json").status_code == 400
+    assert main.webhook_workers.drain() == 1
+    session = sessions.get_session("sess-0001")
+    assert session["status"] == "paid" and session["stripe_intent_id"] == "pi_1"
+    [invoice] = invoices.for_session("sess-0001")
+    assert invoice["amount"] == 40 and invoice["payment_provider"] == "stripe"
+
+
+def test_inline_mode_settles_with_vat(stores, monkeypatch):
+    sessions, invoices = stores
+    monkeypatch.setattr(main, "WEBHOOK_ASYNC", False)
+    monkeypatch.setattr(main, "load_users", lambda: [{"id": 3, "country": "NL"}])
+    client = TestClient(main.app)
+    body = {"event_type": "PAYMENT.CAPTURE.COMPLETED",
+            "resource": {"id": "cap_1", "custom_id": "sess-0001", "amount": {"value": "121.00", "currency_code": "EUR"}}}
+    r = client.post("/webhooks/paypal", json=body)
+    assert r.status_code == 200
+    invoice = r.json()["invoice"]
+    assert invoice["total"] == 121.0 and invoice["paypal_capture_id"] == "cap_1"
+    assert invoice["subtotal"] + invoice["vat_amount"] == pytest.approx(121.0)
+
+    r = client.post("/webhooks/paypal", json={**body, "resource": {**body["resource"], "id": "cap_2", "custom_id": "nope"}})
+    assert r.status_code == 404
+    assert client.post("/webhooks/paypal", json={"event_type": "OTHER"}).json() == {"received": True}
+
+
+def test_redelivered_webhooks_issue_one_invoice(stores, monkeypatch):
+    sessions, invoices = stores
+    client = TestClient(main.app)
+    body = json.dumps({"id": "evt_1", "type": "payment_intent.succeeded",
+                       "data": {"object": {"id": "pi_1", "metadata": {"session_id": "sess-0001"}}}})
+    assert "queued" in client.post("/webhooks/stripe", content=body).json()
+    assert client.post("/webhooks/stripe", content=body).json() == {"received": True, "duplicate": True}
+    assert main.webhook_workers.drain() == 1
+    assert len(invoices.for_session("sess-0001")) == 1
+
+    # Inline: a retriable failure (session not written yet) lets the redelivery through
+    monkeypatch.setattr(main, "WEBHOOK_ASYNC", False)
+    body = {"event": "payment.confirmed", "session_id": "sess-0002", "blockchain_tx_id": "0xfeed", "amount": 10}
+    assert client.post("/webhooks/web3", json=body).status_code == 404
+    sessions.create_session({"id": "sess-0002", "merchant_id": 3, "amount": 10, "status": "created",
+                             "mode": "test", "metadata": {}})
+    assert client.post("/webhooks/web3", json=body).json()["success"] is True
+    assert client.post("/webhooks/web3", json=body).json()["duplicate"] is True
+    assert len(invoices.for_session("sess-0002")) == 1
+
+
+def test_concurrent_events_for_one_session_issue_one_invoice(stores, monkeypatch):
+    sessions, invoices = stores
+    check = main.validate_payment_state_transition
+    # Widen the gap between reading the session and writing it
+    monkeypatch.setattr(main, "validate_payment_state_transition", lambda *a: time.sleep(0.02) or check(*a))
+    events = [
+        ("stripe", {"id": "evt_a", "type": "payment_intent.succeeded",
+                    "data": {"object": {"id": "pi_1", "metadata": {"session_id": "sess-0001"}}}}),
+        ("stripe", {"id": "evt_b", "type": "payment_intent.succeeded",
+                    "data": {"object": {"id": "pi_2", "metadata": {"session_id": "sess-0001"}}}}),
+        ("web3", {"event": "payment.confirmed", "session_id": "sess-0001", "blockchain_tx_id": "0x1", "amount": 40}),
+    ] * 3
+    results = []
+    threads = [threading.Thread(target=lambda e=e: results.append(main.process_webhook_event(*e))) for e in events]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(results) == len(events)
+    assert len([r for r in results if "invoice" in r]) == 1
+    assert len(invoices.for_session("sess-0001")) == 1
+    assert sessions.get_session("sess-0001")["status"] == "paid"
+
+
+def test_failed_session_write_keeps_the_invoice_for_the_retry(stores, monkeypatch):
+    sessions, invoices = stores
+    update = sessions.update_session
+    monkeypatch.setattr(sessions, "update_session", lambda *args: 1 / 0)
+    body = {"event": "payment.confirmed", "session_id": "sess-0001", "blockchain_tx_id": "0x1", "amount": 40}
+    with pytest.raises(WebhookError):
+        main.process_webhook_event("web3", body)
+    [invoice] = invoices.for_session("sess-0001")
+    assert sessions.get_session("sess-0001")["status"] == "created"
+
+    monkeypatch.setattr(sessions, "update_session", update)
+    assert main.process_webhook_event("web3", body)["invoice"]["id"] == invoice["id"]
+    assert len(invoices.for_session("sess-0001")) == 1
+    assert sessions.get_session("sess-0001")["status"] == "paid"
+
+
+def test_settles_db_backed_session(stores, tmp_path, monkeypatch):
+    from app.db import sessions as db_sessions
+    from app.db.engine import get_sessionmaker, session_scope
+    from app.models.hosted_session import Base
+
+    url = f"sqlite:///{tmp_path / 'sessions.db'}"
+    Base.metadata.create_all(get_engine(url))
+    factory = get_sessionmaker(url)
+    monkeypatch.setattr(db_sessions, "_db", lambda: session_scope(factory))
+    monkeypatch.setattr(main, "_db_session_backend", lambda: db_sessions.DBSessionStore())
+    db_sessions.create_session({"id": "db-sess-1", "merchant_id": 3, "amount": 25})
+
+    body = {"event": "payment.confirmed", "session_id": "db-sess-1", "blockchain_tx_id": "0xbeef", "amount": 25}
+    assert main.process_webhook_event("web3", body)["success"] is True
+    session = db_sessions.get_session("db-sess-1")
+    assert session["status"] == "paid" and session["paid_at"] and session["created_at"]
+    assert session["blockchain_tx_id"] == "0xbeef"
+    [invoice] = stores[1].for_session("db-sess-1")
+    assert invoice["amount"] == 25
+
+
+def test_pool_starts_with_the_app_and_settles_leftover_events(tmp_path, monkeypatch):
+    queue = _queue(tmp_path)
+    queue.enqueue("stripe", '{"n": 1}')  # queued before the restart
+    settled = threading.Event()
+    pool = WebhookWorkerPool(queue, lambda provider, payload: settled.set(), workers=1)
+    monkeypatch.setattr(main, "webhook_workers", pool)
+    with TestClient(main.app):
+        assert settled.wait(5)
+    assert pool._closed and not any(t.is_alive() for t in pool._threads)
+    assert queue.pending() == 0
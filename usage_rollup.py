@@ -0,0 +1,157 @@
+"""
+Per-merchant usage rollups for /merchant/usage.
+
+`/merchant/usage` used to load every invoice of the merchant and re-aggregate
+it on each dashboard refresh. `UsageRollup` keeps the aggregates instead:
+invoice count and total per payment_system and per status, plus revenue per
+day. It is registered as an `InvoiceStore` listener, so every record change
+(create, payment webhook, void, credit note, edit, or another worker's write
+picked up from the log) is applied as a delta of old vs new contribution.
+
+Invoices are matched to a merchant by `merchant_id` or, for legacy rows, by
+`created_by`. Each invoice is counted in an `m` bucket (merchant_id), a `u`
+bucket (created_by) and, when it has both, an `mu` bucket; usage for
+(id, name) is m + u - mu, the same set `InvoiceStore.for_merchant` returns.
+
+Amounts are summed as integer micro-units, so deltas never drift.
+"""
+
+from datetime import date, datetime, timedelta
+import threading
+from typing import Dict, Iterable, Optional, Tuple
+
+MICROS = 1_000_000
+
+
+def _amount_micros(inv: dict) -> int:
+    val = inv.get("total", 0)
+    if val is None:
+        val = 0
+    try:
+        return int(round(float(str(val).strip()) * MICROS))
+    except (ValueError, TypeError):
+        return 0
+
+
+def _day(inv: dict) -> Optional[str]:
+    created_at = inv.get("created_at", "")
+    if not created_at or not isinstance(created_at, str):
+        return None
+    # Format: 2026-02-12 or 2026-02-12T...
+    return created_at.split("T")[0] if "T" in created_at else created_at[:10]
+
+
+def _empty_bucket() -> dict:
+    return {"count": 0, "total": 0, "by_payment_system": {}, "by_status": {}, "daily": {}}
+
+
+def _bump(counter: dict, key, sign: int, micros: int) -> None:
+    entry = counter.setdefault(key, [0, 0])
+    entry[0] += sign
+    entry[1] += sign * micros
+    if entry[0] == 0 and entry[1] == 0:
+        del counter[key]
+
+
+class UsageRollup:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets: Dict[Tuple, dict] = {}
+
+    @staticmethod
+    def _keys(inv: dict) -> Iterable[Tuple]:
+        merchant_id = inv.get("merchant_id")
+        created_by = inv.get("created_by")
+        if merchant_id is not None:
+            yield ("m", merchant_id)
+        if created_by is not None:
+            yield ("u", created_by)
+        if merchant_id is not None and created_by is not None:
+            yield ("mu", merchant_id, created_by)
+
+    def _add(self, inv: dict, sign: int) -> None:
+        micros = _amount_micros(inv)
+        payment_system = inv.get("payment_system") or "web2"
+        status = inv.get("status") or "issued"
+        day = _day(inv)
+        for key in self._keys(inv):
+            bucket = self._buckets.setdefault(key, _empty_bucket())
+            bucket["count"] += sign
+            bucket["total"] += sign * micros
+            _bump(bucket["by_payment_system"], payment_system, sign, micros)
+            _bump(bucket["by_status"], status, sign, micros)
+            if day:
+                _bump(bucket["daily"], day, sign, micros)
+            if bucket["count"] == 0:
+                del self._buckets[key]
+
+    # ----- InvoiceStore listener -----
+
+    def reset(self) -> None:
+        with self._lock:
+            self._buckets = {}
+
+    def apply(self, old: Optional[dict], new: Optional[dict]) -> None:
+        """Replace `old`'s contribution with `new`'s (either may be None)."""
+        with self._lock:
+            if old is not None:
+                self._add(old, -1)
+            if new is not None:
+                self._add(new, +1)
+
+    def rebuild(self, invoices: Iterable[dict]) -> int:
+        """Recompute from scratch; returns the number of merchant buckets."""
+        with self._lock:
+            self._buckets = {}
+            for inv in invoices:
+                self._add(inv, +1)
+            return sum(1 for key in self._buckets if key[0] != "mu")
+
+    # ----- reads -----
+
+    def usage(self, merchant_id=None, created_by: Optional[str] = None, days: int = 30,
+              today: Optional[date] = None) -> dict:
+        """The /merchant/usage payload, in O(days)."""
+        signed = []
+        if merchant_id is not None:
+            signed.append((("m", merchant_id), 1))
+        if created_by is not None:
+            signed.append((("u", created_by), 1))
+        if merchant_id is not None and created_by is not None:
+            signed.append((("mu", merchant_id, created_by), -1))
+
+        today = today or datetime.now().date()
+        day_keys = [(today - timedelta(days=i)).strftime("%Y-%m-%d") for i in range(days)]
+        count = total = web2_count = web2_total = web3_count = web3_total = 0
+        daily = dict.fromkeys(day_keys, 0)
+        with self._lock:
+            for key, sign in signed:
+                bucket = self._buckets.get(key)
+                if bucket is None:
+                    continue
+                count += sign * bucket["count"]
+                total += sign * bucket["total"]
+                web2 = bucket["by_payment_system"].get("web2", (0, 0))
+                web3 = bucket["by_payment_system"].get("web3", (0, 0))
+                web2_count += sign * web2[0]
+                web2_total += sign * web2[1]
+                web3_count += sign * web3[0]
+                web3_total += sign * web3[1]
+                for day in day_keys:
+                    entry = bucket["daily"].get(day)
+                    if entry:
+                        daily[day] += sign * entry[1]
+
+        return {
+            "total_invoices": count,
+            "web2_count": web2_count,
+            "web3_count": web3_count,
+            "web2_total": round(web2_total / MICROS, 2),
+            "web3_total": round(web3_total / MICROS, 2),
+            "total_amount": round(total / MICROS, 2),
+            "revenue": [{"date": day, "amount": round(daily[day] / MICROS, 2)} for day in sorted(day_keys)],
+        }
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"buckets": len(self._buckets)}
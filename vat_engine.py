@@ -1,5 +1,14 @@
 from datetime import date, timedelta
 from decimal import Decimal, ROUND_HALF_UP
+import re
+
+from tax_engine import decide
+
+try:
+    import numpy as np
+except Exception:
+    # Optional: calculate_vat_batch uses plain integer arithmetic without it
+    np = None
 try:
     from sqlalchemy.orm import Session
     from models import Shop, Customer, Invoice, InvoiceItem, Product
@@ -51,23 +60,12 @@ def compute_vat_for_line(shop: Shop, customer: Customer, unit_price: Decimal, qt
         # Same country: charge VAT normally
         vat = q(line * vat_rate / Decimal("100"))
     else:
-        # Different country
-        # EU handling simplified: assume shop_country and cust_country are EU if 2-letter and not 'US'
-        eu_countries = set()  # Placeholder: in prod provide real EU set or use library
-        # crude EU membership check — treat non-empty and length==2 as EU for now
-        is_eu_shop = len(shop_country) == 2
-        is_eu_cust = len(cust_country) == 2
-
-        if is_eu_shop and is_eu_cust:
-            if is_b2b:
-                # Reverse charge: 0% VAT
-                vat = Decimal("0.00")
-            else:
-                # B2C: charge shop VAT
-                vat = q(line * vat_rate / Decimal("100"))
-        else:
-            # Non-EU customer: 0%
+        # Cross-border: reverse charge / exports are 0%, otherwise the line rate applies
+        decision = decide(shop_country, cust_country, is_b2b)
+        if decision.reverse_charge or decision.rate == 0:
             vat = Decimal("0.00")
+        else:
+            vat = q(line * vat_rate / Decimal("100"))
 
     return q(vat)
 
@@ -170,6 +168,23 @@ def create_credit_note(session: Session, original_invoice_id: str, actor: str =
     return credit
 
 
+class _SimpleParty:
+    """Shop/customer dict coerced to the attributes `compute_vat_for_line` reads."""
+
+    def __init__(self, d: dict | None):
+        if not d:
+            self.country = ""
+            self.vat_number = ""
+        else:
+            self.country = d.get("country", "")
+            # support both vat_number and vatNo keys
+            self.vat_number = d.get("vat_number") or d.get("vatNo") or ""
+
+
+def _coerce_party(party):
+    return _SimpleParty(party) if isinstance(party, dict) else party
+
+
 def calculate_vat(payload: dict) -> dict:
     """Lightweight VAT calculator for use by external HTTP endpoints.
 
@@ -179,6 +194,8 @@ def calculate_vat(payload: dict) -> dict:
     """
     # Accept either `items` (preferred) or `lines` (legacy clients)
     items = payload.get("items") or payload.get("lines") or []
+    shop = _coerce_party(payload.get("shop"))
+    customer = _coerce_party(payload.get("customer"))
 
     subtotal = Decimal("0.00")
     vat_total = Decimal("0.00")
@@ -191,27 +208,8 @@ def calculate_vat(payload: dict) -> dict:
         line = q(unit_price) * qty
 
         try:
-            # Best-effort: attempt to use `compute_vat_for_line` when shop/customer
-            # objects are available and compatible. Accept dicts by coercing
-            # them into simple objects exposing the expected attributes.
-            shop = payload.get("shop")
-            customer = payload.get("customer")
-
-            class _Simple:
-                def __init__(self, d: dict | None):
-                    if not d:
-                        self.country = ""
-                        self.vat_number = ""
-                    else:
-                        self.country = d.get("country", "")
-                        # support both vat_number and vatNo keys
-                        self.vat_number = d.get("vat_number") or d.get("vatNo") or ""
-
-            if isinstance(shop, dict):
-                shop = _Simple(shop)
-            if isinstance(customer, dict):
-                customer = _Simple(customer)
-
+            # Best-effort: use `compute_vat_for_line` when shop/customer are
+            # available; fall back to charging the line rate.
             v = compute_vat_for_line(shop, customer, unit_price, qty, vat_rate)
             v = Decimal(str(v))
         except Exception:
@@ -222,3 +220,222 @@ def calculate_vat(payload: dict) -> dict:
 
     total = q(subtotal + vat_total)
     return {"subtotal": str(q(subtotal)), "vat_total": str(q(vat_total)), "total": str(total)}
+
+
+# ===== BATCH (fixed-point cents) =====
+#
+# Same results as calculate_vat, computed on integer columns instead of a
+# Decimal per line: unit prices are rounded half-up to cents, rates are scaled
+# to integers with as many decimals as the batch needs, and line VAT is
+# round_half_up(net_cents * rate / 100). Vectorized with NumPy when it is
+# installed and the products fit in int64; plain Python ints otherwise.
+
+_NUMBER_RE = re.compile(r"^([+-]?)(\d*)(?:\.(\d*))?$")
+_INT64_LIMIT = 2 ** 62
+
+
+def _scaled_int(value, places: int) -> int:
+    """str(value) * 10**places as an int, rounded ROUND_HALF_UP (exact)."""
+    text = str(value).strip()
+    whole, _, frac = text.partition(".")
+    if len(frac) <= places:
+        # Fast path for the common "12.34" / "12" / 12 shapes
+        try:
+            if whole.lstrip("+-")[:1].isdigit() or (frac.isdigit() and whole in ("", "+", "-")):
+                return int(whole + frac.ljust(places, "0"))
+        except ValueError:
+            pass
+    m = _NUMBER_RE.match(text)
+    if not m or not (m.group(2) or m.group(3)):
+        return int(Decimal(text).scaleb(places).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+    sign, whole, frac = m.group(1), m.group(2) or "0", m.group(3) or ""
+    kept, dropped = frac[:places].ljust(places, "0"), frac[places:]
+    magnitude = int(whole + kept)
+    if dropped and dropped[0] >= "5":
+        magnitude += 1
+    return -magnitude if sign == "-" else magnitude
+
+
+def _scaled_column(values, places: int) -> list:
+    # Rates (and often prices) repeat a lot; parse each distinct value once
+    seen = {}
+    out = []
+    for v in values:
+        key = str(v)
+        n = seen.get(key)
+        if n is None:
+            n = seen[key] = _scaled_int(key, places)
+        out.append(n)
+    return out
+
+
+def _decimal_places(value) -> int:
+    text = str(value).strip()
+    m = _NUMBER_RE.match(text)
+    if m and (m.group(2) or m.group(3)):
+        return len((m.group(3) or "").rstrip("0"))
+    exponent = Decimal(text).normalize().as_tuple().exponent
+    return max(0, -exponent) if isinstance(exponent, int) else 0
+
+
+def _div_half_up(n: int, d: int) -> int:
+    return (n + d // 2) // d if n >= 0 else -((-n + d // 2) // d)
+
+
+def _cents_str(cents: int) -> str:
+    sign = "-" if cents < 0 else ""
+    cents = abs(int(cents))
+    return f"{sign}{cents // 100}.{cents % 100:02d}"
+
+
+def _charges_vat(shop, customer) -> bool:
+    """Whether compute_vat_for_line charges the line rate for this shop/customer."""
+    if shop is None or customer is None:
+        return True  # calculate_vat falls back to charging the line rate
+    try:
+        shop_country = shop.country.upper()
+        cust_country = customer.country.upper()
+        if cust_country == shop_country:
+            return True
+        decision = decide(shop_country, cust_country, bool(customer.vat_number))
+        return not (decision.reverse_charge or decision.rate == 0)
+    except Exception:
+        return True
+
+
+def _batch_columns(payload: dict):
+    """Normalize row or columnar input to (invoices, invoice_idx, qty, unit_price, vat_rate)."""
+    invoices = payload.get("invoices") or []
+    columns = payload.get("lines")
+    if isinstance(columns, dict):
+        idx = list(columns.get("invoice") or [])
+        n = len(idx)
+        qty = list(columns.get("qty") or columns.get("quantity") or [1] * n)
+        price = list(columns.get("unit_price") or columns.get("price") or ["0"] * n)
+        rate = list(columns.get("vat_rate") or ["0"] * n)
+        if not (len(qty) == len(price) == len(rate) == n):
+            raise ValueError("lines columns must all have the same length")
+        idx = [int(i) for i in idx]
+        count = max(len(invoices), max(idx) + 1 if idx else 0)
+        if idx and min(idx) < 0:
+            raise ValueError("lines.invoice must be non-negative invoice indexes")
+        invoices = list(invoices) + [{}] * (count - len(invoices))
+        qty = [int(x or 1) for x in qty]
+        price = [x or "0" for x in price]
+        rate = [x or "0" for x in rate]
+        return invoices, idx, qty, price, rate
+
+    idx, qty, price, rate = [], [], [], []
+    for i, inv in enumerate(invoices):
+        for it in inv.get("items") or inv.get("lines") or []:
+            idx.append(i)
+            qty.append(int(it.get("qty") or it.get("quantity") or 1))
+            price.append(it.get("unit_price") or it.get("price") or "0")
+            rate.append(it.get("vat_rate") or "0")
+    return invoices, idx, qty, price, rate
+
+
+def _cents_array(values):
+    """Unit prices as int64 cents, or None when they don't fit the fast path.
+
+    float * 100 rounded to nearest is exact for prices with at most two
+    decimals; anything that isn't within a hair of a whole cent (e.g. 0.005)
+    is re-parsed exactly with ROUND_HALF_UP.
+    """
+    try:
+        scaled = np.array([float(v) for v in values], dtype=np.float64) * 100
+    except (TypeError, ValueError):
+        return None
+    cents = np.rint(scaled)
+    inexact = ~(np.abs(scaled - cents) < 1e-3) | ~(np.abs(scaled) < 1e13)
+    cents = np.where(inexact, 0, cents).astype(np.int64)
+    for i in np.flatnonzero(inexact):
+        exact = _scaled_int(values[i], 2)
+        if abs(exact) >= _INT64_LIMIT:
+            return None
+        cents[i] = exact
+    return cents
+
+
+def _batch_numpy(idx, qty, price, rate_scaled, denom, charges, n_inv):
+    unit = _cents_array(price)
+    if unit is None:
+        return None
+    qty_arr = np.asarray(qty, dtype=object)
+    rate_arr = np.asarray(rate_scaled, dtype=object)
+    bound = int(np.abs(unit).max()) * int(np.abs(qty_arr).max()) * max(1, int(np.abs(rate_arr).max()))
+    if bound + denom >= _INT64_LIMIT:
+        return None  # would overflow int64; use Python ints
+
+    inv_arr = np.asarray(idx, dtype=np.int64)
+    net = unit * qty_arr.astype(np.int64)
+    n = net * rate_arr.astype(np.int64)
+    vat = np.sign(n) * ((np.abs(n) + denom // 2) // denom)
+    vat = np.where(np.asarray(charges, dtype=bool)[inv_arr], vat, 0)
+    sub_totals = np.zeros(n_inv, dtype=np.int64)
+    vat_totals = np.zeros(n_inv, dtype=np.int64)
+    np.add.at(sub_totals, inv_arr, net)
+    np.add.at(vat_totals, inv_arr, vat)
+    return net.tolist(), vat.tolist(), sub_totals.tolist(), vat_totals.tolist()
+
+
+def _batch_python(idx, qty, unit_cents, rate_scaled, denom, charges, n_inv):
+    net = [u * x for u, x in zip(unit_cents, qty)]
+    vat = [
+        _div_half_up(line * r, denom) if charges[i] else 0
+        for line, r, i in zip(net, rate_scaled, idx)
+    ]
+    sub_totals = [0] * n_inv
+    vat_totals = [0] * n_inv
+    for i, line, v in zip(idx, net, vat):
+        sub_totals[i] += line
+        vat_totals[i] += v
+    return net, vat, sub_totals, vat_totals
+
+
+def calculate_vat_batch(payload: dict) -> dict:
+    """Batch version of calculate_vat for large carts and bulk imports.
+
+    Accepts either row form:
+        {"invoices": [{"id", "shop", "customer", "items": [...]}, ...]}
+    or columnar form (invoice = index into `invoices`):
+        {"invoices": [{"shop", "customer"}, ...],
+         "lines": {"invoice": [...], "qty": [...], "unit_price": [...], "vat_rate": [...]}}
+    Top-level `shop`/`customer` apply to invoices that don't set their own.
+
+    Returns per-invoice subtotal/vat_total/total strings (identical to
+    calculate_vat) and per-line `net_cents`/`vat_cents` integer columns.
+    """
+    invoices, idx, qty, price, rate = _batch_columns(payload)
+    default_shop, default_customer = payload.get("shop"), payload.get("customer")
+    charges = [
+        _charges_vat(_coerce_party(inv.get("shop", default_shop)), _coerce_party(inv.get("customer", default_customer)))
+        for inv in invoices
+    ]
+
+    places = max((_decimal_places(r) for r in set(map(str, rate))), default=0)
+    rate_scaled = _scaled_column(rate, places)
+    denom = 100 * 10 ** places
+    n_inv = len(invoices)
+
+    totals = None
+    if np is not None and idx:
+        totals = _batch_numpy(idx, qty, price, rate_scaled, denom, charges, n_inv)
+    if totals is None:
+        totals = _batch_python(idx, qty, _scaled_column(price, 2), rate_scaled, denom, charges, n_inv)
+    net, vat, sub_totals, vat_totals = totals
+
+    results = []
+    for i, inv in enumerate(invoices):
+        row = {
+            "subtotal": _cents_str(sub_totals[i]),
+            "vat_total": _cents_str(vat_totals[i]),
+            "total": _cents_str(sub_totals[i] + vat_totals[i]),
+        }
+        if inv.get("id") is not None:
+            row = {"id": inv.get("id"), **row}
+        results.append(row)
+    return {
+        "invoices": results,
+        "lines": {"invoice": idx, "net_cents": net, "vat_cents": vat},
+    }
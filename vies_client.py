@@ -0,0 +1,219 @@
+"""
+Shared client for the EU VIES checkVat SOAP service.
+
+Building a `zeep.Client` downloads and parses the WSDL, which used to happen
+on every validation. `VIESClient` builds it once from a local copy of the
+WSDL (fetched on first use and kept at `wsdl_cache_path`), and on top of it:
+
+- runs the blocking SOAP calls in a thread pool (`check_async`);
+- caches results per VAT number: valid/invalid answers for `ttl_seconds`,
+  INVALID_INPUT faults and "not registered" answers for the shorter
+  `negative_ttl_seconds`;
+- trips a circuit breaker after `failure_threshold` consecutive outages and
+  fails fast with `VIESUnavailable` until `reset_seconds` have passed, then
+  lets a single trial call through.
+
+Pass a different `wsdl_url` (e.g. a local fake server) to test it end to end.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import asyncio
+import os
+import threading
+from time import monotonic
+from typing import Dict, Optional, Tuple
+
+import requests
+
+VIES_WSDL_URL = "https://ec.europa.eu/taxation_customs/vies/checkVatService.wsdl"
+
+# Faults that say something about the number rather than about VIES itself
+INPUT_FAULTS = ("INVALID_INPUT",)
+
+
+class VIESUnavailable(Exception):
+    """VIES could not answer (network error, service fault, or breaker open)."""
+
+    def __init__(self, message: str, fault: Optional[str] = None):
+        super().__init__(message)
+        self.fault = fault
+
+
+def normalize_vat_number(vat_number: str) -> str:
+    return (vat_number or "").strip().upper().replace(" ", "").replace(".", "").replace("-", "")
+
+
+class VIESClient:
+    def __init__(self, wsdl_url: str = VIES_WSDL_URL, wsdl_cache_path: Optional[Path] = None,
+                 max_workers: int = 8, timeout: float = 10, ttl_seconds: float = 24 * 3600,
+                 negative_ttl_seconds: float = 3600, failure_threshold: int = 5, reset_seconds: float = 60):
+        self.wsdl_url = wsdl_url
+        self.wsdl_cache_path = Path(wsdl_cache_path) if wsdl_cache_path else None
+        self.timeout = timeout
+        self.ttl_seconds = ttl_seconds
+        self.negative_ttl_seconds = negative_ttl_seconds
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="vies")
+        self._client = None
+        self._client_lock = threading.Lock()
+        self._cache: Dict[str, Tuple[float, dict]] = {}
+        self._cache_lock = threading.Lock()
+
+        self._breaker_lock = threading.Lock()
+        self._consecutive_failures = 0
+        self._open_until = 0.0
+        self._trial_in_flight = False
+
+    # ----- zeep client -----
+
+    def _wsdl_location(self) -> str:
+        if self.wsdl_cache_path is None:
+            return self.wsdl_url
+        if not self.wsdl_cache_path.exists():
+            resp = requests.get(self.wsdl_url, timeout=self.timeout)
+            resp.raise_for_status()
+            self.wsdl_cache_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.wsdl_cache_path.with_suffix(".tmp")
+            tmp.write_bytes(resp.content)
+            tmp.replace(self.wsdl_cache_path)
+        return str(self.wsdl_cache_path)
+
+    def _get_client(self):
+        if self._client is not None:
+            return self._client
+        with self._client_lock:
+            if self._client is None:
+                from zeep import Client
+                from zeep.transports import Transport
+                transport = Transport(timeout=self.timeout, operation_timeout=self.timeout)
+                self._client = Client(wsdl=self._wsdl_location(), transport=transport)
+        return self._client
+
+    # ----- result cache -----
+
+    def cached(self, vat_number: str) -> Optional[dict]:
+        key = normalize_vat_number(vat_number)
+        with self._cache_lock:
+            entry = self._cache.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= monotonic():
+                del self._cache[key]
+                return None
+            return dict(entry[1], cached=True)
+
+    def _store(self, key: str, result: dict) -> None:
+        ttl = self.ttl_seconds if result.get("valid") else self.negative_ttl_seconds
+        with self._cache_lock:
+            self._cache[key] = (monotonic() + ttl, result)
+
+    def clear_cache(self) -> None:
+        with self._cache_lock:
+            self._cache.clear()
+
+    # ----- circuit breaker -----
+
+    def _before_call(self) -> None:
+        with self._breaker_lock:
+            if self._consecutive_failures < self.failure_threshold:
+                return
+            if monotonic() < self._open_until or self._trial_in_flight:
+                raise VIESUnavailable("VIES circuit breaker is open")
+            self._trial_in_flight = True  # half-open: let one request probe
+
+    def _record(self, success: bool) -> None:
+        with self._breaker_lock:
+            self._trial_in_flight = False
+            if success:
+                self._consecutive_failures = 0
+                return
+            self._consecutive_failures += 1
+            if self._consecutive_failures >= self.failure_threshold:
+                self._open_until = monotonic() + self.reset_seconds
+
+    @property
+    def breaker_open(self) -> bool:
+        with self._breaker_lock:
+            return self._consecutive_failures >= self.failure_threshold and monotonic() < self._open_until
+
+    # ----- public API -----
+
+    def check(self, country_code: str, number: str) -> dict:
+        """Blocking checkVat with caching.
+
+        Returns {"valid", "country", "vat_number", "name", "address", "fault", "cached"};
+        raises VIESUnavailable when VIES can't give an answer.
+        """
+        country_code = (country_code or "").upper()
+        key = normalize_vat_number(f"{country_code}{number}")
+        hit = self.cached(key)
+        if hit is not None:
+            return hit
+
+        self._before_call()
+        try:
+            from zeep.exceptions import Fault
+        except ImportError:
+            Fault = None
+        try:
+            response = self._get_client().service.checkVat(countryCode=country_code, vatNumber=number)
+        except Exception as e:
+            message = str(e)
+            if Fault is not None and isinstance(e, Fault) and any(f in message for f in INPUT_FAULTS):
+                self._record(True)
+                result = {"valid": False, "country": country_code, "vat_number": key, "name": None,
+                          "address": None, "fault": message, "cached": False}
+                self._store(key, result)
+                return result
+            self._record(False)
+            fault = message if Fault is not None and isinstance(e, Fault) else None
+            raise VIESUnavailable(message, fault=fault)
+
+        self._record(True)
+        result = {
+            "valid": bool(getattr(response, "valid", False)),
+            "country": country_code,
+            "vat_number": key,
+            "name": getattr(response, "name", None),
+            "address": getattr(response, "address", None),
+            "fault": None,
+            "cached": False,
+        }
+        self._store(key, result)
+        return result
+
+    async def check_async(self, country_code: str, number: str) -> dict:
+        """Like `check`, but answers cache hits inline and runs SOAP calls in the pool."""
+        hit = self.cached(f"{country_code}{number}")
+        if hit is not None:
+            return hit
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self.check, country_code, number)
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+_default_client: Optional[VIESClient] = None
+_default_lock = threading.Lock()
+
+
+def get_vies_client() -> VIESClient:
+    """Process-wide client configured from the environment."""
+    global _default_client
+    if _default_client is None:
+        with _default_lock:
+            if _default_client is None:
+                data_dir = Path(os.getenv("DATA_DIR", "/tmp"))
+                _default_client = VIESClient(
+                    wsdl_url=os.getenv("VIES_WSDL_URL", VIES_WSDL_URL),
+                    wsdl_cache_path=Path(os.getenv("VIES_WSDL_CACHE", str(data_dir / "vies_checkVatService.wsdl"))),
+                    max_workers=int(os.getenv("VIES_MAX_WORKERS", "8")),
+                    timeout=float(os.getenv("VIES_TIMEOUT_SECONDS", "10")),
+                    ttl_seconds=float(os.getenv("VIES_CACHE_TTL_SECONDS", str(24 * 3600))),
+                    negative_ttl_seconds=float(os.getenv("VIES_NEGATIVE_TTL_SECONDS", "3600")),
+                )
+    return _default_client
@@ -0,0 +1,430 @@
+"""
+Durable webhook ingestion queue and worker pool.
+
+The payment webhooks in main.py used to settle inline before answering the
+provider. Settling means finding the session, VAT, API-key unlock, a JWT and
+two store writes. Under bursts the providers timed out and retried, which
+made the burst worse. Now a webhook request only verifies the payload,
+stores the raw body in `WebhookQueue` and returns 200. A `WebhookWorkerPool`
+settles the events afterwards.
+
+- The queue is a `webhook_events` table in a local SQLite file (WAL). Every
+  gunicorn worker enqueues into it and claims from it. A claim is a lease:
+  an event whose worker died is handed out again once `lease_seconds` pass.
+- Failures are retried with exponential backoff. A `WebhookError` with
+  `retry=False` (e.g. an invalid state transition), or running out of
+  `max_attempts`, parks the event as `dead` for inspection.
+- Backpressure: once `max_pending` events wait, `enqueue` raises
+  `QueueFull` and the endpoint answers 503 + Retry-After. Providers retry
+  later instead of piling more work onto a queue that isn't draining.
+- `lag()` reports, per provider, how many events wait, the age of the
+  oldest one, and the delay between receiving and settling the last one.
+- Providers redeliver. `EventKeyIndex` remembers each provider event id
+  (Stripe `evt_...`, PayPal/Coinbase event id, web3 tx hash) for
+  `retention_seconds`, in a `webhook_event_keys` table whose primary key
+  makes the check O(1) and atomic across workers. `enqueue` inserts the key
+  and the event in one transaction, so a redelivery is dropped before any
+  store is touched, even when both copies arrive at the same time. Keys
+  this process saw in the last few minutes are also kept in a bounded
+  in-memory cache, so a retry burst against the same worker costs only a
+  dict lookup. An event that ends up `dead` gives its key back, so a later
+  redelivery can settle it.
+"""
+
+from collections import OrderedDict
+from dataclasses import dataclass
+import json
+import os
+import threading
+import uuid
+from time import time
+from typing import Callable, Dict, List, Optional, Union
+
+from sqlalchemy import Column, Float, Index, Integer, MetaData, String, Table, Text, and_, delete, event, func, or_, select, update
+from sqlalchemy.exc import IntegrityError
+
+PENDING, PROCESSING, DONE, DEAD = "pending", "processing", "done", "dead"
+
+metadata = MetaData()
+
+webhook_events = Table(
+    "webhook_events",
+    metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("provider", String(20), nullable=False),
+    Column("body", Text, nullable=False),            # raw request body, as received
+    Column("state", String(12), nullable=False, default=PENDING),
+    Column("attempts", Integer, nullable=False, default=0),
+    Column("received_at", Float, nullable=False),
+    Column("available_at", Float, nullable=False),   # not claimable before (retry backoff / lease expiry)
+    Column("claimed_by", String(40)),
+    Column("processed_at", Float),
+    Column("error", Text),
+    Column("result", Text),
+    Index("ix_webhook_events_state_available", "state", "available_at"),
+)
+
+webhook_event_keys = Table(
+    "webhook_event_keys",
+    metadata,
+    Column("provider", String(20), primary_key=True),
+    Column("event_key", String(200), primary_key=True),
+    Column("seen_at", Float, nullable=False),
+    Column("event_id", Integer),                     # queued as this webhook_events row (None: settled inline)
+    Index("ix_webhook_event_keys_seen_at", "seen_at"),
+)
+
+
+class QueueFull(Exception):
+    """Too many events are waiting; the caller should ask the provider to retry later."""
+
+
+class WebhookError(Exception):
+    """A settlement failure with the HTTP status the inline path answers with."""
+
+    def __init__(self, status_code: int, message: str, retry: bool = True):
+        super().__init__(message)
+        self.status_code = status_code
+        self.message = message
+        self.retry = retry
+
+
+@dataclass
+class QueuedEvent:
+    id: int
+    provider: str
+    body: str
+    attempts: int
+    received_at: float
+
+    def payload(self):
+        return json.loads(self.body)
+
+
+def _sqlite_pragmas(dbapi_conn, _record) -> None:
+    cur = dbapi_conn.cursor()
+    cur.execute("PRAGMA journal_mode=WAL")
+    cur.execute("PRAGMA synchronous=FULL")   # an acknowledged webhook must survive a crash
+    cur.execute("PRAGMA busy_timeout=5000")  # other workers write to the same file
+    cur.close()
+
+
+class EventKeyIndex:
+    """Provider event ids seen in the last `retention_seconds`, shared by all workers."""
+
+    def __init__(self, engine, retention_seconds: float = 7 * 86400, cache_size: int = 100_000,
+                 cache_seconds: float = 300, clock: Callable[[], float] = time):
+        self.engine = engine
+        self.retention_seconds = retention_seconds
+        self.cache_size = cache_size
+        # Kept short: the database is the source of truth, and a dead event's key
+        # is only given back there.
+        self.cache_seconds = min(cache_seconds, retention_seconds)
+        self.clock = clock
+        self._cache: "OrderedDict[tuple, float]" = OrderedDict()  # (provider, key) -> seen_at
+        self._lock = threading.Lock()
+        self.duplicates = 0
+
+    def seen_locally(self, provider: str, key: str) -> bool:
+        """True if this process already recorded the key (no database round trip)."""
+        with self._lock:
+            seen_at = self._cache.get((provider, key))
+            if seen_at is None:
+                return False
+            if seen_at < self.clock() - self.cache_seconds:
+                del self._cache[(provider, key)]
+                return False
+            self.duplicates += 1
+            return True
+
+    def remember(self, provider: str, key: str, seen_at: float) -> None:
+        with self._lock:
+            self._cache[(provider, key)] = seen_at
+            self._cache.move_to_end((provider, key))
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def forget(self, provider: str, key: str) -> None:
+        with self._lock:
+            self._cache.pop((provider, key), None)
+
+    def insert(self, conn, provider: str, key: str, now: float, event_id: Optional[int] = None) -> None:
+        """Record the key inside the caller's transaction; IntegrityError if another worker already did."""
+        conn.execute(webhook_event_keys.insert().values(provider=provider, event_key=key, seen_at=now, event_id=event_id))
+
+    def duplicate(self, provider: str, key: str, now: float) -> None:
+        """Note a redelivery caught by the database, so the next one stays in memory."""
+        self.remember(provider, key, now)
+        with self._lock:
+            self.duplicates += 1
+
+    def claim(self, provider: str, key: str) -> bool:
+        """Record the key on its own; False for a duplicate. Used when settling inline."""
+        if self.seen_locally(provider, key):
+            return False
+        now = self.clock()
+        try:
+            with self.engine.begin() as conn:
+                self.insert(conn, provider, key, now)
+        except IntegrityError:
+            self.duplicate(provider, key, now)
+            return False
+        self.remember(provider, key, now)
+        return True
+
+    def release(self, provider: str, key: str) -> None:
+        """Give a key back so the provider's next redelivery is processed."""
+        self.forget(provider, key)
+        t = webhook_event_keys
+        with self.engine.begin() as conn:
+            conn.execute(delete(t).where(t.c.provider == provider, t.c.event_key == key))
+
+    def purge(self) -> int:
+        """Evict keys older than `retention_seconds`."""
+        t = webhook_event_keys
+        now = self.clock()
+        with self._lock:
+            while self._cache:
+                oldest_key, seen_at = next(iter(self._cache.items()))
+                if seen_at >= now - self.cache_seconds:
+                    break
+                del self._cache[oldest_key]
+        with self.engine.begin() as conn:
+            return conn.execute(delete(t).where(t.c.seen_at < now - self.retention_seconds)).rowcount
+
+
+class WebhookQueue:
+    def __init__(self, engine, max_pending: int = 10_000, lease_seconds: float = 60, max_attempts: int = 8,
+                 retry_base_seconds: float = 2, retention_seconds: float = 7 * 86400,
+                 dedup_seconds: float = 7 * 86400, clock: Callable[[], float] = time):
+        self.engine = engine
+        if engine.dialect.name == "sqlite":
+            event.listen(engine, "connect", _sqlite_pragmas)
+            engine.dispose()  # so existing pooled connections pick the pragmas up too
+        metadata.create_all(bind=engine, checkfirst=True)
+        self.dedup = EventKeyIndex(engine, retention_seconds=dedup_seconds, clock=clock)
+        self.max_pending = max_pending
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_base_seconds = retry_base_seconds
+        self.retention_seconds = retention_seconds
+        self.clock = clock
+        self._last_settled: Dict[str, float] = {}  # provider -> seconds from receipt to settlement (this process)
+        self._stats_lock = threading.Lock()
+
+    # ----- producer -----
+
+    def pending(self) -> int:
+        t = webhook_events
+        with self.engine.connect() as conn:
+            return conn.execute(select(func.count()).select_from(t).where(t.c.state.in_((PENDING, PROCESSING)))).scalar()
+
+    def enqueue(self, provider: str, body: Union[bytes, str], event_key: Optional[str] = None) -> Optional[int]:
+        """Durably store one raw event; returns its queue id.
+
+        Returns None, without queueing, when `event_key` was already seen.
+        Raises QueueFull under backpressure.
+        """
+        if event_key and self.dedup.seen_locally(provider, event_key):
+            return None
+        if isinstance(body, bytes):
+            body = body.decode("utf-8")
+        if self.max_pending and self.pending() >= self.max_pending:
+            raise QueueFull(f"{self.max_pending} webhook events already waiting")
+        now = self.clock()
+        try:
+            with self.engine.begin() as conn:
+                result = conn.execute(webhook_events.insert().values(
+                    provider=provider, body=body, state=PENDING, attempts=0, received_at=now, available_at=now))
+                queue_id = result.inserted_primary_key[0]
+                if event_key:
+                    self.dedup.insert(conn, provider, event_key, now, event_id=queue_id)
+        except IntegrityError:
+            if not event_key:
+                raise
+            self.dedup.duplicate(provider, event_key, now)
+            return None
+        if event_key:
+            self.dedup.remember(provider, event_key, now)
+        return queue_id
+
+    # ----- consumer -----
+
+    def claim(self, limit: int = 1) -> List[QueuedEvent]:
+        """Lease up to `limit` due events (oldest first) to the caller."""
+        t = webhook_events
+        now = self.clock()
+        token = uuid.uuid4().hex
+        due = or_(
+            and_(t.c.state == PENDING, t.c.available_at <= now),
+            and_(t.c.state == PROCESSING, t.c.available_at <= now),  # lease expired: its worker died
+        )
+        ids = select(t.c.id).where(due).order_by(t.c.id).limit(limit)
+        with self.engine.begin() as conn:
+            conn.execute(update(t).where(t.c.id.in_(ids)).values(
+                state=PROCESSING, claimed_by=token, attempts=t.c.attempts + 1,
+                available_at=now + self.lease_seconds))
+            rows = conn.execute(
+                select(t.c.id, t.c.provider, t.c.body, t.c.attempts, t.c.received_at)
+                .where(t.c.claimed_by == token, t.c.state == PROCESSING).order_by(t.c.id)
+            ).all()
+        return [QueuedEvent(*row) for row in rows]
+
+    def complete(self, item: QueuedEvent, result: Optional[dict] = None) -> None:
+        now = self.clock()
+        with self.engine.begin() as conn:
+            conn.execute(update(webhook_events).where(webhook_events.c.id == item.id).values(
+                state=DONE, processed_at=now, error=None,
+                result=json.dumps(result, default=str) if result is not None else None))
+        with self._stats_lock:
+            self._last_settled[item.provider] = now - item.received_at
+
+    def fail(self, item: QueuedEvent, error: str, retry: bool = True) -> str:
+        """Record a failed attempt; returns the event's new state (pending for a retry, or dead)."""
+        now = self.clock()
+        if retry and item.attempts < self.max_attempts:
+            state = PENDING
+            available_at = now + self.retry_base_seconds * (2 ** (item.attempts - 1))
+        else:
+            state, available_at = DEAD, now
+        with self.engine.begin() as conn:
+            conn.execute(update(webhook_events).where(webhook_events.c.id == item.id).values(
+                state=state, available_at=available_at, error=error[:2000],
+                processed_at=now if state == DEAD else None))
+            if state == DEAD:
+                conn.execute(delete(webhook_event_keys).where(webhook_event_keys.c.event_id == item.id))
+        return state
+
+    def purge(self) -> int:
+        """Drop settled events older than `retention_seconds`, and expired event keys."""
+        t = webhook_events
+        with self.engine.begin() as conn:
+            purged = conn.execute(delete(t).where(
+                t.c.state == DONE, t.c.processed_at < self.clock() - self.retention_seconds)).rowcount
+        return purged + self.dedup.purge()
+
+    # ----- metrics -----
+
+    def lag(self) -> Dict[str, dict]:
+        t = webhook_events
+        now = self.clock()
+        with self.engine.connect() as conn:
+            rows = conn.execute(
+                select(t.c.provider, t.c.state, func.count(), func.min(t.c.received_at))
+                .where(t.c.state.in_((PENDING, PROCESSING, DEAD))).group_by(t.c.provider, t.c.state)
+            ).all()
+        out: Dict[str, dict] = {}
+        for provider, state, count, oldest in rows:
+            entry = out.setdefault(provider, {"pending": 0, "processing": 0, "dead": 0, "oldest_age_seconds": 0.0})
+            entry[state] = count
+            if state != DEAD and oldest is not None:
+                entry["oldest_age_seconds"] = round(max(entry["oldest_age_seconds"], now - oldest), 3)
+        with self._stats_lock:
+            for provider, seconds in self._last_settled.items():
+                out.setdefault(provider, {"pending": 0, "processing": 0, "dead": 0, "oldest_age_seconds": 0.0})
+                out[provider]["last_settle_lag_seconds"] = round(seconds, 3)
+        return out
+
+
+class WebhookWorkerPool:
+    """Threads that claim queued events and pass them to `handler(provider, payload)`."""
+
+    def __init__(self, queue: WebhookQueue, handler: Callable[[str, dict], Optional[dict]], workers: int = 4,
+                 poll_interval: float = 1.0, purge_interval: float = 3600, name: str = "webhook"):
+        self.queue = queue
+        self.handler = handler
+        self.workers = workers
+        self.poll_interval = poll_interval  # picks up events enqueued by other processes
+        self.purge_interval = purge_interval
+        self.name = name
+        self._next_purge = 0.0
+        self._cond = threading.Condition()
+        self._threads: List[threading.Thread] = []
+        self._pid: Optional[int] = None
+        self._closed = False
+        self.processed = 0
+        self.failed = 0
+
+    def start(self) -> None:
+        # Started lazily and per process: threads don't survive a gunicorn fork.
+        with self._cond:
+            if self._closed or (self._pid == os.getpid() and all(t.is_alive() for t in self._threads)):
+                return
+            self._pid = os.getpid()
+            self._threads = [
+                threading.Thread(target=self._run, name=f"{self.name}-worker-{n}", daemon=True)
+                for n in range(self.workers)
+            ]
+            for thread in self._threads:
+                thread.start()
+
+    def wake(self) -> None:
+        self.start()
+        with self._cond:
+            self._cond.notify()
+
+    def run_one(self, item: QueuedEvent) -> None:
+        try:
+            result = self.handler(item.provider, item.payload())
+        except WebhookError as e:
+            state = self.queue.fail(item, f"{e.status_code}: {e.message}", retry=e.retry)
+            self.failed += 1
+            print(f"[WARN] {self.name} event {item.id} ({item.provider}) failed, now {state}: {e.message}")
+            return
+        except Exception as e:
+            state = self.queue.fail(item, repr(e))
+            self.failed += 1
+            print(f"[WARN] {self.name} event {item.id} ({item.provider}) failed, now {state}: {e!r}")
+            return
+        self.queue.complete(item, result)
+        self.processed += 1
+
+    def drain(self, limit: Optional[int] = None) -> int:
+        """Settle due events on the calling thread (tests, maintenance); returns how many ran."""
+        ran = 0
+        while limit is None or ran < limit:
+            batch = self.queue.claim(1)
+            if not batch:
+                return ran
+            self.run_one(batch[0])
+            ran += 1
+        return ran
+
+    def _run(self) -> None:
+        while not self._closed:
+            try:
+                batch = self.queue.claim(1)
+            except Exception as e:
+                print(f"[WARN] {self.name} queue unavailable: {e}")
+                batch = []
+            if batch:
+                self.run_one(batch[0])
+                continue
+            self._maybe_purge()
+            with self._cond:
+                if not self._closed:
+                    self._cond.wait(self.poll_interval)
+
+    def _maybe_purge(self) -> None:
+        # Idle time only; one thread per process does it
+        with self._cond:
+            now = self.queue.clock()
+            if now < self._next_purge:
+                return
+            self._next_purge = now + self.purge_interval
+        try:
+            self.queue.purge()
+        except Exception as e:
+            print(f"[WARN] {self.name} purge failed: {e}")
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        for thread in self._threads:
+            if thread is not threading.current_thread():
+                thread.join(timeout=10)
+
+    def stats(self) -> dict:
+        return {"workers": self.workers, "processed": self.processed, "failed": self.failed,
+                "duplicates": self.queue.dedup.duplicates, "providers": self.queue.lag()}